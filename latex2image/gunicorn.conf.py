@@ -0,0 +1,9 @@
+"""
+Gunicorn hooks, used by start-server.sh
+"""
+
+
+def child_exit(server, worker):
+    # Drop the live gauges of the dead worker from the metrics
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Text, Tuple  # noqa
+
+from django.conf import settings
+from django.db.models import F
+
+from latex.cache import get_default_cache, is_redis_cache
+
+logger = logging.getLogger(__name__)
+
+# The redis hashes of the access counts and the last access timestamps of
+# tex_keys, not yet flushed to the database
+ACCESS_COUNTS_KEY = "l2i:access:counts"
+ACCESS_LAST_KEY = "l2i:access:last"
+
+# Held by the process flushing the redis hashes to the database
+ACCESS_FLUSH_LOCK_KEY = "l2i:access:flush_lock"
+
+# The max number of tex_keys updated by one query
+UPDATE_BATCH_SIZE = 500
+
+# HSET the fields of KEYS[1] to the values of ARGV (field, value, ...),
+# unless their current values are larger, so that a process flushing an
+# older timestamp doesn't overwrite a newer one
+HSET_MAX_SCRIPT = """
+for i = 1, #ARGV, 2 do
+    local current = redis.call("HGET", KEYS[1], ARGV[i])
+    if not current or tonumber(current) < tonumber(ARGV[i + 1]) then
+        redis.call("HSET", KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+return 0
+"""
+
+# (count, last access timestamp) by tex_key
+AccessCounts = Dict[Text, Tuple[int, float]]
+
+
+def is_access_tracking_enabled():
+    # type: () -> bool
+    return bool(getattr(settings, "L2I_ACCESS_TRACKING", False))
+
+
+class AccessBuffer(object):
+    """
+    The accesses of tex_keys in this process since the last flush.
+    """
+
+    def __init__(self):
+        self._counts = {}  # type: Dict[Text, List[Any]]
+        self._lock = threading.Lock()
+
+    def add(self, tex_keys, timestamp):
+        # type: (List[Text], float) -> None
+        with self._lock:
+            for tex_key in tex_keys:
+                entry = self._counts.get(tex_key)
+                if entry is None:
+                    self._counts[tex_key] = [1, timestamp]
+                else:
+                    entry[0] += 1
+                    entry[1] = max(entry[1], timestamp)
+
+    def drain(self):
+        # type: () -> AccessCounts
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        return {
+            tex_key: (count, last) for tex_key, (count, last) in counts.items()}
+
+    def restore(self, counts):
+        # type: (AccessCounts) -> None
+        """
+        Put back drained `counts` which failed to be flushed.
+        """
+        with self._lock:
+            for tex_key, (count, last) in counts.items():
+                entry = self._counts.get(tex_key)
+                if entry is None:
+                    self._counts[tex_key] = [count, last]
+                else:
+                    entry[0] += count
+                    entry[1] = max(entry[1], last)
+
+    def __len__(self):
+        # type: () -> int
+        return len(self._counts)
+
+
+def merge_access_counts(counts, other):
+    # type: (AccessCounts, AccessCounts) -> AccessCounts
+    merged = dict(counts)
+    for tex_key, (count, last) in other.items():
+        if tex_key in merged:
+            merged_count, merged_last = merged[tex_key]
+            merged[tex_key] = (merged_count + count, max(merged_last, last))
+        else:
+            merged[tex_key] = (count, last)
+    return merged
+
+
+def update_access_counts(counts):
+    # type: (AccessCounts) -> int
+    """
+    Add `counts` to the hit_count of the instances, and update their
+    last_accessed, with one UPDATE per distinct count and interval of
+    settings.L2I_ACCESS_FLUSH_INTERVAL seconds of the last access (and
+    per :data:`UPDATE_BATCH_SIZE` tex_keys). The last_accessed of all the
+    instances of an UPDATE is their latest access, so it is off by less
+    than that interval.
+    :return: the number of instances updated.
+    """
+    from latex.models import LatexImage
+
+    resolution = max(
+        1., float(getattr(settings, "L2I_ACCESS_FLUSH_INTERVAL", 60)))
+
+    by_count = defaultdict(list)  # type: Dict[Tuple[int, int], List[Tuple[Text, float]]]  # noqa
+    for tex_key, (count, last) in counts.items():
+        by_count[count, int(last // resolution)].append((tex_key, last))
+
+    n_updated = 0
+    for (count, _), entries in sorted(by_count.items()):
+        for i in range(0, len(entries), UPDATE_BATCH_SIZE):
+            batch = entries[i:i + UPDATE_BATCH_SIZE]
+            n_updated += LatexImage.objects.filter(
+                tex_key__in=[tex_key for tex_key, _ in batch]
+            ).update(
+                hit_count=F("hit_count") + count,
+                last_accessed=datetime.fromtimestamp(
+                    max(last for _, last in batch), tz=timezone.utc))
+    return n_updated
+
+
+def push_access_counts(def_cache, counts):
+    # type: (Any, AccessCounts) -> None
+    """
+    Add `counts` to the redis hashes shared by all processes, keeping the
+    latest last access of each tex_key.
+    """
+    if not counts:
+        return
+
+    pipe = def_cache.client.get_client(write=True).pipeline(transaction=False)
+    counts_key = def_cache.make_key(ACCESS_COUNTS_KEY)
+    lasts = []  # type: List[Any]
+    for tex_key, (count, last) in counts.items():
+        pipe.hincrby(counts_key, tex_key, count)
+        lasts.extend([tex_key, repr(float(last))])
+    pipe.eval(HSET_MAX_SCRIPT, 1, def_cache.make_key(ACCESS_LAST_KEY), *lasts)
+    pipe.execute()
+
+
+def pop_access_counts(def_cache):
+    # type: (Any) -> AccessCounts
+    """
+    Take the counts of the redis hashes, which are atomically renamed, so
+    that concurrent pushes go to new hashes.
+    """
+    client = def_cache.client.get_client(write=True)
+    suffix = ":flushing:%s" % uuid.uuid4().hex
+    keys = [def_cache.make_key(ACCESS_COUNTS_KEY),
+            def_cache.make_key(ACCESS_LAST_KEY)]
+    flushing_keys = [key + suffix for key in keys]
+
+    pipe = client.pipeline(transaction=True)
+    for key, flushing_key in zip(keys, flushing_keys):
+        pipe.rename(key, flushing_key)
+    # The hashes don't exist if nothing was pushed
+    renamed = pipe.execute(raise_on_error=False)
+    if isinstance(renamed[0], Exception):
+        # Not leaking the last access timestamps without counts
+        if not isinstance(renamed[1], Exception):
+            client.delete(*flushing_keys)
+        return {}
+
+    pipe = client.pipeline(transaction=False)
+    for flushing_key in flushing_keys:
+        pipe.hgetall(flushing_key)
+    pipe.delete(*flushing_keys)
+    hit_counts, lasts, _ = pipe.execute()
+
+    def decode(value):
+        return value.decode() if isinstance(value, bytes) else value
+
+    lasts = {decode(tex_key): float(last) for tex_key, last in lasts.items()}
+    return {
+        decode(tex_key): (int(count), lasts.get(decode(tex_key), 0.))
+        for tex_key, count in hit_counts.items()}
+
+
+def flush_access_counts(buffer, force=False):
+    # type: (AccessBuffer, bool) -> int
+    """
+    Flush the accesses of `buffer`. With a django-redis default cache,
+    they are pushed to redis, and the process which gets the flush lock
+    (at most one every settings.L2I_ACCESS_FLUSH_INTERVAL seconds) writes
+    the counts of all processes to the database. Else, they are written
+    to the database directly.
+    :param force: write the counts in redis to the database regardless of
+    the flush lock.
+    :return: the number of instances updated in the database.
+    If the database update fails, the counts are put back (to redis, or
+    to `buffer`) for the next flush, and the error is raised.
+    """
+    counts = buffer.drain()
+    popped = False
+
+    def_cache = get_default_cache()
+    if is_redis_cache(def_cache):
+        from redis.exceptions import RedisError
+        try:
+            push_access_counts(def_cache, counts)
+            counts = {}
+
+            interval = getattr(settings, "L2I_ACCESS_FLUSH_INTERVAL", 60)
+            locked = def_cache.client.get_client(write=True).set(
+                def_cache.make_key(ACCESS_FLUSH_LOCK_KEY), os.getpid(),
+                nx=True, ex=max(1, int(interval)))
+            if locked or force:
+                counts = pop_access_counts(def_cache)
+                popped = True
+        except RedisError:
+            # The counts not pushed yet are written to the database
+            logger.warning("Failed to flush access counts via redis",
+                           exc_info=True)
+
+    if not counts:
+        return 0
+
+    try:
+        return update_access_counts(counts)
+    except Exception:
+        if not popped:
+            buffer.restore(counts)
+            raise
+
+        # The counts of all processes would be lost
+        from redis.exceptions import RedisError
+        try:
+            push_access_counts(def_cache, counts)
+        except RedisError:
+            logger.warning("Failed to push back access counts",
+                           exc_info=True)
+            buffer.restore(counts)
+        raise
+
+
+class AccessTracker(threading.Thread):
+    """
+    Buffer the accesses of tex_keys, which are flushed every
+    settings.L2I_ACCESS_FLUSH_INTERVAL seconds, or once
+    settings.L2I_ACCESS_BUFFER_MAX_KEYS tex_keys are buffered, by this
+    thread, so that the database is never written on the request path.
+    """
+
+    def __init__(self, interval, max_keys):
+        # type: (float, int) -> None
+        super(AccessTracker, self).__init__(
+            name="l2i_access_tracker", daemon=True)
+        self.interval = interval
+        self.max_keys = max_keys
+        self.buffer = AccessBuffer()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+
+    def record(self, tex_keys):
+        # type: (List[Text]) -> None
+        self.buffer.add(tex_keys, time.time())
+        if len(self.buffer) >= self.max_keys:
+            self._wake_event.set()
+
+    def flush(self, force=False):
+        # type: (bool) -> int
+        try:
+            return flush_access_counts(self.buffer, force=force)
+        except Exception:
+            logger.warning("Failed to flush access counts", exc_info=True)
+            return 0
+
+    def run(self):
+        from django.db import connection
+
+        while not self._stop_event.is_set():
+            self._wake_event.wait(self.interval)
+            self._wake_event.clear()
+            self.flush()
+            # Not keeping a connection of this thread open between flushes
+            connection.close()
+
+    def stop(self):
+        # type: () -> None
+        self._stop_event.set()
+        self._wake_event.set()
+
+
+_access_tracker = None  # type: Optional[AccessTracker]
+_access_tracker_pid = None  # type: Optional[int]
+_access_tracker_lock = threading.Lock()
+
+
+def get_access_tracker():
+    # type: () -> Optional[AccessTracker]
+    """
+    :return: the access tracker of this process, started on first use,
+    None if settings.L2I_ACCESS_TRACKING is not enabled.
+    """
+    global _access_tracker, _access_tracker_pid
+
+    if not is_access_tracking_enabled():
+        return None
+
+    interval = getattr(settings, "L2I_ACCESS_FLUSH_INTERVAL", 60)
+    max_keys = getattr(settings, "L2I_ACCESS_BUFFER_MAX_KEYS", 10000)
+
+    with _access_tracker_lock:
+        tracker = _access_tracker
+        if (tracker is not None
+                and (tracker.interval, tracker.max_keys) == (interval, max_keys)
+                # Not inherited from the parent process
+                and _access_tracker_pid == os.getpid()):
+            return tracker
+
+        if tracker is not None and _access_tracker_pid == os.getpid():
+            tracker.stop()
+            tracker.flush()
+
+        tracker = _access_tracker = AccessTracker(interval, max_keys)
+        _access_tracker_pid = os.getpid()
+        tracker.start()
+        return tracker
+
+
+def record_access(tex_keys):
+    # type: (List[Text]) -> None
+    """
+    Count an access of each of `tex_keys`, without any I/O.
+    """
+    if not tex_keys:
+        return
+    tracker = get_access_tracker()
+    if tracker is not None:
+        tracker.record(tex_keys)
+
+
+@atexit.register
+def _flush_access_tracker():
+    # type: () -> None
+    if _access_tracker is not None and _access_tracker_pid == os.getpid():
+        _access_tracker.stop()
+        _access_tracker.flush()
+
+
+def get_hot_images(n):
+    # type: (int) -> List[Tuple[Text, int, Optional[datetime]]]
+    """
+    :return: (tex_key, hit_count, last_accessed) of the `n` most accessed
+    instances, by the counts flushed to the database, the most recently
+    accessed first among equal counts.
+    """
+    from latex.models import LatexImage
+
+    return list(
+        LatexImage.objects.filter(hit_count__gt=0).order_by(
+            "-hit_count", F("last_accessed").desc(nulls_last=True), "-id"
+        ).values_list("tex_key", "hit_count", "last_accessed")[:n])
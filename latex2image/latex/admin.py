@@ -28,7 +28,8 @@ class HasCompileErrorFilter(SimpleListFilter):
 
 
 class LatexImageAdmin(admin.ModelAdmin):
-    _readonly_fields = ["data_url", "compile_error"]
+    _readonly_fields = ["data_url", "compile_error", "hit_count",
+                        "last_accessed"]
     readonly_fields = ["image_tag"]
     list_display = (
             "id",
@@ -36,6 +37,8 @@ class LatexImageAdmin(admin.ModelAdmin):
             "creation_time",
             "image_tag",
             "creator",
+            "hit_count",
+            "last_accessed",
     )
     list_filter = ("creation_time", "creator", HasCompileErrorFilter)
     search_fields = (
@@ -22,23 +22,45 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextvars import copy_context
 from copy import deepcopy
+from mimetypes import guess_type
 
 from django.conf import settings
-from django.core.exceptions import ImproperlyConfigured
 from django.core.files.storage import default_storage
-from django.db import transaction
+from django.db import IntegrityError, transaction
+from django.http import (FileResponse, Http404, HttpResponse,
+                         StreamingHttpResponse)
+from django.urls import reverse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from django.utils.translation import gettext_lazy as _
 from rest_framework import generics, permissions, status
+from rest_framework.authentication import (SessionAuthentication,
+                                           TokenAuthentication)
 from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
 from rest_framework.parsers import JSONParser
 from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
+from latex.access import record_access
+from latex.cache import get_field_cache
 from latex.converter import LatexCompileError, tex_to_img_converter
+from latex.executor import ConversionQueueFull, get_conversion_executor
+from latex.jobs import (JOB_STATUS_ERROR, JOB_STATUS_PENDING, enqueue_job,
+                        get_job_status)
+from latex.metrics import CACHE_REQUESTS
 from latex.models import UPLOAD_TO, LatexImage
-from latex.serializers import (LatexImageCreateDataSerialzier,
-                               LatexImageSerializer)
+from latex.serializers import (LATEX_IMAGE_ALLOWED_FIELDS_NAME,
+                               LatexImageBulkCreateDataSerializer,
+                               LatexImageBulkLookupDataSerializer,
+                               LatexImageCreateDataSerialzier,
+                               LatexImageSerializer, get_only_fields)
+from latex.singleflight import single_flight
+from latex.timing import (STAGE_CACHE_LOOKUP, STAGE_PERSIST,
+                          collect_timings_into, merge_timings, timed_stage)
 
 
 class L2IRenderer(JSONRenderer):
@@ -57,68 +79,161 @@ class L2IRenderer(JSONRenderer):
         return super().render(data, accepted_media_type, renderer_context)
 
 
-def get_field_cache_key(tex_key, field_name):
-    return "%s:%s" % (tex_key, field_name)
+class NDJSONRenderer(JSONRenderer):
+    """ One JSON document per line, for each item if data is a list """
+    media_type = "application/x-ndjson"
+    format = "ndjson"
 
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, list):
+            data = [data]
+        render = super().render
+        return b"".join(render(item) + b"\n" for item in data)
 
-def get_cached_attribute_by_tex_key(tex_key, attr, request):
-    try:
-        import django.core.cache as cache
-
-        def_cache = cache.caches["default"]
-        cache_key = get_field_cache_key(tex_key, attr)
-    except ImproperlyConfigured:
-        cache_key = None
-
-    result_dict = {}
 
-    if cache_key is not None:
-        # def_cache.delete(cache_key)
-        ret_value = def_cache.get(cache_key)
+class LatexImageCursorPagination(CursorPagination):
+    """
+    Not enabled unless settings.L2I_API_LIST_PAGE_SIZE is set or the
+    page_size querystring is passed, for backward compatibility.
+    """
+    ordering = ("creation_time", "id")
+    page_size_query_param = "page_size"
+    max_page_size = 1000
 
-        if ret_value is not None:
-            # print("Got value in cache!")
-            result_dict[attr] = ret_value
-            return result_dict
+    def get_page_size(self, request):
+        self.page_size = getattr(settings, "L2I_API_LIST_PAGE_SIZE", None)
+        return super().get_page_size(request)
 
-        compile_error_cache_key = get_field_cache_key(tex_key, "compile_error")
-        cached_compile_error = def_cache.get(compile_error_cache_key)
-        if cached_compile_error is not None:
-            return {"compile_error": cached_compile_error}
 
-    # Check db if it exists
-    objs = LatexImage.objects.filter(tex_key=tex_key)
-    if not objs.count():
+def get_cached_attribute_by_tex_key(tex_key, attr, request):
+    result_dict = get_cached_attributes_by_tex_keys(
+        [tex_key], [attr], request).get(tex_key)
+    if result_dict is None:
         return None if request.method == "POST" else {}
+    return result_dict
 
-    obj = objs[0]
-
-    serializer = LatexImageSerializer(obj, fields=attr, context={"request": request})
-
-    data = serializer.to_representation(obj)
 
-    compile_error = data.pop("compile_error", None)
-    if compile_error is not None:
-        result_dict["compile_error"] = compile_error
+def get_cached_attributes_by_tex_keys(tex_keys, fields, request,
+                                      queryset=None):
+    """
+    Look up the results of `tex_keys`, with one read of the field cache,
+    one database query for the cache misses, and one write of the field
+    cache to backfill them.
+    :param fields: a list of field names, None for all fields (which
+    are not cached).
+    :param queryset: the instances the cache misses are looked up in,
+    default to all instances. Cache hits are not filtered by it.
+    :return: a dict mapping the found tex_keys to their result dicts,
+    with either the requested fields or "compile_error".
+    """
+    results = {}
+    tex_keys = list(dict.fromkeys(tex_keys))
+
+    field_cache = get_field_cache() if fields else None
+
+    if field_cache is not None:
+        cached = field_cache.get_many(tex_keys, fields + ["compile_error"])
+
+        for tex_key, values in cached.items():
+            if all(values.get(field) is not None for field in fields):
+                results[tex_key] = {field: values[field] for field in fields}
+            elif values.get("compile_error") is not None:
+                results[tex_key] = {"compile_error": values["compile_error"]}
+
+        CACHE_REQUESTS.labels(result="hit").inc(len(results))
+        CACHE_REQUESTS.labels(result="miss").inc(len(tex_keys) - len(results))
+
+    missing = [tex_key for tex_key in tex_keys if tex_key not in results]
+    if not missing:
+        record_access(list(results))
+        return results
+
+    if queryset is None:
+        queryset = LatexImage.objects.all()
+    queryset = queryset.filter(tex_key__in=missing)
+    if fields:
+        queryset = queryset.only("tex_key", *get_only_fields(fields))
+    serializer = LatexImageSerializer(
+        fields=fields, context={"request": request})
+
+    to_cache = {}
+    for obj in queryset:
+        data = serializer.to_representation(obj)
+        compile_error = data.pop("compile_error", None)
+        if compile_error is not None:
+            results[obj.tex_key] = {"compile_error": compile_error}
+            to_cache[obj.tex_key] = {"compile_error": obj.compile_error}
+            continue
+
+        if fields and any(data.get(field) is None for field in fields):
+            continue
+
+        # Values too large are skipped by the field cache
+        to_cache[obj.tex_key] = {field: data[field] for field in fields or []}
+
+        results[obj.tex_key] = data
+
+    if field_cache is not None and to_cache:
+        field_cache.set_many(to_cache)
+
+    record_access(list(results))
+    return results
+
+
+def get_existing_instance(
+        _converter, image_format, use_storage_file_if_exists, creator):
+    """
+    :return: the LatexImage instance of the tex_key of `_converter`,
+    if it exists in the database, or if `use_storage_file_if_exists`
+    and the image file exists in the storage (the instance will be
+    created with that file). Else None.
+    """
+    qs = LatexImage.objects.filter(tex_key=_converter.tex_key)
+
+    if qs.count():
+        return qs[0]
+
+    if use_storage_file_if_exists:
+        # Set Django's FileField to an existing file
+        # https://stackoverflow.com/a/10906037/3437454
+        _path = "/".join(
+            [UPLOAD_TO, ".".join([_converter.tex_key, image_format])])
+        if default_storage.exists(_path):
+            with transaction.atomic():
+                instance = LatexImage(
+                    tex_key=_converter.tex_key,
+                    creator=creator
+                )
+                instance.image = _path
+                instance.save()
+            return instance
+
+    return None
+
+
+def convert_to_image_data(_converter, creator_pk):
+    """
+    Convert the tex source of `_converter`.
+    :return: the data used to create a LatexImage instance with
+    LatexImageSerializer, with either "converted_image" (which should be
+    passed to the `save` method of the serializer) or "compile_error".
+    Errors other than LatexCompileError are raised.
+    """
+    data = {"tex_key": _converter.tex_key, "creator": creator_pk}
 
-        if cache_key is not None:
-            compile_error_cache_key = get_field_cache_key(tex_key, "compile_error")
-            def_cache.add(compile_error_cache_key, obj.compile_error, None)
-        return result_dict
+    try:
+        data["converted_image"] = _converter.get_converted_image()
+    except LatexCompileError as e:
+        data["compile_error"] = f"{type(e).__name__}: {str(e)}"
 
-    ret_value = data.get(attr, None)
-    if ret_value is None:
-        return None if request.method == "POST" else {}
+    return data
 
-    assert isinstance(ret_value, str)
 
-    # Ignore attribute value with size (byte) over L2I_CACHE_MAX_BYTES
-    if (cache_key is not None
-            and len(ret_value) <= getattr(settings, "L2I_CACHE_MAX_BYTES", 0)):
-        def_cache.add(cache_key, ret_value, None)
-
-    result_dict[attr] = ret_value
-    return result_dict
+def get_queue_full_response(e):
+    return Response(
+        {"error": f"{type(e).__name__}: {str(e)}"},
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(e.retry_after)})
 
 
 class CreateMixin:
@@ -141,8 +256,9 @@ class CreateMixin:
 
         if fields and len(fields) == 1 and tex_key is not None:
             # Try to get cached result
-            cached_result = (
-                get_cached_attribute_by_tex_key(tex_key, fields[0], request))
+            with timed_stage(STAGE_CACHE_LOOKUP):
+                cached_result = get_cached_attribute_by_tex_key(
+                    tex_key, fields[0], request)
             if cached_result:
                 return Response(cached_result, status=status.HTTP_200_OK)
             else:
@@ -157,9 +273,6 @@ class CreateMixin:
                             "to regenerate the image. ")
                     raise ValidationError(detail=f"{msg}{e.detail}")
 
-        data_url = None
-        error = None
-
         image_format = data["image_format"]
         fields = data.pop("fields", None)
         use_storage_file_if_exists = data.pop(
@@ -175,57 +288,58 @@ class CreateMixin:
                 {"error": f"{type(e).__name__}: {str(e)}"},
                 status=status.HTTP_400_BAD_REQUEST)
 
-        qs = LatexImage.objects.filter(tex_key=_converter.tex_key)
-        instance = None
-
-        if qs.count():
-            instance = qs[0]
-        else:
-            if use_storage_file_if_exists:
-                # Set Django's FileField to an existing file
-                # https://stackoverflow.com/a/10906037/3437454
-                _path = "/".join(
-                    [UPLOAD_TO, ".".join([_converter.tex_key, image_format])])
-                if default_storage.exists(_path):
-                    with transaction.atomic():
-                        instance = LatexImage(
-                            tex_key=_converter.tex_key,
-                            creator=self.request.user
-                        )
-                        instance.image = _path
-                        instance.save()
+        instance = get_existing_instance(
+            _converter, image_format, use_storage_file_if_exists,
+            self.request.user)
 
         if instance:
+            record_access([instance.tex_key])
             image_serializer = self.get_serializer(instance, fields=fields)
             return Response(
                 image_serializer.data, status=status.HTTP_200_OK)
 
-        try:
-            data_url = _converter.get_converted_data_url()
-        except Exception as e:
-            error = f"{type(e).__name__}: {str(e)}"
-            if not isinstance(e, LatexCompileError):
-                return Response(
-                    {"error": error},
-                    status=status.HTTP_400_BAD_REQUEST)
+        with single_flight(_converter.tex_key):
+            # Concurrent requests of the same tex_key wait here for the
+            # leader, and then find the instance it saved.
+            instance = get_existing_instance(
+                _converter, image_format, use_storage_file_if_exists,
+                self.request.user)
 
-        assert not all([data_url is None, error is None])
+            if instance:
+                record_access([instance.tex_key])
+                image_serializer = self.get_serializer(instance, fields=fields)
+                return Response(
+                    image_serializer.data, status=status.HTTP_200_OK)
 
-        data = {"tex_key": _converter.tex_key}
-        if data_url is not None:
-            data["data_url"] = data_url
-        else:
-            data["compile_error"] = error
+            try:
+                data = convert_to_image_data(_converter, self.request.user.pk)
+            except ConversionQueueFull as e:
+                return get_queue_full_response(e)
+            except Exception as e:
+                return Response(
+                    {"error": f"{type(e).__name__}: {str(e)}"},
+                    status=status.HTTP_400_BAD_REQUEST)
 
-        data["creator"] = self.request.user.pk
+            image_serializer = self.get_serializer(data=data)
 
-        image_serializer = self.get_serializer(data=data)
+            if image_serializer.is_valid():
+                try:
+                    with timed_stage(STAGE_PERSIST), transaction.atomic():
+                        instance = image_serializer.save(
+                            converted_image=data.get("converted_image"))
+                except IntegrityError:
+                    # Saved by a request which timed out waiting for the lock,
+                    # just after the unique validation of tex_key.
+                    instance = LatexImage.objects.get(tex_key=_converter.tex_key)
+                    record_access([instance.tex_key])
+                    return Response(
+                        self.get_serializer(instance, fields=fields).data,
+                        status=status.HTTP_200_OK)
+                record_access([instance.tex_key])
+                return Response(
+                    self.get_serializer(instance, fields=fields).data,
+                    status=status.HTTP_201_CREATED)
 
-        if image_serializer.is_valid():
-            instance = image_serializer.save()
-            return Response(
-                self.get_serializer(instance, fields=fields).data,
-                status=status.HTTP_201_CREATED)
         return Response(
             # For example, tex_key already exists.
             image_serializer.errors,
@@ -239,6 +353,287 @@ class LatexImageCreate(
     serializer_class = LatexImageSerializer
 
 
+class LatexImageBulkCreate(generics.GenericAPIView):
+    """
+    Create many images in one request. Existing results are looked up
+    at once, and the others are converted in parallel, within the
+    concurrency of the conversion executor. Each item gets its own result,
+    with "index" (the index in "items") and "status_code". With the
+    NDJSON format, results are streamed as soon as they are done.
+    """
+    renderer_classes = (JSONRenderer, NDJSONRenderer)
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = LatexImageSerializer
+
+    def post(self, request, *args, **kwargs):
+        data_serializer = LatexImageBulkCreateDataSerializer(data=request.data)
+        data_serializer.is_valid(raise_exception=True)
+
+        items = data_serializer.validated_data["items"]
+        fields = data_serializer.validated_data.get("fields")
+
+        results = self.iter_results(items, fields)
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            renderer = JSONRenderer()
+            return StreamingHttpResponse(
+                (renderer.render(result) + b"\n" for result in results),
+                content_type=NDJSONRenderer.media_type)
+
+        return Response(
+            sorted(results, key=lambda result: result["index"]),
+            status=status.HTTP_200_OK)
+
+    def get_item_converter(self, item):
+        """
+        :return: the converter of `item`, or the error result.
+        """
+        item_serializer = LatexImageCreateDataSerialzier(data=item)
+        if not item_serializer.is_valid():
+            return None, {"error": item_serializer.errors}
+
+        # Without "fields", the serializer requires all the fields
+        # needed by the converter.
+        data = item_serializer.validated_data
+        try:
+            return tex_to_img_converter(
+                data["compiler"], data["tex_source"], data["image_format"],
+                tex_key=data.get("tex_key")), None
+        except Exception as e:
+            return None, {"error": f"{type(e).__name__}: {str(e)}"}
+
+    def save_image_data(self, data, fields):
+        """
+        :return: the status code and the result of saving `data`,
+        returned by :func:`convert_to_image_data`.
+        """
+        image_serializer = self.get_serializer(data=data)
+        if not image_serializer.is_valid():
+            return status.HTTP_400_BAD_REQUEST, image_serializer.errors
+
+        try:
+            with timed_stage(STAGE_PERSIST), transaction.atomic():
+                instance = image_serializer.save(
+                    converted_image=data.get("converted_image"))
+            status_code = status.HTTP_201_CREATED
+        except IntegrityError:
+            # Saved by another request in the meantime
+            instance = LatexImage.objects.get(tex_key=data["tex_key"])
+            status_code = status.HTTP_200_OK
+
+        result = self.get_serializer(instance, fields=fields).data
+        if result.get("compile_error") is not None:
+            status_code = status.HTTP_400_BAD_REQUEST
+        return status_code, result
+
+    def iter_results(self, items, fields):
+        def make_result(index, status_code, data):
+            result = {"index": index, "status_code": status_code}
+            result.update(data)
+            if result.get("compile_error", "") is None:
+                result.pop("compile_error")
+            return result
+
+        # items of the same tex_key are converted once
+        converters = {}
+        indices = {}
+        for index, item in enumerate(items):
+            _converter, error = self.get_item_converter(item)
+            if error is not None:
+                yield make_result(index, status.HTTP_400_BAD_REQUEST, error)
+                continue
+            converters.setdefault(_converter.tex_key, _converter)
+            indices.setdefault(_converter.tex_key, []).append(index)
+
+        with timed_stage(STAGE_CACHE_LOOKUP):
+            existing = get_cached_attributes_by_tex_keys(
+                list(converters), fields, self.request)
+
+        for tex_key, data in existing.items():
+            status_code = (
+                status.HTTP_400_BAD_REQUEST if "compile_error" in data
+                else status.HTTP_200_OK)
+            for index in indices[tex_key]:
+                yield make_result(index, status_code, data)
+
+        misses = [
+            _converter for tex_key, _converter in converters.items()
+            if tex_key not in existing]
+        if not misses:
+            return
+
+        def convert(_converter, timings):
+            with collect_timings_into(timings):
+                return convert_to_image_data(
+                    _converter, self.request.user.pk)
+
+        # The timings of each conversion, so that the render cost of an
+        # item is its own, merged into the timings of the request once
+        # done (not concurrently).
+        item_timings = {_converter.tex_key: {} for _converter in misses}
+
+        max_workers = min(
+            len(misses), get_conversion_executor().max_concurrency)
+        with ThreadPoolExecutor(
+                max_workers=max_workers,
+                thread_name_prefix="l2i_bulk") as executor:
+            futures = {
+                executor.submit(
+                    copy_context().run, convert, _converter,
+                    item_timings[_converter.tex_key]): _converter.tex_key
+                for _converter in misses}
+
+            try:
+                for future in as_completed(futures):
+                    tex_key = futures[future]
+                    try:
+                        with collect_timings_into(item_timings[tex_key]):
+                            status_code, data = self.save_image_data(
+                                future.result(), fields)
+                    except ConversionQueueFull as e:
+                        status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+                        data = {"error": f"{type(e).__name__}: {str(e)}",
+                                "retry_after": e.retry_after}
+                    except Exception as e:
+                        status_code = status.HTTP_400_BAD_REQUEST
+                        data = {"error": f"{type(e).__name__}: {str(e)}"}
+                    merge_timings(item_timings[tex_key])
+
+                    for index in indices[tex_key]:
+                        yield make_result(index, status_code, data)
+            finally:
+                # e.g., the client went away while streaming
+                for future in futures:
+                    future.cancel()
+
+
+class LatexImageBulkLookup(generics.GenericAPIView):
+    """
+    Look up the results of many tex_keys in one request, with one cache
+    multi-get, one database query for the cache misses, and one cache
+    multi-set to backfill them. Like the cached results of
+    :class:`LatexImageCreate`, results are looked up by tex_key only.
+    """
+    renderer_classes = (JSONRenderer,)
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = LatexImageSerializer
+
+    def post(self, request, *args, **kwargs):
+        data_serializer = LatexImageBulkLookupDataSerializer(data=request.data)
+        data_serializer.is_valid(raise_exception=True)
+
+        tex_keys = data_serializer.validated_data["tex_keys"]
+        fields = data_serializer.validated_data.get("fields")
+
+        with timed_stage(STAGE_CACHE_LOOKUP):
+            results = get_cached_attributes_by_tex_keys(
+                tex_keys, fields, request)
+
+        # tex_keys not found are null
+        return Response(
+            {tex_key: results.get(tex_key) for tex_key in tex_keys},
+            status=status.HTTP_200_OK)
+
+
+class LatexImageCreateAsync(generics.GenericAPIView):
+    """
+    Queue the conversion and return 202 at once, with the url of the
+    detail view which reports the status of the conversion.
+    """
+    renderer_classes = (L2IRenderer,)
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = LatexImageSerializer
+
+    def post(self, request, *args, **kwargs):
+        req_params = JSONParser().parse(request)
+        data_serializer = LatexImageCreateDataSerialzier(data=req_params)
+        data_serializer.is_valid(raise_exception=True)
+
+        data = data_serializer.data
+
+        missing_fields = [
+            field for field in ["compiler", "tex_source", "image_format"]
+            if data.get(field) is None]
+        if missing_fields:
+            raise ValidationError(
+                {field: _("This field is required.")
+                 for field in missing_fields})
+
+        image_format = data["image_format"]
+        fields = data.pop("fields", None)
+        use_storage_file_if_exists = data.pop(
+            "use_storage_file_if_exists",
+            getattr(
+                settings, "L2I_USE_EXISTING_STORAGE_IMAGE_TO_CREATE_INSTANCE",
+                False))
+
+        try:
+            _converter = tex_to_img_converter(**data)
+        except Exception as e:
+            return Response(
+                {"error": f"{type(e).__name__}: {str(e)}"},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        instance = get_existing_instance(
+            _converter, image_format, use_storage_file_if_exists,
+            self.request.user)
+
+        if instance:
+            image_serializer = self.get_serializer(instance, fields=fields)
+            return Response(
+                image_serializer.data, status=status.HTTP_200_OK)
+
+        try:
+            enqueue_job({
+                "compiler": data["compiler"],
+                "tex_source": data["tex_source"],
+                "image_format": _converter.image_format,
+                "tex_key": _converter.tex_key,
+                "creator": self.request.user.pk,
+            })
+        except ConversionQueueFull as e:
+            return get_queue_full_response(e)
+
+        return Response(
+            {"tex_key": _converter.tex_key,
+             "status": JOB_STATUS_PENDING,
+             "status_url": request.build_absolute_uri(
+                 reverse("detail", args=(_converter.tex_key,)))},
+            status=status.HTTP_202_ACCEPTED)
+
+
+def get_job_status_response(tex_key):
+    """
+    :return: a response reporting the status of the queued conversion
+    of `tex_key`, if it is pending or errored, else None.
+    """
+    job_status = get_job_status(tex_key)
+    if job_status is None:
+        return None
+
+    if job_status["status"] == JOB_STATUS_PENDING:
+        return Response(
+            {"tex_key": tex_key, "status": JOB_STATUS_PENDING},
+            status=status.HTTP_202_ACCEPTED)
+
+    if job_status["status"] == JOB_STATUS_ERROR:
+        return Response(
+            {"tex_key": tex_key, "status": JOB_STATUS_ERROR,
+             "error": job_status["error"]},
+            status=status.HTTP_400_BAD_REQUEST)
+
+    return None
+
+
+class UserImageQuerysetMixin:
+    """
+    Users other than superusers may only access their own images.
+    """
+    def get_queryset(self):
+        if not self.request.user.is_superuser:
+            return LatexImage.objects.filter(creator=self.request.user)
+        return LatexImage.objects.all()
+
+
 class FieldsSerializerMixin:
     def get_serializer(self, *args, **kwargs):
         fields = self.request.GET.getlist('fields')
@@ -246,20 +641,26 @@ class FieldsSerializerMixin:
             kwargs["fields"] = fields[0]
         return super().get_serializer(*args, **kwargs)
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        # Only load the fields to be serialized. Instances are fully
+        # loaded for updates, which save all fields.
+        fields = self.request.GET.getlist('fields')
+        if fields and self.request.method in permissions.SAFE_METHODS:
+            queryset = queryset.only(*get_only_fields(fields[0]))
+        return queryset
+
 
 class LatexImageDetail(
-        FieldsSerializerMixin, generics.RetrieveUpdateDestroyAPIView):
+        FieldsSerializerMixin, UserImageQuerysetMixin,
+        generics.RetrieveUpdateDestroyAPIView):
     renderer_classes = (L2IRenderer,)
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = LatexImageSerializer
 
     lookup_field = "tex_key"
 
-    def get_queryset(self):
-        if not self.request.user.is_superuser:
-            return LatexImage.objects.filter(creator=self.request.user)
-        return LatexImage.objects.all()
-
     def get(self, request, *args, **kwargs):
         tex_key = kwargs.get("tex_key")
         assert tex_key is not None
@@ -267,22 +668,181 @@ class LatexImageDetail(
         if len(fields) == 1:
             fields = fields[0].split(",")
             if len(fields) == 1:
-                cached_result = (
-                    get_cached_attribute_by_tex_key(
-                        tex_key, fields[0], request))
+                with timed_stage(STAGE_CACHE_LOOKUP):
+                    cached_result = get_cached_attribute_by_tex_key(
+                        tex_key, fields[0], request)
+                if not cached_result:
+                    job_status_response = get_job_status_response(tex_key)
+                    if job_status_response is not None:
+                        return job_status_response
                 return Response(
                     data=cached_result,
                     status=status.HTTP_200_OK)
-        return super().get(request, *args, **kwargs)
+
+            if all(field in LATEX_IMAGE_ALLOWED_FIELDS_NAME for field in fields):
+                cached_result = self.get_cached_result(tex_key, fields)
+                if cached_result:
+                    return Response(
+                        data=cached_result,
+                        status=status.HTTP_200_OK)
+
+        try:
+            return super().get(request, *args, **kwargs)
+        except Http404:
+            job_status_response = get_job_status_response(tex_key)
+            if job_status_response is None:
+                raise
+            return job_status_response
+
+    def get_cached_result(self, tex_key, fields):
+        """
+        :return: the cached `fields` of `tex_key`, None if they are not
+        cached, or the instance is not one of the user's (in which case
+        the request is served from :meth:`get_queryset`).
+        """
+        user = self.request.user
+        lookup_fields = list(fields)
+        if not user.is_superuser and "creator" not in fields:
+            # To check the owner of cache hits, without a query
+            lookup_fields.append("creator")
+
+        with timed_stage(STAGE_CACHE_LOOKUP):
+            cached_result = get_cached_attributes_by_tex_keys(
+                [tex_key], lookup_fields, self.request,
+                queryset=self.get_queryset()).get(tex_key)
+
+        if cached_result is None or user.is_superuser:
+            return cached_result
+        if cached_result.get("creator") != user.pk:
+            # Including compile errors, whose owner is not cached
+            return None
+        if "creator" not in fields:
+            del cached_result["creator"]
+        return cached_result
 
 
 class LatexImageList(
-        CreateMixin, FieldsSerializerMixin, generics.ListCreateAPIView):
+        CreateMixin, FieldsSerializerMixin, UserImageQuerysetMixin,
+        generics.ListCreateAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = LatexImageSerializer
-    renderer_classes = (L2IRenderer,)
+    renderer_classes = (L2IRenderer, NDJSONRenderer)
+    pagination_class = LatexImageCursorPagination
+
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format == NDJSONRenderer.format:
+            return self.get_ndjson_streaming_response()
+        return super().list(request, *args, **kwargs)
+
+    def get_ndjson_streaming_response(self):
+        """
+        Stream all the instances, one JSON document per line, from a
+        server-side cursor, so that neither end needs to hold the whole
+        list in memory.
+        """
+        queryset = self.filter_queryset(
+            self.get_queryset()).order_by("creation_time", "id")
+        serializer = self.get_serializer()
+        renderer = JSONRenderer()
+        chunk_size = getattr(settings, "L2I_API_STREAM_CHUNK_SIZE", 500)
+
+        def lines():
+            for instance in queryset.iterator(chunk_size=chunk_size):
+                yield renderer.render(
+                    serializer.to_representation(instance)) + b"\n"
+
+        return StreamingHttpResponse(
+            lines(), content_type=NDJSONRenderer.media_type)
+
+
+def get_image_etag(tex_key):
+    # The image of a tex_key never changes, since the tex_key is derived
+    # from the tex source, the compiler and the image format.
+    return quote_etag(tex_key)
+
+
+def image_requires_auth():
+    return getattr(settings, "L2I_IMAGE_REQUIRE_AUTH", False)
+
+
+def set_image_cache_headers(response, etag, last_modified=None):
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+
+    # Shared caches must not serve images which require authorization
+    response["Cache-Control"] = "%s, max-age=%d, immutable" % (
+        "private" if image_requires_auth() else "public",
+        getattr(settings, "L2I_IMAGE_CACHE_MAX_AGE", 31536000))
+    return response
+
+
+def get_image_file_response(image_name):
+    """
+    :return: a response sending the file `image_name` of the default
+    storage, by nginx if L2I_IMAGE_X_ACCEL_REDIRECT_LOCATION is set.
+    """
+    content_type = guess_type(image_name)[0]
+
+    x_accel_location = getattr(
+        settings, "L2I_IMAGE_X_ACCEL_REDIRECT_LOCATION", None)
+    if x_accel_location:
+        response = HttpResponse(content_type=content_type)
+        response["X-Accel-Redirect"] = "%s/%s" % (
+            x_accel_location.rstrip("/"), image_name[len(UPLOAD_TO) + 1:])
+        return response
+
+    try:
+        image_file = default_storage.open(image_name)
+    except FileNotFoundError:
+        raise Http404()
+    return FileResponse(image_file, content_type=content_type)
+
+
+class LatexImageRaw(UserImageQuerysetMixin, generics.GenericAPIView):
+    """
+    Send the image of a tex_key as is, e.g., api/image/<tex_key>.svg,
+    with ETag and Last-Modified headers. Conditional requests with a
+    matching ETag are answered with 304 without querying the database.
+
+    With L2I_IMAGE_REQUIRE_AUTH, only users who may access the instance
+    in the detail view get the image, and the 304 is sent after that check.
+    """
+    # Session authentication allows logged in users to view the images
+    # in browsers.
+    authentication_classes = [TokenAuthentication, SessionAuthentication]
+    http_method_names = ["get", "head", "options"]
+
+    def get_permissions(self):
+        if image_requires_auth():
+            return [permissions.IsAuthenticated()]
+        return [permissions.AllowAny()]
 
     def get_queryset(self):
-        if not self.request.user.is_superuser:
-            return LatexImage.objects.filter(creator=self.request.user)
+        if image_requires_auth():
+            return super().get_queryset()
         return LatexImage.objects.all()
+
+    def get(self, request, *args, **kwargs):
+        tex_key = kwargs["tex_key"]
+        etag = get_image_etag(tex_key)
+
+        if not image_requires_auth():
+            response = get_conditional_response(request, etag=etag)
+            if response is not None:
+                return set_image_cache_headers(response, etag)
+
+        instance = (
+            self.get_queryset().filter(tex_key=tex_key)
+            .only("image", "creation_time").first())
+        if (instance is None or not instance.image
+                or not instance.image.name.endswith(".%s" % kwargs["ext"])):
+            raise Http404()
+
+        last_modified = int(instance.creation_time.timestamp())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = get_image_file_response(instance.image.name)
+
+        return set_image_cache_headers(response, etag, last_modified)
@@ -8,6 +8,9 @@ class Latex2ImageConfig(AppConfig):
     def ready(self):
         import latex.receivers  # noqa
         from latex.checks import register_startup_checks
+        from latex.converter import set_imagemagick_memory_limit
 
         # register checks
         register_startup_checks()
+
+        set_imagemagick_memory_limit()
@@ -0,0 +1,361 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Text, Tuple  # noqa
+
+from django.conf import settings
+
+from latex.constants import ALLOWED_COMPILER_FORMAT_COMBINATION
+from latex.converter import tex_to_img_converter
+from latex.utils import file_read
+
+try:
+    import resource
+except ImportError:  # pragma: no cover, on Windows
+    resource = None
+
+# Synthetic cases, in addition to the documents in the corpus dirs.
+SYNTHETIC_CASES = {
+    "synthetic_inline_math": (
+        "\\documentclass[border=1pt]{standalone}\n"
+        "\\begin{document}\n"
+        "$E = mc^2$, $\\sum_{i=1}^n i = \\frac{n(n+1)}{2}$\n"
+        "\\end{document}\n"),
+    "synthetic_display_math": (
+        "\\documentclass[varwidth, border=1pt]{standalone}\n"
+        "\\usepackage{amsmath}\n"
+        "\\begin{document}\n"
+        "\\begin{align*}\n"
+        "\\int_{-\\infty}^{\\infty} e^{-x^2}\\,dx &= \\sqrt{\\pi} \\\\\n"
+        "\\det\\begin{pmatrix} a & b \\\\ c & d \\end{pmatrix} &= ad - bc\n"
+        "\\end{align*}\n"
+        "\\end{document}\n"),
+    "synthetic_tikz": (
+        "\\documentclass[border=1pt]{standalone}\n"
+        "\\usepackage{tikz}\n"
+        "\\begin{document}\n"
+        "\\begin{tikzpicture}\n"
+        "\\draw[->] (-1.5, 0) -- (1.5, 0);\n"
+        "\\draw[->] (0, -1.5) -- (0, 1.5);\n"
+        "\\draw[blue] (0, 0) circle (1);\n"
+        "\\end{tikzpicture}\n"
+        "\\end{document}\n"),
+    "synthetic_cjk": (
+        "\\documentclass[border=1pt]{standalone}\n"
+        "\\usepackage{CJKutf8}\n"
+        "\\begin{document}\n"
+        "\\begin{CJK}{UTF8}{gbsn}你好，世界\\end{CJK}\n"
+        "\\end{document}\n"),
+}  # type: Dict[Text, Text]
+
+
+def get_default_corpus_dirs():
+    # type: () -> List[Text]
+    return [os.path.join(settings.BASE_DIR, "tests", "resource")]
+
+
+def load_corpus(corpus_dirs, synthetic=True):
+    # type: (List[Text], bool) -> Dict[Text, Text]
+    """
+    :return: a dict mapping the names of the documents to their tex source,
+    with all .tex files (recursively) in `corpus_dirs`, and the synthetic
+    cases if `synthetic`.
+    """
+    corpus = {}  # type: Dict[Text, Text]
+    for corpus_dir in corpus_dirs:
+        for root, __, filenames in sorted(os.walk(corpus_dir)):
+            for filename in sorted(filenames):
+                if not filename.endswith(".tex"):
+                    continue
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, corpus_dir)
+                corpus[name] = file_read(path).decode("utf-8")
+
+    if synthetic:
+        corpus.update(SYNTHETIC_CASES)
+    return corpus
+
+
+def percentile(values, q):
+    # type: (List[float], float) -> Optional[float]
+    """
+    :return: the `q`-th percentile (0 to 100) of `values`, with linear
+    interpolation, None if `values` is empty.
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * q / 100
+    lower = int(k)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (k - lower)
+
+
+def summarize_latencies(latencies):
+    # type: (List[float]) -> Dict[Text, Any]
+    return {
+        "n": len(latencies),
+        "mean": sum(latencies) / len(latencies) if latencies else None,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+    }
+
+
+def get_peak_rss_kb():
+    # type: () -> Dict[Text, Optional[int]]
+    """
+    :return: the peak RSS (in KiB) of this process (ImageMagick conversions
+    run in it) and of the largest child process (TeX and converters), since
+    the process started.
+    """
+    if resource is None:  # pragma: no cover
+        return {"self": None, "children": None}
+
+    # ru_maxrss is in bytes on macOS, and in KiB elsewhere
+    factor = 1024 if sys.platform == "darwin" else 1
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // factor,
+        "children": (
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // factor),
+    }
+
+
+def convert_once(compiler, image_format, tex_source):
+    # type: (Text, Text, Text) -> Tuple[float, int]
+    """
+    Convert `tex_source` with an unique tex_key, bypassing the database
+    and the cache.
+    :return: the latency in seconds, and the size of the image in bytes.
+    """
+    converter = tex_to_img_converter(
+        compiler, tex_source, image_format,
+        tex_key="l2i_bench_%s" % uuid.uuid4().hex)
+    start = time.perf_counter()
+    image = converter.get_converted_image()
+    # The data url is part of the response of each request
+    image.data_url
+    latency = time.perf_counter() - start
+    return latency, image.size
+
+
+def format_error(e):
+    # type: (Exception) -> Text
+    return "%s: %s" % (
+        type(e).__name__,
+        str(e).strip().splitlines()[0] if str(e).strip() else "")
+
+
+def measure_throughput(compiler, image_format, sources, concurrency, n_jobs):
+    # type: (Text, Text, List[Text], int, int) -> Tuple[Optional[float], int]
+    """
+    :return: successful conversions per second (None if none succeeded),
+    when running `n_jobs` conversions of `sources` (in turn) with
+    `concurrency` threads, and the number of failed conversions, e.g.,
+    rejected with ConversionQueueFull when `concurrency` is beyond the
+    capacity of the conversion executor.
+    """
+    def convert(source):
+        # type: (Text) -> bool
+        try:
+            convert_once(compiler, image_format, source)
+        except Exception:
+            return False
+        return True
+
+    jobs = [sources[i % len(sources)] for i in range(n_jobs)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        n_succeeded = sum(executor.map(convert, jobs))
+    elapsed = time.perf_counter() - start
+
+    if not n_succeeded:
+        return None, n_jobs
+    return n_succeeded / elapsed, n_jobs - n_succeeded
+
+
+def benchmark_combination(compiler, image_format, corpus, repeat=3,
+                          concurrency_levels=(1,)):
+    # type: (Text, Text, Dict[Text, Text], int, Tuple[int, ...]) -> Dict[Text, Any]  # noqa
+    """
+    Convert each document of `corpus` once cold (the first conversion of the
+    document in this process), then `repeat` times warm, and measure the
+    throughput at each of `concurrency_levels` with the documents which
+    succeeded. The documents failing cold are reported in "errors", the
+    numbers of failed warm and throughput conversions in "failures".
+    """
+    cold = []  # type: List[float]
+    warm = []  # type: List[float]
+    sizes = []  # type: List[int]
+    errors = {}  # type: Dict[Text, Text]
+    succeeded = []  # type: List[Text]
+    n_warm_failed = 0
+
+    for name, tex_source in corpus.items():
+        try:
+            latency, size = convert_once(compiler, image_format, tex_source)
+        except Exception as e:
+            errors[name] = format_error(e)
+            continue
+
+        cold.append(latency)
+        sizes.append(size)
+        succeeded.append(tex_source)
+
+        for __ in range(repeat):
+            try:
+                warm.append(
+                    convert_once(compiler, image_format, tex_source)[0])
+            except Exception:
+                n_warm_failed += 1
+
+    throughput = {}  # type: Dict[Text, Optional[float]]
+    throughput_failed = {}  # type: Dict[Text, int]
+    for concurrency in concurrency_levels:
+        throughput[str(concurrency)] = None
+        throughput_failed[str(concurrency)] = 0
+        if succeeded:
+            (throughput[str(concurrency)],
+             throughput_failed[str(concurrency)]) = measure_throughput(
+                compiler, image_format, succeeded, concurrency,
+                n_jobs=max(concurrency * 2, len(succeeded)))
+
+    return {
+        "compiler": compiler,
+        "image_format": image_format,
+        "n_documents": len(corpus),
+        "errors": errors,
+        "failures": {"warm": n_warm_failed, "throughput": throughput_failed},
+        "cold": summarize_latencies(cold),
+        "warm": summarize_latencies(warm),
+        "throughput": throughput,
+        "output_bytes": {
+            "min": min(sizes) if sizes else None,
+            "max": max(sizes) if sizes else None,
+            "mean": sum(sizes) / len(sizes) if sizes else None,
+        },
+    }
+
+
+def get_benchmark_settings():
+    # type: () -> Dict[Text, Any]
+    """
+    :return: the settings which affect the results, so that runs with
+    different settings can be told apart.
+    """
+    names = [
+        "L2I_IMAGEMAGICK_PNG_RESOLUTION", "L2I_FORMAT_CACHE_DIR",
+        "L2I_WARM_POOL_SIZE", "L2I_CONVERSION_MAX_CONCURRENCY",
+        "L2I_COMPILE_TIMEOUT", "L2I_CONVERT_TIMEOUT",
+    ]
+    return {name: getattr(settings, name, None) for name in names}
+
+
+def run_in_child_process(func, *args):
+    # type: (Any, *Any) -> Tuple[Any, Dict[Text, Optional[int]]]
+    """
+    Run `func` in a forked child process, whose peak RSS is then that of
+    `func` only (it can't be reset in a process).
+    :return: the result of `func`, and the peak RSS of the child, see
+    :func:`get_peak_rss_kb`.
+    :raises RuntimeError: if `func` raised, or the child died.
+    """
+    if not hasattr(os, "fork"):  # pragma: no cover, on Windows
+        return func(*args), get_peak_rss_kb()
+
+    import multiprocessing
+    context = multiprocessing.get_context("fork")
+    reader, writer = context.Pipe(duplex=False)
+
+    def target():
+        try:
+            writer.send((func(*args), get_peak_rss_kb(), None))
+        except Exception as e:
+            writer.send((None, None, format_error(e)))
+
+    process = context.Process(target=target, daemon=True)
+    process.start()
+    writer.close()
+    try:
+        result, peak_rss_kb, error = reader.recv()
+    except EOFError:
+        result, peak_rss_kb, error = None, None, (
+            "The benchmark process died")
+    finally:
+        reader.close()
+        process.join()
+
+    if error is not None:
+        raise RuntimeError(error)
+    return result, peak_rss_kb
+
+
+def run_benchmark(corpus, combinations=None, repeat=3, concurrency_levels=(1,),
+                  log=None):
+    # type: (...) -> Dict[Text, Any]
+    """
+    Benchmark each of `combinations` (default to all allowed (compiler,
+    image_format) combinations) with `corpus`, each in a child process so
+    that its peak RSS is measured on its own. Forking is safe as the
+    command runs no other thread between the combinations.
+    :return: the JSON-serializable results.
+    """
+    if combinations is None:
+        combinations = list(ALLOWED_COMPILER_FORMAT_COMBINATION)
+
+    started_at = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+    results = []
+    for compiler, image_format in combinations:
+        if log is not None:
+            log("Benchmarking %s2%s..." % (compiler, image_format))
+        try:
+            result, peak_rss_kb = run_in_child_process(
+                benchmark_combination, compiler, image_format, corpus,
+                repeat, concurrency_levels)
+        except RuntimeError as e:
+            result, peak_rss_kb = {
+                "compiler": compiler,
+                "image_format": image_format,
+                "n_documents": len(corpus),
+                "error": str(e),
+            }, None
+        result["peak_rss_kb"] = peak_rss_kb
+        results.append(result)
+
+    return {
+        "started_at": started_at,
+        "python": sys.version.split()[0],
+        "settings": get_benchmark_settings(),
+        "documents": sorted(corpus),
+        "repeat": repeat,
+        "results": results,
+    }
@@ -0,0 +1,1323 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Text, Tuple  # noqa
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from latex.metrics import (CACHE_COMPRESSION_INPUT_BYTES,
+                           CACHE_COMPRESSION_OUTPUT_BYTES,
+                           CACHE_COMPRESSION_RATIO, FIELD_CACHE_REQUESTS,
+                           LOCAL_FIELD_CACHE_BYTES)
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover, optional
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+LAYOUT_KEYS = "keys"
+LAYOUT_HASH = "hash"
+CACHE_LAYOUTS = [LAYOUT_KEYS, LAYOUT_HASH]
+
+# The fields of LatexImage which can be cached
+CACHED_FIELDS = ["image", "creation_time", "data_url", "compile_error", "creator"]
+
+HASH_CACHE_KEY_SUFFIX = "fields"
+
+# The cache key of the generation of the cached fields, which namespaces
+# their cache keys, see :func:`bump_cache_generation`
+GENERATION_CACHE_KEY = "l2i:cache_generation"
+
+COMPRESSION_NONE = "none"
+COMPRESSION_ZLIB = "zlib"
+COMPRESSION_ZSTD = "zstd"
+COMPRESSION_ALGORITHMS = [COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_ZSTD]
+
+# The prefixes of compressed cached values, by algorithm. Values without
+# one of them are read as they are.
+COMPRESSED_VALUE_TAGS = {
+    COMPRESSION_ZLIB: b"l2i:zlib:",
+    COMPRESSION_ZSTD: b"l2i:zstd:",
+}
+
+# Strings not larger than that (in bytes) are not compressed by default
+DEFAULT_COMPRESSION_MIN_BYTES = 1024
+
+# The formats of cached values, see :func:`get_value_format`
+VALUE_FORMAT_SVG = "svg"
+VALUE_FORMAT_PNG = "png"
+VALUE_FORMAT_TEXT = "text"
+VALUE_FORMATS = [VALUE_FORMAT_SVG, VALUE_FORMAT_PNG, VALUE_FORMAT_TEXT]
+
+# The redis pub/sub channel of tex_keys whose local field caches are stale
+INVALIDATION_CHANNEL = "l2i:field_cache:invalidate"
+
+# Seconds before re-subscribing to the invalidation channel after errors
+INVALIDATION_RETRY_INTERVAL = 1
+
+# The tex_keys read from the local field cache refresh their priorities of
+# the GreedyDualSizePolicy in batches, at most every that many seconds, or
+# once that many tex_keys are read
+LOCAL_HITS_TOUCH_INTERVAL = 1
+LOCAL_HITS_TOUCH_MAX_KEYS = 1000
+
+
+def get_namespaced_key(key, generation=0):
+    # type: (Text, int) -> Text
+    """
+    :return: `key` in the namespace of `generation`. Generation 0, i.e.,
+    before the first bump, is not prefixed, so that the keys cached before
+    namespacing are still read.
+    """
+    if not generation:
+        return key
+    return "g%d:%s" % (generation, key)
+
+
+def get_field_cache_key(tex_key, field_name, generation=0):
+    # type: (Text, Text, int) -> Text
+    return get_namespaced_key("%s:%s" % (tex_key, field_name), generation)
+
+
+def get_hash_cache_key(tex_key, generation=0):
+    # type: (Text, int) -> Text
+    return get_namespaced_key(
+        "%s:%s" % (tex_key, HASH_CACHE_KEY_SUFFIX), generation)
+
+
+def get_default_cache():
+    try:
+        import django.core.cache as cache
+        return cache.caches["default"]
+    except ImproperlyConfigured:
+        return None
+
+
+def is_redis_cache(def_cache):
+    # type: (Any) -> bool
+    """
+    Whether `def_cache` is a django-redis cache, which gives access to
+    the redis client.
+    """
+    return hasattr(getattr(def_cache, "client", None), "get_client")
+
+
+def get_value_size(value):
+    # type: (Any) -> int
+    """
+    :return: the approximate size in bytes of a cached field value.
+    """
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    return len(str(value))
+
+
+def get_value_format(value):
+    # type: (Text) -> Text
+    """
+    :return: the format of a cached string, "svg" and "png" for the data
+    urls of images, else "text" (e.g., compile errors and image paths).
+    """
+    if value.startswith("data:image/svg+xml"):
+        return VALUE_FORMAT_SVG
+    if value.startswith("data:image/png"):
+        return VALUE_FORMAT_PNG
+    return VALUE_FORMAT_TEXT
+
+
+def get_compression_min_bytes(value_format):
+    # type: (Text) -> Optional[int]
+    """
+    :return: the size above which strings of `value_format` are compressed,
+    from settings.L2I_CACHE_COMPRESSION_MIN_BYTES_BY_FORMAT, else
+    settings.L2I_CACHE_COMPRESSION_MIN_BYTES. None means never compressed.
+    """
+    by_format = getattr(
+        settings, "L2I_CACHE_COMPRESSION_MIN_BYTES_BY_FORMAT", None) or {}
+    if value_format in by_format:
+        return by_format[value_format]
+    return getattr(settings, "L2I_CACHE_COMPRESSION_MIN_BYTES",
+                   DEFAULT_COMPRESSION_MIN_BYTES)
+
+
+def is_compression_available(algorithm):
+    # type: (Text) -> bool
+    return algorithm != COMPRESSION_ZSTD or zstandard is not None
+
+
+def compress(data, algorithm, level=None):
+    # type: (bytes, Text, Optional[int]) -> bytes
+    """
+    :param level: the compression level, default to that of `algorithm`.
+    """
+    if algorithm == COMPRESSION_ZLIB:
+        return zlib.compress(data, -1 if level is None else level)
+    if algorithm == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise ImproperlyConfigured(
+                "zstd compression requires the zstandard package")
+        # Compressors are not thread safe, hence one per call
+        return zstandard.ZstdCompressor(
+            level=3 if level is None else level).compress(data)
+    raise ValueError("Unknown compression algorithm: %s" % algorithm)
+
+
+def decompress(data, algorithm):
+    # type: (bytes, Text) -> bytes
+    if algorithm == COMPRESSION_ZLIB:
+        return zlib.decompress(data)
+    if algorithm == COMPRESSION_ZSTD:
+        if zstandard is None:
+            raise ImproperlyConfigured(
+                "zstd compression requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError("Unknown compression algorithm: %s" % algorithm)
+
+
+def encode_cache_value(value):
+    # type: (Any) -> Any
+    """
+    :return: `value` as it is cached, or None if it is larger than
+    settings.L2I_CACHE_MAX_BYTES. Strings larger than their compression
+    threshold (see :func:`get_compression_min_bytes`) are compressed with
+    settings.L2I_CACHE_COMPRESSION, and tagged with the algorithm, unless
+    that doesn't make them smaller.
+    """
+    algorithm = getattr(settings, "L2I_CACHE_COMPRESSION", COMPRESSION_ZLIB)
+    size = get_value_size(value)
+
+    if isinstance(value, str) and algorithm != COMPRESSION_NONE:
+        value_format = get_value_format(value)
+        min_bytes = get_compression_min_bytes(value_format)
+        if min_bytes is not None and size > min_bytes:
+            compressed = COMPRESSED_VALUE_TAGS[algorithm] + compress(
+                value.encode("utf-8"), algorithm,
+                getattr(settings, "L2I_CACHE_COMPRESSION_LEVEL", None))
+
+            labels = {"algorithm": algorithm, "value_format": value_format}
+            CACHE_COMPRESSION_RATIO.labels(**labels).observe(
+                len(compressed) / size)
+            CACHE_COMPRESSION_INPUT_BYTES.labels(**labels).inc(size)
+            if len(compressed) < size:
+                value, size = compressed, len(compressed)
+            CACHE_COMPRESSION_OUTPUT_BYTES.labels(**labels).inc(size)
+    if size > getattr(settings, "L2I_CACHE_MAX_BYTES", 0):
+        return None
+    return value
+
+
+def decode_cache_value(value):
+    # type: (Any) -> Any
+    """
+    The reverse of :func:`encode_cache_value`.
+    :return: None if the value can't be decompressed, e.g., if the
+    algorithm it was compressed with is no longer available.
+    """
+    if not isinstance(value, bytes):
+        return value
+
+    for algorithm, tag in COMPRESSED_VALUE_TAGS.items():
+        if value.startswith(tag):
+            try:
+                return decompress(value[len(tag):], algorithm).decode("utf-8")
+            except Exception:
+                logger.warning("Failed to decompress a cached value (%s)",
+                               algorithm, exc_info=True)
+                return None
+    return value
+
+
+def get_fields_cached_on_save():
+    # type: () -> List[Text]
+    """
+    :return: the fields of instances cached when they are saved.
+    """
+    fields = ["compile_error"]
+
+    # We only cache image when image relative path are requested in api,
+    # because we can't access the request thus no way to know the url.
+    if getattr(settings, "L2I_API_IMAGE_RETURNS_RELATIVE_PATH", True):
+        fields.append("image")
+
+    if getattr(settings, "L2I_CACHE_DATA_URL_ON_SAVE", False):
+        fields.append("data_url")
+    return fields
+
+
+def get_cache_timeout(fields):
+    # type: (Dict[Text, Any]) -> Optional[int]
+    """
+    :return: the timeout (in seconds) of the cached `fields` of a
+    tex_key, settings.L2I_CACHE_COMPILE_ERROR_TIMEOUT for compile errors,
+    else settings.L2I_CACHE_TIMEOUT. None means never expire.
+    """
+    if fields.get("compile_error") is not None:
+        return getattr(settings, "L2I_CACHE_COMPILE_ERROR_TIMEOUT", None)
+    return getattr(settings, "L2I_CACHE_TIMEOUT", None)
+
+
+def encode_cache_values(values):
+    # type: (Dict[Text, Dict[Text, Any]]) -> Dict[Text, Dict[Text, Any]]
+    """
+    Encode the fields of each tex_key with :func:`encode_cache_value`,
+    dropping those which can't be cached.
+    """
+    encoded = {}  # type: Dict[Text, Dict[Text, Any]]
+    for tex_key, fields in values.items():
+        for field, value in fields.items():
+            if value is None:
+                continue
+            value = encode_cache_value(value)
+            if value is not None:
+                encoded.setdefault(tex_key, {})[field] = value
+    return encoded
+
+
+class FieldCacheBase(object):
+    """
+    The cached fields of LatexImage instances, by tex_key.
+    """
+
+    def get_many(self, tex_keys, fields):
+        # type: (List[Text], List[Text]) -> Dict[Text, Dict[Text, Any]]
+        """
+        :return: a dict mapping tex_keys to the dicts of their cached
+        `fields`. Fields not cached are omitted, and so are tex_keys
+        with none of the fields cached.
+        """
+        raise NotImplementedError
+
+    def set_many(self, values, overwrite=True, costs=None):
+        # type: (Dict[Text, Dict[Text, Any]], bool, Optional[Dict[Text, float]]) -> Dict[Text, int]  # noqa
+        """
+        :param values: a dict mapping tex_keys to the dicts of the fields
+        to cache. Values too large to be cached are skipped, see
+        :func:`encode_cache_value`.
+        :param overwrite: if False, fields already cached are kept.
+        :param costs: the render costs (in milliseconds) of the tex_keys,
+        if known, which are used by :class:`PolicyFieldCache`.
+        :return: a dict mapping tex_keys to the dicts of the sizes in bytes
+        of the fields written. Fields kept (with `overwrite` False) are
+        omitted, and so are tex_keys with no field written.
+        """
+        raise NotImplementedError
+
+    def touch(self, tex_keys):
+        # type: (List[Text]) -> None
+        """
+        Note that `tex_keys` were read from a cache in front of this one,
+        e.g., the local field cache.
+        """
+        pass
+
+    def delete_many(self, tex_keys):
+        # type: (List[Text]) -> None
+        """
+        Delete all the cached fields of `tex_keys`.
+        """
+        raise NotImplementedError
+
+    def iter_tex_keys(self):
+        # type: () -> Iterator[Text]
+        """
+        Iterate over the tex_keys which have cached fields, this requires
+        a django-redis cache.
+        """
+        raise NotImplementedError
+
+
+class RedisClientMixin(object):
+    cache = None  # type: Any
+
+    def _run(self, func, default):
+        """
+        Run `func` with the redis client, and, like django-redis, return
+        `default` on connection errors if the cache is configured to
+        ignore exceptions.
+        """
+        from redis.exceptions import ConnectionError, TimeoutError
+
+        try:
+            return func(self.cache.client.get_client(write=True))
+        except (ConnectionError, TimeoutError):
+            if not getattr(self.cache, "_ignore_exceptions", False):
+                raise
+            logger.warning("Ignored redis error of the field cache",
+                           exc_info=True)
+            return default
+
+
+class KeyPerFieldCache(RedisClientMixin, FieldCacheBase):
+    """
+    One cache key per (tex_key, field), which works with all cache
+    backends. With django-redis, the keys of all tex_keys are written
+    in one pipeline.
+    """
+
+    def __init__(self, cache, generation=0):
+        # type: (Any, int) -> None
+        self.cache = cache
+        self.generation = generation
+
+    def get_many(self, tex_keys, fields):
+        cache_keys = {
+            get_field_cache_key(tex_key, field, self.generation):
+                (tex_key, field)
+            for tex_key in tex_keys for field in fields}
+
+        result = {}  # type: Dict[Text, Dict[Text, Any]]
+        for cache_key, value in self.cache.get_many(list(cache_keys)).items():
+            if value is None:
+                continue
+            value = decode_cache_value(value)
+            if value is None:
+                continue
+            tex_key, field = cache_keys[cache_key]
+            result.setdefault(tex_key, {})[field] = value
+        return result
+
+    def set_many(self, values, overwrite=True, costs=None):
+        # One write per timeout, rather than per tex_key
+        by_timeout = {}  # type: Dict[Optional[int], Dict[Text, Any]]
+        cache_key_fields = {}  # type: Dict[Text, Tuple[Text, Text]]
+        for tex_key, fields in encode_cache_values(values).items():
+            to_cache = by_timeout.setdefault(
+                get_cache_timeout(values[tex_key]), {})
+            for field, value in fields.items():
+                cache_key = get_field_cache_key(
+                    tex_key, field, self.generation)
+                to_cache[cache_key] = value
+                cache_key_fields[cache_key] = (tex_key, field)
+
+        sizes = {}  # type: Dict[Text, Dict[Text, int]]
+        for timeout, to_cache in by_timeout.items():
+            if overwrite:
+                self.cache.set_many(to_cache, timeout)
+                written = list(to_cache)
+            elif is_redis_cache(self.cache):
+                written = self._run(
+                    lambda client: self._add_many(client, to_cache, timeout),
+                    [])
+            else:
+                written = [
+                    cache_key for cache_key, value in to_cache.items()
+                    if self.cache.add(cache_key, value, timeout)]
+
+            for cache_key in written:
+                tex_key, field = cache_key_fields[cache_key]
+                sizes.setdefault(tex_key, {})[field] = (
+                    get_value_size(to_cache[cache_key]))
+        return sizes
+
+    def _add_many(self, client, to_cache, timeout):
+        # type: (Any, Dict[Text, Any], Optional[int]) -> List[Text]
+        # What cache.add does for each key, in one pipeline
+        encode = self.cache.client.encode
+        pipe = client.pipeline(transaction=False)
+        for cache_key, value in to_cache.items():
+            pipe.set(self.cache.make_key(cache_key), encode(value),
+                     nx=True, ex=timeout)
+        return [
+            cache_key
+            for cache_key, added in zip(to_cache, pipe.execute()) if added]
+
+    def delete_many(self, tex_keys):
+        self.cache.delete_many([
+            get_field_cache_key(tex_key, field, self.generation)
+            for tex_key in tex_keys for field in CACHED_FIELDS])
+
+    def iter_tex_keys(self):
+        if not is_redis_cache(self.cache):
+            raise NotImplementedError(
+                "Iterating over cached tex_keys requires django-redis")
+
+        seen = set()
+        prefix = get_namespaced_key("", self.generation)
+        for field in CACHED_FIELDS:
+            suffix = ":%s" % field
+            for cache_key in self.cache.iter_keys(
+                    get_field_cache_key("*", field, self.generation)):
+                tex_key = cache_key[len(prefix):-len(suffix)]
+                # Skipping the keys of other generations
+                if ":" not in tex_key and tex_key not in seen:
+                    seen.add(tex_key)
+                    yield tex_key
+
+
+class HashFieldCache(RedisClientMixin, FieldCacheBase):
+    """
+    One redis hash per tex_key holding all its cached fields, so that
+    any subset of fields of a tex_key is read with one HMGET, and deleted
+    with one DEL. Requests of many tex_keys are pipelined.
+    """
+
+    def __init__(self, cache, generation=0):
+        # type: (Any, int) -> None
+        assert is_redis_cache(cache)
+        self.cache = cache
+        self.generation = generation
+
+    def _make_key(self, tex_key):
+        # type: (Text) -> Text
+        return self.cache.make_key(
+            get_hash_cache_key(tex_key, self.generation))
+
+    def get_many(self, tex_keys, fields):
+        if not tex_keys or not fields:
+            return {}
+
+        def hmget(client):
+            pipe = client.pipeline(transaction=False)
+            for tex_key in tex_keys:
+                pipe.hmget(self._make_key(tex_key), fields)
+            return pipe.execute()
+
+        decode = self.cache.client.decode
+        result = {}  # type: Dict[Text, Dict[Text, Any]]
+        for tex_key, values in zip(tex_keys, self._run(hmget, [])):
+            cached = {}
+            for field, value in zip(fields, values):
+                if value is not None:
+                    value = decode_cache_value(decode(value))
+                if value is not None:
+                    cached[field] = value
+            if cached:
+                result[tex_key] = cached
+        return result
+
+    def set_many(self, values, overwrite=True, costs=None):
+        # Accounted by their size before pickling, like KeyPerFieldCache
+        to_cache = encode_cache_values(values)
+        encode = self.cache.client.encode
+        encoded = {
+            tex_key: {field: encode(value) for field, value in fields.items()}
+            for tex_key, fields in to_cache.items()}
+        if not encoded:
+            return {}
+
+        def hset(client):
+            # type: (Any) -> List[Tuple[Text, Text]]
+            pipe = client.pipeline(transaction=False)
+            hsetnx_fields = []  # type: List[Tuple[Text, Text]]
+            for tex_key, fields in encoded.items():
+                key = self._make_key(tex_key)
+                if overwrite:
+                    pipe.hset(key, mapping=fields)
+                else:
+                    for field, value in fields.items():
+                        pipe.hsetnx(key, field, value)
+                        hsetnx_fields.append((tex_key, field))
+
+            # After the writes, so that the results of HSETNX come first
+            for tex_key in encoded:
+                timeout = get_cache_timeout(values[tex_key])
+                if timeout is not None:
+                    pipe.expire(self._make_key(tex_key), timeout)
+
+            results = pipe.execute()
+            if overwrite:
+                return [
+                    (tex_key, field)
+                    for tex_key, fields in encoded.items() for field in fields]
+            return [
+                tex_key_field
+                for tex_key_field, added in zip(hsetnx_fields, results)
+                if added]
+
+        sizes = {}  # type: Dict[Text, Dict[Text, int]]
+        for tex_key, field in self._run(hset, []):
+            sizes.setdefault(tex_key, {})[field] = (
+                get_value_size(to_cache[tex_key][field]))
+        return sizes
+
+    def delete_many(self, tex_keys):
+        if not tex_keys:
+            return
+
+        self._run(
+            lambda client: client.delete(
+                *[self._make_key(tex_key) for tex_key in tex_keys]),
+            None)
+
+    def iter_tex_keys(self):
+        prefix = get_namespaced_key("", self.generation)
+        suffix = ":%s" % HASH_CACHE_KEY_SUFFIX
+        for cache_key in self.cache.iter_keys(
+                get_hash_cache_key("*", self.generation)):
+            tex_key = cache_key[len(prefix):-len(suffix)]
+            # Skipping the keys of other generations
+            if ":" not in tex_key:
+                yield tex_key
+
+
+class LocalFieldCache(object):
+    """
+    An in-process LRU of the fields of tex_keys, bounded by the
+    approximate size in bytes of the values. A field known to be not
+    cached in the remote tier is kept as None, so that it is not looked
+    up again.
+    """
+
+    def __init__(self, max_bytes):
+        # type: (int) -> None
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+
+        # Incremented by each invalidation, see :meth:`update`
+        self.generation = 0
+
+        self._entries = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+
+    def _remove(self, tex_key):
+        # type: (Text) -> None
+        entry = self._entries.pop(tex_key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+            LOCAL_FIELD_CACHE_BYTES.dec(entry[1])
+
+    def get(self, tex_key, fields):
+        # type: (Text, List[Text]) -> Optional[Dict[Text, Any]]
+        """
+        :return: a dict of all `fields` of `tex_key`, with None for fields
+        not cached, or None if some of `fields` are unknown.
+        """
+        with self._lock:
+            entry = self._entries.get(tex_key)
+            if entry is None or not all(field in entry[0] for field in fields):
+                return None
+            self._entries.move_to_end(tex_key)
+            return {field: entry[0][field] for field in fields}
+
+    def update(self, tex_key, values, generation=None):
+        # type: (Text, Dict[Text, Any], Optional[int]) -> None
+        """
+        Merge `values` into the fields of `tex_key`, and evict the least
+        recently used tex_keys if the cache is full.
+        :param generation: the :attr:`generation` when `values` were
+        read from the remote tier. If there were invalidations since
+        then, `values` may be stale and are not kept.
+        """
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            entry = self._entries.get(tex_key)
+            merged = dict(entry[0]) if entry is not None else {}
+            merged.update(values)
+            size = len(tex_key) + sum(
+                get_value_size(value) for value in merged.values()
+                if value is not None)
+
+            self._remove(tex_key)
+            if size > self.max_bytes:
+                return
+
+            self._entries[tex_key] = (merged, size)
+            self.total_bytes += size
+            LOCAL_FIELD_CACHE_BYTES.inc(size)
+
+            while self.total_bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def delete_many(self, tex_keys):
+        # type: (List[Text]) -> None
+        with self._lock:
+            self.generation += 1
+            for tex_key in tex_keys:
+                self._remove(tex_key)
+
+    def clear(self):
+        # type: () -> None
+        with self._lock:
+            self.generation += 1
+            LOCAL_FIELD_CACHE_BYTES.dec(self.total_bytes)
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        # type: () -> int
+        return len(self._entries)
+
+
+class TwoTierFieldCache(FieldCacheBase):
+    """
+    A :class:`LocalFieldCache` in front of a remote field cache, so that
+    hot tex_keys are served without a round trip to the remote cache.
+    Writes and deletes go to both tiers, and the local caches of other
+    processes are invalidated via :func:`invalidate_local_field_cache`.
+    """
+
+    def __init__(self, local, remote):
+        # type: (LocalFieldCache, FieldCacheBase) -> None
+        self.local = local
+        self.remote = remote
+
+    def get_many(self, tex_keys, fields):
+        result = {}  # type: Dict[Text, Dict[Text, Any]]
+        to_fetch = []
+
+        for tex_key in tex_keys:
+            values = self.local.get(tex_key, fields)
+            if values is None:
+                to_fetch.append(tex_key)
+                continue
+            values = {
+                field: value for field, value in values.items()
+                if value is not None}
+            if values:
+                result[tex_key] = values
+
+        FIELD_CACHE_REQUESTS.labels(tier="local", result="hit").inc(
+            len(tex_keys) - len(to_fetch))
+        FIELD_CACHE_REQUESTS.labels(tier="local", result="miss").inc(
+            len(to_fetch))
+
+        if result:
+            self.remote.touch(list(result))
+
+        if not to_fetch:
+            return result
+
+        generation = self.local.generation
+        fetched = self.remote.get_many(to_fetch, fields)
+        for tex_key in to_fetch:
+            values = fetched.get(tex_key, {})
+            self.local.update(
+                tex_key, {field: values.get(field) for field in fields},
+                generation=generation)
+
+        FIELD_CACHE_REQUESTS.labels(tier="remote", result="hit").inc(
+            len(fetched))
+        FIELD_CACHE_REQUESTS.labels(tier="remote", result="miss").inc(
+            len(to_fetch) - len(fetched))
+
+        result.update(fetched)
+        return result
+
+    def set_many(self, values, overwrite=True, costs=None):
+        sizes = self.remote.set_many(values, overwrite=overwrite, costs=costs)
+        for tex_key, fields in values.items():
+            if overwrite:
+                self.local.update(tex_key, fields)
+            else:
+                # The fields already cached in the remote tier are kept,
+                # the local tier will read them.
+                self.local.delete_many([tex_key])
+        return sizes
+
+    def delete_many(self, tex_keys):
+        self.remote.delete_many(tex_keys)
+        self.local.delete_many(tex_keys)
+
+    def iter_tex_keys(self):
+        return self.remote.iter_tex_keys()
+
+
+class GreedyDualSizePolicy(RedisClientMixin):
+    """
+    GreedyDual-Size eviction of the cached tex_keys, with the bookkeeping
+    in redis shared by all processes. Each tex_key has a priority of
+    ``L + cost / size``, refreshed when it is cached or read, where
+    ``L`` is the priority of the last evicted tex_key. When the total
+    size of the cached tex_keys exceeds `budget_bytes`, the tex_keys of
+    the lowest priorities are evicted, i.e., the cheap to render and
+    large ones, and those not read for a while.
+
+    The sizes of the fields of each tex_key are kept, and replaced when
+    the fields are written again. They are approximate, e.g., fields
+    expired by their timeouts are only accounted for until evicted or
+    cached again.
+    """
+
+    def __init__(self, cache, budget_bytes, default_cost_ms=1000.):
+        # type: (Any, int, float) -> None
+        assert is_redis_cache(cache)
+        self.cache = cache
+        self.budget_bytes = budget_bytes
+        self.default_cost_ms = default_cost_ms
+
+        # The priorities of the tex_keys
+        self.queue_key = cache.make_key("l2i:gds:queue")
+
+        # The sizes of the fields and the cost of the tex_keys, in JSON
+        self.entries_key = cache.make_key("l2i:gds:entries")
+
+        # L and the total size of the tex_keys
+        self.meta_key = cache.make_key("l2i:gds:meta")
+
+    @staticmethod
+    def _parse_entry(entry):
+        # type: (Optional[bytes]) -> Optional[Tuple[Dict[Text, int], float]]
+        """
+        :return: the sizes of the fields, and the cost of an entry.
+        """
+        if entry is None:
+            return None
+        if isinstance(entry, bytes):
+            entry = entry.decode()
+        entry = json.loads(entry)
+        return entry["sizes"], float(entry["cost"])
+
+    @classmethod
+    def _get_entry_size(cls, entry):
+        # type: (Optional[bytes]) -> int
+        parsed = cls._parse_entry(entry)
+        if parsed is None:
+            return 0
+        return sum(parsed[0].values())
+
+    def admit(self, sizes, costs=None):
+        # type: (Dict[Text, Dict[Text, int]], Optional[Dict[Text, float]]) -> List[Text]  # noqa
+        """
+        Account for the fields of the tex_keys just cached.
+        :param sizes: the sizes in bytes of the fields of tex_keys just
+        written, replacing the sizes of those fields if already accounted.
+        :param costs: the render costs (in milliseconds) of the tex_keys,
+        default to the known costs or the default cost.
+        :return: the tex_keys to evict.
+        """
+        sizes = {tex_key: size for tex_key, size in sizes.items() if size}
+        if not sizes:
+            return []
+        costs = costs or {}
+        tex_keys = list(sizes)
+
+        def read(client):
+            pipe = client.pipeline(transaction=False)
+            pipe.hget(self.meta_key, "L")
+            pipe.hmget(self.entries_key, tex_keys)
+            return pipe.execute()
+
+        def write(client):
+            pipe = client.pipeline(transaction=True)
+            for tex_key in tex_keys:
+                pipe.zadd(self.queue_key, {tex_key: priorities[tex_key]})
+            pipe.hset(self.entries_key, mapping=entries)
+            pipe.hincrby(self.meta_key, "bytes", added_bytes)
+            return pipe.execute()[-1]
+
+        result = self._run(read, None)
+        if result is None:
+            return []
+        inflation = float(result[0] or 0)
+
+        priorities = {}
+        entries = {}
+        added_bytes = 0
+        for tex_key, entry in zip(tex_keys, result[1]):
+            field_sizes, cost = self._parse_entry(entry) or ({}, None)
+            cost = costs.get(tex_key) or cost or self.default_cost_ms
+            old_size = sum(field_sizes.values())
+            field_sizes.update(sizes[tex_key])
+            size = sum(field_sizes.values())
+            added_bytes += size - old_size
+            priorities[tex_key] = inflation + cost / max(size, 1)
+            entries[tex_key] = json.dumps(
+                {"sizes": field_sizes, "cost": cost})
+
+        total_bytes = self._run(write, None)
+        if total_bytes is None or total_bytes <= self.budget_bytes:
+            return []
+        return self.evict(total_bytes - self.budget_bytes)
+
+    def evict(self, n_bytes):
+        # type: (int) -> List[Text]
+        """
+        Pop the tex_keys of the lowest priorities until `n_bytes` are
+        freed (or none is left).
+        :return: the popped tex_keys, whose fields should be deleted.
+        """
+        evicted = []  # type: List[Text]
+
+        def pop(client):
+            popped = client.zpopmin(self.queue_key)
+            if not popped:
+                return [], 0
+            victims = [
+                tex_key.decode() if isinstance(tex_key, bytes) else tex_key
+                for tex_key, _ in popped]
+
+            pipe = client.pipeline(transaction=True)
+            pipe.hmget(self.entries_key, victims)
+            pipe.hdel(self.entries_key, *victims)
+            pipe.hget(self.meta_key, "L")
+            entries, _, inflation = pipe.execute()
+
+            freed = sum(self._get_entry_size(entry) for entry in entries)
+            pipe = client.pipeline(transaction=True)
+            pipe.hincrby(self.meta_key, "bytes", -freed)
+            # L never decreases
+            pipe.hset(
+                self.meta_key, "L", max(float(inflation or 0), popped[-1][1]))
+            pipe.execute()
+            return victims, freed
+
+        while n_bytes > 0:
+            victims, freed = self._run(pop, ([], 0))
+            if not victims:
+                break
+            evicted.extend(victims)
+            n_bytes -= freed
+
+        return evicted
+
+    def touch(self, tex_keys):
+        # type: (List[Text]) -> None
+        """
+        Refresh the priorities of the tex_keys just read.
+        """
+        if not tex_keys:
+            return
+
+        def read(client):
+            pipe = client.pipeline(transaction=False)
+            pipe.hget(self.meta_key, "L")
+            pipe.hmget(self.entries_key, tex_keys)
+            return pipe.execute()
+
+        result = self._run(read, None)
+        if result is None:
+            return
+        inflation = float(result[0] or 0)
+
+        priorities = {}
+        for tex_key, entry in zip(tex_keys, result[1]):
+            parsed = self._parse_entry(entry)
+            if parsed is not None:
+                field_sizes, cost = parsed
+                priorities[tex_key] = (
+                    inflation + cost / max(sum(field_sizes.values()), 1))
+
+        if priorities:
+            # Not re-adding tex_keys evicted in the meantime
+            self._run(
+                lambda client: client.zadd(
+                    self.queue_key, priorities, xx=True),
+                None)
+
+    def forget(self, tex_keys):
+        # type: (List[Text]) -> None
+        """
+        Stop accounting for the deleted tex_keys.
+        """
+        if not tex_keys:
+            return
+
+        def remove(client):
+            entries = client.hmget(self.entries_key, tex_keys)
+            freed = sum(self._get_entry_size(entry) for entry in entries)
+            pipe = client.pipeline(transaction=True)
+            pipe.zrem(self.queue_key, *tex_keys)
+            pipe.hdel(self.entries_key, *tex_keys)
+            pipe.hincrby(self.meta_key, "bytes", -freed)
+            pipe.execute()
+
+        self._run(remove, None)
+
+    def clear(self):
+        # type: () -> None
+        self._run(
+            lambda client: client.delete(
+                self.queue_key, self.entries_key, self.meta_key),
+            None)
+
+
+class TouchBuffer(object):
+    """
+    Collect the tex_keys read from the local field cache of the process,
+    whose priorities are refreshed in batches.
+    """
+
+    def __init__(self, interval, max_keys):
+        # type: (float, int) -> None
+        self.interval = interval
+        self.max_keys = max_keys
+        self._tex_keys = set()  # type: set
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add(self, tex_keys):
+        # type: (List[Text]) -> List[Text]
+        """
+        :return: the tex_keys collected, to be touched, if `interval`
+        seconds elapsed since the last flush or `max_keys` are collected,
+        else an empty list.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._tex_keys.update(tex_keys)
+            if (len(self._tex_keys) < self.max_keys
+                    and now - self._flushed_at < self.interval):
+                return []
+            tex_keys = list(self._tex_keys)
+            self._tex_keys = set()
+            self._flushed_at = now
+        return tex_keys
+
+
+_local_hits = TouchBuffer(LOCAL_HITS_TOUCH_INTERVAL, LOCAL_HITS_TOUCH_MAX_KEYS)
+
+
+class PolicyFieldCache(FieldCacheBase):
+    """
+    A field cache whose tex_keys are evicted by a
+    :class:`GreedyDualSizePolicy`. The tex_keys read from the local field
+    cache in front of it are touched in batches, via :data:`_local_hits`.
+    """
+
+    def __init__(self, policy, field_cache):
+        # type: (GreedyDualSizePolicy, FieldCacheBase) -> None
+        self.policy = policy
+        self.field_cache = field_cache
+
+    def get_many(self, tex_keys, fields):
+        result = self.field_cache.get_many(tex_keys, fields)
+        self.policy.touch(list(result))
+        return result
+
+    def set_many(self, values, overwrite=True, costs=None):
+        sizes = self.field_cache.set_many(
+            values, overwrite=overwrite, costs=costs)
+        evicted = self.policy.admit(sizes, costs)
+        if evicted:
+            self.field_cache.delete_many(evicted)
+            logger.debug("Evicted the cache of %d tex_key(s)", len(evicted))
+        return sizes
+
+    def touch(self, tex_keys):
+        self.policy.touch(_local_hits.add(tex_keys))
+
+    def delete_many(self, tex_keys):
+        self.field_cache.delete_many(tex_keys)
+        self.policy.forget(tex_keys)
+
+    def iter_tex_keys(self):
+        return self.field_cache.iter_tex_keys()
+
+
+class InvalidationListener(threading.Thread):
+    """
+    Drop the tex_keys published to :data:`INVALIDATION_CHANNEL` from the
+    local field cache of this process.
+    """
+
+    def __init__(self, local, cache):
+        # type: (LocalFieldCache, Any) -> None
+        super(InvalidationListener, self).__init__(
+            name="l2i_cache_invalidation", daemon=True)
+        self.local = local
+        self.cache = cache
+        self._stop_event = threading.Event()
+
+    def handle_message(self, message):
+        # type: (Dict[Text, Any]) -> None
+        if message.get("type") != "message":
+            return
+        try:
+            tex_keys = json.loads(message["data"])
+        except ValueError:
+            logger.warning("Invalid cache invalidation message: %r",
+                           message["data"])
+            return
+
+        if tex_keys is None:
+            # The cache generation was bumped
+            forget_cache_generation()
+            self.local.clear()
+            return
+        self.local.delete_many(tex_keys)
+
+    def run(self):
+        while not self._stop_event.is_set():
+            pubsub = None
+            try:
+                pubsub = self.cache.client.get_client(write=True).pubsub(
+                    ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                while not self._stop_event.is_set():
+                    message = pubsub.get_message(timeout=1)
+                    if message is not None:
+                        self.handle_message(message)
+            except Exception:
+                logger.warning("Cache invalidation listener failed",
+                               exc_info=True)
+                # Invalidations may be missed until subscribed again
+                self.local.clear()
+                self._stop_event.wait(INVALIDATION_RETRY_INTERVAL)
+            finally:
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+
+    def stop(self):
+        # type: () -> None
+        self._stop_event.set()
+
+
+_local_field_cache = None  # type: Optional[LocalFieldCache]
+_local_field_cache_pid = None  # type: Optional[int]
+_invalidation_listener = None  # type: Optional[InvalidationListener]
+_local_field_cache_lock = threading.Lock()
+
+
+def get_local_field_cache():
+    # type: () -> Optional[LocalFieldCache]
+    """
+    :return: the local field cache of this process, None if
+    settings.L2I_LOCAL_CACHE_MAX_BYTES is not positive. With a django-redis
+    default cache, a thread listening to invalidations is started along.
+    """
+    global _local_field_cache, _local_field_cache_pid, _invalidation_listener
+
+    max_bytes = int(getattr(settings, "L2I_LOCAL_CACHE_MAX_BYTES", 0) or 0)
+
+    with _local_field_cache_lock:
+        local = _local_field_cache
+        if (local is not None
+                and local.max_bytes == max_bytes
+                # Not inherited from the parent process
+                and _local_field_cache_pid == os.getpid()):
+            return local
+
+        if _invalidation_listener is not None:
+            _invalidation_listener.stop()
+            _invalidation_listener = None
+
+        if max_bytes <= 0:
+            _local_field_cache = None
+            return None
+
+        local = _local_field_cache = LocalFieldCache(max_bytes)
+        _local_field_cache_pid = os.getpid()
+
+        def_cache = get_default_cache()
+        if is_redis_cache(def_cache):
+            _invalidation_listener = InvalidationListener(local, def_cache)
+            _invalidation_listener.start()
+
+        return local
+
+
+def invalidate_local_field_cache(tex_keys):
+    # type: (List[Text]) -> None
+    """
+    Drop `tex_keys` from the local field caches of this process, and of
+    the other processes via redis pub/sub.
+    """
+    local = get_local_field_cache()
+    if local is None:
+        return
+
+    local.delete_many(tex_keys)
+    publish_invalidation(get_default_cache(), tex_keys)
+
+
+def publish_invalidation(def_cache, tex_keys):
+    # type: (Any, Optional[List[Text]]) -> None
+    """
+    Publish `tex_keys` to :data:`INVALIDATION_CHANNEL` if `def_cache` is a
+    django-redis cache. None invalidates all tex_keys.
+    """
+    if not is_redis_cache(def_cache):
+        return
+
+    from redis.exceptions import ConnectionError, TimeoutError
+    try:
+        def_cache.client.get_client(write=True).publish(
+            INVALIDATION_CHANNEL, json.dumps(tex_keys))
+    except (ConnectionError, TimeoutError):
+        if not getattr(def_cache, "_ignore_exceptions", False):
+            raise
+        logger.warning("Failed to publish cache invalidation", exc_info=True)
+
+
+_cache_generation = None  # type: Optional[int]
+_cache_generation_checked_at = 0.
+_cache_generation_lock = threading.Lock()
+
+
+def get_cache_generation(def_cache):
+    # type: (Any) -> int
+    """
+    :return: the generation of the cached fields in `def_cache`, read at
+    most every settings.L2I_CACHE_GENERATION_CHECK_INTERVAL seconds by each
+    process. When it changed, the local field cache of the process is
+    cleared.
+    """
+    global _cache_generation, _cache_generation_checked_at
+
+    interval = getattr(settings, "L2I_CACHE_GENERATION_CHECK_INTERVAL", 1)
+    now = time.monotonic()
+    with _cache_generation_lock:
+        if (_cache_generation is not None
+                and now - _cache_generation_checked_at < interval):
+            return _cache_generation
+        previous = _cache_generation
+
+    generation = int(def_cache.get(GENERATION_CACHE_KEY) or 0)
+
+    with _cache_generation_lock:
+        _cache_generation = generation
+        _cache_generation_checked_at = now
+
+    if previous is not None and generation != previous:
+        local = get_local_field_cache()
+        if local is not None:
+            local.clear()
+    return generation
+
+
+def forget_cache_generation():
+    # type: () -> None
+    """
+    Read the cache generation again on the next use.
+    """
+    global _cache_generation
+    with _cache_generation_lock:
+        _cache_generation = None
+
+
+def bump_cache_generation():
+    # type: () -> int
+    """
+    Invalidate all the cached fields at once, by moving to a new namespace
+    of cache keys. The entries of previous generations are not deleted,
+    they are no longer read and expire with their timeouts (if any). The
+    local field caches of all processes, and the bookkeeping of the
+    :class:`GreedyDualSizePolicy`, are cleared.
+    :return: the new generation.
+    """
+    def_cache = get_default_cache()
+    if def_cache is None:
+        raise ImproperlyConfigured("No default cache is configured")
+
+    # Never expires
+    def_cache.add(GENERATION_CACHE_KEY, 0, None)
+    generation = def_cache.incr(GENERATION_CACHE_KEY)
+    if generation is None:
+        # django-redis ignoring exceptions
+        raise RuntimeError("Failed to bump the cache generation")
+
+    forget_cache_generation()
+    local = get_local_field_cache()
+    if local is not None:
+        local.clear()
+    publish_invalidation(def_cache, None)
+
+    if is_redis_cache(def_cache):
+        GreedyDualSizePolicy(def_cache, 0).clear()
+
+    return generation
+
+
+def get_field_cache(layout=None, use_local=True):
+    # type: (Optional[Text], bool) -> Optional[FieldCacheBase]
+    """
+    :param layout: one of :data:`CACHE_LAYOUTS`, default to
+    settings.L2I_CACHE_LAYOUT.
+    :param use_local: whether the local field cache of the process (if
+    enabled) is put in front, e.g., not for management commands which
+    only write.
+    :return: the field cache of the default cache, or None if no cache is
+    configured. The hash layout falls back to the key-per-field layout if
+    the default cache is not a django-redis cache. With
+    settings.L2I_CACHE_MEMORY_BUDGET_BYTES (and django-redis), the
+    tex_keys are evicted by a :class:`GreedyDualSizePolicy`. If enabled,
+    the local field cache of the process is put in front of it. The cache
+    keys are namespaced by the current cache generation.
+    """
+    def_cache = get_default_cache()
+    if def_cache is None:
+        return None
+
+    if layout is None:
+        layout = getattr(settings, "L2I_CACHE_LAYOUT", LAYOUT_KEYS)
+
+    generation = get_cache_generation(def_cache)
+    if layout == LAYOUT_HASH and is_redis_cache(def_cache):
+        field_cache = HashFieldCache(
+            def_cache, generation)  # type: FieldCacheBase
+    else:
+        field_cache = KeyPerFieldCache(def_cache, generation)
+
+    budget_bytes = getattr(settings, "L2I_CACHE_MEMORY_BUDGET_BYTES", None)
+    if budget_bytes and is_redis_cache(def_cache):
+        field_cache = PolicyFieldCache(
+            GreedyDualSizePolicy(
+                def_cache, int(budget_bytes),
+                float(getattr(settings, "L2I_CACHE_DEFAULT_COST_MS", 1000))),
+            field_cache)
+
+    local = get_local_field_cache() if use_local else None
+    if local is not None:
+        field_cache = TwoTierFieldCache(local, field_cache)
+    return field_cache
+
+
+def migrate_field_cache(source, target, batch_size=500, delete_source=True):
+    # type: (FieldCacheBase, FieldCacheBase, int, bool) -> int
+    """
+    Copy the cached fields of all tex_keys from the `source` layout to
+    the `target` layout, `batch_size` tex_keys at a time. Fields already
+    cached in the target are kept.
+    :return: the number of tex_keys migrated.
+    """
+    n_migrated = 0
+    batch = []  # type: List[Text]
+
+    def migrate_batch():
+        values = source.get_many(batch, CACHED_FIELDS)
+        target.set_many(values, overwrite=False)
+        if delete_source:
+            source.delete_many(batch)
+        return len(values)
+
+    # Collect the keys before deleting, so that deleting doesn't
+    # interfere with the scan.
+    for tex_key in list(source.iter_tex_keys()):
+        batch.append(tex_key)
+        if len(batch) >= batch_size:
+            n_migrated += migrate_batch()
+            batch = []
+
+    if batch:
+        n_migrated += migrate_batch()
+
+    return n_migrated
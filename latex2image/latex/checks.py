@@ -24,8 +24,12 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import os
+
 from django.core.checks import register
 
+from latex.cache import (CACHE_LAYOUTS, COMPRESSION_ALGORITHMS, VALUE_FORMATS,
+                         is_compression_available)
 from latex.utils import CriticalCheckMessage, get_all_indirect_subclasses
 
 
@@ -70,6 +74,365 @@ def settings_check(app_configs, **kwargs):
                         "must be a positive int",
                     id="imagemagick_png_resolution.E001"))
 
+    format_cache_max_bytes = (
+        getattr(settings, "L2I_FORMAT_CACHE_MAX_BYTES", None))
+    if format_cache_max_bytes is not None:
+        try:
+            assert int(format_cache_max_bytes) > 0
+        except Exception:
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_FORMAT_CACHE_MAX_BYTES "
+                        "must be a positive int",
+                    id="format_cache_max_bytes.E001"))
+
+    warm_pool_size = getattr(settings, "L2I_WARM_POOL_SIZE", None)
+    if warm_pool_size is not None:
+        try:
+            assert int(warm_pool_size) >= 0
+        except Exception:
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_WARM_POOL_SIZE "
+                        "must be a non-negative int",
+                    id="warm_pool_size.E001"))
+
+    job_queue = getattr(settings, "L2I_JOB_QUEUE", None)
+    if job_queue is not None and job_queue not in ("inprocess", "redis"):
+        errors.append(
+            CriticalCheckMessage(
+                msg="if set, settings.L2I_JOB_QUEUE must be one of "
+                    "'inprocess' and 'redis'",
+                id="job_queue.E001"))
+
+    job_queue_max_size = getattr(settings, "L2I_JOB_QUEUE_MAX_SIZE", None)
+    if job_queue_max_size is not None:
+        try:
+            assert int(job_queue_max_size) > 0
+        except Exception:
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_JOB_QUEUE_MAX_SIZE "
+                        "must be a positive int",
+                    id="job_queue_max_size.E001"))
+
+    for name in ["L2I_JOB_PENDING_TIMEOUT", "L2I_SINGLE_FLIGHT_WAIT_TIMEOUT",
+                 "L2I_SINGLE_FLIGHT_LOCK_TIMEOUT"]:
+        value = getattr(settings, name, None)
+        if value is not None:
+            try:
+                assert float(value) > 0
+            except Exception:
+                errors.append(
+                    CriticalCheckMessage(
+                        msg="if set, settings.%s must be a positive number"
+                            % name,
+                        id="%s.E001" % name[len("L2I_"):].lower()))
+
+    conversion_max_concurrency = (
+        getattr(settings, "L2I_CONVERSION_MAX_CONCURRENCY", None))
+    if conversion_max_concurrency is not None:
+        try:
+            assert int(conversion_max_concurrency) > 0
+        except Exception:
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_CONVERSION_MAX_CONCURRENCY "
+                        "must be a positive int",
+                    id="conversion_max_concurrency.E001"))
+
+    for name in ["L2I_CONVERSION_MAX_QUEUE", "L2I_CONVERSION_RETRY_AFTER"]:
+        value = getattr(settings, name, None)
+        if value is not None:
+            try:
+                assert int(value) >= 0
+            except Exception:
+                errors.append(
+                    CriticalCheckMessage(
+                        msg="if set, settings.%s must be a non-negative int"
+                            % name,
+                        id="%s.E001" % name[len("L2I_"):].lower()))
+
+    conversion_queue_timeout = (
+        getattr(settings, "L2I_CONVERSION_QUEUE_TIMEOUT", None))
+    if conversion_queue_timeout is not None:
+        try:
+            assert float(conversion_queue_timeout) >= 0
+        except Exception:
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_CONVERSION_QUEUE_TIMEOUT "
+                        "must be a non-negative number",
+                    id="conversion_queue_timeout.E001"))
+
+    for name in ["L2I_COMPILE_TIMEOUT", "L2I_CONVERT_TIMEOUT",
+                 "L2I_CROP_TIMEOUT", "L2I_SUBPROCESS_CPU_TIME_LIMIT",
+                 "L2I_SUBPROCESS_MEMORY_LIMIT"]:
+        value = getattr(settings, name, None)
+        if value is not None:
+            try:
+                assert float(value) > 0
+            except Exception:
+                errors.append(
+                    CriticalCheckMessage(
+                        msg="if set, settings.%s must be a positive number"
+                            % name,
+                        id="%s.E001" % name[len("L2I_"):].lower()))
+
+    subprocess_limits = getattr(settings, "L2I_SUBPROCESS_LIMITS", None)
+    if subprocess_limits is not None:
+        try:
+            assert isinstance(subprocess_limits, dict)
+            for limits in subprocess_limits.values():
+                assert isinstance(limits, dict)
+                assert set(limits).issubset(
+                    {"timeout", "cpu_time_limit", "memory_limit"})
+        except AssertionError:
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_SUBPROCESS_LIMITS must be a "
+                        "dict mapping commands to dicts with keys in "
+                        "'timeout', 'cpu_time_limit' and 'memory_limit'",
+                    id="subprocess_limits.E001"))
+
+    server_timing_header = getattr(settings, "L2I_SERVER_TIMING_HEADER", None)
+    if server_timing_header is not None:
+        if not isinstance(server_timing_header, bool):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_SERVER_TIMING_HEADER "
+                        "must be a bool value",
+                    id="server_timing_header.E001"))
+
+    metrics_enabled = getattr(settings, "L2I_METRICS_ENABLED", None)
+    if metrics_enabled is not None:
+        if not isinstance(metrics_enabled, bool):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_METRICS_ENABLED "
+                        "must be a bool value",
+                    id="metrics_enabled.E001"))
+
+    working_dir_root = getattr(settings, "L2I_WORKING_DIR_ROOT", None)
+    if working_dir_root:
+        if not (os.path.isdir(working_dir_root)
+                and os.access(working_dir_root, os.W_OK)):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_WORKING_DIR_ROOT must be "
+                        "an existing writable directory",
+                    id="working_dir_root.E001"))
+
+    working_dir_pool_size = getattr(
+        settings, "L2I_WORKING_DIR_POOL_SIZE", None)
+    if working_dir_pool_size is not None:
+        try:
+            assert int(working_dir_pool_size) >= 0
+        except Exception:
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_WORKING_DIR_POOL_SIZE "
+                        "must be a non-negative integer",
+                    id="working_dir_pool_size.E001"))
+
+    working_dir_quota_bytes = getattr(
+        settings, "L2I_WORKING_DIR_QUOTA_BYTES", None)
+    if working_dir_quota_bytes is not None:
+        try:
+            assert int(working_dir_quota_bytes) > 0
+        except Exception:
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_WORKING_DIR_QUOTA_BYTES "
+                        "must be a positive integer",
+                    id="working_dir_quota_bytes.E001"))
+
+    for name in ["L2I_API_LIST_PAGE_SIZE", "L2I_API_STREAM_CHUNK_SIZE"]:
+        value = getattr(settings, name, None)
+        if value is not None:
+            if not isinstance(value, int) or value <= 0:
+                errors.append(
+                    CriticalCheckMessage(
+                        msg="if set, settings.%s must be a positive integer"
+                            % name,
+                        id="%s.E001" % name[len("L2I_"):].lower()))
+
+    cache_layout = getattr(settings, "L2I_CACHE_LAYOUT", None)
+    if cache_layout is not None:
+        if cache_layout not in CACHE_LAYOUTS:
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_CACHE_LAYOUT must be one of %s"
+                        % ", ".join(CACHE_LAYOUTS),
+                    id="cache_layout.E001"))
+
+    cache_compression = getattr(settings, "L2I_CACHE_COMPRESSION", None)
+    if cache_compression is not None:
+        if cache_compression not in COMPRESSION_ALGORITHMS:
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_CACHE_COMPRESSION must be "
+                        "one of %s" % ", ".join(COMPRESSION_ALGORITHMS),
+                    id="cache_compression.E001"))
+        elif not is_compression_available(cache_compression):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="settings.L2I_CACHE_COMPRESSION is '%s', which "
+                        "requires the zstandard package" % cache_compression,
+                    id="cache_compression.E002"))
+
+    cache_compression_level = getattr(
+        settings, "L2I_CACHE_COMPRESSION_LEVEL", None)
+    if cache_compression_level is not None:
+        if not isinstance(cache_compression_level, int):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_CACHE_COMPRESSION_LEVEL "
+                        "must be an integer",
+                    id="cache_compression_level.E001"))
+
+    cache_compression_min_bytes = getattr(
+        settings, "L2I_CACHE_COMPRESSION_MIN_BYTES", None)
+    if cache_compression_min_bytes is not None:
+        if (not isinstance(cache_compression_min_bytes, int)
+                or cache_compression_min_bytes < 0):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_CACHE_COMPRESSION_MIN_BYTES "
+                        "must be a non-negative integer",
+                    id="cache_compression_min_bytes.E001"))
+
+    min_bytes_by_format = getattr(
+        settings, "L2I_CACHE_COMPRESSION_MIN_BYTES_BY_FORMAT", None)
+    if min_bytes_by_format is not None:
+        if (not isinstance(min_bytes_by_format, dict)
+                or not all(
+                    value_format in VALUE_FORMATS
+                    and (min_bytes is None
+                         or isinstance(min_bytes, int) and min_bytes >= 0)
+                    for value_format, min_bytes
+                    in min_bytes_by_format.items())):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings."
+                        "L2I_CACHE_COMPRESSION_MIN_BYTES_BY_FORMAT must be "
+                        "a dict mapping formats (%s) to non-negative "
+                        "integers or None" % ", ".join(VALUE_FORMATS),
+                    id="cache_compression_min_bytes_by_format.E001"))
+
+    for name in ["L2I_CACHE_TIMEOUT", "L2I_CACHE_COMPILE_ERROR_TIMEOUT",
+                 "L2I_CACHE_MEMORY_BUDGET_BYTES"]:
+        value = getattr(settings, name, None)
+        if value is not None:
+            if not isinstance(value, int) or value <= 0:
+                errors.append(
+                    CriticalCheckMessage(
+                        msg="if set, settings.%s must be a positive integer"
+                            % name,
+                        id="%s.E001" % name[len("L2I_"):].lower()))
+
+    cache_generation_check_interval = getattr(
+        settings, "L2I_CACHE_GENERATION_CHECK_INTERVAL", None)
+    if cache_generation_check_interval is not None:
+        if (not isinstance(cache_generation_check_interval, (int, float))
+                or cache_generation_check_interval < 0):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_CACHE_GENERATION_CHECK_INTERVAL "
+                        "must be a non-negative number",
+                    id="cache_generation_check_interval.E001"))
+
+    cache_default_cost_ms = getattr(settings, "L2I_CACHE_DEFAULT_COST_MS", None)
+    if cache_default_cost_ms is not None:
+        if (not isinstance(cache_default_cost_ms, (int, float))
+                or cache_default_cost_ms <= 0):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_CACHE_DEFAULT_COST_MS "
+                        "must be a positive number",
+                    id="cache_default_cost_ms.E001"))
+
+    local_cache_max_bytes = getattr(settings, "L2I_LOCAL_CACHE_MAX_BYTES", None)
+    if local_cache_max_bytes is not None:
+        if (not isinstance(local_cache_max_bytes, int)
+                or local_cache_max_bytes < 0):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_LOCAL_CACHE_MAX_BYTES "
+                        "must be a non-negative integer",
+                    id="local_cache_max_bytes.E001"))
+
+    access_tracking = getattr(settings, "L2I_ACCESS_TRACKING", None)
+    if access_tracking is not None:
+        if not isinstance(access_tracking, bool):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_ACCESS_TRACKING "
+                        "must be a bool value",
+                    id="access_tracking.E001"))
+
+    access_flush_interval = getattr(
+        settings, "L2I_ACCESS_FLUSH_INTERVAL", None)
+    if access_flush_interval is not None:
+        if (not isinstance(access_flush_interval, (int, float))
+                or access_flush_interval <= 0):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_ACCESS_FLUSH_INTERVAL "
+                        "must be a positive number",
+                    id="access_flush_interval.E001"))
+
+    access_buffer_max_keys = getattr(
+        settings, "L2I_ACCESS_BUFFER_MAX_KEYS", None)
+    if access_buffer_max_keys is not None:
+        if (not isinstance(access_buffer_max_keys, int)
+                or access_buffer_max_keys <= 0):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_ACCESS_BUFFER_MAX_KEYS "
+                        "must be a positive integer",
+                    id="access_buffer_max_keys.E001"))
+
+    bulk_max_items = getattr(settings, "L2I_BULK_MAX_ITEMS", None)
+    if bulk_max_items is not None:
+        if not isinstance(bulk_max_items, int) or bulk_max_items <= 0:
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_BULK_MAX_ITEMS "
+                        "must be a positive integer",
+                    id="bulk_max_items.E001"))
+
+    image_cache_max_age = getattr(settings, "L2I_IMAGE_CACHE_MAX_AGE", None)
+    if image_cache_max_age is not None:
+        try:
+            assert int(image_cache_max_age) >= 0
+        except Exception:
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_IMAGE_CACHE_MAX_AGE "
+                        "must be a non-negative integer",
+                    id="image_cache_max_age.E001"))
+
+    image_require_auth = getattr(settings, "L2I_IMAGE_REQUIRE_AUTH", None)
+    if image_require_auth is not None:
+        if not isinstance(image_require_auth, bool):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_IMAGE_REQUIRE_AUTH "
+                        "must be a bool value",
+                    id="image_require_auth.E001"))
+
+    x_accel_location = getattr(
+        settings, "L2I_IMAGE_X_ACCEL_REDIRECT_LOCATION", None)
+    if x_accel_location is not None:
+        if (not isinstance(x_accel_location, str)
+                or not x_accel_location.startswith("/")):
+            errors.append(
+                CriticalCheckMessage(
+                    msg="if set, settings.L2I_IMAGE_X_ACCEL_REDIRECT_LOCATION "
+                        "must be a string starting with '/'",
+                    id="image_x_accel_redirect_location.E001"))
+
     use_existing_storage_image_to_create_instance = (
         getattr(settings,
                 "L2I_USE_EXISTING_STORAGE_IMAGE_TO_CREATE_INSTANCE",
@@ -29,36 +29,68 @@ import os
 import re
 import shutil
 import sys
+from contextlib import contextmanager
 from hashlib import md5
 
+from django.core.files.base import ContentFile
 from django.core.management.base import CommandError
 from django.utils.encoding import DEFAULT_LOCALE_ENCODING
+from django.utils.functional import cached_property
 from django.utils.translation import gettext as _
 from wand.image import Image as wand_image
+from wand.resource import limits as wand_limits
 
+from latex import metrics
 from latex.constants import (ALLOWED_COMPILER,
                              ALLOWED_COMPILER_FORMAT_COMBINATION,
                              ALLOWED_LATEX2IMG_FORMAT)
-from latex.utils import (CriticalCheckMessage, file_read, file_write,
+from latex.executor import get_conversion_executor
+from latex.timing import (STAGE_COMPILE, STAGE_CONVERT, STAGE_ENCODE,
+                          timed_stage)
+from latex.utils import (LATEX_ERR_LOG_BEGIN_LINE_STARTS, CriticalCheckMessage,
+                         SubprocessTimeoutError, file_read, file_write,
                          get_abstract_latex_log,
                          get_data_url_from_buf_and_mimetype, popen_wrapper,
                          string_concat)
+from latex.workdir import WorkingDirQuotaExceeded, get_working_dir_pool
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover, on Windows
+    fcntl = None
 
 debug = False
 
-from typing import TYPE_CHECKING, Any, List, Optional, Text  # noqa
+from typing import (TYPE_CHECKING, Any, Dict, Iterator, List, Optional,  # noqa
+                    Text, Tuple)
 
 if TYPE_CHECKING:
     from django.core.checks.messages import CheckMessage  # noqa
 
+    from latex.workers import WarmEngine  # noqa
+
 
 TIKZ_PGF_RE = re.compile(r"\\begin\{(?:tikzpicture|pgfpicture)\}")
+BEGIN_DOCUMENT_RE = re.compile(r"\\begin\s*\{document\}")
+FORMAT_FILE_ERROR_RE = re.compile(r"format file", re.IGNORECASE)
+DOCUMENT_CLASS_RE = re.compile(
+    r"\\documentclass\s*(?:\[([^\]]*)\])?\s*\{([^}]*)\}")
 
 
 class LatexCompileError(RuntimeError):
     pass
 
 
+class LatexTimeoutError(LatexCompileError):
+    """
+    Raised when a compile, convert or crop subprocess is killed on its
+    deadline. It is a LatexCompileError so that the failure is saved
+    (thus cached) like compile errors, and the pathological source won't
+    be run again.
+    """
+    pass
+
+
 class UnknownCompileError(RuntimeError):
     pass
 
@@ -67,6 +99,31 @@ class ImageConvertError(RuntimeError):
     pass
 
 
+def get_subprocess_limits(cmd, timeout_setting_name, default_timeout):
+    # type: (Text, Text, float) -> Dict[Text, Any]
+    """
+    :return: the "timeout", "cpu_time_limit", "memory_limit" and
+    "file_size_limit" kwargs of :func:`latex.utils.popen_wrapper` for the
+    subprocess of `cmd`. The file size limit is the quota of the working
+    directories (if any), so that a runaway job can't fill the filesystem
+    before the quota is checked. The values can be overridden for each
+    cmd by settings.L2I_SUBPROCESS_LIMITS, e.g.,
+    ``{"xelatex": {"timeout": 120, "cpu_time_limit": 100}}``.
+    """
+    from django.conf import settings
+    limits = {
+        "timeout": getattr(settings, timeout_setting_name, default_timeout),
+        "cpu_time_limit": getattr(
+            settings, "L2I_SUBPROCESS_CPU_TIME_LIMIT", None),
+        "memory_limit": getattr(
+            settings, "L2I_SUBPROCESS_MEMORY_LIMIT", None),
+        "file_size_limit": get_working_dir_pool().quota_bytes,
+    }
+    limits.update(
+        (getattr(settings, "L2I_SUBPROCESS_LIMITS", None) or {}).get(cmd, {}))
+    return limits
+
+
 # {{{ latex compiler classes and image converter classes
 
 
@@ -96,6 +153,11 @@ class CommandBase(object):
     max_version = None  # type: Optional[Text]
     bin_path = ""  # type: Text
 
+    # The setting of the deadline (in seconds) of the subprocesses of the
+    # command, and its default value.
+    timeout_setting_name = "L2I_CONVERT_TIMEOUT"
+    default_timeout = 30  # type: float
+
     def __init__(self):
         # type: () -> None
         self.bin_path = self.get_bin_path()
@@ -103,6 +165,11 @@ class CommandBase(object):
     def get_bin_path(self):
         return self.cmd.lower()
 
+    def get_subprocess_limits(self):
+        # type: () -> Dict[Text, Any]
+        return get_subprocess_limits(
+            self.cmd, self.timeout_setting_name, self.default_timeout)
+
     def version_popen(self):
         return popen_wrapper(
             [self.bin_path, '--version'],
@@ -202,6 +269,13 @@ class LatexCompiler(TexCompilerBase):
         '-halt-on-error'
     ]
 
+    # Whether a format can be dumped from the preamble with mylatexformat
+    # and used for later compiles.
+    format_dump_supported = True
+
+    timeout_setting_name = "L2I_COMPILE_TIMEOUT"
+    default_timeout = 60
+
     @property
     def output_format(self):
         # type: () -> Text
@@ -225,8 +299,8 @@ class LatexCompiler(TexCompilerBase):
             "-%s=%s" % (self.name.lower(), self.bin_path.lower())
         )
 
-    def get_latexmk_subpro_cmdline(self, input_path):
-        # type: (Text) -> List[Text]
+    def get_latexmk_subpro_cmdline(self, input_path, fmt_path=None):
+        # type: (Text, Optional[Text]) -> List[Text]
         latexmk = Latexmk()
         args = [
             latexmk.bin_path,
@@ -234,10 +308,30 @@ class LatexCompiler(TexCompilerBase):
             self.latexmk_prog_repl,
         ]
         args.extend(self.latexmk_option)
+        if fmt_path is not None:
+            args.append('-latexoption="-fmt=%s"' % fmt_path)
         args.append(input_path)
 
         return args
 
+    def get_format_dump_cmdline(self, jobname, input_path):
+        # type: (Text, Text) -> List[Text]
+        """
+        :return: the cmdline which dumps a format named `jobname`
+        from the preamble of `input_path`, using mylatexformat.
+        """
+        return [
+            self.bin_path,
+            "-ini",
+            "-interaction=nonstopmode",
+            "-halt-on-error",
+            "-no-shell-escape",
+            "-jobname=%s" % jobname,
+            "&%s" % self.cmd,
+            "mylatexformat.ltx",
+            input_path,
+        ]
+
 
 class Latex(LatexCompiler):
     name = "latex"
@@ -256,6 +350,10 @@ class LuaLatex(LatexCompiler):
     cmd = "lualatex"
     output_format = "pdf"
 
+    # Lua states (thus fonts loaded by fontspec/luaotfload) can't be
+    # restored from a dumped format.
+    format_dump_supported = False
+
     def __init__(self):
         # type: () -> None
         super().__init__()
@@ -276,35 +374,62 @@ class XeLatex(LatexCompiler):
 
 
 class ImageConverter(CommandBase):
+    default_crop_timeout = 30  # type: float
 
     @property
     def output_format(self):
         # type: () -> Text
         raise NotImplementedError
 
-    @staticmethod
-    def convert_popen(cmdline, cwd):
-        return popen_wrapper(cmdline, cwd=cwd)
+    def convert_popen(self, cmdline, cwd):
+        return popen_wrapper(cmdline, cwd=cwd, **self.get_subprocess_limits())
+
+    def crop_popen(self, cmdline, cwd):
+        return popen_wrapper(
+            cmdline, cwd=cwd,
+            **get_subprocess_limits(
+                cmdline[0], "L2I_CROP_TIMEOUT", self.default_crop_timeout))
 
-    def do_convert(self, compiled_file_path, image_path, working_dir):
-        cmdlines = self._get_convert_cmdlines(
-            compiled_file_path, image_path)
+    def do_convert(self, compiled_file_path, image_path, working_dir,
+                   multi_page=False):
+        """
+        :param multi_page: if True, convert all pages of the compiled file,
+        the image of each page is saved to the path given by
+        :func:`get_page_image_path`.
+        """
+        cmdlines = [
+            (self.crop_popen, cmdline)
+            for cmdline in self._get_crop_cmdlines(compiled_file_path)]
+        cmdlines.extend(
+            (self.convert_popen, cmdline)
+            for cmdline in self._get_convert_cmdlines(
+                compiled_file_path, image_path, multi_page=multi_page))
 
         status = None
         error = None
-        for cmdline in cmdlines:
-            _output, error, status = self.convert_popen(
-                cmdline,
-                cwd=working_dir
-            )
+        for popen, cmdline in cmdlines:
+            try:
+                _output, error, status = popen(
+                    cmdline,
+                    cwd=working_dir
+                )
+            except SubprocessTimeoutError as e:
+                raise LatexTimeoutError(str(e))
             if status != 0:
                 return False, error
 
         return status == 0, error
 
+    def _get_crop_cmdlines(self, input_filepath):
+        # type: (Text) -> List[List[Text]]
+        """
+        The cmdlines run (in place) on the compiled file before converting.
+        """
+        return []
+
     def _get_convert_cmdlines(
-            self, input_filepath, output_filepath):
-        # type: (Text, Text) -> List[List[Text]]
+            self, input_filepath, output_filepath, multi_page=False):
+        # type: (Text, Text, bool) -> List[List[Text]]
         raise NotImplementedError
 
 
@@ -317,14 +442,18 @@ class Dvipng(TexCompilerBase, ImageConverter):
     output_format = "png"
 
     def _get_convert_cmdlines(
-            self, input_filepath, output_filepath):
-        # type: (Text, Text) -> List[List[Text]]
-        return [[self.bin_path,
-                 '-o', output_filepath,
-                 '-pp', '1',
-                 '-T', 'tight',
-                 '-z9',
-                 input_filepath]]
+            self, input_filepath, output_filepath, multi_page=False):
+        # type: (Text, Text, bool) -> List[List[Text]]
+        if multi_page:
+            page_args = [
+                '-o', get_page_image_path(output_filepath, "%d")]
+        else:
+            page_args = ['-o', output_filepath, '-pp', '1']
+        return [[self.bin_path]
+                + page_args
+                + ['-T', 'tight',
+                   '-z9',
+                   input_filepath]]
 
 
 class Dvisvg(TexCompilerBase, ImageConverter):
@@ -336,12 +465,18 @@ class Dvisvg(TexCompilerBase, ImageConverter):
     output_format = "svg"
 
     def _get_convert_cmdlines(
-            self, input_filepath, output_filepath):
-        # type: (Text, Text) -> List[List[Text]]
-        return [[self.bin_path,
-                 '--no-fonts',
-                 '-o', output_filepath,
-                 input_filepath]]
+            self, input_filepath, output_filepath, multi_page=False):
+        # type: (Text, Text, bool) -> List[List[Text]]
+        if multi_page:
+            # dvisvgm pads "%p" with zeros to the width of the largest page
+            # number, "%1p" is not padded like other converters
+            page_args = [
+                '-p', '1-', '-o', get_page_image_path(output_filepath, "%1p")]
+        else:
+            page_args = ['-o', output_filepath]
+        return [[self.bin_path, '--no-fonts']
+                + page_args
+                + [input_filepath]]
 
 
 class Pdf2svg(TexCompilerBase, ImageConverter):
@@ -352,16 +487,28 @@ class Pdf2svg(TexCompilerBase, ImageConverter):
     # pdf2svg has no version
     skip_version_check = True
 
+    def _get_crop_cmdlines(self, input_filepath):
+        # type: (Text) -> List[List[Text]]
+        return [["pdfcrop", input_filepath, input_filepath]]
+
     def _get_convert_cmdlines(
-            self, input_filepath, output_filepath):
-        # type: (Text, Text) -> List[List[Text]]
-        return [
-            ["pdfcrop", input_filepath, input_filepath],
-            [self.bin_path, input_filepath, output_filepath]
-        ]
+            self, input_filepath, output_filepath, multi_page=False):
+        # type: (Text, Text, bool) -> List[List[Text]]
+        if multi_page:
+            convert_cmdline = [
+                self.bin_path, input_filepath,
+                get_page_image_path(output_filepath, "%d"), "all"]
+        else:
+            convert_cmdline = [self.bin_path, input_filepath, output_filepath]
+        return [convert_cmdline]
 
 
 class ImageMagick(ImageConverter):
+    """
+    Convert in this process via wand, so the conversion has no deadline
+    (settings.L2I_CONVERT_TIMEOUT doesn't apply), and only the memory
+    limit set by :func:`set_imagemagick_memory_limit` applies.
+    """
     name = "ImageMagick"
     cmd = "convert"
     output_format = "png"
@@ -376,7 +523,8 @@ class ImageMagick(ImageConverter):
         else:
             return super().get_bin_path()
 
-    def do_convert(self, compiled_file_path, image_path, working_dir):
+    def do_convert(self, compiled_file_path, image_path, working_dir,
+                   multi_page=False):
         success = True
         error = ""
         try:
@@ -386,9 +534,19 @@ class ImageMagick(ImageConverter):
             with wand_image(
                     filename=compiled_file_path, resolution=resolution
             ) as original:
-                with original.convert(self.output_format) as converted:
-                    converted.trim()
-                    converted.save(filename=image_path)
+                if multi_page:
+                    for i, page in enumerate(original.sequence):
+                        with wand_image(page) as page_image:
+                            with page_image.convert(
+                                    self.output_format) as converted:
+                                converted.trim()
+                                converted.save(
+                                    filename=get_page_image_path(
+                                        image_path, i + 1))
+                else:
+                    with original.convert(self.output_format) as converted:
+                        converted.trim()
+                        converted.save(filename=image_path)
         except Exception as e:
             success = False
             error = "%s: %s" % (type(e).__name__, str(e))
@@ -398,20 +556,258 @@ class ImageMagick(ImageConverter):
 # }}}
 
 
-# {{{ convert file to data url
+# {{{ converted image
 
-def get_data_url(file_path):
-    # type: (Text) -> Text
+class ConvertedImage(object):
     """
-    Convert file to data URL
+    The result of a conversion: the raw bytes of the image and its mime
+    type. The data url is only built when needed, and at most once, so
+    the bytes are written to the storage without a base64 round trip.
     """
-    buf = file_read(file_path)
 
+    def __init__(self, buf, mime_type):
+        # type: (bytes, Text) -> None
+        self.buf = buf
+        self.mime_type = mime_type
+
+    @property
+    def size(self):
+        # type: () -> int
+        return len(self.buf)
+
+    @property
+    def ext(self):
+        # type: () -> Text
+        return ".png" if self.mime_type == "image/png" else ".svg"
+
+    @cached_property
+    def data_url(self):
+        # type: () -> Text
+        with timed_stage(STAGE_ENCODE):
+            return get_data_url_from_buf_and_mimetype(self.buf, self.mime_type)
+
+    def to_file(self, file_base_name):
+        # type: (Text) -> ContentFile
+        """
+        :return: a file which can be assigned to an ImageField.
+        """
+        return ContentFile(self.buf, name=file_base_name + self.ext)
+
+
+def read_converted_image(file_path):
+    # type: (Text) -> ConvertedImage
     from mimetypes import guess_type
-    mime_type = guess_type(file_path)[0]
+    return ConvertedImage(file_read(file_path), guess_type(file_path)[0])
+
+
+# }}}
+
+
+# {{{ preamble format cache
+
+def split_preamble(tex_source):
+    # type: (Text) -> Tuple[Optional[Text], Text]
+    """
+    Split tex source into preamble and body.
+    :return: a tuple (preamble, body), where body begins with
+    `\\begin{document}`. preamble is None if the source has no
+    `\\begin{document}` or no `\\documentclass` in its preamble.
+    """
+    m = BEGIN_DOCUMENT_RE.search(tex_source)
+    if m is None:
+        return None, tex_source
+
+    preamble = tex_source[:m.start()]
+    if "\\documentclass" not in preamble or preamble.startswith("%&"):
+        return None, tex_source
+
+    return preamble, tex_source[m.start():]
+
+
+class FormatCache(object):
+    """
+    An on-disk cache of TeX formats (.fmt) dumped from document preambles,
+    one format per compiler and distinct preamble. Least recently used
+    formats are evicted when the total size exceeds `max_bytes`.
+    """
+
+    format_ext = ".fmt"
+
+    # Marks a preamble from which no format can be dumped, so that
+    # the dump is not retried for each request.
+    failed_ext = ".failed"
 
-    return get_data_url_from_buf_and_mimetype(buf, mime_type)
+    # The dumps of the same format are serialized across processes, by
+    # a fixed number of lock files (so that they are never deleted).
+    lock_ext = ".lock"
+    n_dump_locks = 64
 
+    def __init__(self, cache_dir, max_bytes):
+        # type: (Text, int) -> None
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+
+    def get_format_key(self, compiler, preamble):
+        # type: (LatexCompiler, Text) -> Text
+        engine_path = shutil.which(compiler.bin_path) or compiler.bin_path
+        try:
+            # Formats are not portable across engine upgrades.
+            engine_mtime = int(os.path.getmtime(engine_path))
+        except OSError:
+            engine_mtime = 0
+
+        return "%s_%s_%d" % (
+            compiler.cmd,
+            md5(preamble.encode("utf-8")).hexdigest(),
+            engine_mtime)
+
+    def get_format_path(self, compiler, preamble):
+        # type: (LatexCompiler, Text) -> Optional[Text]
+        """
+        :return: the path of the format dumped from `preamble`,
+        dump it if not cached. None if the format can't be dumped.
+        """
+        key = self.get_format_key(compiler, preamble)
+        fmt_path = os.path.join(self.cache_dir, key + self.format_ext)
+
+        if os.path.isfile(fmt_path):
+            try:
+                # Mark as recently used
+                os.utime(fmt_path)
+            except OSError:
+                pass
+            return fmt_path
+
+        if os.path.isfile(
+                os.path.join(self.cache_dir, key + self.failed_ext)):
+            return None
+
+        return self.dump_format(compiler, preamble, key)
+
+    @contextmanager
+    def dump_lock(self, key):
+        # type: (Text) -> Iterator[None]
+        if fcntl is None:  # pragma: no cover
+            yield
+            return
+
+        index = int(md5(key.encode("utf-8")).hexdigest()[:8], 16)
+        lock_path = os.path.join(
+            self.cache_dir,
+            "dump_%d%s" % (index % self.n_dump_locks, self.lock_ext))
+        with open(lock_path, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def dump_format(self, compiler, preamble, key):
+        # type: (LatexCompiler, Text, Text) -> Optional[Text]
+        """
+        Dump the format of `preamble`, unless concurrently dumped by
+        another process or thread, whose result is used instead.
+        """
+        try:
+            os.makedirs(self.cache_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        fmt_path = os.path.join(self.cache_dir, key + self.format_ext)
+        with self.dump_lock(key):
+            if os.path.isfile(fmt_path):
+                return fmt_path
+            if os.path.isfile(
+                    os.path.join(self.cache_dir, key + self.failed_ext)):
+                return None
+
+            if not self._dump_format(compiler, preamble, key, fmt_path):
+                return None
+
+        self.evict(keep=fmt_path)
+        return fmt_path
+
+    def _dump_format(self, compiler, preamble, key, fmt_path):
+        # type: (LatexCompiler, Text, Text, Text) -> bool
+        from tempfile import mkdtemp
+
+        working_dir = mkdtemp(prefix="LATEX_FMT_")
+        try:
+            tex_path = os.path.join(working_dir, key + ".tex")
+            file_write(
+                tex_path,
+                (preamble + "\n\\begin{document}\n\\end{document}\n"
+                 ).encode("utf-8"))
+
+            try:
+                # Not in a working dir of the pool, formats can be larger
+                # than its quota
+                limits = dict(
+                    compiler.get_subprocess_limits(), file_size_limit=None)
+                _output, _error, status = popen_wrapper(
+                    compiler.get_format_dump_cmdline(key, tex_path),
+                    cwd=working_dir, **limits)
+            except (CommandError, SubprocessTimeoutError):
+                # e.g., timed out under load, which may succeed next time
+                return False
+
+            dumped_path = os.path.join(working_dir, key + self.format_ext)
+            if status != 0 or not os.path.isfile(dumped_path):
+                file_write(
+                    os.path.join(self.cache_dir, key + self.failed_ext), b"")
+                return False
+
+            # Atomic, so that readers not holding the lock never see a
+            # partial format.
+            os.replace(dumped_path, fmt_path)
+        finally:
+            shutil.rmtree(working_dir, ignore_errors=True)
+
+        return True
+
+    def invalidate(self, fmt_path):
+        # type: (Text) -> None
+        try:
+            os.remove(fmt_path)
+        except OSError:
+            pass
+
+    def evict(self, keep=None):
+        # type: (Optional[Text]) -> None
+        entries = []
+        total_bytes = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(self.lock_ext):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_bytes += stat.st_size
+
+        entries.sort()
+        for _mtime, size, path in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            self.invalidate(path)
+            total_bytes -= size
+
+
+def get_format_cache():
+    # type: () -> Optional[FormatCache]
+    from django.conf import settings
+    cache_dir = getattr(settings, "L2I_FORMAT_CACHE_DIR", None)
+    if not cache_dir:
+        return None
+
+    return FormatCache(
+        cache_dir,
+        int(getattr(settings, "L2I_FORMAT_CACHE_MAX_BYTES", 268435456)))
 
 # }}}
 
@@ -478,9 +874,50 @@ class Tex2ImgBase(object):
         self.tex_key = tex_key
         self.force_overwrite = force_overwrite
 
-    def get_compiler_cmdline(self, tex_path):
-        # type: (Text) -> List[Text]
-        return self.compiler.get_latexmk_subpro_cmdline(tex_path)
+    def get_metric_labels(self):
+        # type: () -> Dict[Text, Text]
+        return {"compiler": self.compiler.cmd,
+                "image_format": self.image_format}
+
+    def get_compiled_file_with_metrics(self):
+        # type: () -> Optional[Text]
+        labels = self.get_metric_labels()
+        try:
+            with timed_stage(STAGE_COMPILE), \
+                    metrics.COMPILE_SECONDS.labels(**labels).time():
+                return self.get_compiled_file()
+        except LatexCompileError as e:
+            metrics.COMPILE_ERRORS.labels(
+                kind="timeout" if isinstance(e, LatexTimeoutError) else "error",
+                **labels).inc()
+            raise
+
+    def get_compiler_cmdline(self, tex_path, fmt_path=None):
+        # type: (Text, Optional[Text]) -> List[Text]
+        return self.compiler.get_latexmk_subpro_cmdline(
+            tex_path, fmt_path=fmt_path)
+
+    def get_format_path(self):
+        # type: () -> Optional[Text]
+        """
+        :return: the path of the cached format dumped from the preamble
+        of the tex source, None if format cache is not enabled or not
+        applicable. The preamble is skipped by mylatexformat when the
+        source is compiled with that format, thus only the body is
+        compiled.
+        """
+        if not self.compiler.format_dump_supported:
+            return None
+
+        format_cache = get_format_cache()
+        if format_cache is None:
+            return None
+
+        preamble, __ = split_preamble(self.tex_source)
+        if preamble is None:
+            return None
+
+        return format_cache.get_format_path(self.compiler, preamble)
 
     def save_source(self):  # pragma: no cover, this happens when debugging
         file_name = self.tex_key + ".tex"
@@ -505,26 +942,110 @@ class Tex2ImgBase(object):
             if debug:
                 print(self.working_dir)
             else:
-                shutil.rmtree(self.working_dir)
+                # Working dirs not acquired from the pool (e.g., those of
+                # warm engines) are removed.
+                get_working_dir_pool().release(self.working_dir)
+
+    def check_working_dir_quota(self, error_class):
+        # type: (type) -> None
+        try:
+            get_working_dir_pool().check_quota(self.working_dir)
+        except WorkingDirQuotaExceeded as e:
+            raise error_class(str(e))
 
     def compile_popen(self, cmdline):
         # This method is introduced for facilitating subprocess tests.
-        return popen_wrapper(cmdline, cwd=self.working_dir)
+        try:
+            return popen_wrapper(
+                cmdline, cwd=self.working_dir,
+                **self.compiler.get_subprocess_limits())
+        except SubprocessTimeoutError as e:
+            raise LatexTimeoutError(str(e))
+
+    def get_warm_engine(self):
+        # type: () -> Optional[WarmEngine]
+        """
+        :return: a warm engine of the compiler if the warm engine pool
+        is enabled and the source uses the standard preamble of the pool.
+        """
+        from latex.workers import get_warm_engine_pool
+        pool = get_warm_engine_pool()
+        if pool is None or not pool.accepts(self.tex_source):
+            return None
+        return pool.acquire(self.compiler)
+
+    def compile_with_latexmk(self, tex_path, log_path):
+        # type: (Text, Text) -> Tuple[Text, Text, int]
+        fmt_path = self.get_format_path()
+        cmdline = self.get_compiler_cmdline(tex_path, fmt_path=fmt_path)
+        output, error, status = self.compile_popen(cmdline)
+
+        if status != 0 and fmt_path is not None:
+            try:
+                log = file_read(log_path).decode("utf-8")
+            except OSError:
+                log = error
+
+            if FORMAT_FILE_ERROR_RE.search(log):
+                # The cached format is broken or outdated, compile without it.
+                get_format_cache().invalidate(fmt_path)
+                output, error, status = self.compile_popen(
+                    self.get_compiler_cmdline(tex_path))
+
+        return output, error, status
+
+    def compile_with_warm_engine(self, warm_engine, log_path):
+        # type: (WarmEngine, Text) -> Optional[Tuple[Text, Text, int]]
+        """
+        :return: the result of the warm engine run, None if the run
+        failed without a LaTeX error, e.g., the engine died.
+        """
+        try:
+            output, error, status = warm_engine.run(
+                timeout=self.compiler.get_subprocess_limits()["timeout"])
+        except OSError:
+            return None
+        except SubprocessTimeoutError as e:
+            raise LatexTimeoutError(str(e))
+
+        if status != 0:
+            try:
+                log = file_read(log_path).decode("utf-8")
+            except OSError:
+                return None
+            if LATEX_ERR_LOG_BEGIN_LINE_STARTS not in log:
+                return None
+
+        return output, error, status
 
     def get_compiled_file(self):
         # type: () -> Optional[Text]
         """
         Compile latex source.
         :return: string, the path of the compiled file if succeeded.
+        The working dir is removed if failed.
         """
-        from tempfile import mkdtemp
+        warm_engine = self.get_warm_engine()
 
-        # https://github.com/python/mypy/issues/1833
-        self.working_dir = mkdtemp(prefix="LATEX_")  # type: ignore
+        if warm_engine is not None:
+            self.working_dir = warm_engine.working_dir
+            tex_filename_to_compile = warm_engine.tex_filename
+        else:
+            # https://github.com/python/mypy/issues/1833
+            self.working_dir = (  # type: ignore
+                get_working_dir_pool().acquire(prefix="LATEX_"))
+            tex_filename_to_compile = self.tex_key + ".tex"
 
+        try:
+            return self._get_compiled_file(warm_engine, tex_filename_to_compile)
+        except BaseException:
+            self._remove_working_dir()
+            raise
+
+    def _get_compiled_file(self, warm_engine, tex_filename_to_compile):
+        # type: (Optional[WarmEngine], Text) -> Optional[Text]
         assert self.tex_key is not None
         assert self.working_dir is not None
-        tex_filename_to_compile = self.tex_key + ".tex"
         tex_path = os.path.join(self.working_dir, tex_filename_to_compile)
         file_write(tex_path, self.tex_source.encode('UTF-8'))
 
@@ -533,26 +1054,32 @@ class Tex2ImgBase(object):
         compiled_file_path = tex_path.replace(
             ".tex", self.compiled_ext)
 
-        cmdline = self.get_compiler_cmdline(tex_path)
-        output, error, status = self.compile_popen(cmdline)
+        result = None
+        if warm_engine is not None:
+            result = self.compile_with_warm_engine(warm_engine, log_path)
+
+        if result is None:
+            result = self.compile_with_latexmk(tex_path, log_path)
+
+        output, error, status = result
 
         if status != 0:
+            # e.g., killed when writing a file larger than the quota
+            self.check_working_dir_quota(LatexCompileError)
             try:
                 log = file_read(log_path).decode("utf-8")
             except OSError:
                 # no log file is generated
-                self._remove_working_dir()
                 raise LatexCompileError(error)
 
             log = get_abstract_latex_log(log).replace("\\n", "\n").strip()
-            self._remove_working_dir()
             raise LatexCompileError(log)
 
+        self.check_working_dir_quota(LatexCompileError)
+
         if os.path.isfile(compiled_file_path):
             return compiled_file_path
         else:
-            self._remove_working_dir()
-
             raise UnknownCompileError(
                 string_concat(
                     ("%s." % error) if error else "",
@@ -560,53 +1087,143 @@ class Tex2ImgBase(object):
                     % self.compiler.output_format)
             )
 
+    def get_converted_image(self):
+        # type: () -> ConvertedImage
+        """
+        Convert compiled file into image, when admitted by the conversion
+        executor.
+        :return: a :class:`ConvertedImage`
+        """
+        return get_conversion_executor().run(self._get_converted_image)
+
     def get_converted_data_url(self):
         # type: () -> Optional[Text]
         """
-        Convert compiled file into image.
-        :return: string, the data_url
+        :return: string, the data_url of :meth:`get_converted_image`
         """
-        compiled_file_path = self.get_compiled_file()
+        return self.get_converted_image().data_url
+
+    def _get_converted_image(self):
+        # type: () -> ConvertedImage
+        compiled_file_path = self.get_compiled_file_with_metrics()
         assert compiled_file_path
 
         image_path = compiled_file_path.replace(
             self.compiled_ext,
             self.image_ext)
 
-        convert_success, error = self.converter.do_convert(
-            compiled_file_path, image_path, self.working_dir)
+        try:
+            with timed_stage(STAGE_CONVERT), metrics.CONVERT_SECONDS.labels(
+                    **self.get_metric_labels()).time():
+                convert_success, error = self.converter.do_convert(
+                    compiled_file_path, image_path, self.working_dir)
+
+                self.check_working_dir_quota(ImageConvertError)
+                if not convert_success:
+                    raise ImageConvertError(error)
+
+                n_images = get_number_of_images(image_path, self.image_ext)
+
+            if n_images == 0:
+                raise ImageConvertError(
+                    _("No image was generated at %s" % self.working_dir))
+            elif n_images > 1:
+                raise ImageConvertError(
+                    string_concat(
+                        "%s images are generated while expecting 1, "
+                        "possibly due to long pdf file."
+                        % (n_images, )
+                    ))
 
-        if not convert_success:
+            try:
+                image = read_converted_image(image_path)
+            except Exception as e:
+                raise ImageConvertError(
+                    "%s:%s" % (type(e).__name__, str(e))
+                )
+
+            metrics.IMAGE_BYTES.labels(
+                **self.get_metric_labels()).observe(image.size)
+            return image
+        finally:
             self._remove_working_dir()
-            raise ImageConvertError(error)
 
-        n_images = get_number_of_images(image_path, self.image_ext)
+    def get_converted_images(self, n_pages):
+        # type: (int) -> List[ConvertedImage]
+        """
+        Convert each page of the compiled file into an image, used when
+        the source is built by :func:`build_batch_tex_source`.
+        :return: a list of :class:`ConvertedImage`, one for each page.
+        """
+        return get_conversion_executor().run(
+            self._get_converted_images, n_pages)
 
-        if n_images == 0:
-            raise ImageConvertError(
-                _("No image was generated at %s" % self.working_dir))
-        elif n_images > 1:
-            raise ImageConvertError(
-                string_concat(
-                    "%s images are generated while expecting 1, "
-                    "possibly due to long pdf file."
-                    % (n_images, )
-                ))
+    def get_converted_data_urls(self, n_pages):
+        # type: (int) -> List[Text]
+        """
+        :return: a list of data_url, one for each page.
+        """
+        return [image.data_url for image in self.get_converted_images(n_pages)]
+
+    def _get_converted_images(self, n_pages):
+        # type: (int) -> List[ConvertedImage]
+        compiled_file_path = self.get_compiled_file_with_metrics()
+        assert compiled_file_path
+
+        image_path = compiled_file_path.replace(
+            self.compiled_ext,
+            self.image_ext)
 
         try:
-            data_url = get_data_url(image_path)
-        except Exception as e:
-            raise ImageConvertError(
-                "%s:%s" % (type(e).__name__, str(e))
-            )
+            with timed_stage(STAGE_CONVERT), metrics.CONVERT_SECONDS.labels(
+                    **self.get_metric_labels()).time():
+                convert_success, error = self.converter.do_convert(
+                    compiled_file_path, image_path, self.working_dir,
+                    multi_page=True)
+
+                self.check_working_dir_quota(ImageConvertError)
+                if not convert_success:
+                    raise ImageConvertError(error)
+
+                n_images = get_number_of_page_images(image_path)
+
+            if n_images != n_pages:
+                raise ImageConvertError(
+                    "%d images are generated while expecting %d."
+                    % (n_images, n_pages))
+
+            try:
+                return [
+                    read_converted_image(get_page_image_path(image_path, page))
+                    for page in range(1, n_pages + 1)]
+            except Exception as e:
+                raise ImageConvertError(
+                    "%s:%s" % (type(e).__name__, str(e))
+                )
         finally:
             self._remove_working_dir()
 
-        return data_url
-
 # }}}
 
 
+def set_imagemagick_memory_limit():
+    # type: () -> None
+    """
+    Set the memory limit of ImageMagick conversions, over which the pixel
+    cache goes to disk, to the memory limit of the "convert" command. The
+    limit is shared by all the threads of the process, so it's set once
+    at startup.
+    """
+    from django.conf import settings
+    memory_limit = (
+        (getattr(settings, "L2I_SUBPROCESS_LIMITS", None) or {})
+        .get(ImageMagick.cmd, {})
+        .get("memory_limit",
+             getattr(settings, "L2I_SUBPROCESS_MEMORY_LIMIT", None)))
+    if memory_limit:
+        wand_limits["memory"] = int(memory_limit)
+
+
 # {{{ derived tex2img converter
 
 class Latex2Svg(Tex2ImgBase):
@@ -705,6 +1322,26 @@ def get_number_of_images(image_path, image_ext):
 
     return count
 
+
+def get_page_image_path(image_path, page):
+    # type: (Text, Any) -> Text
+    """
+    :param page: the page number, or a placeholder of the page number
+    used by the converter, e.g., "%d".
+    :return: the path of the image of that page when converting
+    multiple pages.
+    """
+    root, ext = os.path.splitext(image_path)
+    return "%s-%s%s" % (root, page, ext)
+
+
+def get_number_of_page_images(image_path):
+    # type: (Text) -> int
+    count = 0
+    while os.path.isfile(get_page_image_path(image_path, count + 1)):
+        count += 1
+    return count
+
 # }}}
 
 
@@ -730,4 +1367,76 @@ def tex_to_img_converter(
     return latex2img
 
 
+# {{{ batch convert
+
+def get_batch_preamble(preamble):
+    # type: (Text) -> Text
+    """
+    :return: `preamble`, with the `multi` class option added if the
+    document class is `standalone`, which otherwise puts all the pages
+    into one.
+    :raises: ValueError if `preamble` has no `\\documentclass`, or
+    disables the `multi` option of `standalone`.
+    """
+    m = DOCUMENT_CLASS_RE.search(preamble)
+    if m is None:
+        raise ValueError("The preamble of a batch has no \\documentclass")
+
+    if m.group(2).strip() != "standalone":
+        return preamble
+
+    options = [
+        option.strip() for option in (m.group(1) or "").split(",")
+        if option.strip()]
+    multi_options = [
+        option for option in options
+        if option.replace(" ", "").split("=")[0] == "multi"]
+    if not multi_options:
+        options.append("multi")
+    elif any(option.replace(" ", "") == "multi=false"
+             for option in multi_options):
+        raise ValueError(
+            "The standalone class of a batch requires the multi option")
+
+    return "".join([
+        preamble[:m.start()],
+        "\\documentclass[%s]{standalone}" % ",".join(options),
+        preamble[m.end():]])
+
+
+def build_batch_tex_source(preamble, snippets):
+    # type: (Text, List[Text]) -> Text
+    """
+    Build a document with one snippet per page.
+    :param preamble: the preamble shared by the snippets, see
+    :func:`get_batch_preamble`.
+    :param snippets: a list of strings, each is the body of a page.
+    """
+    return "".join([
+        get_batch_preamble(preamble).strip(),
+        "\n\\begin{document}\n\\pagestyle{empty}\n",
+        "\n\\clearpage\n".join(snippet.strip() for snippet in snippets),
+        "\n\\end{document}\n"
+    ])
+
+
+def batch_tex_to_img_convert(compiler, preamble, snippets, image_format):
+    # type: (Text, Text, List[Text], Text) -> List[Text]
+    """
+    Convert many snippets sharing the same preamble with one compile.
+    :return: a list of data_url, in the same order as `snippets`.
+    If any of the snippets fails to compile, LatexCompileError is raised
+    for the whole batch. ValueError is raised if the pages of `preamble`
+    can't be split, see :func:`get_batch_preamble`.
+    """
+    if not snippets:
+        return []
+
+    latex2img = tex_to_img_converter(
+        compiler, build_batch_tex_source(preamble, snippets), image_format)
+    return latex2img.get_converted_data_urls(len(snippets))
+
+# }}}
+
+
 # vim: foldmethod=marker
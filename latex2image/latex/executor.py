@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Text  # noqa
+
+from django.conf import settings
+
+from latex import metrics
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover, on Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SLOT_POLL_INTERVAL = 0.05
+
+
+class ConversionQueueFull(RuntimeError):
+    """
+    Raised when a conversion is rejected because all running and
+    queuing slots are taken, or it waited in the queue for too long.
+    """
+
+    def __init__(self, msg, retry_after):
+        # type: (Text, int) -> None
+        super().__init__(msg)
+        self.retry_after = retry_after
+
+
+# {{{ slots
+
+class FileLockSlots(object):
+    """
+    `n_slots` slots shared by all processes on the host, each of which
+    is an exclusive flock on a file in `lock_dir`. The locks are released
+    by the OS if the process holding them dies.
+    """
+
+    def __init__(self, lock_dir, name, n_slots):
+        # type: (Text, Text, int) -> None
+        self.n_slots = n_slots
+        self.paths = [
+            os.path.join(lock_dir, "%s-%d.lock" % (name, i))
+            for i in range(n_slots)]
+
+    def try_acquire(self):
+        # type: () -> Optional[Any]
+        """
+        :return: a handle to be passed to :meth:`release`, or None if all
+        slots are taken.
+        """
+        for path in self.paths:
+            f = open(path, "a")
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                continue
+            return f
+        return None
+
+    def release(self, handle):
+        # type: (Any) -> None
+        try:
+            fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+        finally:
+            handle.close()
+
+
+class ThreadSlots(object):
+    """
+    Slots of the current process only, used where flock is not available.
+    """
+
+    def __init__(self, n_slots):
+        # type: (int) -> None
+        self.n_slots = n_slots
+        self.semaphore = threading.BoundedSemaphore(n_slots)
+
+    def try_acquire(self):
+        # type: () -> Optional[Any]
+        if self.semaphore.acquire(blocking=False):
+            return self.semaphore
+        return None
+
+    def release(self, handle):
+        # type: (Any) -> None
+        handle.release()
+
+# }}}
+
+
+class ConversionExecutor(object):
+    """
+    Admission control of conversions. At most `max_concurrency`
+    conversions run at a time on the host, and at most `max_queue` wait
+    for a running slot. A conversion which finds the queue full, or waits
+    longer than `queue_timeout` seconds, is rejected with
+    :class:`ConversionQueueFull`.
+
+    Conversions are run in the calling thread once admitted, because the
+    web workers are sync workers and each of them is already a process
+    serving one request at a time.
+    """
+
+    def __init__(self, max_concurrency, max_queue, queue_timeout,
+                 retry_after=5, lock_dir=None):
+        # type: (int, int, float, int, Optional[Text]) -> None
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        if fcntl is not None:
+            if lock_dir is None:
+                lock_dir = os.path.join(
+                    tempfile.gettempdir(), "l2i_conversion_slots")
+            os.makedirs(lock_dir, exist_ok=True)
+            self.running_slots = FileLockSlots(
+                lock_dir, "running", max_concurrency)
+            self.queue_slots = FileLockSlots(lock_dir, "queue", max_queue)
+        else:  # pragma: no cover
+            self.running_slots = ThreadSlots(max_concurrency)
+            self.queue_slots = ThreadSlots(max_queue)
+
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "admitted": 0,
+            "rejected": 0,
+            "timed_out": 0,
+            "queue_time_total": 0.,
+            "queue_time_max": 0.,
+        }  # type: Dict[Text, Any]
+
+    def _count(self, name, queue_time=None):
+        # type: (Text, Optional[float]) -> None
+        with self._stats_lock:
+            self.stats[name] += 1
+            if queue_time is not None:
+                self.stats["queue_time_total"] += queue_time
+                self.stats["queue_time_max"] = max(
+                    self.stats["queue_time_max"], queue_time)
+
+    def get_stats(self):
+        # type: () -> Dict[Text, Any]
+        """
+        :return: the counts of admitted, rejected and timed out
+        conversions, and the queue time (in seconds) of the admitted ones,
+        in the current process.
+        """
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["queue_time_avg"] = (
+            stats["queue_time_total"] / stats["admitted"]
+            if stats["admitted"] else 0.)
+        return stats
+
+    def _reject(self, msg):
+        # type: (Text) -> ConversionQueueFull
+        return ConversionQueueFull(msg, self.retry_after)
+
+    @contextmanager
+    def slot(self):
+        # type: () -> Iterator[float]
+        """
+        Hold a running slot, yield the time (in seconds) waited for it.
+        """
+        queued_at = time.monotonic()
+
+        running = self.running_slots.try_acquire()
+        if running is None:
+            queuing = self.queue_slots.try_acquire()
+            if queuing is None:
+                self._count("rejected")
+                raise self._reject("Conversion queue is full")
+
+            metrics.CONVERSION_QUEUE_DEPTH.inc()
+            try:
+                deadline = queued_at + self.queue_timeout
+                while running is None:
+                    if time.monotonic() >= deadline:
+                        self._count("timed_out")
+                        raise self._reject(
+                            "Timed out waiting in the conversion queue")
+                    time.sleep(SLOT_POLL_INTERVAL)
+                    running = self.running_slots.try_acquire()
+            finally:
+                metrics.CONVERSION_QUEUE_DEPTH.dec()
+                self.queue_slots.release(queuing)
+
+        queue_time = time.monotonic() - queued_at
+        self._count("admitted", queue_time)
+        if queue_time > 1:
+            logger.info("Conversion waited %.2fs in queue", queue_time)
+
+        metrics.CONVERSIONS_RUNNING.inc()
+        try:
+            yield queue_time
+        finally:
+            metrics.CONVERSIONS_RUNNING.dec()
+            self.running_slots.release(running)
+
+    def run(self, func, *args, **kwargs):
+        # type: (Callable, *Any, **Any) -> Any
+        with self.slot():
+            return func(*args, **kwargs)
+
+
+_executor = None  # type: Optional[ConversionExecutor]
+_executor_lock = threading.Lock()
+
+
+def get_conversion_executor():
+    # type: () -> ConversionExecutor
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ConversionExecutor(
+                max_concurrency=int(getattr(
+                    settings, "L2I_CONVERSION_MAX_CONCURRENCY",
+                    os.cpu_count() or 1)),
+                max_queue=int(getattr(
+                    settings, "L2I_CONVERSION_MAX_QUEUE", 16)),
+                queue_timeout=float(getattr(
+                    settings, "L2I_CONVERSION_QUEUE_TIMEOUT", 30)),
+                retry_after=int(getattr(
+                    settings, "L2I_CONVERSION_RETRY_AFTER", 5)),
+                lock_dir=getattr(settings, "L2I_CONVERSION_LOCK_DIR", None))
+        return _executor
@@ -0,0 +1,313 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Text  # noqa
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+
+from latex.executor import ConversionQueueFull
+from latex.singleflight import single_flight
+from latex.timing import STAGE_PERSIST, collect_timings, timed_stage
+
+JOB_STATUS_PENDING = "pending"
+JOB_STATUS_DONE = "done"
+JOB_STATUS_ERROR = "error"
+
+REDIS_JOB_QUEUE_KEY = "l2i:jobs"
+
+
+# {{{ job status
+
+def get_job_status_cache_key(tex_key):
+    # type: (Text) -> Text
+    return "l2i_job:%s" % tex_key
+
+
+def get_job_status_timeout():
+    # type: () -> int
+    return int(getattr(settings, "L2I_JOB_STATUS_TIMEOUT", 86400))
+
+
+def get_job_pending_timeout():
+    # type: () -> float
+    """
+    :return: the seconds after which a pending job which was not updated
+    is considered lost (e.g., its worker was restarted), default to the
+    sum of the queue, compile, convert and crop deadlines.
+    """
+    pending_timeout = getattr(settings, "L2I_JOB_PENDING_TIMEOUT", None)
+    if pending_timeout is not None:
+        return float(pending_timeout)
+    return sum(
+        float(getattr(settings, name, default))
+        for name, default in [
+            ("L2I_CONVERSION_QUEUE_TIMEOUT", 30),
+            ("L2I_COMPILE_TIMEOUT", 60),
+            ("L2I_CONVERT_TIMEOUT", 30),
+            ("L2I_CROP_TIMEOUT", 30)])
+
+
+def set_job_status(tex_key, job_status, error=None):
+    # type: (Text, Text, Optional[Text]) -> None
+    caches["default"].set(
+        get_job_status_cache_key(tex_key),
+        {"status": job_status, "error": error, "updated_at": time.time()},
+        get_job_status_timeout())
+
+
+def is_job_stale(job_status):
+    # type: (Dict[Text, Any]) -> bool
+    """
+    :return: True if `job_status` is pending, and was not updated within
+    :func:`get_job_pending_timeout`.
+    """
+    return (
+        job_status["status"] == JOB_STATUS_PENDING
+        and (time.time() - job_status.get("updated_at", 0)
+             > get_job_pending_timeout()))
+
+
+def get_job_status(tex_key):
+    # type: (Text) -> Optional[Dict[Text, Any]]
+    """
+    :return: a dict with "status" and "error", None if no job of
+    `tex_key` was queued, the status expired, or the job is stale.
+    """
+    job_status = caches["default"].get(get_job_status_cache_key(tex_key))
+    if job_status is None or is_job_stale(job_status):
+        return None
+    return job_status
+
+
+def mark_job_pending(tex_key):
+    # type: (Text) -> bool
+    """
+    :return: False if a job of `tex_key` is already pending (and not
+    stale), else mark it pending and return True.
+    """
+    def_cache = caches["default"]
+    cache_key = get_job_status_cache_key(tex_key)
+    pending = {
+        "status": JOB_STATUS_PENDING, "error": None, "updated_at": time.time()}
+    if def_cache.add(cache_key, pending, get_job_status_timeout()):
+        return True
+
+    current = def_cache.get(cache_key)
+    if (current is not None and current["status"] == JOB_STATUS_PENDING
+            and not is_job_stale(current)):
+        return False
+
+    def_cache.set(cache_key, pending, get_job_status_timeout())
+    return True
+
+
+def clear_job_status(tex_key):
+    # type: (Text) -> None
+    caches["default"].delete(get_job_status_cache_key(tex_key))
+
+# }}}
+
+
+def run_job(job):
+    # type: (Dict[Text, Any]) -> None
+    """
+    Convert and save the image of a job, which is a dict with keys
+    "compiler", "tex_source", "image_format", "tex_key" and "creator"
+    (the pk of the user).
+    """
+    with collect_timings("job:%s" % job["tex_key"]):
+        _run_job(job)
+
+
+def _run_job(job):
+    # type: (Dict[Text, Any]) -> None
+    from latex.api import convert_to_image_data
+    from latex.converter import tex_to_img_converter
+    from latex.models import LatexImage
+    from latex.serializers import LatexImageSerializer
+
+    tex_key = job["tex_key"]
+
+    # So that the job is not considered stale while it's running
+    set_job_status(tex_key, JOB_STATUS_PENDING)
+
+    try:
+        _converter = tex_to_img_converter(
+            job["compiler"], job["tex_source"], job["image_format"],
+            tex_key=tex_key)
+
+        with single_flight(tex_key):
+            if not LatexImage.objects.filter(tex_key=tex_key).count():
+                data = convert_to_image_data(_converter, job["creator"])
+                image_serializer = LatexImageSerializer(data=data)
+                if not image_serializer.is_valid():
+                    raise ValueError(json.dumps(image_serializer.errors))
+                with timed_stage(STAGE_PERSIST):
+                    image_serializer.save(
+                        converted_image=data.get("converted_image"))
+    except Exception as e:
+        set_job_status(
+            tex_key, JOB_STATUS_ERROR, f"{type(e).__name__}: {str(e)}")
+        return
+
+    set_job_status(tex_key, JOB_STATUS_DONE)
+
+
+# {{{ job queues
+
+class InProcessJobQueue(object):
+    """
+    Run the jobs in a thread pool of the current process, for
+    single node setups. At most `max_size` jobs are queued or running,
+    others are rejected with :class:`latex.executor.ConversionQueueFull`.
+    """
+
+    def __init__(self, max_workers, max_size=100, retry_after=5):
+        # type: (int, int, int) -> None
+        self.max_workers = max_workers
+        self.max_size = max_size
+        self.retry_after = retry_after
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="l2i_job")
+        self._n_jobs = 0
+        self._lock = threading.Lock()
+
+    def _run_job_in_thread(self, job):
+        # type: (Dict[Text, Any]) -> None
+        try:
+            run_job(job)
+        finally:
+            with self._lock:
+                self._n_jobs -= 1
+
+            # Each thread has its own db connection
+            close_old_connections()
+            from django.db import connection
+            connection.close()
+
+    def enqueue(self, job):
+        # type: (Dict[Text, Any]) -> None
+        with self._lock:
+            if self._n_jobs >= self.max_size:
+                raise ConversionQueueFull(
+                    "The job queue is full (%d jobs)" % self.max_size,
+                    self.retry_after)
+            self._n_jobs += 1
+
+        try:
+            self.executor.submit(self._run_job_in_thread, job)
+        except Exception:
+            with self._lock:
+                self._n_jobs -= 1
+            raise
+
+    def __len__(self):
+        # type: () -> int
+        return self._n_jobs
+
+
+class RedisJobQueue(object):
+    """
+    Push the jobs to a Redis list, which are run by the workers
+    started by `manage.py l2i_worker`.
+    """
+
+    def __init__(self, connection=None):
+        if connection is None:
+            from django_redis import get_redis_connection
+            connection = get_redis_connection("default")
+        self.connection = connection
+
+    def enqueue(self, job):
+        # type: (Dict[Text, Any]) -> None
+        self.connection.rpush(REDIS_JOB_QUEUE_KEY, json.dumps(job))
+
+    def dequeue(self, timeout=0):
+        # type: (int) -> Optional[Dict[Text, Any]]
+        item = self.connection.blpop([REDIS_JOB_QUEUE_KEY], timeout=timeout)
+        if item is None:
+            return None
+        return json.loads(item[1])
+
+    def __len__(self):
+        # type: () -> int
+        return self.connection.llen(REDIS_JOB_QUEUE_KEY)
+
+
+_in_process_job_queue = None  # type: Optional[InProcessJobQueue]
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """
+    :return: the job queue configured by `L2I_JOB_QUEUE`, either
+    "inprocess" (default) or "redis".
+    """
+    global _in_process_job_queue
+
+    queue_type = getattr(settings, "L2I_JOB_QUEUE", "inprocess")
+    if queue_type == "redis":
+        return RedisJobQueue()
+
+    max_workers = int(getattr(settings, "L2I_JOB_QUEUE_WORKERS", 2))
+    max_size = int(getattr(settings, "L2I_JOB_QUEUE_MAX_SIZE", 100))
+    with _job_queue_lock:
+        if (_in_process_job_queue is None
+                or _in_process_job_queue.max_workers != max_workers
+                or _in_process_job_queue.max_size != max_size):
+            _in_process_job_queue = InProcessJobQueue(
+                max_workers, max_size,
+                retry_after=int(getattr(
+                    settings, "L2I_CONVERSION_RETRY_AFTER", 5)))
+        return _in_process_job_queue
+
+
+def enqueue_job(job):
+    # type: (Dict[Text, Any]) -> bool
+    """
+    :return: False if the job of the same tex_key is already pending.
+    :raises: :class:`latex.executor.ConversionQueueFull` if the
+    in-process queue is full.
+    """
+    if not mark_job_pending(job["tex_key"]):
+        return False
+    try:
+        get_job_queue().enqueue(job)
+    except ConversionQueueFull:
+        clear_job_status(job["tex_key"])
+        raise
+    return True
+
+# }}}
+
+# vim: foldmethod=marker
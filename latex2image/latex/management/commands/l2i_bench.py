@@ -0,0 +1,87 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from latex.bench import get_default_corpus_dirs, load_corpus, run_benchmark
+from latex.constants import ALLOWED_COMPILER_FORMAT_COMBINATION
+
+
+class Command(BaseCommand):
+    help = ("Benchmark the conversion of a corpus of tex documents with "
+            "every allowed compiler/image format combination, reporting "
+            "cold and warm latency percentiles, throughput, failures, peak "
+            "RSS and output sizes as JSON. The database and the cache are not used.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--corpus", action="append", default=None, metavar="DIR",
+            help="Directory of .tex documents (searched recursively), can be "
+                 "repeated. Default to the documents in tests/resource.")
+        parser.add_argument(
+            "--no-synthetic", action="store_true",
+            help="Don't include the synthetic inline math, display math, "
+                 "TikZ and CJK documents.")
+        parser.add_argument(
+            "--combination", action="append", default=None,
+            metavar="COMPILER2FORMAT",
+            help="Only benchmark that combination, e.g., 'xelatex2svg', "
+                 "can be repeated. Default to all allowed combinations.")
+        parser.add_argument(
+            "--repeat", type=int, default=3,
+            help="Number of warm conversions of each document (default 3).")
+        parser.add_argument(
+            "--concurrency", type=int, action="append", default=None,
+            help="Concurrency level at which to measure the throughput, "
+                 "can be repeated (default 1).")
+        parser.add_argument(
+            "--output", "-o", default=None,
+            help="Write the JSON results to that file instead of stdout.")
+
+    def get_combinations(self, names):
+        if not names:
+            return None
+
+        allowed = {
+            "%s2%s" % combination: combination
+            for combination in ALLOWED_COMPILER_FORMAT_COMBINATION}
+        combinations = []
+        for name in names:
+            if name not in allowed:
+                raise CommandError(
+                    "Unknown combination '%s', allowed are: %s"
+                    % (name, ", ".join(sorted(allowed))))
+            combinations.append(allowed[name])
+        return combinations
+
+    def handle(self, *args, **options):
+        combinations = self.get_combinations(options["combination"])
+
+        if options["repeat"] < 0:
+            raise CommandError("--repeat must be a non-negative integer")
+
+        concurrency_levels = tuple(options["concurrency"] or [1])
+        if any(c < 1 for c in concurrency_levels):
+            raise CommandError("--concurrency must be a positive integer")
+
+        corpus = load_corpus(
+            options["corpus"] or get_default_corpus_dirs(),
+            synthetic=not options["no_synthetic"])
+        if not corpus:
+            raise CommandError("No documents to benchmark")
+
+        log = None
+        if options["verbosity"] > 1:
+            log = self.stderr.write
+
+        results = run_benchmark(
+            corpus, combinations=combinations, repeat=options["repeat"],
+            concurrency_levels=concurrency_levels, log=log)
+
+        output = json.dumps(results, indent=2, ensure_ascii=False)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output)
+            if options["verbosity"] > 0:
+                self.stderr.write("Results written to %s" % options["output"])
+        else:
+            self.stdout.write(output)
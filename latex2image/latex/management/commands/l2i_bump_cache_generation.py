@@ -0,0 +1,20 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+
+from latex.cache import bump_cache_generation
+
+
+class Command(BaseCommand):
+    help = ("Invalidate all the cached fields of the images at once, e.g., "
+            "after changing the serializer output, by bumping the "
+            "generation which namespaces their cache keys. The entries of "
+            "previous generations are not deleted but no longer read.")
+
+    def handle(self, *args, **options):
+        try:
+            generation = bump_cache_generation()
+        except (ImproperlyConfigured, RuntimeError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(
+            "Bumped the cache generation to %d" % generation)
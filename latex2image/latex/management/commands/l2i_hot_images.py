@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from latex.access import (AccessBuffer, flush_access_counts, get_hot_images,
+                          is_access_tracking_enabled)
+
+
+class Command(BaseCommand):
+    help = ("List the most accessed images (tex_key, hit count and last "
+            "access time), by the access counts flushed to the database "
+            "(see settings.L2I_ACCESS_TRACKING).")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--top", type=int, default=20,
+            help="Number of images listed, default to 20.")
+        parser.add_argument(
+            "--flush", action="store_true",
+            help="Flush the access counts buffered in redis to the "
+                 "database first.")
+
+    def handle(self, *args, **options):
+        if options["top"] < 1:
+            raise CommandError("--top must be a positive integer")
+
+        if options["flush"]:
+            if not is_access_tracking_enabled():
+                raise CommandError("Access tracking is not enabled")
+            n_updated = flush_access_counts(AccessBuffer(), force=True)
+            self.stdout.write(
+                "Flushed the access counts of %d image(s)" % n_updated)
+
+        for tex_key, hit_count, last_accessed in get_hot_images(
+                options["top"]):
+            self.stdout.write("%s\t%d\t%s" % (
+                tex_key, hit_count,
+                last_accessed.isoformat() if last_accessed else "-"))
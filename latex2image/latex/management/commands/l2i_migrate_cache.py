@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from latex.cache import (CACHE_LAYOUTS, LAYOUT_HASH, LAYOUT_KEYS,
+                         HashFieldCache, get_field_cache, migrate_field_cache)
+
+
+class Command(BaseCommand):
+    help = ("Move the cached fields of the images from one cache layout to "
+            "another (see settings.L2I_CACHE_LAYOUT). Requires the default "
+            "cache to be a django-redis cache.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--to", choices=CACHE_LAYOUTS, default=LAYOUT_HASH,
+            help="The layout to migrate to, default to '%s'. The cache is "
+                 "migrated from the other layout." % LAYOUT_HASH)
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Number of tex_keys migrated at a time, default to 500.")
+        parser.add_argument(
+            "--keep-old", action="store_true",
+            help="Don't delete the migrated entries of the old layout.")
+
+    def handle(self, *args, **options):
+        # The hash layout falls back to the keys layout without django-redis
+        if not isinstance(get_field_cache(LAYOUT_HASH), HashFieldCache):
+            raise CommandError(
+                "Migrating the cache requires a django-redis default cache")
+
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be a positive integer")
+
+        target_layout = options["to"]
+        source_layout = (
+            LAYOUT_KEYS if target_layout == LAYOUT_HASH else LAYOUT_HASH)
+
+        n_migrated = migrate_field_cache(
+            get_field_cache(source_layout), get_field_cache(target_layout),
+            batch_size=options["batch_size"],
+            delete_source=not options["keep_old"])
+
+        self.stdout.write(
+            "Migrated the cache of %d tex_key(s) from the '%s' layout to "
+            "the '%s' layout" % (n_migrated, source_layout, target_layout))
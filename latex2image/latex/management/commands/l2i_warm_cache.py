@@ -0,0 +1,108 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from latex.cache import (CACHED_FIELDS, get_field_cache,
+                         get_fields_cached_on_save)
+from latex.warmup import (ORDER_ACCESSED, ORDER_RECENT, WARM_ORDERS,
+                          get_warm_queryset, warm_field_cache)
+
+# Seconds between progress reports
+PROGRESS_INTERVAL = 5
+
+
+class Command(BaseCommand):
+    help = ("Fill the cache with the fields of the images in the database, "
+            "e.g., at deploy time or after a redis restart, so that the "
+            "first requests of hot images don't hit the database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--order", choices=WARM_ORDERS, default=ORDER_RECENT,
+            help="Which images are cached first, default to '%s' (the "
+                 "most recently created), or '%s' (the most accessed, see "
+                 "settings.L2I_ACCESS_TRACKING)."
+                 % (ORDER_RECENT, ORDER_ACCESSED))
+        parser.add_argument(
+            "--fields", default=None,
+            help="Comma separated fields to cache, default to those cached "
+                 "when an image is saved. 'compile_error' is always "
+                 "cached.")
+        parser.add_argument(
+            "--limit", type=int, default=None,
+            help="The max number of images to cache.")
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Number of images cached at a time, default to 500.")
+        parser.add_argument(
+            "--max-bytes", type=int, default=None,
+            help="Stop once about that many bytes are cached, default to "
+                 "settings.L2I_CACHE_MEMORY_BUDGET_BYTES (no limit if not "
+                 "set).")
+        parser.add_argument(
+            "--rate", type=float, default=None,
+            help="The max number of images cached per second, default to "
+                 "no limit.")
+
+    def get_fields(self, fields):
+        if fields is None:
+            return get_fields_cached_on_save()
+
+        fields = fields.split(",")
+        unknown = [field for field in fields if field not in CACHED_FIELDS]
+        if unknown:
+            raise CommandError(
+                "Unknown field(s): %s, allowed are: %s"
+                % (", ".join(unknown), ", ".join(CACHED_FIELDS)))
+
+        if ("image" in fields
+                and not getattr(
+                    settings, "L2I_API_IMAGE_RETURNS_RELATIVE_PATH", True)):
+            raise CommandError(
+                "The 'image' field can only be cached when "
+                "settings.L2I_API_IMAGE_RETURNS_RELATIVE_PATH is True")
+        return fields
+
+    def handle(self, *args, **options):
+        fields = self.get_fields(options["fields"])
+
+        for name in ["limit", "batch_size", "max_bytes", "rate"]:
+            if options[name] is not None and options[name] <= 0:
+                raise CommandError(
+                    "--%s must be positive" % name.replace("_", "-"))
+
+        # Only writing, no need of the local field cache
+        field_cache = get_field_cache(use_local=False)
+        if field_cache is None:
+            raise CommandError("No cache is configured")
+
+        max_bytes = options["max_bytes"]
+        if max_bytes is None:
+            max_bytes = getattr(settings, "L2I_CACHE_MEMORY_BUDGET_BYTES", None)
+
+        queryset = get_warm_queryset(fields, options["order"])
+        if options["limit"] is not None:
+            queryset = queryset[:options["limit"]]
+
+        total = queryset.count()
+        last_reported_at = [0.]
+
+        def progress(stats):
+            if stats.elapsed - last_reported_at[0] < PROGRESS_INTERVAL:
+                return
+            last_reported_at[0] = stats.elapsed
+            self.stdout.write(
+                "%d/%d image(s) read, %d cached (%d bytes), %.1f image(s)/s"
+                % (stats.n_read, total, stats.n_cached, stats.n_bytes,
+                   stats.throughput))
+
+        stats = warm_field_cache(
+            field_cache,
+            queryset.iterator(chunk_size=options["batch_size"]),
+            fields, batch_size=options["batch_size"], max_bytes=max_bytes,
+            rate=options["rate"], progress=progress)
+
+        self.stdout.write(
+            "Cached the fields of %d image(s) (%d bytes) out of %d read "
+            "in %.1fs, %.1f image(s)/s"
+            % (stats.n_cached, stats.n_bytes, stats.n_read, stats.elapsed,
+               stats.throughput))
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from latex.jobs import RedisJobQueue, run_job
+
+
+class Command(BaseCommand):
+    help = ("Run the conversion jobs queued by the async create API, "
+            "when settings.L2I_JOB_QUEUE is 'redis'. Start more than one "
+            "worker to run jobs in parallel.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--max-jobs", type=int, default=0,
+            help="Exit after running that many jobs, 0 (default) "
+                 "means never exit.")
+
+    def handle(self, *args, **options):
+        queue = RedisJobQueue()
+        max_jobs = options["max_jobs"]
+        n_jobs = 0
+
+        while not max_jobs or n_jobs < max_jobs:
+            job = queue.dequeue(timeout=5)
+            if job is None:
+                continue
+
+            close_old_connections()
+            run_job(job)
+            n_jobs += 1
+
+            if options["verbosity"] > 1:
+                self.stdout.write("Finished job of %s" % job["tex_key"])
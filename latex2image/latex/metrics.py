@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import os
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+# When PROMETHEUS_MULTIPROC_DIR is set (by start-server.sh), the values are
+# kept in files of that dir, so that the metrics of all gunicorn workers
+# are aggregated by :func:`metrics_view`.
+
+LATENCY_BUCKETS = (
+    0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30., 60., float("inf"))
+IMAGE_BYTES_BUCKETS = (
+    1024, 4 * 1024, 16 * 1024, 64 * 1024, 256 * 1024, 1024 ** 2,
+    4 * 1024 ** 2, float("inf"))
+RATIO_BUCKETS = (0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1., float("inf"))
+
+COMPILE_SECONDS = Histogram(
+    "l2i_compile_seconds", "Duration of compiling the tex source",
+    ["compiler", "image_format"], buckets=LATENCY_BUCKETS)
+CONVERT_SECONDS = Histogram(
+    "l2i_convert_seconds", "Duration of converting the compiled file to image",
+    ["compiler", "image_format"], buckets=LATENCY_BUCKETS)
+IMAGE_BYTES = Histogram(
+    "l2i_image_bytes", "Size of the converted images in bytes",
+    ["compiler", "image_format"], buckets=IMAGE_BYTES_BUCKETS)
+COMPILE_ERRORS = Counter(
+    "l2i_compile_errors", "Number of failed compiles, including timeouts",
+    ["compiler", "image_format", "kind"])
+CACHE_REQUESTS = Counter(
+    "l2i_cache_requests", "Number of lookups of cached attributes",
+    ["result"])
+FIELD_CACHE_REQUESTS = Counter(
+    "l2i_field_cache_requests",
+    "Number of lookups of the cached fields of a tex_key, by cache tier",
+    ["tier", "result"])
+LOCAL_FIELD_CACHE_BYTES = Gauge(
+    "l2i_local_field_cache_bytes",
+    "Approximate size of the in-process field caches",
+    multiprocess_mode="livesum")
+CACHE_COMPRESSION_RATIO = Histogram(
+    "l2i_cache_compression_ratio",
+    "Compressed to uncompressed size ratio of the compressed cached values",
+    ["algorithm", "value_format"], buckets=RATIO_BUCKETS)
+CACHE_COMPRESSION_INPUT_BYTES = Counter(
+    "l2i_cache_compression_input_bytes",
+    "Size of the cached values before compression",
+    ["algorithm", "value_format"])
+CACHE_COMPRESSION_OUTPUT_BYTES = Counter(
+    "l2i_cache_compression_output_bytes",
+    "Size of the cached values after compression, as cached",
+    ["algorithm", "value_format"])
+CONVERSION_QUEUE_DEPTH = Gauge(
+    "l2i_conversion_queue_depth",
+    "Number of conversions waiting for a running slot",
+    multiprocess_mode="livesum")
+CONVERSIONS_RUNNING = Gauge(
+    "l2i_conversions_running", "Number of conversions running",
+    multiprocess_mode="livesum")
+SUBPROCESSES_IN_FLIGHT = Gauge(
+    "l2i_subprocesses_in_flight",
+    "Number of compile, convert and crop subprocesses running",
+    multiprocess_mode="livesum")
+
+
+def get_registry():
+    # type: () -> CollectorRegistry
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def metrics_view(request):
+    if not getattr(settings, "L2I_METRICS_ENABLED", True):
+        raise Http404()
+
+    return HttpResponse(
+        generate_latest(get_registry()), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.15 on 2026-10-18 04:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('latex', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lateximage',
+            name='hit_count',
+            field=models.PositiveBigIntegerField(db_index=True, default=0, verbose_name='Hit count'),
+        ),
+        migrations.AddField(
+            model_name='lateximage',
+            name='last_accessed',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last accessed'),
+        ),
+    ]
@@ -81,10 +81,30 @@ class LatexImage(models.Model):
         settings.AUTH_USER_MODEL, verbose_name=_('Creator'),
         on_delete=models.CASCADE)
 
+    # Updated in bulk by latex.access, not by save()
+    hit_count = models.PositiveBigIntegerField(
+        default=0, db_index=True, verbose_name=_('Hit count'))
+    last_accessed = models.DateTimeField(
+        null=True, blank=True, verbose_name=_('Last accessed'))
+
     class Meta:
         verbose_name = _("LaTeXImage")
         verbose_name_plural = _("LaTeXImages")
 
+    _converted_image = None
+
+    @property
+    def converted_image(self):
+        """
+        The :class:`latex.converter.ConvertedImage` from which the image
+        and data_url are saved, can be passed to the constructor.
+        """
+        return self._converted_image
+
+    @converted_image.setter
+    def converted_image(self, value):
+        self._converted_image = value
+
     def _get_changed_fields(self):
         # Get updated_fields: https://stackoverflow.com/a/55005137/3437454
         # This method should only be used before saving.
@@ -111,20 +131,29 @@ class LatexImage(models.Model):
         return []
 
     def save(self, **kwargs):
-        # https://stackoverflow.com/a/18803218/3437454
-        changed_fields = self._get_changed_fields()
+        if self.converted_image is not None:
+            # Both are built from the raw bytes, without decoding the
+            # data_url or reading the stored image back.
+            self.image = self.converted_image.to_file(self.tex_key)
+            self.data_url = self.converted_image.data_url
+        else:
+            # https://stackoverflow.com/a/18803218/3437454
+            changed_fields = self._get_changed_fields()
 
-        if (self.data_url and not self.image) or "data_url" in changed_fields:
-            self.image = make_image_file(self.data_url, self.tex_key)
+            if ((self.data_url and not self.image)
+                    or "data_url" in changed_fields):
+                self.image = make_image_file(self.data_url, self.tex_key)
 
-        if self.image and not self.data_url:
-            file = default_storage.open(self.image.name)
-            self.data_url = get_data_url_from_buf_and_mimetype(
-                buf=file.read(), mime_type=guess_type(self.image.name)[0])
-            file.close()
+            if self.image and not self.data_url:
+                file = default_storage.open(self.image.name)
+                self.data_url = get_data_url_from_buf_and_mimetype(
+                    buf=file.read(), mime_type=guess_type(self.image.name)[0])
+                file.close()
 
         self.full_clean()
-        return super().save(**kwargs)
+        result = super().save(**kwargs)
+        self.converted_image = None
+        return result
 
     def clean(self):
         super().clean()
@@ -1,12 +1,28 @@
 from django.contrib.auth import get_user_model
-from django.core.exceptions import ImproperlyConfigured
 from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from rest_framework.authtoken.models import Token
 
-from latex.api import get_field_cache_key
+from latex.cache import (get_field_cache, get_fields_cached_on_save,
+                         invalidate_local_field_cache)
 from latex.models import LatexImage
 from latex.serializers import LatexImageSerializer
+from latex.timing import STAGE_COMPILE, STAGE_CONVERT, get_current_timings
+
+
+def get_render_costs(tex_key):
+    """
+    :return: the render cost (in milliseconds) of `tex_key`, if it was
+    converted in the current request (or job).
+    """
+    timings = get_current_timings()
+    if not timings:
+        return None
+
+    cost_ms = sum(
+        timings.get(stage, 0.) for stage in (STAGE_COMPILE, STAGE_CONVERT)
+    ) * 1000
+    return {tex_key: cost_ms} if cost_ms else None
 
 
 @receiver(post_save, sender=get_user_model())
@@ -29,49 +45,33 @@ def image_delete(sender, instance, **kwargs):
     # is successfully deleted.
     instance.image.delete(False)
 
-    try:
-        import django.core.cache as cache
-    except ImproperlyConfigured:
+    field_cache = get_field_cache()
+    if field_cache is None:
         return
 
-    def_cache = cache.caches["default"]
-
-    for attr in ("image", "creation_time", "data_url", "compile_error", "creator"):
-        def_cache.delete(get_field_cache_key(instance.tex_key, attr))
+    field_cache.delete_many([instance.tex_key])
+    invalidate_local_field_cache([instance.tex_key])
 
 
 @receiver(post_save, sender=LatexImage)
 def create_image_cache_on_save(sender, instance, **kwargs):
     # We will cache image and data_url
-    try:
-        import django.core.cache as cache
-    except ImproperlyConfigured:
+    field_cache = get_field_cache()
+    if field_cache is None:
         return
 
-    def_cache = cache.caches["default"]
-
-    from django.conf import settings
-
     serializer = LatexImageSerializer(instance)
     data = serializer.to_representation(instance)
 
-    attr_to_cache = ["compile_error"]
-
-    if (data["image"]
-            and getattr(settings, "L2I_API_IMAGE_RETURNS_RELATIVE_PATH", True)):
-        # We only cache when image relative path are requested in api
-        # because we can't access the request thus no way to know
-        # the url and can't build the image url.
-
-        attr_to_cache.append("image")
+    attr_to_cache = [
+        attr for attr in get_fields_cached_on_save()
+        if attr != "image" or data["image"]]
 
-    if getattr(settings, "L2I_CACHE_DATA_URL_ON_SAVE", False):
-        attr_to_cache.append("data_url")
+    # Values too large are skipped by the field cache, and all are
+    # written at once (one pipeline with the hash layout).
+    field_cache.set_many(
+        {instance.tex_key: {attr: data[attr] for attr in attr_to_cache}},
+        overwrite=False, costs=get_render_costs(instance.tex_key))
 
-    for attr in attr_to_cache:
-        attr_value = data[attr]
-        if (attr_value is not None
-                and len(str(attr_value)) <= getattr(
-                    settings, "L2I_CACHE_MAX_BYTES", 0)):
-            def_cache.add(
-                get_field_cache_key(instance.tex_key, attr), attr_value, None)
+    # The instance may be updated, drop the stale fields of all processes
+    invalidate_local_field_cache([instance.tex_key])
@@ -9,6 +9,22 @@ LATEX_IMAGE_ALLOWED_FIELDS_NAME = [
     f.name for f in LatexImage._meta.get_fields() if f.name != "id"]
 
 
+def get_only_fields(fields):
+    """
+    :param fields: a list of field names, or a string of field names
+    concatenated by ",", as passed to `DynamicFieldsModelSerializer`.
+    :return: the names of the model fields needed to serialize `fields`,
+    which can be passed to `QuerySet.only()`, so that large fields like
+    data_url are not loaded if not requested.
+    """
+    if isinstance(fields, str):
+        fields = fields.split(",")
+
+    # "compile_error" is always serialized
+    return [name for name in LATEX_IMAGE_ALLOWED_FIELDS_NAME
+            if name in fields or name == "compile_error"]
+
+
 class DynamicFieldsModelSerializer(serializers.ModelSerializer):
     """
     A ModelSerializer that takes an additional `fields` argument that
@@ -83,6 +99,40 @@ class _FieldsSerializer(serializers.ListField):
         return super().to_internal_value(data)
 
 
+def validate_bulk_size(values):
+    max_items = getattr(settings, "L2I_BULK_MAX_ITEMS", 100)
+    if len(values) > max_items:
+        raise serializers.ValidationError(
+            _("At most {max_items} items are allowed.").format(
+                max_items=max_items))
+    return values
+
+
+class LatexImageBulkCreateDataSerializer(serializers.Serializer):
+    """
+    Serializer for the data of bulk create, each item is validated
+    by LatexImageCreateDataSerialzier.
+    """
+    items = serializers.ListField(
+        child=serializers.DictField(), allow_empty=False)
+    fields = _FieldsSerializer(required=False, allow_null=False)
+
+    def validate_items(self, items):
+        return validate_bulk_size(items)
+
+
+class LatexImageBulkLookupDataSerializer(serializers.Serializer):
+    """
+    Serializer for the data of bulk lookup.
+    """
+    tex_keys = serializers.ListField(
+        child=serializers.CharField(max_length=None), allow_empty=False)
+    fields = _FieldsSerializer(required=False, allow_null=False)
+
+    def validate_tex_keys(self, tex_keys):
+        return validate_bulk_size(tex_keys)
+
+
 class LatexImageCreateDataSerialzier(serializers.Serializer):
     """
     Serializer for (request/form) data when create new LatexImage
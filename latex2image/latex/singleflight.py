@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Text  # noqa
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+SINGLE_FLIGHT_POLL_INTERVAL = 0.05
+
+
+def get_single_flight_lock_cache_key(tex_key):
+    # type: (Text) -> Text
+    return "l2i_lock:%s" % tex_key
+
+
+def get_single_flight_wait_timeout():
+    # type: () -> float
+    return float(getattr(settings, "L2I_SINGLE_FLIGHT_WAIT_TIMEOUT", 60))
+
+
+def get_single_flight_lock_timeout():
+    # type: () -> int
+    return int(getattr(settings, "L2I_SINGLE_FLIGHT_LOCK_TIMEOUT", 120))
+
+
+class KeyLockTable(object):
+    """
+    A table of per key locks of the current process. A lock is
+    removed from the table when no thread holds or waits for it.
+    """
+
+    def __init__(self):
+        # type: () -> None
+        self._lock = threading.Lock()
+        self._locks = {}  # type: Dict[Text, List]
+
+    def __len__(self):
+        # type: () -> int
+        return len(self._locks)
+
+    @contextmanager
+    def hold(self, key, timeout):
+        # type: (Text, float) -> Iterator[bool]
+        """
+        Hold the lock of `key`, yield False if it can't be acquired
+        in `timeout` seconds.
+        """
+        with self._lock:
+            entry = self._locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+
+        acquired = entry[0].acquire(timeout=max(timeout, 0))
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                entry[0].release()
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+
+
+_key_lock_table = KeyLockTable()
+
+
+def _get_lock_cache():
+    try:
+        import django.core.cache as cache
+        return cache.caches["default"]
+    except ImproperlyConfigured:
+        return None
+
+
+def acquire_cache_lock(def_cache, tex_key, token, deadline):
+    # type: (...) -> Optional[bool]
+    """
+    Poll until the lock of `tex_key` is set to `token` in the cache
+    (an atomic SET NX with redis), or `deadline` is passed.
+    :return: None if the cache is unavailable, e.g., redis is down, and
+    django-redis ignores its exceptions (add returns None).
+    """
+    cache_key = get_single_flight_lock_cache_key(tex_key)
+    lock_timeout = get_single_flight_lock_timeout()
+    while True:
+        try:
+            added = def_cache.add(cache_key, token, lock_timeout)
+        except Exception:
+            logger.warning("Failed to acquire the single flight lock",
+                           exc_info=True)
+            return None
+        if added is None:
+            return None
+        if added:
+            return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+
+
+def release_cache_lock(def_cache, tex_key, token):
+    # type: (...) -> None
+    cache_key = get_single_flight_lock_cache_key(tex_key)
+
+    # Don't release the lock which expired and was taken by others.
+    if def_cache.get(cache_key) == token:
+        def_cache.delete(cache_key)
+
+
+@contextmanager
+def single_flight(tex_key):
+    # type: (Text) -> Iterator[bool]
+    """
+    Make sure only one thread, among the threads of all processes sharing
+    the default cache, converts `tex_key` at a time, so that concurrent
+    identical requests wait for the leader and then find its result,
+    instead of compiling it again.
+
+    Threads of the current process wait on an in-process lock, and only
+    the holder of it polls the lock in the cache. Yield False if the locks
+    can't be acquired in L2I_SINGLE_FLIGHT_WAIT_TIMEOUT seconds, and the
+    caller should convert without the lock, as a fallback. If the cache
+    is unavailable, only the in-process lock is held.
+    """
+    wait_timeout = get_single_flight_wait_timeout()
+    deadline = time.monotonic() + wait_timeout
+
+    with _key_lock_table.hold(tex_key, wait_timeout) as acquired:
+        if not acquired:
+            yield False
+            return
+
+        def_cache = _get_lock_cache()
+        if def_cache is None:
+            yield True
+            return
+
+        token = uuid.uuid4().hex
+        acquired = acquire_cache_lock(def_cache, tex_key, token, deadline)
+        if acquired is None:
+            yield True
+            return
+
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                release_cache_lock(def_cache, tex_key, token)
@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional, Text  # noqa
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# The names of the stages, which are kept stable for dashboards.
+STAGE_COMPILE = "compile"
+STAGE_CONVERT = "convert"
+STAGE_ENCODE = "encode"
+STAGE_PERSIST = "persist"
+STAGE_CACHE_LOOKUP = "cache_lookup"
+
+STAGES = (
+    STAGE_COMPILE, STAGE_CONVERT, STAGE_ENCODE, STAGE_PERSIST,
+    STAGE_CACHE_LOOKUP)
+
+
+class TimingAggregator(object):
+    """
+    The count, total, min and max duration (in seconds) of each stage
+    in the current process.
+    """
+
+    def __init__(self):
+        # type: () -> None
+        self._lock = threading.Lock()
+        self._stats = {}  # type: Dict[Text, Dict[Text, float]]
+
+    def add(self, stage, duration):
+        # type: (Text, float) -> None
+        with self._lock:
+            stats = self._stats.get(stage)
+            if stats is None:
+                self._stats[stage] = {
+                    "count": 1, "total": duration,
+                    "min": duration, "max": duration}
+                return
+            stats["count"] += 1
+            stats["total"] += duration
+            stats["min"] = min(stats["min"], duration)
+            stats["max"] = max(stats["max"], duration)
+
+    def get_stats(self):
+        # type: () -> Dict[Text, Dict[Text, float]]
+        with self._lock:
+            result = {
+                stage: dict(stats) for stage, stats in self._stats.items()}
+        for stats in result.values():
+            stats["avg"] = stats["total"] / stats["count"]
+        return result
+
+    def reset(self):
+        # type: () -> None
+        with self._lock:
+            self._stats.clear()
+
+
+timing_aggregator = TimingAggregator()
+
+_current_timings = ContextVar(
+    "l2i_stage_timings", default=None
+)  # type: ContextVar[Optional[Dict[Text, float]]]
+
+
+def get_stage_stats():
+    # type: () -> Dict[Text, Dict[Text, float]]
+    """
+    :return: the stats of the durations of each stage in the current
+    process, see :class:`TimingAggregator`.
+    """
+    return timing_aggregator.get_stats()
+
+
+def get_current_timings():
+    # type: () -> Optional[Dict[Text, float]]
+    """
+    :return: a copy of the timings being collected, None if not
+    collecting.
+    """
+    timings = _current_timings.get()
+    return dict(timings) if timings is not None else None
+
+
+def record_stage(stage, duration):
+    # type: (Text, float) -> None
+    """
+    Add `duration` (in seconds) of `stage` to the timings being collected
+    (if any), and to the aggregator.
+    """
+    timings = _current_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.) + duration
+    timing_aggregator.add(stage, duration)
+
+
+@contextmanager
+def timed_stage(stage):
+    # type: (Text) -> Iterator[None]
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def collect_timings(label):
+    # type: (Text) -> Iterator[Dict[Text, float]]
+    """
+    Collect the durations of the stages run inside the block into the
+    yielded dict, and log them as a JSON line labelled `label`.
+    """
+    timings = {}  # type: Dict[Text, float]
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+        if timings:
+            logger.info(json.dumps({
+                "label": label,
+                "stages": {
+                    stage: round(duration * 1000, 3)
+                    for stage, duration in timings.items()}}))
+
+
+@contextmanager
+def collect_timings_into(timings):
+    # type: (Dict[Text, float]) -> Iterator[Dict[Text, float]]
+    """
+    Collect the durations of the stages run inside the block into
+    `timings` only, rather than into the timings being collected, e.g.,
+    for the conversions of a request run concurrently, which are merged
+    afterwards by :func:`merge_timings`.
+    """
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+
+def merge_timings(timings):
+    # type: (Dict[Text, float]) -> None
+    """
+    Add `timings` to the timings being collected (if any), without
+    counting them again in the aggregator.
+    """
+    current = _current_timings.get()
+    if current is None:
+        return
+    for stage, duration in timings.items():
+        current[stage] = current.get(stage, 0.) + duration
+
+
+def get_server_timing_header_value(timings):
+    # type: (Dict[Text, float]) -> Text
+    return ", ".join(
+        "%s;dur=%.3f" % (stage, duration * 1000)
+        for stage, duration in timings.items())
+
+
+class ServerTimingMiddleware(object):
+    """
+    Collect the stage timings of each request, and return them in the
+    Server-Timing header (in milliseconds), unless
+    settings.L2I_SERVER_TIMING_HEADER is False.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with collect_timings(request.path) as timings:
+            response = self.get_response(request)
+
+        if timings and getattr(settings, "L2I_SERVER_TIMING_HEADER", True):
+            response["Server-Timing"] = get_server_timing_header_value(timings)
+        return response
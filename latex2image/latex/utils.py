@@ -24,9 +24,11 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import math
 import os
-from subprocess import PIPE, Popen
-from typing import Any, List, Optional, Text, Tuple  # noqa
+import signal
+from subprocess import PIPE, Popen, TimeoutExpired
+from typing import Any, Callable, Dict, List, Optional, Text, Tuple  # noqa
 
 from codemirror import CodeMirrorJavascript, CodeMirrorTextarea
 from django.core.checks import Critical
@@ -35,6 +37,8 @@ from django.core.management.base import CommandError
 from django.utils.encoding import DEFAULT_LOCALE_ENCODING, force_str
 from django.utils.text import format_lazy
 
+from latex.metrics import SUBPROCESSES_IN_FLIGHT
+
 # {{{ Constants
 
 ALLOWED_COMPILER = ['latex', 'xelatex', 'xelatex']
@@ -58,8 +62,75 @@ def string_concat(*strings):
 
 # {{{ subprocess popen wrapper
 
+class SubprocessTimeoutError(RuntimeError):
+    def __init__(self, cmd, timeout):
+        # type: (Text, float) -> None
+        super().__init__(
+            "'%s' timed out after %s seconds" % (cmd, timeout))
+        self.cmd = cmd
+        self.timeout = timeout
+
+
+def get_rlimits_cmdline(args, cpu_time_limit=None, memory_limit=None,
+                        file_size_limit=None):
+    # type: (List[Text], Optional[float], Optional[float], Optional[float]) -> List[Text]  # noqa
+    """
+    :return: `args` run by a shell which first sets the CPU time (in
+    seconds), the address space (in bytes) and the file size (in bytes)
+    rlimits, which are inherited by all its descendants, or `args` if no
+    limit is set or rlimits are not supported. The rlimits are not set
+    via `preexec_fn` of Popen, which may deadlock the child when the
+    parent has other threads running.
+    """
+    if os.name == 'nt' or not (
+            cpu_time_limit or memory_limit or file_size_limit):
+        return list(args)
+
+    ulimits = []
+    if cpu_time_limit:
+        ulimits.append("ulimit -t %d" % math.ceil(float(cpu_time_limit)))
+    if memory_limit:
+        # In KiB
+        ulimits.append("ulimit -v %d" % (int(memory_limit) // 1024))
+    if file_size_limit:
+        # In 512-byte blocks
+        ulimits.append("ulimit -f %d" % math.ceil(int(file_size_limit) / 512))
+
+    return (
+        ["sh", "-c", " && ".join(ulimits + ['exec "$@"']), "sh"]
+        + list(args))
+
+
+def get_subprocess_session_kwargs():
+    # type: () -> Dict[Text, Any]
+    """
+    :return: the Popen kwargs which start the child in a new process
+    group (so that it can be killed with all its descendants).
+    """
+    if os.name == 'nt':  # pragma: no cover
+        return {}
+    return {"start_new_session": True}
+
+
+def kill_process_group(p):
+    # type: (Popen) -> None
+    """
+    Kill the process started with :func:`get_subprocess_session_kwargs`,
+    and all its descendants.
+    """
+    try:
+        if os.name == 'nt':  # pragma: no cover
+            p.kill()
+        else:
+            os.killpg(p.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
 def popen_wrapper(args, os_err_exc_type=CommandError,
-                  stdout_encoding='utf-8', **kwargs):
+                  stdout_encoding='utf-8', timeout=None,
+                  cpu_time_limit=None, memory_limit=None,
+                  file_size_limit=None, **kwargs):
     # type: (...) -> Tuple[Text, Text, int]
     """
     Extended from django.core.management.utils.popen_wrapper.
@@ -70,16 +141,36 @@ def popen_wrapper(args, os_err_exc_type=CommandError,
 
     Friendly wrapper around Popen
 
+    :param timeout: if set, the process group of the child is killed
+    after `timeout` seconds, and :class:`SubprocessTimeoutError` is raised.
+    :param cpu_time_limit: the CPU time rlimit of the child, in seconds.
+    :param memory_limit: the address space rlimit of the child, in bytes.
+    :param file_size_limit: the max size of the files written by the
+    child, in bytes.
+
     Returns stdout output, stderr output and OS status code.
     """
 
+    if (timeout is not None or cpu_time_limit or memory_limit
+            or file_size_limit):
+        kwargs.update(get_subprocess_session_kwargs())
+
     try:
-        p = Popen(args, stdout=PIPE,
+        p = Popen(get_rlimits_cmdline(
+                      args, cpu_time_limit, memory_limit, file_size_limit),
+                  stdout=PIPE,
                   stderr=PIPE, close_fds=os.name != 'nt', **kwargs)
     except OSError as e:
         raise os_err_exc_type from e
 
-    output, errors = p.communicate()
+    try:
+        with SUBPROCESSES_IN_FLIGHT.track_inprogress():
+            output, errors = p.communicate(timeout=timeout)
+    except TimeoutExpired:
+        kill_process_group(p)
+        p.communicate()
+        raise SubprocessTimeoutError(args[0], timeout)
+
     return (
         force_str(output, stdout_encoding, strings_only=True,
                    errors='strict'),
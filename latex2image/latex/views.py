@@ -27,6 +27,7 @@ import sys
 from crispy_forms.layout import Submit
 from django import forms
 from django.contrib.auth.decorators import login_required
+from django.db import IntegrityError
 from django.db.transaction import atomic
 from django.shortcuts import render
 from django.utils.translation import gettext as _
@@ -34,7 +35,10 @@ from rest_framework import status
 
 from latex.constants import ALLOWED_COMPILER_FORMAT_COMBINATION
 from latex.converter import LatexCompileError, tex_to_img_converter
+from latex.executor import ConversionQueueFull
 from latex.models import LatexImage
+from latex.singleflight import single_flight
+from latex.timing import STAGE_PERSIST, timed_stage
 from latex.utils import StyledFormMixin, get_codemirror_widget
 
 
@@ -82,11 +86,54 @@ class LatexToImageForm(StyledFormMixin, forms.Form):
             )
 
 
+def save_instance(instance):
+    try:
+        with timed_stage(STAGE_PERSIST), atomic():
+            instance.save()
+    except IntegrityError:
+        # Saved by a request which timed out waiting for the lock
+        instance = LatexImage.objects.get(tex_key=instance.tex_key)
+    return instance
+
+
+def convert_and_save_instance(_converter, user):
+    """
+    :return: a tuple of the saved LatexImage instance (None if failed)
+    and the error string of unknown errors.
+    """
+    try:
+        converted_image = _converter.get_converted_image()
+        instance = save_instance(LatexImage(
+            tex_key=_converter.tex_key,
+            converted_image=converted_image,
+            creator=user,
+        ))
+    except ConversionQueueFull:
+        raise
+    except Exception as e:
+        from traceback import print_exc
+        print_exc()
+
+        tp, err, __ = sys.exc_info()
+        error_str = "%s: %s" % (tp.__name__, str(err))
+        if isinstance(e, LatexCompileError):
+            instance = save_instance(LatexImage(
+                tex_key=_converter.tex_key,
+                compile_error=error_str,
+                creator=user,
+            ))
+        else:
+            return None, error_str
+
+    return instance, None
+
+
 @login_required(login_url='/login/')
 def request_get_data_url_from_latex_form_request(request):
     instance = None
     ctx = {}
     unknown_error = None
+    queue_full = None
     if request.method == "POST":
         form = LatexToImageForm(request.POST, request.FILES)
         if form.is_valid():
@@ -110,36 +157,25 @@ def request_get_data_url_from_latex_form_request(request):
                 compiler, tex_source, image_format=image_format,
                 tex_key=tex_key)
 
-            instance = None
-
-            try:
-                instance = LatexImage.objects.get(tex_key=_converter.tex_key)
-            except LatexImage.DoesNotExist:
-                try:
-                    data_url = _converter.get_converted_data_url()
-                    instance = LatexImage(
-                        tex_key=_converter.tex_key,
-                        data_url=data_url,
-                        creator=request.user,
-                    )
-                    with atomic():
-                        instance.save()
-                except Exception as e:
-                    from traceback import print_exc
-                    print_exc()
-
-                    tp, err, __ = sys.exc_info()
-                    error_str = "%s: %s" % (tp.__name__, str(err))
-                    if isinstance(e, LatexCompileError):
-                        instance = LatexImage(
-                            tex_key=_converter.tex_key,
-                            compile_error=error_str,
-                            creator=request.user,
-                        )
-                        with atomic():
-                            instance.save()
-                    else:
-                        unknown_error = ctx["unknown_error"] = error_str
+            instance = LatexImage.objects.filter(
+                tex_key=_converter.tex_key).first()
+
+            if instance is None:
+                with single_flight(_converter.tex_key):
+                    # Another request of the same tex_key might have saved
+                    # the instance while we waited.
+                    instance = LatexImage.objects.filter(
+                        tex_key=_converter.tex_key).first()
+                    if instance is None:
+                        try:
+                            instance, unknown_error = (
+                                convert_and_save_instance(
+                                    _converter, request.user))
+                        except ConversionQueueFull as e:
+                            queue_full = e
+                            unknown_error = "%s: %s" % (type(e).__name__, str(e))
+                        if unknown_error:
+                            ctx["unknown_error"] = unknown_error
 
             if instance is not None:
                 if instance.image:
@@ -169,4 +205,10 @@ def request_get_data_url_from_latex_form_request(request):
     if unknown_error:
         render_kwargs["status"] = status.HTTP_500_INTERNAL_SERVER_ERROR
 
+    if queue_full is not None:
+        render_kwargs["status"] = status.HTTP_503_SERVICE_UNAVAILABLE
+        response = render(**render_kwargs)
+        response["Retry-After"] = str(queue_full.retry_after)
+        return response
+
     return render(**render_kwargs)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import time
+from typing import Any, Callable, Iterable, List, Optional, Text  # noqa
+
+from django.db.models import F
+
+from latex.cache import FieldCacheBase  # noqa
+from latex.models import LatexImage
+from latex.serializers import LatexImageSerializer, get_only_fields
+
+ORDER_RECENT = "recent"
+ORDER_ACCESSED = "accessed"
+WARM_ORDERS = [ORDER_RECENT, ORDER_ACCESSED]
+
+# The orderings of the instances warmed first, by order
+WARM_ORDERINGS = {
+    ORDER_RECENT: ["-creation_time", "-id"],
+    ORDER_ACCESSED: [
+        "-hit_count", F("last_accessed").desc(nulls_last=True), "-id"],
+}
+
+
+def get_warm_queryset(fields, order=ORDER_RECENT):
+    # type: (List[Text], Text) -> Any
+    """
+    :return: the instances to warm, in `order`, only loading the model
+    fields needed to serialize `fields`.
+    """
+    return LatexImage.objects.order_by(*WARM_ORDERINGS[order]).only(
+        "tex_key", *get_only_fields(fields))
+
+
+class WarmUpStats(object):
+    """
+    The progress of :func:`warm_field_cache`.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        # type: (Callable[[], float]) -> None
+        self.clock = clock
+        self.started_at = clock()
+
+        # The number of instances read, and of those with cached fields
+        self.n_read = 0
+        self.n_cached = 0
+
+        # The size of the cached fields
+        self.n_bytes = 0
+
+    @property
+    def elapsed(self):
+        # type: () -> float
+        return self.clock() - self.started_at
+
+    @property
+    def throughput(self):
+        # type: () -> float
+        """
+        :return: the instances read per second.
+        """
+        elapsed = self.elapsed
+        return self.n_read / elapsed if elapsed > 0 else 0.
+
+
+def warm_field_cache(field_cache, instances, fields, batch_size=500,
+                     max_bytes=None, rate=None, progress=None,
+                     sleep=time.sleep, clock=time.monotonic):
+    # type: (FieldCacheBase, Iterable[LatexImage], List[Text], int, Optional[int], Optional[float], Optional[Callable[[WarmUpStats], None]], Callable[[float], None], Callable[[], float]) -> WarmUpStats  # noqa
+    """
+    Cache `fields` (and "compile_error", like the api does) of
+    `instances`, in their order, with one write of the field cache per
+    `batch_size` instances. Fields already cached are kept.
+    :param max_bytes: stop once about that many bytes are cached.
+    :param rate: the max number of instances read per second.
+    :param progress: called with the :class:`WarmUpStats` after each batch.
+    """
+    fields = list(dict.fromkeys(list(fields) + ["compile_error"]))
+    serializer = LatexImageSerializer(fields=fields)
+    stats = WarmUpStats(clock)
+
+    if rate:
+        # No burst larger than a second of instances
+        batch_size = max(1, min(batch_size, int(rate)))
+
+    batch = {}
+    n_batch_read = 0
+
+    def write_batch():
+        sizes = field_cache.set_many(batch, overwrite=False) if batch else {}
+        stats.n_read += n_batch_read
+        stats.n_cached += len(sizes)
+        stats.n_bytes += sum(
+            sum(field_sizes.values()) for field_sizes in sizes.values())
+        if progress is not None:
+            progress(stats)
+
+        if rate:
+            delay = stats.n_read / rate - stats.elapsed
+            if delay > 0:
+                sleep(delay)
+
+    for instance in instances:
+        data = serializer.to_representation(instance)
+        values = {
+            field: data[field] for field in fields
+            if data.get(field) is not None}
+        if values:
+            batch[instance.tex_key] = values
+        n_batch_read += 1
+
+        if n_batch_read >= batch_size:
+            write_batch()
+            batch = {}
+            n_batch_read = 0
+            if max_bytes is not None and stats.n_bytes >= max_bytes:
+                return stats
+
+    if n_batch_read:
+        write_batch()
+    return stats
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import atexit
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from tempfile import mkdtemp
+from typing import Iterator, List, Optional, Set, Text  # noqa
+
+
+class WorkingDirQuotaExceeded(RuntimeError):
+    pass
+
+
+def get_dir_size(path):
+    # type: (Text) -> int
+    """
+    :return: the total size in bytes of the files in `path`, symlinks
+    are not followed.
+    """
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def scrub_dir(path):
+    # type: (Text) -> None
+    """
+    Remove everything in `path`, but not `path` itself.
+    """
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.remove(entry.path)
+
+
+class WorkingDirPool(object):
+    """
+    Working directories of compiles and conversions, created in `root`
+    (default to the system temp dir), which should be on a RAM-backed
+    filesystem like `/dev/shm`. At most `size` released directories are
+    scrubbed and kept for reuse, instead of being created and removed
+    for each conversion. A directory whose content exceeds `quota_bytes`
+    is rejected by :meth:`check_quota`.
+    """
+
+    def __init__(self, root=None, size=4, quota_bytes=None):
+        # type: (Optional[Text], int, Optional[int]) -> None
+        self.root = root
+        self.size = size
+        self.quota_bytes = quota_bytes
+        self._idle = []  # type: List[Text]
+        self._in_use = set()  # type: Set[Text]
+        self._lock = threading.Lock()
+
+    def acquire(self, prefix="LATEX_"):
+        # type: (Text) -> Text
+        """
+        :return: the path of an empty working directory, which should be
+        returned by :meth:`release`.
+        """
+        path = None
+        with self._lock:
+            while self._idle:
+                candidate = self._idle.pop()
+                if os.path.isdir(candidate):
+                    path = candidate
+                    break
+
+        if path is None:
+            path = mkdtemp(prefix=prefix, dir=self.root)
+
+        with self._lock:
+            self._in_use.add(path)
+        return path
+
+    def release(self, path):
+        # type: (Text) -> None
+        """
+        Scrub `path` and keep it for reuse if the pool is not full, or
+        remove it. Releasing a directory more than once is harmless, and
+        a directory not acquired from the pool is simply removed.
+        """
+        with self._lock:
+            if path in self._idle:
+                return
+            acquired = path in self._in_use
+            self._in_use.discard(path)
+
+        if acquired:
+            try:
+                scrub_dir(path)
+            except OSError:
+                pass
+            else:
+                with self._lock:
+                    if len(self._idle) < self.size:
+                        self._idle.append(path)
+                        return
+
+        shutil.rmtree(path, ignore_errors=True)
+
+    @contextmanager
+    def working_dir(self, prefix="LATEX_"):
+        # type: (Text) -> Iterator[Text]
+        path = self.acquire(prefix)
+        try:
+            yield path
+        finally:
+            self.release(path)
+
+    def check_quota(self, path):
+        # type: (Text) -> None
+        """
+        :raises: :class:`WorkingDirQuotaExceeded` if the size of `path`
+        exceeds the quota.
+        """
+        if not self.quota_bytes:
+            return
+
+        size = get_dir_size(path)
+        if size > self.quota_bytes:
+            raise WorkingDirQuotaExceeded(
+                "The working directory size (%d bytes) exceeds the "
+                "quota (%d bytes)." % (size, self.quota_bytes))
+
+    def close(self):
+        # type: () -> None
+        with self._lock:
+            idle = self._idle
+            self._idle = []
+        for path in idle:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+_working_dir_pool = None  # type: Optional[WorkingDirPool]
+_working_dir_pool_lock = threading.Lock()
+
+
+def get_working_dir_root():
+    # type: () -> Optional[Text]
+    from django.conf import settings
+    return getattr(settings, "L2I_WORKING_DIR_ROOT", None) or None
+
+
+def get_working_dir_pool():
+    # type: () -> WorkingDirPool
+    """
+    :return: the working directory pool of this process, re-created
+    if the settings changed.
+    """
+    global _working_dir_pool
+
+    from django.conf import settings
+    root = get_working_dir_root()
+    size = int(getattr(settings, "L2I_WORKING_DIR_POOL_SIZE", 4))
+    quota_bytes = getattr(settings, "L2I_WORKING_DIR_QUOTA_BYTES", None)
+    if quota_bytes:
+        quota_bytes = int(quota_bytes)
+
+    with _working_dir_pool_lock:
+        pool = _working_dir_pool
+        if (pool is None
+                or (pool.root, pool.size, pool.quota_bytes)
+                != (root, size, quota_bytes)):
+            if pool is not None:
+                pool.close()
+            pool = _working_dir_pool = WorkingDirPool(
+                root, size, quota_bytes)
+        return pool
+
+
+@atexit.register
+def _close_working_dir_pool():
+    # type: () -> None
+    if _working_dir_pool is not None:
+        _working_dir_pool.close()
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import division
+
+__copyright__ = "Copyright (C) 2020 Dong Zhuang"
+
+__license__ = """
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+"""
+
+
+import atexit
+import os
+import shutil
+import threading
+import time
+from subprocess import PIPE, Popen, TimeoutExpired
+from typing import TYPE_CHECKING, Dict, List, Optional, Text, Tuple  # noqa
+
+from django.utils.encoding import DEFAULT_LOCALE_ENCODING, force_str
+
+from latex.metrics import SUBPROCESSES_IN_FLIGHT
+from latex.utils import (SubprocessTimeoutError, get_rlimits_cmdline,
+                         get_subprocess_session_kwargs, kill_process_group)
+from latex.workdir import get_working_dir_root
+
+if TYPE_CHECKING:
+    from latex.converter import LatexCompiler  # noqa
+
+
+# The jobname of all warm engines, i.e., the base name of
+# the tex file, log file and compiled file.
+WARM_ENGINE_JOBNAME = "l2i_job"
+
+# The first line fed to the engine. The format is loaded before the
+# line is executed, then the engine waits on \read for the name of
+# the file to compile.
+WARM_ENGINE_FIRST_LINE = (
+    b"\\endlinechar=-1 \\global\\read16 to \\l2ijobfile "
+    b"\\endlinechar=13 \\nonstopmode\\input{\\l2ijobfile}\n")
+
+
+class WarmEngine(object):
+    """
+    A TeX engine process which has been started with a format dumped
+    from the standard preamble, and is waiting for the file to compile.
+    Since an engine writes only one output file per run, each
+    warm engine compiles exactly one job.
+    """
+
+    def __init__(self, compiler, fmt_path):
+        # type: (LatexCompiler, Text) -> None
+        from tempfile import mkdtemp
+
+        self.compiler = compiler
+        self.fmt_path = fmt_path
+        self.working_dir = mkdtemp(
+            prefix="LATEX_WARM_", dir=get_working_dir_root())
+        self.spawned_at = time.monotonic()
+
+        limits = compiler.get_subprocess_limits()
+        self.process = Popen(
+            get_rlimits_cmdline(
+                self.get_cmdline(), limits["cpu_time_limit"],
+                limits["memory_limit"], limits["file_size_limit"]),
+            stdin=PIPE, stdout=PIPE, stderr=PIPE,
+            cwd=self.working_dir, close_fds=os.name != 'nt',
+            **get_subprocess_session_kwargs())
+        self.process.stdin.write(WARM_ENGINE_FIRST_LINE)
+        self.process.stdin.flush()
+
+    def get_cmdline(self):
+        # type: () -> List[Text]
+        return [
+            self.compiler.bin_path,
+            "-fmt=%s" % self.fmt_path,
+            "-jobname=%s" % WARM_ENGINE_JOBNAME,
+            "-no-shell-escape",
+            "-halt-on-error",
+        ]
+
+    @property
+    def tex_filename(self):
+        # type: () -> Text
+        return WARM_ENGINE_JOBNAME + ".tex"
+
+    def is_alive(self):
+        # type: () -> bool
+        return self.process.poll() is None
+
+    def run(self, timeout=None):
+        # type: (Optional[float]) -> Tuple[Text, Text, int]
+        """
+        Compile `tex_filename` in `working_dir`, which should have
+        been written before calling this.
+        :return: stdout output, stderr output and OS status code,
+        like :func:`latex.utils.popen_wrapper`.
+        """
+        try:
+            with SUBPROCESSES_IN_FLIGHT.track_inprogress():
+                output, errors = self.process.communicate(
+                    input=self.tex_filename.encode() + b"\n",
+                    timeout=timeout)
+        except TimeoutExpired:
+            kill_process_group(self.process)
+            self.process.communicate()
+            raise SubprocessTimeoutError(self.compiler.bin_path, timeout)
+        return (
+            force_str(output, "utf-8", strings_only=True, errors='replace'),
+            force_str(errors, DEFAULT_LOCALE_ENCODING,
+                      strings_only=True, errors='replace'),
+            self.process.returncode
+        )
+
+    def discard(self):
+        # type: () -> None
+        if self.is_alive():
+            kill_process_group(self.process)
+            self.process.communicate()
+        shutil.rmtree(self.working_dir, ignore_errors=True)
+
+
+class WarmEnginePool(object):
+    """
+    Keep `size` idle warm engines for each compiler, all loaded with
+    the format of the standard `preamble`. Idle engines older than
+    `max_idle_seconds` are recycled.
+    """
+
+    def __init__(self, preamble, size=1, max_idle_seconds=600):
+        # type: (Text, int, float) -> None
+        self.preamble = preamble
+        self.size = size
+        self.max_idle_seconds = max_idle_seconds
+        self._idle = {}  # type: Dict[Text, List[WarmEngine]]
+        self._lock = threading.Lock()
+
+    def accepts(self, tex_source):
+        # type: (Text) -> bool
+        from latex.converter import split_preamble
+        preamble, __ = split_preamble(tex_source)
+        return (preamble is not None
+                and preamble.strip() == self.preamble.strip())
+
+    def get_fmt_path(self, compiler):
+        # type: (LatexCompiler) -> Optional[Text]
+        from latex.converter import get_format_cache
+        format_cache = get_format_cache()
+        if format_cache is None or not compiler.format_dump_supported:
+            return None
+        return format_cache.get_format_path(compiler, self.preamble)
+
+    def acquire(self, compiler):
+        # type: (LatexCompiler) -> Optional[WarmEngine]
+        """
+        :return: an idle warm engine of `compiler`, None if there is
+        none available. The pool is refilled in either case.
+        """
+        fmt_path = self.get_fmt_path(compiler)
+        if fmt_path is None:
+            return None
+
+        engine = None
+        to_discard = []
+        with self._lock:
+            idle = self._idle.setdefault(compiler.cmd, [])
+            while idle:
+                candidate = idle.pop(0)
+                if (candidate.is_alive()
+                        and candidate.fmt_path == fmt_path
+                        and not self._is_expired(candidate)):
+                    engine = candidate
+                    break
+                to_discard.append(candidate)
+
+            for __ in range(self.size - len(idle)):
+                try:
+                    idle.append(WarmEngine(compiler, fmt_path))
+                except OSError:
+                    break
+
+        for candidate in to_discard:
+            candidate.discard()
+
+        return engine
+
+    def _is_expired(self, engine):
+        # type: (WarmEngine) -> bool
+        return time.monotonic() - engine.spawned_at > self.max_idle_seconds
+
+    def close(self):
+        # type: () -> None
+        with self._lock:
+            engines = [e for idle in self._idle.values() for e in idle]
+            self._idle = {}
+        for engine in engines:
+            engine.discard()
+
+
+_warm_engine_pool = None  # type: Optional[WarmEnginePool]
+
+
+def get_warm_engine_pool():
+    # type: () -> Optional[WarmEnginePool]
+    """
+    :return: the warm engine pool of this process, None if
+    `L2I_WARM_POOL_PREAMBLE` is not configured.
+    """
+    global _warm_engine_pool
+
+    from django.conf import settings
+    preamble = getattr(settings, "L2I_WARM_POOL_PREAMBLE", None)
+    if not preamble:
+        return None
+
+    size = int(getattr(settings, "L2I_WARM_POOL_SIZE", 1))
+    max_idle_seconds = float(
+        getattr(settings, "L2I_WARM_POOL_MAX_IDLE_SECONDS", 600))
+
+    pool = _warm_engine_pool
+    if (pool is None
+            or (pool.preamble, pool.size, pool.max_idle_seconds)
+            != (preamble, size, max_idle_seconds)):
+        if pool is not None:
+            pool.close()
+        pool = _warm_engine_pool = WarmEnginePool(
+            preamble, size, max_idle_seconds)
+
+    return pool
+
+
+@atexit.register
+def _close_warm_engine_pool():
+    # type: () -> None
+    if _warm_engine_pool is not None:
+        _warm_engine_pool.close()
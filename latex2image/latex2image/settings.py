@@ -108,6 +108,7 @@ INSTALLED_APPS = [
 
 
 MIDDLEWARE = [
+    'latex.timing.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -193,6 +194,32 @@ DATABASES = {
 
 # L2I_IMAGEMAGICK_PNG_RESOLUTION = 96
 
+# L2I_FORMAT_CACHE_DIR: Default to None (disabled). A directory where TeX
+# formats dumped from the preambles of the tex sources are cached, so that
+# sources sharing the same preamble don't need to load the packages again
+# when compiled. L2I_FORMAT_CACHE_MAX_BYTES is the max total size of the
+# cached formats, least recently used formats will be removed when exceeded.
+
+L2I_FORMAT_CACHE_DIR = os.getenv("L2I_FORMAT_CACHE_DIR", None)
+L2I_FORMAT_CACHE_MAX_BYTES = int(
+    os.getenv("L2I_FORMAT_CACHE_MAX_BYTES", 268435456))
+
+# L2I_WARM_POOL_PREAMBLE: Default to None (disabled). The standard preamble
+# for which each worker process keeps L2I_WARM_POOL_SIZE (default 1) TeX
+# engines per compiler started and loaded with the format of the preamble.
+# Sources with exactly that preamble are then compiled by the warm engines
+# instead of latexmk. Requires L2I_FORMAT_CACHE_DIR. Idle engines are
+# recycled after L2I_WARM_POOL_MAX_IDLE_SECONDS (default 600).
+
+# L2I_WARM_POOL_PREAMBLE = r'''
+# \documentclass{standalone}
+# \usepackage{amsmath}
+# '''
+
+L2I_WARM_POOL_SIZE = int(os.getenv("L2I_WARM_POOL_SIZE", 1))
+L2I_WARM_POOL_MAX_IDLE_SECONDS = int(
+    os.getenv("L2I_WARM_POOL_MAX_IDLE_SECONDS", 600))
+
 redis_location = os.getenv('L2I_REDIS_LOCATION', None)
 redis_cache_location = (
     f"{redis_location}/0" if redis_location
@@ -210,8 +237,102 @@ CACHES = {
     }
 }
 
+# L2I_CACHE_MAX_BYTES: Default to 65536. Cached values larger than that
+# (after compression) are skipped.
+# L2I_CACHE_COMPRESSION: Default to "zlib". The algorithm cached strings are
+# compressed with, "zlib", "zstd" (requires the zstandard package) or "none".
+# Entries cached uncompressed, or with another algorithm, are still read.
+# L2I_CACHE_COMPRESSION_LEVEL: Default to None (the default level of the
+# algorithm).
+# L2I_CACHE_COMPRESSION_MIN_BYTES: Default to 1024. Strings not larger than
+# that are not compressed. L2I_CACHE_COMPRESSION_MIN_BYTES_BY_FORMAT (only
+# in local_settings.py) overrides it by format, "svg" and "png" (data urls)
+# or "text", e.g., {"png": None} to never compress png data urls.
+# L2I_CACHE_TIMEOUT: Default to None (never expire). Seconds after which the
+# cached fields of an image expire. L2I_CACHE_COMPILE_ERROR_TIMEOUT is the
+# same for compile errors.
+# L2I_CACHE_MEMORY_BUDGET_BYTES: Default to None (no limit). The approximate
+# max size of the cached fields in redis. When exceeded, the images of the
+# lowest GreedyDual-Size priorities are evicted, i.e., the large ones which
+# are fast to render and were not read for a while. The render cost of
+# images converted before is unknown, and default to
+# L2I_CACHE_DEFAULT_COST_MS.
+
 L2I_CACHE_MAX_BYTES = int(os.getenv("L2I_CACHE_MAX_BYTES", 65536))
 
+L2I_CACHE_COMPRESSION = os.getenv("L2I_CACHE_COMPRESSION", "zlib")
+L2I_CACHE_COMPRESSION_LEVEL = os.getenv("L2I_CACHE_COMPRESSION_LEVEL", None)
+if L2I_CACHE_COMPRESSION_LEVEL is not None:
+    L2I_CACHE_COMPRESSION_LEVEL = int(L2I_CACHE_COMPRESSION_LEVEL)
+L2I_CACHE_COMPRESSION_MIN_BYTES = int(
+    os.getenv("L2I_CACHE_COMPRESSION_MIN_BYTES", 1024))
+
+L2I_CACHE_TIMEOUT = os.getenv("L2I_CACHE_TIMEOUT", None)
+if L2I_CACHE_TIMEOUT is not None:
+    L2I_CACHE_TIMEOUT = int(L2I_CACHE_TIMEOUT)
+L2I_CACHE_COMPILE_ERROR_TIMEOUT = os.getenv(
+    "L2I_CACHE_COMPILE_ERROR_TIMEOUT", None)
+if L2I_CACHE_COMPILE_ERROR_TIMEOUT is not None:
+    L2I_CACHE_COMPILE_ERROR_TIMEOUT = int(L2I_CACHE_COMPILE_ERROR_TIMEOUT)
+
+L2I_CACHE_MEMORY_BUDGET_BYTES = os.getenv("L2I_CACHE_MEMORY_BUDGET_BYTES", None)
+if L2I_CACHE_MEMORY_BUDGET_BYTES is not None:
+    L2I_CACHE_MEMORY_BUDGET_BYTES = int(L2I_CACHE_MEMORY_BUDGET_BYTES)
+L2I_CACHE_DEFAULT_COST_MS = float(os.getenv("L2I_CACHE_DEFAULT_COST_MS", 1000))
+
+# L2I_CACHE_LAYOUT: Default to "hash". How the fields of images are cached,
+# "hash" (one redis hash per tex_key, which requires django-redis) or "keys"
+# (one cache key per field of each tex_key). Use the l2i_migrate_cache
+# command to move the existing cache to another layout.
+
+L2I_CACHE_LAYOUT = os.getenv("L2I_CACHE_LAYOUT", "hash")
+
+# L2I_CACHE_GENERATION_CHECK_INTERVAL: Default to 1. The cache keys of the
+# fields of images are namespaced by a generation stored in the default
+# cache, and the l2i_bump_cache_generation command invalidates all of them
+# at once by bumping it. Workers read the generation at most every that
+# many seconds (they are also notified via redis pub/sub).
+
+L2I_CACHE_GENERATION_CHECK_INTERVAL = float(
+    os.getenv("L2I_CACHE_GENERATION_CHECK_INTERVAL", 1))
+
+# L2I_LOCAL_CACHE_MAX_BYTES: Default to 16777216 (16MB). The approximate max
+# size of the in-process cache of each worker in front of the default cache.
+# Entries of updated or deleted instances are dropped in all workers via
+# redis pub/sub. Set to 0 to disable it.
+
+L2I_LOCAL_CACHE_MAX_BYTES = int(
+    os.getenv("L2I_LOCAL_CACHE_MAX_BYTES", 16777216))
+
+# L2I_ACCESS_TRACKING: Default to True. Whether to count the accesses of
+# images (cache and database hits of the api), in the hit_count and
+# last_accessed fields. The counts are buffered in each worker and flushed
+# every L2I_ACCESS_FLUSH_INTERVAL seconds (default to 60), or once
+# L2I_ACCESS_BUFFER_MAX_KEYS (default to 10000) images are buffered, by a
+# background thread. With redis, they are pushed to redis, and written to
+# the database by one worker at a time.
+
+L2I_ACCESS_TRACKING = os.getenv("L2I_ACCESS_TRACKING", "true") == "true"
+L2I_ACCESS_FLUSH_INTERVAL = float(os.getenv("L2I_ACCESS_FLUSH_INTERVAL", 60))
+L2I_ACCESS_BUFFER_MAX_KEYS = int(
+    os.getenv("L2I_ACCESS_BUFFER_MAX_KEYS", 10000))
+
+# L2I_API_LIST_PAGE_SIZE: Default to None (not paginated). The page size of
+# the cursor pagination of api/list, ordered by (creation_time, id). Clients
+# can also request pages with the page_size querystring (at most 1000).
+# L2I_API_STREAM_CHUNK_SIZE: Default to 500. The number of rows fetched at a
+# time when api/list is streamed as NDJSON.
+
+L2I_API_LIST_PAGE_SIZE = os.getenv("L2I_API_LIST_PAGE_SIZE", None)
+if L2I_API_LIST_PAGE_SIZE is not None:
+    L2I_API_LIST_PAGE_SIZE = int(L2I_API_LIST_PAGE_SIZE)
+L2I_API_STREAM_CHUNK_SIZE = int(os.getenv("L2I_API_STREAM_CHUNK_SIZE", 500))
+
+# L2I_BULK_MAX_ITEMS: Default to 100. The max number of items in a request
+# to api/create/bulk, and of tex_keys in a request to api/lookup.
+
+L2I_BULK_MAX_ITEMS = int(os.getenv("L2I_BULK_MAX_ITEMS", 100))
+
 # L2I_API_IMAGE_RETURNS_RELATIVE_PATH: Default to True. If False, api query
 # only image will return the url of the file according to the MEDIA_URL and
 # MEDIA_ROOT you configured. If True, the relative path of the file in the
@@ -240,6 +361,116 @@ L2I_CACHE_DATA_URL_ON_SAVE = os.getenv('L2I_REDIS_LOCATION', None) == "true"
 
 L2I_KEY_VERSION = os.getenv("L2I_KEY_VERSION", 1)
 
+# L2I_JOB_QUEUE: The queue of the conversions requested via the async create
+# API, "inprocess" (default) runs them in a pool of L2I_JOB_QUEUE_WORKERS
+# threads in each web worker process. "redis" pushes them to the redis of
+# the default cache, and they are run by `python manage.py l2i_worker`.
+# The status of a queued conversion expires after L2I_JOB_STATUS_TIMEOUT
+# seconds. With "inprocess", at most L2I_JOB_QUEUE_MAX_SIZE conversions are
+# queued or running in each web worker, others are rejected with 503.
+# A pending conversion not updated for L2I_JOB_PENDING_TIMEOUT seconds
+# (default to the sum of L2I_CONVERSION_QUEUE_TIMEOUT and the compile,
+# convert and crop deadlines) is considered lost, e.g., because its worker
+# was restarted, and can be queued again.
+
+L2I_JOB_QUEUE = os.getenv("L2I_JOB_QUEUE", "inprocess")
+L2I_JOB_QUEUE_WORKERS = int(os.getenv("L2I_JOB_QUEUE_WORKERS", 2))
+L2I_JOB_QUEUE_MAX_SIZE = int(os.getenv("L2I_JOB_QUEUE_MAX_SIZE", 100))
+L2I_JOB_STATUS_TIMEOUT = int(os.getenv("L2I_JOB_STATUS_TIMEOUT", 86400))
+L2I_JOB_PENDING_TIMEOUT = os.getenv("L2I_JOB_PENDING_TIMEOUT", None)
+if L2I_JOB_PENDING_TIMEOUT is not None:
+    L2I_JOB_PENDING_TIMEOUT = float(L2I_JOB_PENDING_TIMEOUT)
+
+# L2I_SINGLE_FLIGHT_WAIT_TIMEOUT: Concurrent requests converting the same
+# tex_key wait for the first one (across processes, via a lock in the
+# default cache) and reuse its result. After waiting for this many seconds,
+# a request converts on its own. The lock expires after
+# L2I_SINGLE_FLIGHT_LOCK_TIMEOUT seconds, in case its holder was killed.
+# If the cache is down, requests only wait for those of the same process.
+
+L2I_SINGLE_FLIGHT_WAIT_TIMEOUT = float(
+    os.getenv("L2I_SINGLE_FLIGHT_WAIT_TIMEOUT", 60))
+L2I_SINGLE_FLIGHT_LOCK_TIMEOUT = int(
+    os.getenv("L2I_SINGLE_FLIGHT_LOCK_TIMEOUT", 120))
+
+# L2I_CONVERSION_MAX_CONCURRENCY: The max number of conversions running at
+# the same time on the host (default to the number of CPUs). At most
+# L2I_CONVERSION_MAX_QUEUE conversions wait for them, for at most
+# L2I_CONVERSION_QUEUE_TIMEOUT seconds. Other conversions are rejected with
+# 503, and a "Retry-After: L2I_CONVERSION_RETRY_AFTER" header.
+# The slots are lock files in L2I_CONVERSION_LOCK_DIR (default to a folder
+# in the temp dir), which must be shared by all processes on the host.
+
+L2I_CONVERSION_MAX_CONCURRENCY = int(
+    os.getenv("L2I_CONVERSION_MAX_CONCURRENCY", os.cpu_count() or 1))
+L2I_CONVERSION_MAX_QUEUE = int(os.getenv("L2I_CONVERSION_MAX_QUEUE", 16))
+L2I_CONVERSION_QUEUE_TIMEOUT = float(
+    os.getenv("L2I_CONVERSION_QUEUE_TIMEOUT", 30))
+L2I_CONVERSION_RETRY_AFTER = int(os.getenv("L2I_CONVERSION_RETRY_AFTER", 5))
+L2I_CONVERSION_LOCK_DIR = os.getenv("L2I_CONVERSION_LOCK_DIR", None)
+
+# L2I_COMPILE_TIMEOUT, L2I_CONVERT_TIMEOUT and L2I_CROP_TIMEOUT: the deadlines
+# (in seconds) of the compile, convert and crop (pdfcrop) subprocesses, after
+# which the whole process group is killed, and the conversion fails with a
+# LatexTimeoutError, which is saved like compile errors.
+# L2I_SUBPROCESS_CPU_TIME_LIMIT (seconds) and L2I_SUBPROCESS_MEMORY_LIMIT
+# (bytes of address space) are the rlimits of those subprocesses, disabled
+# by default. The memory limit also applies to ImageMagick conversions (set
+# once at startup), which run in-process, without any deadline.
+# All of them can be overridden per command by L2I_SUBPROCESS_LIMITS, e.g.:
+# L2I_SUBPROCESS_LIMITS = {
+#     "lualatex": {"timeout": 120, "memory_limit": 4 * 1024 ** 3},
+# }
+
+L2I_COMPILE_TIMEOUT = float(os.getenv("L2I_COMPILE_TIMEOUT", 60))
+L2I_CONVERT_TIMEOUT = float(os.getenv("L2I_CONVERT_TIMEOUT", 30))
+L2I_CROP_TIMEOUT = float(os.getenv("L2I_CROP_TIMEOUT", 30))
+L2I_SUBPROCESS_CPU_TIME_LIMIT = os.getenv("L2I_SUBPROCESS_CPU_TIME_LIMIT", None)
+L2I_SUBPROCESS_MEMORY_LIMIT = os.getenv("L2I_SUBPROCESS_MEMORY_LIMIT", None)
+
+# L2I_SERVER_TIMING_HEADER: Whether to return the durations of the stages
+# (compile, convert, encode, persist and cache_lookup) of a request in the
+# Server-Timing header. They are also logged by the "latex.timing" logger.
+
+L2I_SERVER_TIMING_HEADER = (
+    os.getenv("L2I_SERVER_TIMING_HEADER", "true") == "true")
+
+# L2I_METRICS_ENABLED: Whether to export Prometheus metrics at /metrics.
+# The metrics of all gunicorn workers are aggregated via the files in
+# $PROMETHEUS_MULTIPROC_DIR, which is set by start-server.sh.
+
+L2I_METRICS_ENABLED = os.getenv("L2I_METRICS_ENABLED", "true") == "true"
+
+# L2I_WORKING_DIR_ROOT: Default to None (the system temp dir). Where the
+# working directories of compiles are created, preferably on a RAM-backed
+# filesystem like /dev/shm. Each worker process keeps at most
+# L2I_WORKING_DIR_POOL_SIZE (default 4) scrubbed working directories for
+# reuse. A conversion fails if its working directory grows beyond
+# L2I_WORKING_DIR_QUOTA_BYTES (not set by default). Each file written by
+# the subprocesses is also limited to that size while they run.
+
+L2I_WORKING_DIR_ROOT = os.getenv("L2I_WORKING_DIR_ROOT", None)
+L2I_WORKING_DIR_POOL_SIZE = int(os.getenv("L2I_WORKING_DIR_POOL_SIZE", 4))
+L2I_WORKING_DIR_QUOTA_BYTES = os.getenv("L2I_WORKING_DIR_QUOTA_BYTES", None)
+
+# L2I_IMAGE_CACHE_MAX_AGE: Default to 31536000 (one year). The max-age of
+# the Cache-Control header of images sent by api/image/<tex_key>.<ext>.
+# L2I_IMAGE_X_ACCEL_REDIRECT_LOCATION: Default to None. If set, those images
+# are sent by nginx from that internal location (which must map to the
+# "l2i_images" folder of MEDIA_ROOT) via X-Accel-Redirect, instead of by
+# Django. The bundled nginx.default has "/l2i_internal_images/" configured.
+
+# L2I_IMAGE_REQUIRE_AUTH: Default to False. If True, api/image/<tex_key>.<ext>
+# only sends images to authenticated users who may access them in the detail
+# view (their own images, or all images for superusers), and the files are no
+# longer served under MEDIA_URL. Set L2I_IMAGE_X_ACCEL_REDIRECT_LOCATION too,
+# so that nginx, instead of the gunicorn workers, sends the files.
+
+L2I_IMAGE_CACHE_MAX_AGE = int(os.getenv("L2I_IMAGE_CACHE_MAX_AGE", 31536000))
+L2I_IMAGE_REQUIRE_AUTH = os.getenv("L2I_IMAGE_REQUIRE_AUTH", None) == "true"
+L2I_IMAGE_X_ACCEL_REDIRECT_LOCATION = os.getenv(
+    "L2I_IMAGE_X_ACCEL_REDIRECT_LOCATION", None)
+
 
 # L2I_USE_EXIST_STORAGE_IMAGE_IF_EXIST: Default to False. If an / all instance(s)
 # were deleted while the image(s) were not delete from the default storage,
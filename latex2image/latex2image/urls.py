@@ -31,7 +31,7 @@ from django.contrib.auth import views as auth_views
 from django.urls import path, re_path
 from django.utils.translation import gettext_lazy as _
 
-from latex import api, auth, views
+from latex import api, auth, metrics, views
 
 admin.site.site_header = _("LaTeX2Image Admin")
 admin.site.site_title = _("LaTeX2Image Admin")
@@ -48,11 +48,24 @@ urlpatterns = [
 
     path('api-auth/', include('rest_framework.urls')),
     re_path(r"^api/create/$", api.LatexImageCreate.as_view(), name="create"),
+    re_path(r"^api/create/async/$", api.LatexImageCreateAsync.as_view(),
+            name="create_async"),
+    re_path(r"^api/create/bulk/$", api.LatexImageBulkCreate.as_view(),
+            name="create_bulk"),
+    re_path(r"^api/lookup/$", api.LatexImageBulkLookup.as_view(),
+            name="lookup"),
     re_path(r"^api/list/$", api.LatexImageList.as_view(), name="list"),
     re_path(r"^api/detail/(?P<tex_key>[a-zA-Z0-9_]+)$",
             api.LatexImageDetail.as_view(),
             name="detail"),
+    re_path(r"^api/image/(?P<tex_key>[a-zA-Z0-9_]+)\.(?P<ext>png|svg)$",
+            api.LatexImageRaw.as_view(),
+            name="image"),
+    re_path(r"^metrics$", metrics.metrics_view, name="metrics"),
 ]
 
-# For generated image files
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# For generated image files, which should only be sent by
+# api/image/<tex_key>.<ext> if they require authorization.
+if not getattr(settings, "L2I_IMAGE_REQUIRE_AUTH", False):
+    urlpatterns += static(
+        settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
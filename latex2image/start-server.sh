@@ -10,5 +10,15 @@ python manage.py migrate --noinput
 
 python manage.py createsuperuser --no-input
 
-(gunicorn latex2image.wsgi --user l2i_user --bind 0.0.0.0:8010 --workers 3) &
+# Prometheus metrics of all processes are aggregated through this dir,
+# which must be emptied before the processes start.
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/l2i_prometheus}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+if [ "$L2I_JOB_QUEUE" = "redis" ]; then
+    (python manage.py l2i_worker) &
+fi
+
+(gunicorn latex2image.wsgi --config gunicorn.conf.py --user l2i_user --bind 0.0.0.0:8010 --workers 3) &
 sudo nginx
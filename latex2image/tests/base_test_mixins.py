@@ -404,6 +404,11 @@ def get_fake_data_url(b64_string, mime_type="image/png"):
     return "data:%s;base64,%s" % (mime_type, b64_string)
 
 
+def get_fake_converted_image(buf=b"foob", mime_type="image/png"):
+    from latex.converter import ConvertedImage
+    return ConvertedImage(buf, mime_type)
+
+
 def improperly_configured_cache_patch():
     # can be used as context manager or decorator
     built_in_import_path = "builtins.__import__"
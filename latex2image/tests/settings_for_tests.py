@@ -20,3 +20,10 @@ CACHES = {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
     }
 }
+
+# Tests of the cache manipulate the default cache directly, the in-process
+# field cache is enabled in the tests of it only.
+L2I_LOCAL_CACHE_MAX_BYTES = 0
+
+# No background flushing thread, the tests of access tracking enable it.
+L2I_ACCESS_TRACKING = False
@@ -0,0 +1,307 @@
+from datetime import datetime, timezone
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, override_settings
+from redis.exceptions import ConnectionError
+from tests import factories
+from tests.base_test_mixins import L2ITestMixinBase
+from tests.test_cache import FakeRedisCache
+
+from latex.access import (ACCESS_COUNTS_KEY, ACCESS_LAST_KEY, AccessBuffer,
+                          flush_access_counts, get_access_tracker,
+                          get_hot_images, pop_access_counts,
+                          push_access_counts, record_access,
+                          update_access_counts)
+from latex.cache import get_field_cache
+from latex.models import LatexImage
+
+
+def utc(timestamp):
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc)
+
+
+class AccessBufferTest(SimpleTestCase):
+    # test latex.access.AccessBuffer
+    def test_add_drain(self):
+        buffer = AccessBuffer()
+        buffer.add(["foo", "bar"], 10.)
+        buffer.add(["foo"], 20.)
+        buffer.add(["foo"], 15.)
+        self.assertEqual(len(buffer), 2)
+
+        self.assertEqual(
+            buffer.drain(), {"foo": (3, 20.), "bar": (1, 10.)})
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(buffer.drain(), {})
+
+
+@override_settings(L2I_ACCESS_TRACKING=True)
+class AccessTrackerTest(SimpleTestCase):
+    # test latex.access.get_access_tracker and record_access
+    def setUp(self):
+        patch = mock.patch("latex.access._access_tracker", None)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        patch = mock.patch("latex.access.AccessTracker.start")
+        self.mock_start = patch.start()
+        self.addCleanup(patch.stop)
+
+    @override_settings(L2I_ACCESS_TRACKING=False)
+    def test_disabled(self):
+        self.assertIsNone(get_access_tracker())
+        record_access(["foo"])
+
+    def test_record(self):
+        record_access(["foo", "bar"])
+        record_access(["foo"])
+        record_access([])
+
+        tracker = get_access_tracker()
+        self.assertIs(get_access_tracker(), tracker)
+        self.assertEqual(self.mock_start.call_count, 1)
+        self.assertEqual(
+            {tex_key: count
+             for tex_key, (count, _) in tracker.buffer.drain().items()},
+            {"foo": 2, "bar": 1})
+
+    @override_settings(L2I_ACCESS_BUFFER_MAX_KEYS=2)
+    def test_full_buffer_wakes_flusher(self):
+        tracker = get_access_tracker()
+        record_access(["foo"])
+        self.assertFalse(tracker._wake_event.is_set())
+        record_access(["bar"])
+        self.assertTrue(tracker._wake_event.is_set())
+
+    def test_new_process(self):
+        tracker = get_access_tracker()
+        with mock.patch("latex.access.os.getpid", return_value=-1):
+            self.assertIsNot(get_access_tracker(), tracker)
+
+    @override_settings(L2I_ACCESS_FLUSH_INTERVAL=0.01)
+    def test_run(self):
+        tracker = get_access_tracker()
+        tracker.record(["foo"])
+
+        def flush(force=False):
+            tracker.stop()
+            return 0
+
+        with mock.patch.object(tracker, "flush", side_effect=flush) as mocked:
+            tracker.run()
+        mocked.assert_called_once_with()
+
+
+class UpdateAccessCountsTest(L2ITestMixinBase, TestCase):
+    # test latex.access.update_access_counts and get_hot_images
+    def setUp(self):
+        super().setUp()
+        self.instances = factories.LatexImageFactory.create_batch(size=3)
+        self.tex_keys = [instance.tex_key for instance in self.instances]
+
+    def get_last_accessed(self):
+        return [
+            LatexImage.objects.get(tex_key=tex_key).last_accessed
+            for tex_key in self.tex_keys]
+
+    @override_settings(L2I_ACCESS_FLUSH_INTERVAL=60)
+    def test_update(self):
+        counts = {
+            self.tex_keys[0]: (2, 100.),
+            self.tex_keys[1]: (2, 110.),
+            self.tex_keys[2]: (2, 300.),
+            "not_existing": (1, 400.)}
+
+        # One query per distinct count and flush interval
+        with self.assertNumQueries(3):
+            self.assertEqual(update_access_counts(counts), 3)
+        self.assertEqual(
+            self.get_last_accessed(), [utc(110.), utc(110.), utc(300.)])
+
+        update_access_counts({self.tex_keys[0]: (1, 500.)})
+
+        hit_counts = dict(
+            LatexImage.objects.values_list("tex_key", "hit_count"))
+        self.assertEqual(
+            [hit_counts[tex_key] for tex_key in self.tex_keys], [3, 2, 2])
+        self.assertEqual(self.get_last_accessed()[0], utc(500.))
+
+    def test_batches(self):
+        with mock.patch("latex.access.UPDATE_BATCH_SIZE", 2):
+            with self.assertNumQueries(2):
+                update_access_counts(
+                    {tex_key: (1, 100.) for tex_key in self.tex_keys})
+
+    def test_hot_images(self):
+        update_access_counts({
+            self.tex_keys[0]: (1, 100.),
+            self.tex_keys[1]: (3, 100.),
+            self.tex_keys[2]: (1, 200.)})
+
+        self.assertEqual(
+            get_hot_images(2),
+            [(self.tex_keys[1], 3, utc(100.)),
+             (self.tex_keys[2], 1, utc(200.))])
+
+    @override_settings(L2I_ACCESS_FLUSH_INTERVAL=60)
+    def test_hot_images_recently_accessed_first(self):
+        update_access_counts({
+            self.tex_keys[0]: (1, 100.),
+            self.tex_keys[1]: (1, 1000.),
+            self.tex_keys[2]: (1, 200.)})
+
+        self.assertEqual(
+            get_hot_images(3),
+            [(self.tex_keys[1], 1, utc(1000.)),
+             (self.tex_keys[2], 1, utc(200.)),
+             (self.tex_keys[0], 1, utc(100.))])
+
+    def test_hot_images_command(self):
+        update_access_counts({self.tex_keys[0]: (7, 100.)})
+
+        out = StringIO()
+        call_command("l2i_hot_images", "--top", "5", stdout=out)
+        self.assertEqual(
+            out.getvalue().splitlines(),
+            ["%s\t7\t%s" % (self.tex_keys[0], utc(100.).isoformat())])
+
+        with self.assertRaises(CommandError):
+            call_command("l2i_hot_images", "--top", "0")
+
+        # Access tracking is disabled in tests
+        with self.assertRaises(CommandError):
+            call_command("l2i_hot_images", "--flush")
+
+    @override_settings(L2I_ACCESS_TRACKING=True)
+    def test_hot_images_command_flush(self):
+        cache = FakeRedisCache()
+        push_access_counts(cache, {self.tex_keys[1]: (4, 100.)})
+
+        out = StringIO()
+        with mock.patch("latex.access.get_default_cache", return_value=cache):
+            call_command("l2i_hot_images", "--flush", stdout=out)
+        self.assertEqual(
+            out.getvalue().splitlines(),
+            ["Flushed the access counts of 1 image(s)",
+             "%s\t4\t%s" % (self.tex_keys[1], utc(100.).isoformat())])
+
+    def test_warm_cache_accessed_first(self):
+        update_access_counts({self.tex_keys[1]: (3, 100.)})
+
+        call_command("l2i_warm_cache", "--order", "accessed", "--limit", "1",
+                     "--fields", "data_url", stdout=StringIO())
+        self.assertEqual(
+            list(get_field_cache().get_many(
+                self.tex_keys, ["data_url"])), [self.tex_keys[1]])
+
+
+@override_settings(L2I_ACCESS_FLUSH_INTERVAL=60)
+class FlushAccessCountsTest(L2ITestMixinBase, TestCase):
+    # test latex.access.flush_access_counts
+    def setUp(self):
+        super().setUp()
+        self.instances = factories.LatexImageFactory.create_batch(size=2)
+        self.tex_keys = [instance.tex_key for instance in self.instances]
+        self.cache = FakeRedisCache()
+
+    def get_hit_counts(self):
+        return [
+            LatexImage.objects.get(tex_key=tex_key).hit_count
+            for tex_key in self.tex_keys]
+
+    def flush(self, buffer, **kwargs):
+        with mock.patch(
+                "latex.access.get_default_cache", return_value=self.cache):
+            return flush_access_counts(buffer, **kwargs)
+
+    def test_without_redis(self):
+        buffer = AccessBuffer()
+        buffer.add(self.tex_keys, 100.)
+        with mock.patch("latex.access.get_default_cache", return_value=None):
+            self.assertEqual(flush_access_counts(buffer), 2)
+        self.assertEqual(self.get_hit_counts(), [1, 1])
+        self.assertEqual(len(buffer), 0)
+
+    def test_push_pop(self):
+        push_access_counts(self.cache, {"foo": (2, 100.), "bar": (1, 50.)})
+        push_access_counts(self.cache, {"foo": (1, 200.)})
+        self.assertEqual(
+            pop_access_counts(self.cache),
+            {"foo": (3, 200.), "bar": (1, 50.)})
+        self.assertEqual(pop_access_counts(self.cache), {})
+        self.assertEqual(self.cache.redis.hashes, {})
+
+    def test_push_keeps_latest_access(self):
+        push_access_counts(self.cache, {"foo": (1, 200.)})
+        push_access_counts(self.cache, {"foo": (1, 100.), "bar": (1, 50.)})
+        self.assertEqual(
+            pop_access_counts(self.cache),
+            {"foo": (2, 200.), "bar": (1, 50.)})
+
+    def test_pop_last_without_counts(self):
+        # e.g., the counts were popped between the 2 writes of a push
+        self.cache.redis.hset(
+            self.cache.make_key(ACCESS_LAST_KEY), mapping={"foo": 100.})
+        self.assertEqual(pop_access_counts(self.cache), {})
+        self.assertEqual(self.cache.redis.hashes, {})
+
+    def test_one_process_writes_at_a_time(self):
+        worker_1, worker_2 = AccessBuffer(), AccessBuffer()
+        worker_1.add(self.tex_keys[:1], 100.)
+        worker_2.add(self.tex_keys, 100.)
+
+        # Worker 1 gets the flush lock
+        self.assertEqual(self.flush(worker_1), 1)
+        self.assertEqual(self.get_hit_counts(), [1, 0])
+
+        # Worker 2 only pushes to redis
+        self.assertEqual(self.flush(worker_2), 0)
+        self.assertEqual(self.get_hit_counts(), [1, 0])
+        self.assertIn(
+            self.cache.make_key(ACCESS_COUNTS_KEY), self.cache.redis.hashes)
+
+        self.assertEqual(self.flush(AccessBuffer(), force=True), 2)
+        self.assertEqual(self.get_hit_counts(), [2, 1])
+
+    def test_database_error(self):
+        buffer = AccessBuffer()
+        buffer.add(self.tex_keys, 100.)
+        push_access_counts(self.cache, {self.tex_keys[0]: (2, 200.)})
+        with mock.patch("latex.access.update_access_counts",
+                        side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                self.flush(buffer, force=True)
+
+        # Pushed back to redis
+        self.assertEqual(len(buffer), 0)
+        self.assertEqual(self.flush(AccessBuffer(), force=True), 2)
+        self.assertEqual(self.get_hit_counts(), [3, 1])
+        self.assertEqual(
+            LatexImage.objects.get(tex_key=self.tex_keys[0]).last_accessed,
+            utc(200.))
+
+    def test_database_error_without_redis(self):
+        buffer = AccessBuffer()
+        buffer.add(self.tex_keys, 100.)
+        with mock.patch("latex.access.get_default_cache", return_value=None):
+            with mock.patch("latex.access.update_access_counts",
+                            side_effect=DatabaseError):
+                with self.assertRaises(DatabaseError):
+                    flush_access_counts(buffer)
+
+            # Put back to the buffer
+            buffer.add(self.tex_keys[:1], 200.)
+            self.assertEqual(flush_access_counts(buffer), 2)
+        self.assertEqual(self.get_hit_counts(), [2, 1])
+
+    def test_redis_error(self):
+        buffer = AccessBuffer()
+        buffer.add(self.tex_keys, 100.)
+        with mock.patch(
+                "latex.access.push_access_counts",
+                side_effect=ConnectionError):
+            self.assertEqual(self.flush(buffer), 2)
+        self.assertEqual(self.get_hit_counts(), [1, 1])
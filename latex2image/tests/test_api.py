@@ -25,24 +25,33 @@ THE SOFTWARE.
 
 import json
 import os
+from contextlib import contextmanager
 from random import randint
 from unittest import mock, skipIf
 
+from django.db import IntegrityError, connection
 from django.db.models import signals
 from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
 from factory.django import mute_signals
+from rest_framework.authtoken.models import Token
 from rest_framework.test import (APIClient, APIRequestFactory,
                                  force_authenticate)
 from tests import factories
-from tests.base_test_mixins import (L2ITestMixinBase, get_fake_data_url,
+from tests.base_test_mixins import (L2ITestMixinBase, get_fake_converted_image,
                                     get_latex_file_dir,
                                     improperly_configured_cache_patch,
                                     suppress_stdout_decorator)
 from tests.utils import SKIP_ON_WINDOWS_REASON, skip_on_windows
 
 from latex.api import LatexImageList
-from latex.converter import get_data_url
+from latex.converter import (LatexCompileError, LatexTimeoutError,
+                             read_converted_image)
+from latex.executor import ConversionQueueFull
+from latex.jobs import run_job
 from latex.models import LatexImage
+from latex.timing import STAGE_CONVERT, record_stage
 
 IMAGE_PATH_PREFIX = "l2i_images/"
 
@@ -96,6 +105,77 @@ class LatexListAPITest(APITestBaseMixin, TestCase):
         self.assertEqual(len(json.loads(resp.content.decode())), self.n_new)
         self.assertEqual(resp.status_code, 200)
 
+    def test_get_filter_fields_not_loading_others(self):
+        self.create_n_instances()
+
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.api_client.get(reverse("list") + "?fields=image")
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn("data_url", " ".join(q["sql"] for q in queries))
+
+        response_list = json.loads(resp.content.decode())
+        self.assertEqual(len(response_list), self.n_new)
+        self.assertIn("image", response_list[0])
+        self.assertNotIn("data_url", response_list[0])
+
+    def test_get_cursor_paginated(self):
+        self.create_n_instances(n=5)
+        factories.LatexImageFactory.create_batch(size=2)
+
+        url = reverse("list") + "?page_size=2"
+        results = []
+        while url:
+            resp = self.api_client.get(url)
+            self.assertEqual(resp.status_code, 200)
+            response_dict = json.loads(resp.content.decode())
+            self.assertLessEqual(len(response_dict["results"]), 2)
+            results.extend(response_dict["results"])
+            url = response_dict["next"]
+
+        self.assertEqual(
+            [r["tex_key"] for r in results],
+            list(LatexImage.objects.filter(creator=self.test_user).order_by(
+                "creation_time", "id").values_list("tex_key", flat=True)))
+
+    @override_settings(L2I_API_LIST_PAGE_SIZE=3)
+    def test_get_paginated_by_settings(self):
+        self.create_n_instances(n=5)
+        resp = self.api_client.get(reverse("list"))
+        response_dict = json.loads(resp.content.decode())
+        self.assertEqual(len(response_dict["results"]), 3)
+        self.assertIsNotNone(response_dict["next"])
+
+    def test_get_ndjson(self):
+        self.create_n_instances()
+        factories.LatexImageFactory()
+
+        for query, kwargs in [
+                ("?fields=tex_key", {"HTTP_ACCEPT": "application/x-ndjson"}),
+                ("?fields=tex_key&format=ndjson", {})]:
+            with self.subTest(query=query):
+                resp = self.api_client.get(reverse("list") + query, **kwargs)
+                self.assertEqual(resp.status_code, 200)
+                self.assertEqual(resp["Content-Type"], "application/x-ndjson")
+                self.assertTrue(resp.streaming)
+
+                lines = b"".join(resp.streaming_content).decode().splitlines()
+                self.assertEqual(len(lines), self.n_new)
+                self.assertEqual(
+                    sorted(json.loads(lines[0])), ["compile_error", "tex_key"])
+                self.assertEqual(
+                    [json.loads(line)["tex_key"] for line in lines],
+                    list(LatexImage.objects.filter(
+                        creator=self.test_user).order_by(
+                        "creation_time", "id").values_list(
+                        "tex_key", flat=True)))
+
+    def test_get_ndjson_not_authenticated(self):
+        self.api_client.force_authenticate(user=None)
+        resp = self.api_client.get(
+            reverse("list"), HTTP_ACCEPT="application/x-ndjson")
+        self.assertEqual(resp.status_code, 401)
+        self.assertIn("detail", json.loads(resp.content.decode().strip()))
+
     @skipIf(skip_on_windows, SKIP_ON_WINDOWS_REASON)
     def test_create_success(self):
         self.create_n_instances()
@@ -113,16 +193,18 @@ class LatexListAPITest(APITestBaseMixin, TestCase):
         compile_error = instance.compile_error
         instance.delete()
 
-        def get_data_url_side_effect(file_path):
-            result = get_data_url(file_path)
+        def read_converted_image_side_effect(file_path):
+            result = read_converted_image(file_path)
             factories.LatexImageErrorFactory(
                 tex_key=tex_key, creator=creator,
                 creation_time=creation_time, compile_error=compile_error)
             return result
 
-        with mock.patch("latex.converter.get_data_url") as mock_get_data_url:
-            mock_get_data_url.side_effect = (
-                get_data_url_side_effect)
+        with mock.patch(
+                "latex.converter.read_converted_image"
+        ) as mock_read_converted_image:
+            mock_read_converted_image.side_effect = (
+                read_converted_image_side_effect)
 
             resp = self.api_client.post(
                 self.get_list_url(),
@@ -142,9 +224,9 @@ class LatexListAPITest(APITestBaseMixin, TestCase):
         first_object = self.create_n_instances()[0]
 
         with mock.patch(
-                "latex.converter.Tex2ImgBase.get_converted_data_url"
+                "latex.converter.Tex2ImgBase.get_converted_image"
         ) as mock_convert:
-            mock_convert.return_value = get_fake_data_url("foob=")
+            mock_convert.return_value = get_fake_converted_image()
             resp = self.api_client.post(
                 self.get_list_url(),
                 data=self.get_post_data(
@@ -159,9 +241,9 @@ class LatexListAPITest(APITestBaseMixin, TestCase):
         factories.LatexImageErrorFactory(tex_key=tex_key, creator=self.test_user)
 
         with mock.patch(
-                "latex.converter.Tex2ImgBase.get_converted_data_url"
+                "latex.converter.Tex2ImgBase.get_converted_image"
         ) as mock_convert:
-            mock_convert.return_value = get_fake_data_url("foob=")
+            mock_convert.return_value = get_fake_converted_image()
             resp = self.api_client.post(
                 self.get_list_url(),
                 data=self.get_post_data(tex_key=tex_key), format='json')
@@ -204,7 +286,7 @@ class LatexListAPITest(APITestBaseMixin, TestCase):
     def test_errored_but_not_compile_error(self, mock_save):
         exception_str = "this is a custom exception."
         with mock.patch(
-                "latex.converter.Tex2ImgBase.get_converted_data_url"
+                "latex.converter.Tex2ImgBase.get_converted_image"
         ) as mock_convert:
             mock_convert.side_effect = RuntimeError(exception_str)
             resp = self.api_client.post(
@@ -297,6 +379,17 @@ class LatexDetailAPITest(APITestBaseMixin, TestCase):
             sorted(filter_fields), sorted(list(response_dict.keys())))
 
     @skipIf(skip_on_windows, SKIP_ON_WINDOWS_REASON)
+    def test_get_filter_fields_not_loading_others(self):
+        instance = factories.LatexImageFactory(creator=self.test_user)
+
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.api_client.get(
+                self.get_detail_url(instance.tex_key, fields="image,creator"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn("data_url", " ".join(q["sql"] for q in queries))
+        self.assertEqual(
+            sorted(json.loads(resp.content.decode())), ["creator", "image"])
+
     def test_put_success(self):
         first_instance = self.create_n_instances(n=1)[0]
         first_instance_size = first_instance.image.size
@@ -414,7 +507,7 @@ class LatexCreateAPITest(APITestBaseMixin, TestCase):
         self.assertEqual(LatexImage.objects.all().count(), 0)
 
         with mock.patch(
-                "latex.converter.Tex2ImgBase.get_converted_data_url"
+                "latex.converter.Tex2ImgBase.get_converted_image"
         ) as mock_convert:
 
             resp = self.api_client.post(
@@ -443,7 +536,7 @@ class LatexCreateAPITest(APITestBaseMixin, TestCase):
         self.assertEqual(LatexImage.objects.all().count(), 0)
 
         with mock.patch(
-                "latex.converter.Tex2ImgBase.get_converted_data_url"
+                "latex.converter.Tex2ImgBase.get_converted_image"
         ) as mock_convert:
 
             # post data enabled use_storage_file_if_exists
@@ -472,13 +565,13 @@ class LatexCreateAPITest(APITestBaseMixin, TestCase):
         self.assertEqual(LatexImage.objects.all().count(), 0)
 
         with mock.patch(
-                "latex.converter.Tex2ImgBase.get_converted_data_url"
+                "latex.converter.Tex2ImgBase.get_converted_image"
         ) as mock_convert:
-            mock_convert.return_value = "foo:bar"
+            mock_convert.return_value = get_fake_converted_image()
 
-            with self.assertRaises(ValueError):
-                self.api_client.post(
-                    self.get_creat_url(), data=post_data, format='json')
+            resp = self.api_client.post(
+                self.get_creat_url(), data=post_data, format='json')
+            self.assertEqual(resp.status_code, 201, resp.content.decode())
             mock_convert.assert_called_once()
 
     def test_post_data_validation_error(self):
@@ -534,6 +627,520 @@ class LatexCreateAPITest(APITestBaseMixin, TestCase):
 
             self.assertEqual(resp.status_code, 400)
 
+    def test_server_timing_header(self):
+        with mock.patch(
+                "latex.converter.Tex2ImgBase.get_converted_image"
+        ) as mock_convert:
+            mock_convert.return_value = get_fake_converted_image()
+            resp = self.api_client.post(
+                self.get_list_url(),
+                data=self.get_post_data(), format='json')
+            self.assertEqual(resp.status_code, 201)
+            self.assertIn("persist;dur=", resp["Server-Timing"])
+
+    def test_convert_timeout_saved_as_compile_error(self):
+        with mock.patch(
+                "latex.converter.Tex2ImgBase.get_converted_image"
+        ) as mock_convert:
+            mock_convert.side_effect = LatexTimeoutError(
+                "'latexmk' timed out after 60 seconds")
+            resp = self.api_client.post(
+                self.get_list_url(),
+                data=self.get_post_data(), format='json')
+            self.assertEqual(resp.status_code, 400)
+            self.assertIn(
+                "LatexTimeoutError",
+                json.loads(resp.content.decode())["compile_error"])
+
+            # No conversion of the same source again
+            resp = self.api_client.post(
+                self.get_list_url(),
+                data=self.get_post_data(), format='json')
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(mock_convert.call_count, 1)
+
+        self.assertEqual(LatexImage.objects.all().count(), 1)
+
+
+class LatexCreateSingleFlightAPITest(APITestBaseMixin, TestCase):
+    def test_instance_saved_by_leader(self):
+        post_data = self.get_post_data(tex_key="foo_key")
+
+        @contextmanager
+        def leader_saved(tex_key):
+            factories.LatexImageFactory(creator=self.test_user, tex_key=tex_key)
+            yield True
+
+        with mock.patch("latex.api.single_flight", side_effect=leader_saved):
+            with mock.patch(
+                    "latex.converter.Tex2ImgBase.get_converted_image"
+            ) as mock_convert:
+                resp = self.api_client.post(
+                    self.get_creat_url(), data=post_data, format='json')
+                self.assertEqual(resp.status_code, 200)
+                mock_convert.assert_not_called()
+
+        self.assertEqual(LatexImage.objects.all().count(), 1)
+
+    def test_instance_saved_just_before_saving(self):
+        # i.e., by a request which timed out waiting for the lock, after
+        # the unique validation of tex_key
+        post_data = self.get_post_data(tex_key="foo_key")
+
+        def save_and_convert():
+            factories.LatexImageFactory(creator=self.test_user, tex_key="foo_key")
+            return get_fake_converted_image()
+
+        with mock.patch(
+                "latex.converter.Tex2ImgBase.get_converted_image"
+        ) as mock_convert, mock.patch(
+                "latex.serializers.LatexImageSerializer.is_valid"
+        ) as mock_is_valid, mock.patch(
+                "latex.serializers.LatexImageSerializer.save"
+        ) as mock_save:
+            mock_convert.side_effect = save_and_convert
+            mock_is_valid.return_value = True
+            mock_save.side_effect = IntegrityError()
+            resp = self.api_client.post(
+                self.get_creat_url(), data=post_data, format='json')
+            self.assertEqual(resp.status_code, 200)
+
+        self.assertEqual(LatexImage.objects.all().count(), 1)
+
+
+class LatexCreateQueueFullAPITest(APITestBaseMixin, TestCase):
+    def test_queue_full(self):
+        with mock.patch(
+                "latex.converter.Tex2ImgBase.get_converted_image"
+        ) as mock_convert:
+            mock_convert.side_effect = ConversionQueueFull("queue is full", 7)
+            resp = self.api_client.post(
+                self.get_creat_url(), data=self.get_post_data(), format='json')
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp["Retry-After"], "7")
+        self.assertIn("queue is full", json.loads(resp.content.decode())["error"])
+        self.assertEqual(LatexImage.objects.all().count(), 0)
+
+
+class LatexCreateAsyncAPITest(APITestBaseMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        enqueue_patch = mock.patch("latex.jobs.InProcessJobQueue.enqueue")
+        self.mock_enqueue = enqueue_patch.start()
+        self.addCleanup(enqueue_patch.stop)
+
+    def get_create_async_url(self):
+        return reverse("create_async")
+
+    def post_create_async(self, **kwargs):
+        return self.api_client.post(
+            self.get_create_async_url(),
+            data=self.get_post_data(**kwargs), format='json')
+
+    def test_pending(self):
+        resp = self.post_create_async(tex_key="async_key")
+        self.assertEqual(resp.status_code, 202)
+        response_dict = json.loads(resp.content.decode())
+        self.assertEqual(response_dict["tex_key"], "async_key")
+        self.assertEqual(response_dict["status"], "pending")
+        self.assertTrue(
+            response_dict["status_url"].endswith(
+                self.get_detail_url("async_key")))
+        self.mock_enqueue.assert_called_once()
+
+        resp = self.api_client.get(self.get_detail_url("async_key"))
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(
+            json.loads(resp.content.decode())["status"], "pending")
+
+        resp = self.api_client.get(
+            self.get_detail_url("async_key", fields="image"))
+        self.assertEqual(resp.status_code, 202)
+
+        self.assertEqual(LatexImage.objects.all().count(), 0)
+
+    def test_pending_not_queued_again(self):
+        self.post_create_async(tex_key="async_key")
+        resp = self.post_create_async(tex_key="async_key")
+        self.assertEqual(resp.status_code, 202)
+        self.mock_enqueue.assert_called_once()
+
+    def test_done(self):
+        self.mock_enqueue.side_effect = run_job
+
+        with mock.patch(
+                "latex.converter.Tex2ImgBase.get_converted_image"
+        ) as mock_convert:
+            mock_convert.return_value = get_fake_converted_image()
+            resp = self.post_create_async(tex_key="async_key")
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(LatexImage.objects.all().count(), 1)
+
+        resp = self.api_client.get(self.get_detail_url("async_key"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("image", json.loads(resp.content.decode()))
+
+    def test_errored(self):
+        self.mock_enqueue.side_effect = run_job
+
+        with mock.patch(
+                "latex.converter.Tex2ImgBase.get_converted_image"
+        ) as mock_convert:
+            mock_convert.side_effect = RuntimeError("some error")
+            self.post_create_async(tex_key="async_key")
+
+        self.assertEqual(LatexImage.objects.all().count(), 0)
+
+        resp = self.api_client.get(self.get_detail_url("async_key"))
+        self.assertEqual(resp.status_code, 400)
+        response_dict = json.loads(resp.content.decode())
+        self.assertEqual(response_dict["status"], "error")
+        self.assertIn("some error", response_dict["error"])
+
+    def test_existing_instance(self):
+        instance = factories.LatexImageFactory(creator=self.test_user)
+        resp = self.post_create_async(tex_key=instance.tex_key)
+        self.assertEqual(resp.status_code, 200)
+        self.mock_enqueue.assert_not_called()
+
+    def test_post_data_validation_error(self):
+        post_data = self.get_post_data(tex_key="async_key")
+        del post_data["compiler"]
+        del post_data["image_format"]
+        post_data["fields"] = "image"
+
+        resp = self.api_client.post(
+            self.get_create_async_url(), data=post_data, format='json')
+        self.assertContains(resp, "required", status_code=400)
+        self.mock_enqueue.assert_not_called()
+
+    def test_no_job_not_found(self):
+        resp = self.api_client.get(self.get_detail_url("async_key"))
+        self.assertEqual(resp.status_code, 404)
+
+    def test_job_queue_full(self):
+        self.mock_enqueue.side_effect = ConversionQueueFull("queue is full", 7)
+        resp = self.post_create_async(tex_key="async_key")
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp["Retry-After"], "7")
+
+        resp = self.api_client.get(self.get_detail_url("async_key"))
+        self.assertEqual(resp.status_code, 404)
+
+
+class LatexBulkCreateAPITest(APITestBaseMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        convert_patch = mock.patch(
+            "latex.converter.Tex2ImgBase.get_converted_image")
+        self.mock_convert = convert_patch.start()
+        self.mock_convert.return_value = get_fake_converted_image()
+        self.addCleanup(convert_patch.stop)
+
+    def get_bulk_url(self, **query):
+        url = reverse("create_bulk")
+        if query:
+            url += "?" + "&".join(f"{k}={v}" for k, v in query.items())
+        return url
+
+    def post_bulk(self, items, url=None, **kwargs):
+        data = {"items": items}
+        data.update(kwargs)
+        return self.api_client.post(
+            url or self.get_bulk_url(), data=data, format='json')
+
+    def test_not_authenticated(self):
+        self.api_client.force_authenticate(user=None)
+        resp = self.post_bulk([self.get_post_data()])
+        self.assertEqual(resp.status_code, 401)
+
+    def test_create(self):
+        items = [self.get_post_data(tex_key=f"key_{i}") for i in range(3)]
+        resp = self.post_bulk(items, fields="image")
+        self.assertEqual(resp.status_code, 200)
+
+        results = json.loads(resp.content.decode())
+        self.assertEqual([result["index"] for result in results], [0, 1, 2])
+        for result in results:
+            self.assertEqual(result["status_code"], 201)
+            self.assertIn("image", result)
+        self.assertEqual(LatexImage.objects.all().count(), 3)
+        self.assertEqual(self.mock_convert.call_count, 3)
+
+    def test_render_costs_per_item(self):
+        durations = iter([1., 2., 3.])
+
+        def convert():
+            record_stage(STAGE_CONVERT, next(durations))
+            return get_fake_converted_image()
+
+        self.mock_convert.side_effect = convert
+        items = [self.get_post_data(tex_key=f"key_{i}") for i in range(3)]
+
+        with mock.patch("latex.receivers.get_field_cache") as mock_field_cache:
+            resp = self.post_bulk(items)
+
+        costs = sorted(
+            call[1]["costs"][call[0][0].popitem()[0]]
+            for call in mock_field_cache.return_value.set_many.call_args_list)
+        self.assertEqual(costs, [1000., 2000., 3000.])
+        self.assertIn("convert;dur=6000.000", resp["Server-Timing"])
+
+    def test_existing_instances_one_query(self):
+        instances = factories.LatexImageFactory.create_batch(
+            creator=self.test_user, size=3)
+        items = [self.get_post_data(tex_key=instance.tex_key)
+                 for instance in instances]
+
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.post_bulk(items, fields="image,creator")
+
+        image_queries = [q for q in ctx.captured_queries
+                         if "latex_lateximage" in q["sql"]]
+        self.assertEqual(len(image_queries), 1)
+
+        results = json.loads(resp.content.decode())
+        for result in results:
+            self.assertEqual(result["status_code"], 200)
+            self.assertIn("image", result)
+            self.assertIn("creator", result)
+        self.mock_convert.assert_not_called()
+
+    def test_cached_results(self):
+        instances = factories.LatexImageFactory.create_batch(
+            creator=self.test_user, size=2)
+        items = [self.get_post_data(tex_key=instance.tex_key)
+                 for instance in instances]
+
+        self.post_bulk(items, fields="data_url")
+
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.post_bulk(items, fields="data_url")
+
+        self.assertFalse([q for q in ctx.captured_queries
+                          if "latex_lateximage" in q["sql"]])
+        results = json.loads(resp.content.decode())
+        for instance, result in zip(instances, results):
+            self.assertEqual(result["status_code"], 200)
+            self.assertEqual(result["data_url"], instance.data_url)
+
+    def test_duplicated_items_converted_once(self):
+        items = [self.get_post_data(tex_key="same_key")] * 2
+        resp = self.post_bulk(items)
+
+        results = json.loads(resp.content.decode())
+        self.assertEqual(len(results), 2)
+        self.assertEqual(results[0]["tex_key"], results[1]["tex_key"])
+        self.assertEqual(self.mock_convert.call_count, 1)
+        self.assertEqual(LatexImage.objects.all().count(), 1)
+
+    def test_per_item_errors(self):
+        instance = factories.LatexImageErrorFactory(
+            creator=self.test_user, compile_error="some compile error")
+
+        missing_compiler = self.get_post_data(tex_key="missing_compiler")
+        del missing_compiler["compiler"]
+
+        items = [
+            self.get_post_data(tex_key="ok"),
+            missing_compiler,
+            self.get_post_data(tex_key=instance.tex_key),
+            self.get_post_data(tex_key="compile_error"),
+        ]
+
+        def convert(converter_self):
+            if converter_self.tex_key == "compile_error":
+                raise LatexCompileError("Undefined control sequence")
+            return get_fake_converted_image()
+
+        with mock.patch(
+                "latex.converter.Tex2ImgBase.get_converted_image", new=convert):
+            resp = self.post_bulk(items)
+
+        self.assertEqual(resp.status_code, 200)
+        results = json.loads(resp.content.decode())
+        self.assertEqual(
+            [result["status_code"] for result in results],
+            [201, 400, 400, 400])
+        self.assertIn("compiler", results[1]["error"])
+        self.assertIn("some compile error", results[2]["compile_error"])
+        self.assertIn("Undefined control sequence",
+                      results[3]["compile_error"])
+        self.assertEqual(LatexImage.objects.all().count(), 3)
+
+    def test_queue_full(self):
+        self.mock_convert.side_effect = ConversionQueueFull("queue is full", 7)
+        resp = self.post_bulk([self.get_post_data()])
+
+        self.assertEqual(resp.status_code, 200)
+        result, = json.loads(resp.content.decode())
+        self.assertEqual(result["status_code"], 503)
+        self.assertEqual(result["retry_after"], 7)
+        self.assertIn("queue is full", result["error"])
+        self.assertEqual(LatexImage.objects.all().count(), 0)
+
+    def test_ndjson(self):
+        items = [self.get_post_data(tex_key=f"key_{i}") for i in range(3)]
+        resp = self.post_bulk(items, url=self.get_bulk_url(format="ndjson"))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp["Content-Type"], "application/x-ndjson")
+        lines = b"".join(resp.streaming_content).decode().splitlines()
+        results = [json.loads(line) for line in lines]
+        self.assertEqual(
+            sorted(result["index"] for result in results), [0, 1, 2])
+        self.assertEqual(LatexImage.objects.all().count(), 3)
+
+    @override_settings(L2I_BULK_MAX_ITEMS=2)
+    def test_too_many_items(self):
+        items = [self.get_post_data(tex_key=f"key_{i}") for i in range(3)]
+        resp = self.post_bulk(items)
+        self.assertContains(resp, "At most 2", status_code=400)
+        self.mock_convert.assert_not_called()
+
+    def test_empty_items(self):
+        resp = self.post_bulk([])
+        self.assertEqual(resp.status_code, 400)
+
+
+class LatexImageRawAPITest(APITestBaseMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.instance = factories.LatexImageFactory(creator=self.test_user)
+        self.api_client.force_authenticate(user=None)
+
+    def get_image_url(self, tex_key=None, ext="png"):
+        return reverse("image", args=(tex_key or self.instance.tex_key, ext))
+
+    def test_get(self):
+        resp = self.api_client.get(self.get_image_url())
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp["Content-Type"], "image/png")
+        self.assertEqual(resp["ETag"], '"%s"' % self.instance.tex_key)
+        self.assertIn("Last-Modified", resp)
+        self.assertIn("immutable", resp["Cache-Control"])
+
+        with self.instance.image.open() as f:
+            self.assertEqual(b"".join(resp.streaming_content), f.read())
+        resp.close()
+
+    def test_head(self):
+        resp = self.api_client.head(self.get_image_url())
+        self.assertEqual(resp.status_code, 200)
+        resp.close()
+
+    def test_post_not_allowed(self):
+        resp = self.api_client.post(self.get_image_url())
+        self.assertEqual(resp.status_code, 405)
+
+    def test_not_found(self):
+        resp = self.api_client.get(self.get_image_url(ext="svg"))
+        self.assertEqual(resp.status_code, 404)
+
+        resp = self.api_client.get(self.get_image_url(tex_key="foo"))
+        self.assertEqual(resp.status_code, 404)
+
+        instance = factories.LatexImageErrorFactory()
+        resp = self.api_client.get(self.get_image_url(instance.tex_key))
+        self.assertEqual(resp.status_code, 404)
+
+    def test_if_none_match(self):
+        with self.assertNumQueries(0):
+            resp = self.api_client.get(
+                self.get_image_url(),
+                HTTP_IF_NONE_MATCH='"%s"' % self.instance.tex_key)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp["ETag"], '"%s"' % self.instance.tex_key)
+
+        resp = self.api_client.get(
+            self.get_image_url(), HTTP_IF_NONE_MATCH='"foo"')
+        self.assertEqual(resp.status_code, 200)
+        resp.close()
+
+    def test_if_modified_since(self):
+        resp = self.api_client.get(self.get_image_url())
+        resp.close()
+
+        resp = self.api_client.get(
+            self.get_image_url(),
+            HTTP_IF_MODIFIED_SINCE=resp["Last-Modified"])
+        self.assertEqual(resp.status_code, 304)
+
+    @override_settings(
+        L2I_IMAGE_X_ACCEL_REDIRECT_LOCATION="/l2i_internal_images/")
+    def test_x_accel_redirect(self):
+        resp = self.api_client.get(self.get_image_url())
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            resp["X-Accel-Redirect"],
+            "/l2i_internal_images/%s.png" % self.instance.tex_key)
+        self.assertEqual(resp["Content-Type"], "image/png")
+        self.assertEqual(resp.content, b"")
+
+
+@override_settings(L2I_IMAGE_REQUIRE_AUTH=True)
+class LatexImageRawAuthAPITest(APITestBaseMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.instance = factories.LatexImageFactory(creator=self.test_user)
+
+    def get_image_url(self):
+        return reverse("image", args=(self.instance.tex_key, "png"))
+
+    def test_not_authenticated(self):
+        self.api_client.force_authenticate(user=None)
+        resp = self.api_client.get(self.get_image_url())
+        self.assertEqual(resp.status_code, 401)
+
+        resp = self.api_client.get(
+            self.get_image_url(),
+            HTTP_IF_NONE_MATCH='"%s"' % self.instance.tex_key)
+        self.assertEqual(resp.status_code, 401)
+
+    def test_may_not_get_others_image_except_superuser(self):
+        another_user = factories.UserFactory()
+        self.api_client.force_authenticate(user=another_user)
+        resp = self.api_client.get(
+            self.get_image_url(),
+            HTTP_IF_NONE_MATCH='"%s"' % self.instance.tex_key)
+        self.assertEqual(resp.status_code, 404)
+
+        self.api_client.force_authenticate(user=self.superuser)
+        resp = self.api_client.get(self.get_image_url())
+        self.assertEqual(resp.status_code, 200)
+        resp.close()
+
+    def test_get(self):
+        resp = self.api_client.get(self.get_image_url())
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp["Cache-Control"].startswith("private"))
+        resp.close()
+
+        resp = self.api_client.get(
+            self.get_image_url(),
+            HTTP_IF_NONE_MATCH='"%s"' % self.instance.tex_key)
+        self.assertEqual(resp.status_code, 304)
+
+    def test_session_authenticated(self):
+        self.api_client.force_authenticate(user=None)
+        self.api_client.login(
+            username=self.test_user.username,
+            password=self._user_create_kwargs["password"])
+        resp = self.api_client.get(self.get_image_url())
+        self.assertEqual(resp.status_code, 200)
+        resp.close()
+
+    @override_settings(
+        L2I_IMAGE_X_ACCEL_REDIRECT_LOCATION="/l2i_internal_images/")
+    def test_x_accel_redirect(self):
+        resp = self.api_client.get(self.get_image_url())
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            resp["X-Accel-Redirect"],
+            "/l2i_internal_images/%s.png" % self.instance.tex_key)
+
 
 class CacheTestBase(APITestBaseMixin):
     def setUp(self):
@@ -564,6 +1171,54 @@ class CacheTestBase(APITestBaseMixin):
 
 
 class DetailViewCacheTest(CacheTestBase, TestCase):
+    def test_get_multiple_fields_cached(self):
+        url = self.get_detail_url(self.tex_key, fields="image,creator")
+        resp = self.api_client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            self.test_cache.get(self.get_field_cache_key("creator")),
+            self.test_user.pk)
+
+        with CaptureQueriesContext(connection) as queries:
+            cached_resp = self.api_client.get(url)
+        self.assertFalse(
+            [q for q in queries if "latex_lateximage" in q["sql"]])
+        self.assertEqual(
+            json.loads(cached_resp.content.decode()),
+            json.loads(resp.content.decode()))
+
+    def test_get_multiple_fields_of_others(self):
+        url = self.get_detail_url(self.tex_key, fields="image,data_url")
+
+        # Cached by the owner
+        resp = self.api_client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            set(json.loads(resp.content.decode())),
+            {"image", "data_url"})
+
+        another_user = factories.UserFactory()
+        token, _ = Token.objects.get_or_create(user=another_user)
+        self.api_client.force_authenticate(user=None)
+        self.api_client.credentials(HTTP_AUTHORIZATION="Token %s" % token.key)
+        resp = self.api_client.get(url)
+        self.assertEqual(resp.status_code, 404)
+
+        # Not cached
+        self.test_cache.clear()
+        resp = self.api_client.get(url)
+        self.assertEqual(resp.status_code, 404)
+
+        self.api_client.credentials()
+        self.api_client.force_authenticate(user=self.superuser)
+        resp = self.api_client.get(url)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_get_multiple_fields_not_found(self):
+        resp = self.api_client.get(
+            self.get_detail_url("not_exist", fields="image,creator"))
+        self.assertEqual(resp.status_code, 404)
+
     def test_get_cached_image_arbitrary_value(self):
         filter_fields_str = "image"
         cache_key = self.get_field_cache_key(filter_fields_str)
@@ -863,3 +1518,174 @@ class CreateViewCacheTest(CacheTestBase, TestCase):
             self.assertEqual(
                 sorted(filter_fields_str.split(",")),
                 sorted(list(response_dict.keys())))
+
+
+class BulkLookupCacheTest(CacheTestBase, TestCase):
+    def get_lookup_url(self):
+        return reverse("lookup")
+
+    def post_lookup(self, tex_keys, fields=None):
+        data = {"tex_keys": tex_keys}
+        if fields is not None:
+            data["fields"] = fields
+        return self.api_client.post(
+            self.get_lookup_url(), data=data, format='json')
+
+    def test_not_authenticated(self):
+        self.api_client.force_authenticate(user=None)
+        resp = self.post_lookup([self.tex_key])
+        self.assertEqual(resp.status_code, 401)
+
+    def test_lookup(self):
+        instances = [self._obj] + factories.LatexImageFactory.create_batch(
+            creator=self.test_user, size=2)
+        tex_keys = [instance.tex_key for instance in instances]
+
+        resp = self.post_lookup(tex_keys + ["not_exist"], fields="image,creator")
+        self.assertEqual(resp.status_code, 200)
+
+        response_dict = json.loads(resp.content.decode())
+        self.assertIsNone(response_dict["not_exist"])
+        for instance in instances:
+            self.assertEqual(
+                sorted(response_dict[instance.tex_key]), ["creator", "image"])
+            self.assertEqual(
+                response_dict[instance.tex_key]["creator"],
+                self.test_user.pk)
+
+    def test_lookup_all_fields_not_cached(self):
+        resp = self.post_lookup([self.tex_key])
+        response_dict = json.loads(resp.content.decode())
+        self.assertEqual(
+            response_dict[self.tex_key]["data_url"], self._obj.data_url)
+        self.assertIsNone(
+            self.test_cache.get(self.get_field_cache_key("data_url")))
+
+    def test_lookup_cache_backfilled(self):
+        instances = [self._obj] + factories.LatexImageFactory.create_batch(
+            creator=self.test_user, size=2)
+        tex_keys = [instance.tex_key for instance in instances]
+
+        with CaptureQueriesContext(connection) as queries:
+            self.post_lookup(tex_keys, fields="image,data_url")
+        self.assertEqual(
+            len([q for q in queries if "latex_lateximage" in q["sql"]]), 1)
+
+        for instance in instances:
+            self.assertEqual(
+                self.test_cache.get(
+                    self.get_field_cache_key("data_url", instance.tex_key)),
+                instance.data_url)
+
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.post_lookup(tex_keys, fields="image,data_url")
+        self.assertFalse(
+            [q for q in queries if "latex_lateximage" in q["sql"]])
+
+        response_dict = json.loads(resp.content.decode())
+        for instance in instances:
+            self.assertEqual(
+                response_dict[instance.tex_key]["data_url"], instance.data_url)
+
+    def test_lookup_shares_single_field_cache(self):
+        self.set_field_cache("image", value="bar")
+
+        resp = self.post_lookup([self.tex_key], fields="image")
+        response_dict = json.loads(resp.content.decode())
+        self.assertEqual(response_dict[self.tex_key], {"image": "bar"})
+
+        # Not all the requested fields are cached
+        resp = self.post_lookup([self.tex_key], fields="image,data_url")
+        response_dict = json.loads(resp.content.decode())
+        self.assertEqual(
+            response_dict[self.tex_key]["data_url"], self._obj.data_url)
+
+    def test_lookup_compile_error(self):
+        instance = factories.LatexImageErrorFactory(creator=self.test_user)
+
+        for _ in range(2):
+            resp = self.post_lookup([instance.tex_key], fields="image")
+            response_dict = json.loads(resp.content.decode())
+            self.assertEqual(
+                response_dict[instance.tex_key],
+                {"compile_error": instance.compile_error})
+
+        self.assertEqual(
+            self.test_cache.get(
+                self.get_field_cache_key("compile_error", instance.tex_key)),
+            instance.compile_error)
+
+    def test_lookup_cache_improperly_configured(self):
+        with improperly_configured_cache_patch():
+            resp = self.post_lookup([self.tex_key], fields="data_url")
+        response_dict = json.loads(resp.content.decode())
+        self.assertEqual(
+            response_dict[self.tex_key], {"data_url": self._obj.data_url})
+
+    @override_settings(L2I_BULK_MAX_ITEMS=2)
+    def test_too_many_tex_keys(self):
+        resp = self.post_lookup(["a", "b", "c"])
+        self.assertContains(resp, "At most 2", status_code=400)
+
+    def test_unknown_fields(self):
+        resp = self.post_lookup([self.tex_key], fields="foo")
+        self.assertEqual(resp.status_code, 400)
+
+
+@override_settings(L2I_ACCESS_TRACKING=True)
+class AccessTrackingAPITest(CacheTestBase, TestCase):
+    # test the accesses are counted via latex.access.record_access
+    def setUp(self):
+        super().setUp()
+        patch = mock.patch("latex.access._access_tracker", None)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        patch = mock.patch("latex.access.AccessTracker.start")
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def get_access_counts(self):
+        from latex.access import get_access_tracker
+        return {
+            tex_key: count for tex_key, (count, _)
+            in get_access_tracker().buffer.drain().items()}
+
+    def test_detail(self):
+        url = self.get_detail_url(self.tex_key, fields="image")
+
+        # From the database, then from the cache
+        self.api_client.get(url)
+        self.api_client.get(url)
+        self.api_client.get(self.get_detail_url("not_existing", fields="image"))
+        self.assertEqual(self.get_access_counts(), {self.tex_key: 2})
+
+    def test_create_existing(self):
+        resp = self.api_client.post(
+            self.get_creat_url(),
+            data=self.get_post_data(tex_key=self.tex_key), format='json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.get_access_counts(), {self.tex_key: 1})
+
+    def test_create_cached(self):
+        self.set_field_cache("image")
+        resp = self.api_client.post(
+            self.get_creat_url(),
+            data={"tex_key": self.tex_key, "fields": "image"}, format='json')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(self.get_access_counts(), {self.tex_key: 1})
+
+    def test_lookup(self):
+        self.api_client.post(
+            reverse("lookup"),
+            data={"tex_keys": [self.tex_key, "not_existing"],
+                  "fields": "image"},
+            format='json')
+        self.assertEqual(self.get_access_counts(), {self.tex_key: 1})
+
+    def test_no_database_write(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.api_client.get(
+                self.get_detail_url(self.tex_key, fields="image"))
+        self.assertFalse(
+            [q for q in queries if q["sql"].startswith("UPDATE")])
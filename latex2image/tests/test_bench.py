@@ -0,0 +1,165 @@
+import json
+import os
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase
+
+from latex.bench import (SYNTHETIC_CASES, load_corpus, percentile,
+                         run_benchmark, summarize_latencies)
+from latex.constants import ALLOWED_COMPILER_FORMAT_COMBINATION
+from latex.converter import (ConvertedImage, ImageConvertError,
+                             LatexCompileError)
+from latex.executor import ConversionQueueFull
+
+IMAGE = ConvertedImage(b"x" * 10, "image/png")
+
+
+class BenchUtilsTest(SimpleTestCase):
+    # test latex.bench helpers
+    def test_percentile(self):
+        self.assertIsNone(percentile([], 50))
+        self.assertEqual(percentile([3], 99), 3)
+        self.assertEqual(percentile([4, 1, 3, 2], 0), 1)
+        self.assertEqual(percentile([4, 1, 3, 2], 100), 4)
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2.5)
+
+    def test_summarize_latencies(self):
+        self.assertEqual(summarize_latencies([])["n"], 0)
+        self.assertIsNone(summarize_latencies([])["p50"])
+
+        summary = summarize_latencies([1, 2, 3])
+        self.assertEqual(summary["n"], 3)
+        self.assertEqual(summary["mean"], 2)
+        self.assertEqual(summary["p50"], 2)
+
+    def test_load_corpus(self):
+        with tempfile.TemporaryDirectory() as corpus_dir:
+            os.makedirs(os.path.join(corpus_dir, "sub"))
+            for name in ["a.tex", os.path.join("sub", "b.tex"), "c.txt"]:
+                with open(os.path.join(corpus_dir, name), "w") as f:
+                    f.write("foo")
+
+            corpus = load_corpus([corpus_dir], synthetic=False)
+            self.assertEqual(
+                sorted(corpus), ["a.tex", os.path.join("sub", "b.tex")])
+
+            corpus = load_corpus([corpus_dir])
+            self.assertEqual(len(corpus), 2 + len(SYNTHETIC_CASES))
+
+
+class RunBenchmarkTest(SimpleTestCase):
+    # test latex.bench.run_benchmark
+    def setUp(self):
+        patcher = mock.patch(
+            "latex.converter.Tex2ImgBase.get_converted_image")
+        self.mock_convert = patcher.start()
+        self.mock_convert.return_value = IMAGE
+        self.addCleanup(patcher.stop)
+
+    def test_all_combinations(self):
+        corpus = {"foo": "foo", "bar": "bar"}
+        results = run_benchmark(corpus, repeat=2, concurrency_levels=(1, 2))
+
+        self.assertEqual(
+            len(results["results"]), len(ALLOWED_COMPILER_FORMAT_COMBINATION))
+
+        result = results["results"][0]
+        self.assertEqual(result["cold"]["n"], 2)
+        self.assertEqual(result["warm"]["n"], 4)
+        self.assertEqual(sorted(result["throughput"]), ["1", "2"])
+        self.assertGreater(result["throughput"]["1"], 0)
+        self.assertEqual(result["output_bytes"]["max"], 10)
+        self.assertEqual(result["errors"], {})
+        self.assertEqual(
+            result["failures"], {"warm": 0, "throughput": {"1": 0, "2": 0}})
+        self.assertIn("children", result["peak_rss_kb"])
+
+        # results are JSON serializable
+        json.dumps(results)
+
+    def test_compile_error(self):
+        self.mock_convert.side_effect = LatexCompileError("some error\nfoo")
+        results = run_benchmark(
+            {"foo": "foo"}, combinations=[("xelatex", "svg")])
+
+        result = results["results"][0]
+        self.assertEqual(result["cold"]["n"], 0)
+        self.assertEqual(result["errors"], {"foo": "LatexCompileError: some error"})
+        self.assertIsNone(result["throughput"]["1"])
+
+    def test_failures_counted(self):
+        self.mock_convert.side_effect = [
+            IMAGE, ImageConvertError("convert failed"),
+            IMAGE, ConversionQueueFull("queue is full", 5)] + [IMAGE] * 4
+        results = run_benchmark(
+            {"foo": "foo"}, combinations=[("xelatex", "svg")], repeat=1,
+            concurrency_levels=(1, 2))
+
+        result = results["results"][0]
+        self.assertEqual(result["cold"]["n"], 1)
+        self.assertEqual(result["warm"]["n"], 0)
+        self.assertEqual(
+            result["failures"], {"warm": 1, "throughput": {"1": 1, "2": 0}})
+        self.assertGreater(result["throughput"]["1"], 0)
+        self.assertGreater(result["throughput"]["2"], 0)
+
+    def test_combination_failed(self):
+        with mock.patch(
+                "latex.bench.benchmark_combination",
+                side_effect=MemoryError()):
+            results = run_benchmark(
+                {"foo": "foo"},
+                combinations=[("xelatex", "svg"), ("latex", "png")])
+
+        self.assertEqual(len(results["results"]), 2)
+        self.assertIn("MemoryError", results["results"][0]["error"])
+
+
+class BenchCommandTest(SimpleTestCase):
+    # test manage.py l2i_bench
+    def setUp(self):
+        patcher = mock.patch(
+            "latex.converter.Tex2ImgBase.get_converted_image")
+        self.mock_convert = patcher.start()
+        self.mock_convert.return_value = IMAGE
+        self.addCleanup(patcher.stop)
+
+    def test_stdout(self):
+        out = StringIO()
+        call_command(
+            "l2i_bench", "--combination", "xelatex2svg", "--repeat", "1",
+            "--no-synthetic", stdout=out)
+
+        results = json.loads(out.getvalue())
+        self.assertEqual(len(results["results"]), 1)
+        self.assertEqual(results["results"][0]["compiler"], "xelatex")
+        self.assertGreater(len(results["documents"]), 0)
+        self.assertTrue(
+            all(name not in SYNTHETIC_CASES for name in results["documents"]))
+
+    def test_output_file(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            output = os.path.join(output_dir, "bench.json")
+            call_command(
+                "l2i_bench", "--combination", "latex2png", "--repeat", "0",
+                "--concurrency", "2", "-o", output, stderr=StringIO())
+
+            with open(output) as f:
+                results = json.load(f)
+
+        self.assertIn("synthetic_tikz", results["documents"])
+        self.assertEqual(
+            list(results["results"][0]["throughput"]), ["2"])
+
+    def test_bad_options(self):
+        with self.assertRaises(CommandError):
+            call_command("l2i_bench", "--combination", "foo2bar")
+
+        with self.assertRaises(CommandError):
+            call_command("l2i_bench", "--repeat", "-1")
+
+        with self.assertRaises(CommandError):
+            call_command("l2i_bench", "--concurrency", "0")
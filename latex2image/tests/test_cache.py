@@ -0,0 +1,1167 @@
+import base64
+import json
+import os
+import pickle
+import zlib
+from fnmatch import fnmatchcase
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from prometheus_client import REGISTRY
+from tests import factories
+
+from latex.cache import (CACHED_FIELDS, COMPRESSED_VALUE_TAGS,
+                         GENERATION_CACHE_KEY, INVALIDATION_CHANNEL,
+                         LAYOUT_HASH, LAYOUT_KEYS, GreedyDualSizePolicy,
+                         HashFieldCache, InvalidationListener,
+                         KeyPerFieldCache, LocalFieldCache, PolicyFieldCache,
+                         TouchBuffer, TwoTierFieldCache, bump_cache_generation,
+                         decode_cache_value, encode_cache_value,
+                         get_cache_generation, get_field_cache,
+                         get_field_cache_key, get_hash_cache_key,
+                         get_local_field_cache, invalidate_local_field_cache,
+                         migrate_field_cache)
+from latex.receivers import get_render_costs
+from latex.timing import (STAGE_COMPILE, STAGE_CONVERT, STAGE_PERSIST,
+                          collect_timings, record_stage)
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    }
+}
+
+
+class FakePipeline(object):
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            self.commands.append((name, args, kwargs))
+        return command
+
+    def execute(self, raise_on_error=True):
+        self.redis.round_trips += 1
+        results = []
+        for name, args, kwargs in self.commands:
+            try:
+                results.append(getattr(self.redis, name)(*args, **kwargs))
+            except Exception as e:
+                if raise_on_error:
+                    raise
+                results.append(e)
+        return results
+
+
+class FakeRedis(object):
+    """
+    The hash commands of a redis client, counting round trips.
+    """
+
+    def __init__(self):
+        self.strings = {}
+        self.hashes = {}
+        self.zsets = {}
+        self.ttls = {}
+        self.round_trips = 0
+        self.published = []
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def hmget(self, key, fields):
+        return [self.hashes.get(key, {}).get(field) for field in fields]
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        mapping = dict(mapping or {})
+        if field is not None:
+            mapping[field] = value
+        self.hashes.setdefault(key, {}).update(mapping)
+        return len(mapping)
+
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def rename(self, key, new_key):
+        if key not in self.hashes:
+            raise ValueError("no such key")
+        self.hashes[new_key] = self.hashes.pop(key)
+        return True
+
+    def hdel(self, key, *fields):
+        values = self.hashes.get(key, {})
+        return len([values.pop(field) for field in fields if field in values])
+
+    def hincrby(self, key, field, amount=1):
+        values = self.hashes.setdefault(key, {})
+        values[field] = int(values.get(field, 0)) + amount
+        return values[field]
+
+    def expire(self, key, time):
+        self.ttls[key] = time
+        return key in self.hashes
+
+    def eval(self, script, numkeys, *keys_and_args):
+        # Only latex.access.HSET_MAX_SCRIPT
+        key, args = keys_and_args[0], keys_and_args[numkeys:]
+        values = self.hashes.setdefault(key, {})
+        for field, value in zip(args[::2], args[1::2]):
+            if field not in values or float(values[field]) < float(value):
+                values[field] = value
+        return 0
+
+    def zadd(self, key, mapping, xx=False):
+        zset = self.zsets.setdefault(key, {})
+        for member, score in mapping.items():
+            if not xx or member in zset:
+                zset[member] = score
+
+    def zpopmin(self, key, count=1):
+        zset = self.zsets.get(key, {})
+        popped = sorted(zset.items(), key=lambda item: item[1])[:count]
+        for member, _ in popped:
+            del zset[member]
+        return popped
+
+    def zrem(self, key, *members):
+        zset = self.zsets.get(key, {})
+        return len([zset.pop(member) for member in members if member in zset])
+
+    def set(self, key, value, nx=False, ex=None):
+        if nx and key in self.strings:
+            return None
+        self.strings[key] = value
+        self.ttls[key] = ex
+        return True
+
+    def hsetnx(self, key, field, value):
+        values = self.hashes.setdefault(key, {})
+        if field in values:
+            return 0
+        values[field] = value
+        return 1
+
+    def delete(self, *keys):
+        self.round_trips += 1
+        return len([
+            key for key in keys
+            if self.hashes.pop(key, None) is not None
+            or self.zsets.pop(key, None) is not None])
+
+    def publish(self, channel, message):
+        self.round_trips += 1
+        self.published.append((channel, message))
+        return 1
+
+
+class FakeRedisCache(object):
+    """
+    The parts of a django-redis cache used by the field caches.
+    """
+
+    def __init__(self):
+        self.redis = FakeRedis()
+        self.values = {}
+        self.timeouts = {}
+        self.client = self
+
+    # {{{ client
+
+    def get_client(self, write=True):
+        return self.redis
+
+    def encode(self, value):
+        return pickle.dumps(value)
+
+    def decode(self, value):
+        return pickle.loads(value)
+
+    # }}}
+
+    def make_key(self, key):
+        return ":1:%s" % key
+
+    def iter_keys(self, pattern):
+        for key in (list(self.values) + list(self.redis.strings)
+                    + list(self.redis.hashes)):
+            if fnmatchcase(key, self.make_key(pattern)):
+                yield key[len(self.make_key("")):]
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def incr(self, key, delta=1):
+        if self.make_key(key) not in self.values:
+            raise ValueError("Key '%s' not found" % key)
+        self.values[self.make_key(key)] += delta
+        return self.values[self.make_key(key)]
+
+    def get_many(self, keys):
+        result = {}
+        for key in keys:
+            if self.make_key(key) in self.values:
+                result[key] = self.values[self.make_key(key)]
+            elif self.make_key(key) in self.redis.strings:
+                # Added via the client
+                result[key] = self.decode(
+                    self.redis.strings[self.make_key(key)])
+        return result
+
+    def set_many(self, data, timeout=None):
+        # Like django-redis, in the store of the SET NX of the client
+        for key, value in data.items():
+            self.redis.strings[self.make_key(key)] = self.encode(value)
+            self.timeouts[self.make_key(key)] = timeout
+
+    def add(self, key, value, timeout=None):
+        if (self.make_key(key) in self.values
+                or self.make_key(key) in self.redis.strings):
+            return False
+        self.values[self.make_key(key)] = value
+        self.timeouts[self.make_key(key)] = timeout
+        return True
+
+    def delete_many(self, keys):
+        for key in keys:
+            self.values.pop(self.make_key(key), None)
+            self.redis.strings.pop(self.make_key(key), None)
+
+
+class HashFieldCacheTest(SimpleTestCase):
+    # test latex.cache.HashFieldCache
+    def setUp(self):
+        self.cache = FakeRedisCache()
+        self.field_cache = HashFieldCache(self.cache)
+
+    def test_get_many_one_round_trip(self):
+        self.field_cache.set_many({
+            "foo": {"image": "foo.png", "creator": 1},
+            "bar": {"compile_error": "some error"},
+        })
+        self.assertEqual(self.cache.redis.round_trips, 1)
+        self.assertIn(
+            self.cache.make_key(get_hash_cache_key("foo")), self.cache.redis.hashes)
+
+        result = self.field_cache.get_many(
+            ["foo", "bar", "baz"], ["image", "creator", "compile_error"])
+        self.assertEqual(self.cache.redis.round_trips, 2)
+        self.assertEqual(result, {
+            "foo": {"image": "foo.png", "creator": 1},
+            "bar": {"compile_error": "some error"},
+        })
+
+    def test_set_many_not_overwrite(self):
+        self.field_cache.set_many({"foo": {"image": "foo.png"}})
+        self.field_cache.set_many(
+            {"foo": {"image": "bar.png", "creator": 1}}, overwrite=False)
+        self.assertEqual(
+            self.field_cache.get_many(["foo"], ["image", "creator"]),
+            {"foo": {"image": "foo.png", "creator": 1}})
+
+        self.field_cache.set_many({"foo": {"image": "bar.png"}})
+        self.assertEqual(
+            self.field_cache.get_many(["foo"], ["image"]),
+            {"foo": {"image": "bar.png"}})
+
+    def test_delete_many_one_round_trip(self):
+        self.field_cache.set_many({
+            "foo": {"image": "foo.png", "data_url": "data:"},
+            "bar": {"image": "bar.png"},
+        })
+        self.cache.redis.round_trips = 0
+
+        self.field_cache.delete_many(["foo", "bar"])
+        self.assertEqual(self.cache.redis.round_trips, 1)
+        self.assertEqual(
+            self.field_cache.get_many(["foo", "bar"], CACHED_FIELDS), {})
+
+    def test_empty(self):
+        self.assertEqual(self.field_cache.get_many([], ["image"]), {})
+        self.field_cache.delete_many([])
+        self.assertEqual(self.cache.redis.round_trips, 0)
+
+    def test_connection_error_ignored(self):
+        from redis.exceptions import ConnectionError
+
+        self.cache._ignore_exceptions = True
+        with mock.patch.object(
+                self.cache.redis, "pipeline", side_effect=ConnectionError()):
+            self.assertEqual(self.field_cache.get_many(["foo"], ["image"]), {})
+
+    def test_connection_error_raised(self):
+        from redis.exceptions import ConnectionError
+
+        with mock.patch.object(
+                self.cache.redis, "pipeline", side_effect=ConnectionError()):
+            with self.assertRaises(ConnectionError):
+                self.field_cache.get_many(["foo"], ["image"])
+
+    def test_iter_tex_keys(self):
+        self.field_cache.set_many({
+            "foo": {"image": "foo.png"}, "bar_v1": {"image": "bar.png"}})
+        self.assertEqual(
+            sorted(self.field_cache.iter_tex_keys()), ["bar_v1", "foo"])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class KeyPerFieldCacheTest(SimpleTestCase):
+    # test latex.cache.KeyPerFieldCache
+    def setUp(self):
+        from django.core.cache import caches
+        self.cache = caches["default"]
+        self.addCleanup(self.cache.clear)
+        self.field_cache = KeyPerFieldCache(self.cache)
+
+    def test_get_set_delete(self):
+        self.field_cache.set_many({
+            "foo": {"image": "foo.png", "creator": 1},
+            "bar": {"compile_error": "some error"},
+        })
+        self.assertEqual(self.cache.get("foo:image"), "foo.png")
+
+        self.assertEqual(
+            self.field_cache.get_many(["foo", "bar", "baz"], ["image"]),
+            {"foo": {"image": "foo.png"}})
+
+        self.field_cache.set_many(
+            {"foo": {"image": "bar.png"}}, overwrite=False)
+        self.assertEqual(self.cache.get("foo:image"), "foo.png")
+
+        self.field_cache.delete_many(["foo", "bar"])
+        self.assertEqual(
+            self.field_cache.get_many(["foo", "bar"], CACHED_FIELDS), {})
+
+    def test_iter_tex_keys_requires_redis(self):
+        with self.assertRaises(NotImplementedError):
+            list(self.field_cache.iter_tex_keys())
+
+
+class GetFieldCacheTest(SimpleTestCase):
+    # test latex.cache.get_field_cache
+    @override_settings(CACHES=LOCMEM_CACHES, L2I_CACHE_LAYOUT=LAYOUT_HASH)
+    def test_hash_layout_falls_back_without_redis(self):
+        self.assertIsInstance(get_field_cache(), KeyPerFieldCache)
+
+    @override_settings(L2I_CACHE_LAYOUT=LAYOUT_HASH)
+    def test_hash_layout(self):
+        with mock.patch(
+                "latex.cache.get_default_cache", return_value=FakeRedisCache()):
+            self.assertIsInstance(get_field_cache(), HashFieldCache)
+            self.assertIsInstance(
+                get_field_cache(LAYOUT_KEYS), KeyPerFieldCache)
+
+    def test_no_cache(self):
+        with mock.patch("latex.cache.get_default_cache", return_value=None):
+            self.assertIsNone(get_field_cache())
+
+
+class MigrateFieldCacheTest(SimpleTestCase):
+    # test latex.cache.migrate_field_cache and the l2i_migrate_cache command
+    def setUp(self):
+        self.cache = FakeRedisCache()
+        self.keys_cache = KeyPerFieldCache(self.cache)
+        self.hash_cache = HashFieldCache(self.cache)
+
+        self.values = {
+            "foo_%d" % i: {"image": "foo_%d.png" % i, "creator": i}
+            for i in range(5)}
+        self.values["bar"] = {"compile_error": "some error"}
+        self.keys_cache.set_many(self.values)
+
+    def test_migrate(self):
+        n_migrated = migrate_field_cache(
+            self.keys_cache, self.hash_cache, batch_size=2)
+        self.assertEqual(n_migrated, 6)
+        self.assertEqual(
+            self.hash_cache.get_many(list(self.values), CACHED_FIELDS),
+            self.values)
+        self.assertEqual(self.cache.redis.strings, {})
+
+        # and back
+        migrate_field_cache(self.hash_cache, self.keys_cache)
+        self.assertEqual(
+            self.keys_cache.get_many(list(self.values), CACHED_FIELDS),
+            self.values)
+        self.assertEqual(self.cache.redis.hashes, {})
+
+    def test_migrate_keep_source(self):
+        migrate_field_cache(
+            self.keys_cache, self.hash_cache, delete_source=False)
+        self.assertEqual(
+            self.keys_cache.get_many(list(self.values), CACHED_FIELDS),
+            self.values)
+
+    def test_command(self):
+        out = StringIO()
+        with mock.patch(
+                "latex.cache.get_default_cache", return_value=self.cache):
+            call_command("l2i_migrate_cache", "--to", "hash", stdout=out)
+        self.assertIn("Migrated the cache of 6 tex_key(s)", out.getvalue())
+        self.assertEqual(
+            self.hash_cache.get_many(list(self.values), CACHED_FIELDS),
+            self.values)
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_command_requires_redis(self):
+        with self.assertRaises(CommandError):
+            call_command("l2i_migrate_cache")
+
+    def test_command_batch_size_error(self):
+        with mock.patch(
+                "latex.cache.get_default_cache", return_value=self.cache):
+            with self.assertRaises(CommandError):
+                call_command("l2i_migrate_cache", "--batch-size", "0")
+
+
+def get_sample_value(name, labels=None):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class LocalFieldCacheTest(SimpleTestCase):
+    # test latex.cache.LocalFieldCache
+    def test_get_update(self):
+        local = LocalFieldCache(1024)
+        self.assertIsNone(local.get("foo", ["image"]))
+
+        local.update("foo", {"image": "foo.png", "compile_error": None})
+        self.assertEqual(
+            local.get("foo", ["image", "compile_error"]),
+            {"image": "foo.png", "compile_error": None})
+
+        # data_url is unknown
+        self.assertIsNone(local.get("foo", ["image", "data_url"]))
+
+        local.update("foo", {"data_url": "data:"})
+        self.assertEqual(
+            local.get("foo", ["image", "data_url"]),
+            {"image": "foo.png", "data_url": "data:"})
+
+    def test_evict_least_recently_used_by_bytes(self):
+        local = LocalFieldCache(30)
+        local.update("foo", {"image": "a" * 10})
+        local.update("bar", {"image": "b" * 10})
+        self.assertEqual(local.total_bytes, 26)
+
+        # foo is used
+        local.get("foo", ["image"])
+        local.update("baz", {"image": "c" * 10})
+
+        self.assertIsNone(local.get("bar", ["image"]))
+        self.assertIsNotNone(local.get("foo", ["image"]))
+        self.assertIsNotNone(local.get("baz", ["image"]))
+        self.assertEqual(local.total_bytes, 26)
+
+    def test_too_large(self):
+        local = LocalFieldCache(10)
+        local.update("foo", {"image": "a" * 10})
+        self.assertEqual(len(local), 0)
+        self.assertEqual(local.total_bytes, 0)
+
+    def test_stale_generation_not_kept(self):
+        local = LocalFieldCache(1024)
+        generation = local.generation
+        local.delete_many(["foo"])
+
+        local.update("foo", {"image": "foo.png"}, generation=generation)
+        self.assertIsNone(local.get("foo", ["image"]))
+
+        local.update("foo", {"image": "foo.png"}, generation=local.generation)
+        self.assertIsNotNone(local.get("foo", ["image"]))
+
+    def test_delete_clear(self):
+        local = LocalFieldCache(1024)
+        local.update("foo", {"image": "foo.png"})
+        local.update("bar", {"image": "bar.png"})
+
+        local.delete_many(["foo"])
+        self.assertIsNone(local.get("foo", ["image"]))
+        self.assertEqual(len(local), 1)
+
+        local.clear()
+        self.assertEqual(len(local), 0)
+        self.assertEqual(local.total_bytes, 0)
+
+
+class TwoTierFieldCacheTest(SimpleTestCase):
+    # test latex.cache.TwoTierFieldCache
+    def setUp(self):
+        self.cache = FakeRedisCache()
+        self.remote = HashFieldCache(self.cache)
+        self.local = LocalFieldCache(1024)
+        self.field_cache = TwoTierFieldCache(self.local, self.remote)
+
+    def test_get_many_local_hit(self):
+        self.remote.set_many({
+            "foo": {"image": "foo.png"}, "bar": {"compile_error": "error"}})
+        self.cache.redis.round_trips = 0
+
+        local_hit = {"tier": "local", "result": "hit"}
+        remote_hit = {"tier": "remote", "result": "hit"}
+        remote_miss = {"tier": "remote", "result": "miss"}
+        before = {
+            labels["tier"] + labels["result"]: get_sample_value(
+                "l2i_field_cache_requests_total", labels)
+            for labels in [local_hit, remote_hit, remote_miss]}
+
+        def get_increase(labels):
+            return get_sample_value(
+                "l2i_field_cache_requests_total", labels) - before[
+                labels["tier"] + labels["result"]]
+
+        expected = {
+            "foo": {"image": "foo.png"}, "bar": {"compile_error": "error"}}
+        fields = ["image", "compile_error"]
+        self.assertEqual(
+            self.field_cache.get_many(["foo", "bar", "baz"], fields), expected)
+        self.assertEqual(self.cache.redis.round_trips, 1)
+        self.assertEqual(get_increase(remote_hit), 2)
+        self.assertEqual(get_increase(remote_miss), 1)
+
+        # All served by the local tier, including the miss of baz
+        self.assertEqual(
+            self.field_cache.get_many(["foo", "bar", "baz"], fields), expected)
+        self.assertEqual(self.cache.redis.round_trips, 1)
+        self.assertEqual(get_increase(local_hit), 3)
+
+    def test_set_many(self):
+        self.field_cache.set_many({"foo": {"image": "foo.png"}})
+        self.assertEqual(
+            self.local.get("foo", ["image"]), {"image": "foo.png"})
+        self.assertEqual(
+            self.remote.get_many(["foo"], ["image"]),
+            {"foo": {"image": "foo.png"}})
+
+        self.field_cache.set_many(
+            {"foo": {"image": "bar.png"}}, overwrite=False)
+        self.assertIsNone(self.local.get("foo", ["image"]))
+        self.assertEqual(
+            self.field_cache.get_many(["foo"], ["image"]),
+            {"foo": {"image": "foo.png"}})
+
+    def test_delete_many(self):
+        self.field_cache.set_many({"foo": {"image": "foo.png"}})
+        self.field_cache.delete_many(["foo"])
+        self.assertIsNone(self.local.get("foo", ["image"]))
+        self.assertEqual(self.field_cache.get_many(["foo"], ["image"]), {})
+
+
+class FakePubSub(object):
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.subscribed = []
+        self.closed = False
+
+    def subscribe(self, channel):
+        self.subscribed.append(channel)
+
+    def get_message(self, timeout=None):
+        if self.messages:
+            return self.messages.pop(0)
+        raise ConnectionError("connection closed")
+
+    def close(self):
+        self.closed = True
+
+
+class InvalidationTest(SimpleTestCase):
+    # test the invalidation of the local field caches
+    def setUp(self):
+        self.cache = FakeRedisCache()
+        self.local = LocalFieldCache(1024)
+        self.local.update("foo", {"image": "foo.png"})
+        self.local.update("bar", {"image": "bar.png"})
+
+        for name in ["_local_field_cache", "_invalidation_listener"]:
+            patch = mock.patch("latex.cache.%s" % name, None)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_handle_message(self):
+        listener = InvalidationListener(self.local, self.cache)
+        listener.handle_message({"type": "subscribe", "data": 1})
+        listener.handle_message({"type": "message", "data": "not json"})
+        self.assertEqual(len(self.local), 2)
+
+        listener.handle_message(
+            {"type": "message", "data": json.dumps(["foo"])})
+        self.assertIsNone(self.local.get("foo", ["image"]))
+        self.assertIsNotNone(self.local.get("bar", ["image"]))
+
+    def test_run(self):
+        listener = InvalidationListener(self.local, self.cache)
+        pubsub = FakePubSub(
+            [None, {"type": "message", "data": json.dumps(["foo"])}])
+
+        def stop_on_error(interval):
+            listener.stop()
+
+        with mock.patch.object(
+                self.cache.redis, "pubsub", create=True, return_value=pubsub):
+            with mock.patch.object(
+                    listener._stop_event, "wait", side_effect=stop_on_error):
+                listener.run()
+
+        self.assertEqual(pubsub.subscribed, [INVALIDATION_CHANNEL])
+        self.assertTrue(pubsub.closed)
+        self.assertIsNone(self.local.get("foo", ["image"]))
+
+        # Invalidations may be missed after the connection error
+        self.assertEqual(len(self.local), 0)
+
+    @override_settings(L2I_LOCAL_CACHE_MAX_BYTES=1024)
+    def test_invalidate_publishes(self):
+        with mock.patch(
+                "latex.cache.get_default_cache", return_value=self.cache):
+            with mock.patch("latex.cache.InvalidationListener.start"):
+                local = get_local_field_cache()
+                local.update("foo", {"image": "foo.png"})
+
+                invalidate_local_field_cache(["foo"])
+
+        self.assertIsNone(local.get("foo", ["image"]))
+        self.assertEqual(
+            self.cache.redis.published,
+            [(INVALIDATION_CHANNEL, json.dumps(["foo"]))])
+
+    @override_settings(L2I_LOCAL_CACHE_MAX_BYTES=0)
+    def test_disabled(self):
+        self.assertIsNone(get_local_field_cache())
+        invalidate_local_field_cache(["foo"])
+
+    @override_settings(CACHES=LOCMEM_CACHES, L2I_LOCAL_CACHE_MAX_BYTES=1024)
+    def test_get_local_field_cache(self):
+        local = get_local_field_cache()
+        self.assertEqual(local.max_bytes, 1024)
+        self.assertIs(get_local_field_cache(), local)
+        self.assertIsInstance(get_field_cache(), TwoTierFieldCache)
+
+        with mock.patch("latex.cache.os.getpid", return_value=-1):
+            self.assertIsNot(get_local_field_cache(), local)
+
+        with override_settings(L2I_LOCAL_CACHE_MAX_BYTES=2048):
+            self.assertEqual(get_local_field_cache().max_bytes, 2048)
+
+
+class CacheGenerationTest(SimpleTestCase):
+    # test the namespacing of cache keys by the cache generation
+    def setUp(self):
+        self.cache = FakeRedisCache()
+        for name in ["_local_field_cache", "_invalidation_listener",
+                     "_cache_generation"]:
+            patch = mock.patch("latex.cache.%s" % name, None)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        patch = mock.patch(
+            "latex.cache.get_default_cache", return_value=self.cache)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_cache_keys(self):
+        self.assertEqual(get_field_cache_key("foo", "image"), "foo:image")
+        self.assertEqual(
+            get_field_cache_key("foo", "image", 3), "g3:foo:image")
+        self.assertEqual(get_hash_cache_key("foo", 3), "g3:foo:fields")
+
+    @override_settings(L2I_CACHE_LAYOUT=LAYOUT_KEYS)
+    def test_bump_keys_layout(self):
+        field_cache = get_field_cache()
+        field_cache.set_many({"foo": {"image": "foo.png"}})
+        self.assertIn(
+            self.cache.make_key(get_field_cache_key("foo", "image")),
+            self.cache.redis.strings)
+
+        self.assertEqual(bump_cache_generation(), 1)
+        field_cache = get_field_cache()
+        self.assertEqual(field_cache.get_many(["foo"], ["image"]), {})
+
+        field_cache.set_many({"foo": {"image": "foo_1.png"}})
+        self.assertEqual(
+            self.cache.get(get_field_cache_key("foo", "image", 1)),
+            "foo_1.png")
+        self.assertEqual(list(field_cache.iter_tex_keys()), ["foo"])
+
+        self.assertEqual(bump_cache_generation(), 2)
+        self.assertEqual(list(get_field_cache().iter_tex_keys()), [])
+
+    @override_settings(L2I_CACHE_LAYOUT=LAYOUT_HASH)
+    def test_bump_hash_layout(self):
+        get_field_cache().set_many({"foo": {"image": "foo.png"}})
+        bump_cache_generation()
+
+        field_cache = get_field_cache()
+        self.assertEqual(field_cache.generation, 1)
+        self.assertEqual(field_cache.get_many(["foo"], ["image"]), {})
+        self.assertEqual(list(field_cache.iter_tex_keys()), [])
+
+        field_cache.set_many({"bar": {"image": "bar.png"}})
+        self.assertEqual(list(field_cache.iter_tex_keys()), ["bar"])
+        self.assertEqual(
+            list(HashFieldCache(self.cache).iter_tex_keys()), ["foo"])
+
+        # Deleting an instance is still one DEL
+        round_trips = self.cache.redis.round_trips
+        field_cache.delete_many(["bar"])
+        self.assertEqual(self.cache.redis.round_trips, round_trips + 1)
+        self.assertEqual(field_cache.get_many(["bar"], ["image"]), {})
+
+    @override_settings(L2I_LOCAL_CACHE_MAX_BYTES=1024,
+                       L2I_CACHE_MEMORY_BUDGET_BYTES=1024)
+    def test_bump_clears(self):
+        with mock.patch("latex.cache.InvalidationListener.start"):
+            local = get_local_field_cache()
+        local.update("foo", {"image": "foo.png"})
+        self.cache.redis.zadd(
+            self.cache.make_key("l2i:gds:queue"), {"foo": 1})
+
+        bump_cache_generation()
+
+        self.assertEqual(len(local), 0)
+        self.assertEqual(
+            self.cache.redis.published, [(INVALIDATION_CHANNEL, "null")])
+        self.assertNotIn(
+            self.cache.make_key("l2i:gds:queue"), self.cache.redis.zsets)
+
+    @override_settings(L2I_CACHE_GENERATION_CHECK_INTERVAL=3600)
+    def test_check_interval(self):
+        self.assertEqual(get_cache_generation(self.cache), 0)
+
+        # Bumped by another process
+        self.cache.add(GENERATION_CACHE_KEY, 5)
+        self.assertEqual(get_cache_generation(self.cache), 0)
+
+        local = LocalFieldCache(1024)
+        local.update("foo", {"image": "foo.png"})
+        listener = InvalidationListener(local, self.cache)
+        listener.handle_message({"type": "message", "data": "null"})
+        self.assertEqual(len(local), 0)
+        self.assertEqual(get_cache_generation(self.cache), 5)
+
+    @override_settings(L2I_CACHE_GENERATION_CHECK_INTERVAL=0,
+                       L2I_LOCAL_CACHE_MAX_BYTES=1024)
+    def test_generation_changed_clears_local(self):
+        with mock.patch("latex.cache.InvalidationListener.start"):
+            local = get_local_field_cache()
+        get_cache_generation(self.cache)
+        local.update("foo", {"image": "foo.png"})
+
+        self.cache.add(GENERATION_CACHE_KEY, 1)
+        self.assertEqual(get_cache_generation(self.cache), 1)
+        self.assertEqual(len(local), 0)
+
+    def test_command(self):
+        out = StringIO()
+        call_command("l2i_bump_cache_generation", stdout=out)
+        self.assertIn("Bumped the cache generation to 1", out.getvalue())
+
+    def test_command_no_cache(self):
+        with mock.patch("latex.cache.get_default_cache", return_value=None):
+            with self.assertRaises(CommandError):
+                call_command("l2i_bump_cache_generation")
+
+    def test_command_error(self):
+        with mock.patch.object(self.cache, "incr", return_value=None):
+            with self.assertRaises(CommandError):
+                call_command("l2i_bump_cache_generation")
+
+
+@override_settings(CACHES=LOCMEM_CACHES, L2I_LOCAL_CACHE_MAX_BYTES=1048576)
+class LocalFieldCacheReceiversTest(TestCase):
+    # test the local field cache is invalidated by latex.receivers
+    def setUp(self):
+        patch = mock.patch("latex.cache._local_field_cache", None)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+        from django.core.cache import caches
+        self.addCleanup(caches["default"].clear)
+
+    def test_invalidated_on_save_and_delete(self):
+        instance = factories.LatexImageFactory()
+        field_cache = get_field_cache()
+        self.assertEqual(
+            field_cache.get_many([instance.tex_key], ["image"]),
+            {instance.tex_key: {"image": str(instance.image)}})
+
+        local = get_local_field_cache()
+        self.assertIsNotNone(local.get(instance.tex_key, ["image"]))
+
+        instance.save()
+        self.assertIsNone(local.get(instance.tex_key, ["image"]))
+
+        field_cache.get_many([instance.tex_key], ["image"])
+        instance.delete()
+        self.assertIsNone(local.get(instance.tex_key, ["image"]))
+        self.assertEqual(field_cache.get_many([instance.tex_key], ["image"]), {})
+
+
+class FakeZstandard(object):
+    """
+    zstandard, which is optional, with zlib.
+    """
+
+    class ZstdCompressor(object):
+        def __init__(self, level=3):
+            self.level = level
+
+        def compress(self, data):
+            return b"zstd" + zlib.compress(data, min(self.level, 9))
+
+    class ZstdDecompressor(object):
+        def decompress(self, data):
+            assert data.startswith(b"zstd")
+            return zlib.decompress(data[4:])
+
+
+SVG_DATA_URL = "data:image/svg+xml;base64," + "PHN2Zz48L3N2Zz4" * 100
+
+
+@override_settings(L2I_CACHE_MAX_BYTES=100000, L2I_CACHE_COMPRESSION="zlib",
+                   L2I_CACHE_COMPRESSION_LEVEL=None,
+                   L2I_CACHE_COMPRESSION_MIN_BYTES=100,
+                   L2I_CACHE_COMPRESSION_MIN_BYTES_BY_FORMAT=None)
+class CacheValueEncodingTest(SimpleTestCase):
+    # test latex.cache.encode_cache_value and decode_cache_value
+    def get_sample_value(self, name, value_format, algorithm="zlib"):
+        return REGISTRY.get_sample_value(
+            name, {"algorithm": algorithm, "value_format": value_format}) or 0
+
+    def test_small_not_compressed(self):
+        self.assertEqual(encode_cache_value("a" * 100), "a" * 100)
+        self.assertEqual(encode_cache_value(1), 1)
+
+    def test_large_compressed(self):
+        encoded = encode_cache_value(SVG_DATA_URL)
+        self.assertTrue(encoded.startswith(COMPRESSED_VALUE_TAGS["zlib"]))
+        self.assertLess(len(encoded), len(SVG_DATA_URL) / 3)
+        self.assertEqual(decode_cache_value(encoded), SVG_DATA_URL)
+
+    @override_settings(L2I_CACHE_COMPRESSION_LEVEL=1)
+    def test_level(self):
+        self.assertEqual(
+            encode_cache_value(SVG_DATA_URL),
+            COMPRESSED_VALUE_TAGS["zlib"]
+            + zlib.compress(SVG_DATA_URL.encode(), 1))
+
+    @override_settings(L2I_CACHE_COMPRESSION="none")
+    def test_not_compressed(self):
+        self.assertEqual(encode_cache_value(SVG_DATA_URL), SVG_DATA_URL)
+
+    @override_settings(L2I_CACHE_COMPRESSION_MIN_BYTES=0)
+    def test_not_smaller_not_compressed(self):
+        self.assertEqual(encode_cache_value("ab"), "ab")
+
+    @override_settings(L2I_CACHE_COMPRESSION_MIN_BYTES_BY_FORMAT={
+        "png": None, "text": 5000})
+    def test_min_bytes_by_format(self):
+        png_data_url = "data:image/png;base64," + "a" * 1000
+        self.assertEqual(encode_cache_value(png_data_url), png_data_url)
+        self.assertEqual(encode_cache_value("a" * 1000), "a" * 1000)
+        self.assertTrue(encode_cache_value("a" * 5001).startswith(
+            COMPRESSED_VALUE_TAGS["zlib"]))
+
+        # Not overridden
+        self.assertTrue(encode_cache_value(SVG_DATA_URL).startswith(
+            COMPRESSED_VALUE_TAGS["zlib"]))
+
+    @override_settings(L2I_CACHE_MAX_BYTES=100)
+    def test_too_large(self):
+        self.assertIsNone(
+            encode_cache_value(base64.b64encode(os.urandom(1000)).decode()))
+
+    @override_settings(L2I_CACHE_MAX_BYTES=300)
+    def test_fits_when_compressed(self):
+        self.assertIsNotNone(encode_cache_value(SVG_DATA_URL))
+
+    @override_settings(L2I_CACHE_COMPRESSION="zstd")
+    def test_zstd(self):
+        with mock.patch("latex.cache.zstandard", FakeZstandard):
+            encoded = encode_cache_value(SVG_DATA_URL)
+            self.assertTrue(encoded.startswith(COMPRESSED_VALUE_TAGS["zstd"]))
+            self.assertEqual(decode_cache_value(encoded), SVG_DATA_URL)
+
+            # Entries compressed with another algorithm are still read
+            zlib_encoded = (
+                COMPRESSED_VALUE_TAGS["zlib"]
+                + zlib.compress(SVG_DATA_URL.encode()))
+            self.assertEqual(decode_cache_value(zlib_encoded), SVG_DATA_URL)
+
+    def test_zstd_not_available(self):
+        encoded = COMPRESSED_VALUE_TAGS["zstd"] + b"zstd" + zlib.compress(
+            SVG_DATA_URL.encode())
+        with mock.patch("latex.cache.zstandard", None):
+            self.assertIsNone(decode_cache_value(encoded))
+
+            cache = FakeRedisCache()
+            field_cache = HashFieldCache(cache)
+            field_cache.set_many({"foo": {"data_url": "bar"}})
+            cache.redis.hashes[field_cache._make_key("foo")]["data_url"] = (
+                cache.client.encode(encoded))
+            self.assertEqual(
+                field_cache.get_many(["foo"], ["data_url"]), {})
+
+    def test_decode_not_compressed(self):
+        self.assertEqual(decode_cache_value("foo"), "foo")
+        self.assertEqual(decode_cache_value(b"foo"), b"foo")
+        self.assertEqual(decode_cache_value(None), None)
+
+    def test_metrics(self):
+        before = {
+            name: self.get_sample_value(name, "svg")
+            for name in ["l2i_cache_compression_ratio_count",
+                         "l2i_cache_compression_input_bytes_total",
+                         "l2i_cache_compression_output_bytes_total"]}
+
+        encoded = encode_cache_value(SVG_DATA_URL)
+
+        self.assertEqual(
+            self.get_sample_value("l2i_cache_compression_ratio_count", "svg")
+            - before["l2i_cache_compression_ratio_count"], 1)
+        self.assertEqual(
+            self.get_sample_value(
+                "l2i_cache_compression_input_bytes_total", "svg")
+            - before["l2i_cache_compression_input_bytes_total"],
+            len(SVG_DATA_URL))
+        self.assertEqual(
+            self.get_sample_value(
+                "l2i_cache_compression_output_bytes_total", "svg")
+            - before["l2i_cache_compression_output_bytes_total"],
+            len(encoded))
+
+    @override_settings(L2I_CACHE_MAX_BYTES=300)
+    def test_field_caches(self):
+        cache = FakeRedisCache()
+        for field_cache in [KeyPerFieldCache(cache), HashFieldCache(cache)]:
+            with self.subTest(field_cache=type(field_cache).__name__):
+                sizes = field_cache.set_many(
+                    {"foo": {"data_url": SVG_DATA_URL,
+                             "image": "b" * 1000000}})
+                self.assertLessEqual(sum(sizes["foo"].values()), 300)
+                self.assertEqual(
+                    field_cache.get_many(["foo"], ["data_url", "image"]),
+                    {"foo": {"data_url": SVG_DATA_URL}})
+
+
+class CacheTimeoutTest(SimpleTestCase):
+    # test the timeouts of the cached fields
+    def setUp(self):
+        self.cache = FakeRedisCache()
+
+    @override_settings(L2I_CACHE_TIMEOUT=3600,
+                       L2I_CACHE_COMPILE_ERROR_TIMEOUT=60)
+    def test_key_per_field_cache(self):
+        field_cache = KeyPerFieldCache(self.cache)
+        field_cache.set_many({
+            "foo": {"image": "foo.png"},
+            "bar": {"compile_error": "error"}})
+        self.assertEqual(self.cache.timeouts, {
+            self.cache.make_key("foo:image"): 3600,
+            self.cache.make_key("bar:compile_error"): 60})
+
+        # Added in one pipeline with django-redis
+        field_cache.set_many({
+            "baz": {"image": "baz.png"},
+            "qux": {"image": "qux.png"}}, overwrite=False)
+        self.assertEqual(self.cache.redis.round_trips, 1)
+        self.assertEqual(self.cache.redis.ttls, {
+            self.cache.make_key("baz:image"): 3600,
+            self.cache.make_key("qux:image"): 3600})
+
+        field_cache.set_many(
+            {"baz": {"image": "other.png"}}, overwrite=False)
+        self.assertEqual(
+            field_cache.get_many(["baz"], ["image"]),
+            {"baz": {"image": "baz.png"}})
+
+    @override_settings(L2I_CACHE_TIMEOUT=None,
+                       L2I_CACHE_COMPILE_ERROR_TIMEOUT=60)
+    def test_hash_field_cache(self):
+        field_cache = HashFieldCache(self.cache)
+        field_cache.set_many({
+            "foo": {"image": "foo.png"},
+            "bar": {"compile_error": "error"}})
+
+        self.assertEqual(self.cache.redis.ttls, {
+            self.cache.make_key(get_hash_cache_key("bar")): 60})
+
+
+def image_sizes(**sizes):
+    return {tex_key: {"image": size} for tex_key, size in sizes.items()}
+
+
+class GreedyDualSizePolicyTest(SimpleTestCase):
+    # test latex.cache.GreedyDualSizePolicy
+    def setUp(self):
+        self.cache = FakeRedisCache()
+        self.policy = GreedyDualSizePolicy(
+            self.cache, budget_bytes=100, default_cost_ms=100.)
+
+    def get_total_bytes(self):
+        return self.cache.redis.hashes.get(
+            self.policy.meta_key, {}).get("bytes", 0)
+
+    def test_within_budget(self):
+        self.assertEqual(self.policy.admit(image_sizes(foo=50, bar=50)), [])
+        self.assertEqual(self.get_total_bytes(), 100)
+
+    def test_evict_cheap_and_large_first(self):
+        self.assertEqual(
+            self.policy.admit(
+                image_sizes(cheap=40, costly=40),
+                {"cheap": 10., "costly": 1000.}),
+            [])
+        self.assertEqual(self.policy.admit(image_sizes(small=30)), ["cheap"])
+        self.assertEqual(self.get_total_bytes(), 70)
+
+        # The priority of a large one is lower
+        self.assertEqual(self.policy.admit(image_sizes(large=80)), ["large"])
+        self.assertEqual(self.get_total_bytes(), 70)
+
+    def test_touch(self):
+        self.policy.admit(
+            image_sizes(foo=50, bar=50), {"foo": 100., "bar": 140.})
+
+        # L is raised to the priority of the evicted one
+        self.assertEqual(
+            self.policy.admit(image_sizes(tiny=1), {"tiny": 1.}), ["tiny"])
+
+        # Without touch, foo would be evicted
+        self.policy.touch(["foo", "not_cached"])
+        self.assertEqual(
+            self.policy.admit(image_sizes(baz=10), {"baz": 1000.}), ["bar"])
+        self.assertNotIn(
+            "not_cached", self.cache.redis.zsets[self.policy.queue_key])
+
+    def test_inflation(self):
+        self.policy.admit(image_sizes(old=50), {"old": 1000.})
+        self.policy.admit(image_sizes(foo=50), {"foo": 10.})
+        self.assertEqual(self.policy.admit(image_sizes(bar=50)), ["foo"])
+
+        # L is raised, new tex_keys end up replacing old ones not read
+        for i in range(30):
+            self.policy.admit({"new_%d" % i: {"image": 50}})
+        self.assertNotIn(
+            "old", self.cache.redis.zsets[self.policy.queue_key])
+
+    def test_costs_kept(self):
+        self.policy.admit(image_sizes(foo=10), {"foo": 500.})
+        self.policy.admit({"foo": {"data_url": 10}})
+        entries = self.cache.redis.hashes[self.policy.entries_key]
+        self.assertEqual(
+            json.loads(entries["foo"]),
+            {"sizes": {"image": 10, "data_url": 10}, "cost": 500.})
+        self.assertEqual(self.get_total_bytes(), 20)
+
+    def test_field_sizes_replaced(self):
+        self.policy.admit({"foo": {"image": 10, "data_url": 30}})
+        self.policy.admit(image_sizes(foo=10))
+        self.policy.admit({"foo": {"data_url": 20}})
+        self.assertEqual(self.get_total_bytes(), 30)
+
+    def test_forget(self):
+        self.policy.admit(image_sizes(foo=50, bar=30))
+        self.policy.forget(["foo"])
+        self.assertEqual(self.get_total_bytes(), 30)
+        self.assertNotIn(
+            "foo", self.cache.redis.zsets[self.policy.queue_key])
+
+    def test_clear(self):
+        self.policy.admit(image_sizes(foo=50))
+        self.policy.clear()
+        self.assertEqual(self.get_total_bytes(), 0)
+
+
+class PolicyFieldCacheTest(SimpleTestCase):
+    # test latex.cache.PolicyFieldCache
+    def setUp(self):
+        self.cache = FakeRedisCache()
+        self.policy = GreedyDualSizePolicy(self.cache, budget_bytes=100)
+        self.field_cache = PolicyFieldCache(
+            self.policy, HashFieldCache(self.cache))
+
+    def test_evicted_deleted(self):
+        self.field_cache.set_many(
+            {"foo": {"image": "a" * 40}}, costs={"foo": 1000.})
+        self.field_cache.set_many(
+            {"bar": {"image": "b" * 40}}, costs={"bar": 10.})
+        self.field_cache.set_many({"baz": {"image": "c" * 40}})
+
+        self.assertEqual(
+            sorted(self.field_cache.get_many(["foo", "bar", "baz"], ["image"])),
+            ["baz", "foo"])
+
+    def test_fields_kept_not_accounted(self):
+        for field_cache in [HashFieldCache(self.cache),
+                            KeyPerFieldCache(self.cache)]:
+            with self.subTest(field_cache=type(field_cache).__name__):
+                self.policy.clear()
+                self.field_cache = PolicyFieldCache(self.policy, field_cache)
+                self.assertEqual(
+                    self.field_cache.set_many({"foo": {"image": "a" * 40}}),
+                    {"foo": {"image": 40}})
+                self.assertEqual(
+                    self.field_cache.set_many(
+                        {"foo": {"image": "b" * 40, "data_url": "c" * 20}},
+                        overwrite=False),
+                    {"foo": {"data_url": 20}})
+                self.field_cache.set_many({"foo": {"image": "d" * 30}})
+                self.assertEqual(
+                    self.cache.redis.hashes[self.policy.meta_key]["bytes"],
+                    50)
+
+    def test_local_hits_touched(self):
+        self.field_cache.set_many({
+            "foo": {"image": "a" * 40}, "bar": {"image": "b" * 40}})
+        two_tier = TwoTierFieldCache(
+            LocalFieldCache(max_bytes=10000), self.field_cache)
+        two_tier.get_many(["foo", "bar"], ["image"])
+
+        buffer = TouchBuffer(interval=60, max_keys=2)
+        with mock.patch("latex.cache._local_hits", buffer):
+            with mock.patch.object(self.policy, "touch") as mock_touch:
+                # Served by the local tier, and touched in a batch
+                two_tier.get_many(["foo"], ["image"])
+                mock_touch.assert_called_once_with([])
+
+                two_tier.get_many(["bar"], ["image"])
+                self.assertEqual(
+                    sorted(mock_touch.call_args[0][0]), ["bar", "foo"])
+
+    def test_delete_many(self):
+        self.field_cache.set_many({"foo": {"image": "a" * 40}})
+        self.field_cache.delete_many(["foo"])
+        self.assertEqual(self.field_cache.get_many(["foo"], ["image"]), {})
+        self.assertEqual(
+            self.cache.redis.hashes[self.policy.meta_key]["bytes"], 0)
+
+    @override_settings(L2I_CACHE_MEMORY_BUDGET_BYTES=100)
+    def test_get_field_cache(self):
+        with mock.patch(
+                "latex.cache.get_default_cache", return_value=self.cache):
+            self.assertIsInstance(get_field_cache(), PolicyFieldCache)
+
+    @override_settings(CACHES=LOCMEM_CACHES, L2I_CACHE_MEMORY_BUDGET_BYTES=100)
+    def test_get_field_cache_requires_redis(self):
+        self.assertIsInstance(get_field_cache(), KeyPerFieldCache)
+
+
+class RenderCostTest(SimpleTestCase):
+    # test latex.receivers.get_render_costs
+    def test_no_timings(self):
+        self.assertIsNone(get_render_costs("foo"))
+
+    def test_costs(self):
+        with collect_timings("test"):
+            record_stage(STAGE_PERSIST, 1)
+            self.assertIsNone(get_render_costs("foo"))
+
+            record_stage(STAGE_COMPILE, 0.5)
+            record_stage(STAGE_CONVERT, 0.25)
+            self.assertEqual(get_render_costs("foo"), {"foo": 750.})
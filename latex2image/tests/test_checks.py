@@ -24,6 +24,7 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 THE SOFTWARE.
 """
 
+import tempfile
 from unittest import mock
 
 from django.test import SimpleTestCase
@@ -202,6 +203,481 @@ class CheckImageMagickPngResolution(CheckL2ISettingsBase):
         self.assertCheckMessages(['imagemagick_png_resolution.E001'])
 
 
+class CheckFormatCacheMaxBytes(CheckL2ISettingsBase):
+    # test L2I_FORMAT_CACHE_MAX_BYTES
+    msg_id_prefix = "format_cache_max_bytes"
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_FORMAT_CACHE_MAX_BYTES=None)
+    def test_checks_none(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_FORMAT_CACHE_MAX_BYTES=1024)
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_FORMAT_CACHE_MAX_BYTES="big")
+    def test_checks_not_int(self):
+        self.assertCheckMessages(['format_cache_max_bytes.E001'])
+
+    @override_settings(L2I_FORMAT_CACHE_MAX_BYTES=0)
+    def test_checks_not_positive(self):
+        self.assertCheckMessages(['format_cache_max_bytes.E001'])
+
+
+class CheckWarmPoolSize(CheckL2ISettingsBase):
+    # test L2I_WARM_POOL_SIZE
+    msg_id_prefix = "warm_pool_size"
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_WARM_POOL_SIZE=None)
+    def test_checks_none(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_WARM_POOL_SIZE=0)
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_WARM_POOL_SIZE=-1)
+    def test_checks_negative(self):
+        self.assertCheckMessages(['warm_pool_size.E001'])
+
+
+class CheckJobQueue(CheckL2ISettingsBase):
+    # test L2I_JOB_QUEUE
+    msg_id_prefix = "job_queue"
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_JOB_QUEUE=None)
+    def test_checks_none(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_JOB_QUEUE="redis")
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_JOB_QUEUE="celery")
+    def test_checks_unknown(self):
+        self.assertCheckMessages(['job_queue.E001'])
+
+
+class CheckJobQueueLimits(CheckL2ISettingsBase):
+    # test L2I_JOB_QUEUE_MAX_SIZE and L2I_JOB_PENDING_TIMEOUT
+    msg_id_prefix = ["job_queue_max_size", "job_pending_timeout"]
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_JOB_QUEUE_MAX_SIZE=None,
+                       L2I_JOB_PENDING_TIMEOUT=None)
+    def test_checks_none(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_JOB_QUEUE_MAX_SIZE=10, L2I_JOB_PENDING_TIMEOUT=300)
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_JOB_QUEUE_MAX_SIZE=0, L2I_JOB_PENDING_TIMEOUT=-1)
+    def test_checks_invalid(self):
+        self.assertCheckMessages(
+            ['job_queue_max_size.E001', 'job_pending_timeout.E001'])
+
+
+class CheckConversionExecutor(CheckL2ISettingsBase):
+    # test L2I_CONVERSION_* settings
+    msg_id_prefix = ["conversion_max_concurrency", "conversion_max_queue",
+                     "conversion_queue_timeout", "conversion_retry_after"]
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_CONVERSION_MAX_CONCURRENCY=2,
+                       L2I_CONVERSION_MAX_QUEUE=0,
+                       L2I_CONVERSION_QUEUE_TIMEOUT=0.5,
+                       L2I_CONVERSION_RETRY_AFTER=5)
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_CONVERSION_MAX_CONCURRENCY=0)
+    def test_checks_max_concurrency_error(self):
+        self.assertCheckMessages(['conversion_max_concurrency.E001'])
+
+    @override_settings(L2I_CONVERSION_MAX_QUEUE=-1,
+                       L2I_CONVERSION_RETRY_AFTER="foo")
+    def test_checks_max_queue_retry_after_error(self):
+        self.assertCheckMessages(['conversion_max_queue.E001',
+                                  'conversion_retry_after.E001'])
+
+    @override_settings(L2I_CONVERSION_QUEUE_TIMEOUT=-1)
+    def test_checks_queue_timeout_error(self):
+        self.assertCheckMessages(['conversion_queue_timeout.E001'])
+
+
+class CheckSubprocessLimits(CheckL2ISettingsBase):
+    # test L2I_*_TIMEOUT and L2I_SUBPROCESS_* settings
+    msg_id_prefix = ["compile_timeout", "subprocess_memory_limit",
+                     "subprocess_limits"]
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_COMPILE_TIMEOUT=10,
+                       L2I_SUBPROCESS_MEMORY_LIMIT="1024",
+                       L2I_SUBPROCESS_LIMITS={"xelatex": {"timeout": 5}})
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_COMPILE_TIMEOUT=0,
+                       L2I_SUBPROCESS_MEMORY_LIMIT="foo")
+    def test_checks_limit_error(self):
+        self.assertCheckMessages(['compile_timeout.E001',
+                                  'subprocess_memory_limit.E001'])
+
+    @override_settings(L2I_SUBPROCESS_LIMITS={"xelatex": {"foo": 5}})
+    def test_checks_subprocess_limits_error(self):
+        self.assertCheckMessages(['subprocess_limits.E001'])
+
+
+class CheckServerTimingHeader(CheckL2ISettingsBase):
+    # test L2I_SERVER_TIMING_HEADER
+    msg_id_prefix = "server_timing_header"
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_SERVER_TIMING_HEADER=False)
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_SERVER_TIMING_HEADER="false")
+    def test_checks_error(self):
+        self.assertCheckMessages(['server_timing_header.E001'])
+
+
+class CheckWorkingDir(CheckL2ISettingsBase):
+    # test L2I_WORKING_DIR_* settings
+    msg_id_prefix = ["working_dir_root", "working_dir_pool_size",
+                     "working_dir_quota_bytes"]
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_WORKING_DIR_ROOT=tempfile.gettempdir(),
+                       L2I_WORKING_DIR_POOL_SIZE=0,
+                       L2I_WORKING_DIR_QUOTA_BYTES="1024")
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_WORKING_DIR_ROOT="/non/existing/dir",
+                       L2I_WORKING_DIR_POOL_SIZE=-1,
+                       L2I_WORKING_DIR_QUOTA_BYTES=0)
+    def test_checks_error(self):
+        self.assertCheckMessages(['working_dir_root.E001',
+                                  'working_dir_pool_size.E001',
+                                  'working_dir_quota_bytes.E001'])
+
+
+class CheckImageServing(CheckL2ISettingsBase):
+    # test L2I_IMAGE_* settings
+    msg_id_prefix = ["image_cache_max_age", "image_require_auth",
+                     "image_x_accel_redirect_location"]
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_IMAGE_CACHE_MAX_AGE=0,
+                       L2I_IMAGE_REQUIRE_AUTH=True,
+                       L2I_IMAGE_X_ACCEL_REDIRECT_LOCATION="/foo/")
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_IMAGE_CACHE_MAX_AGE="foo",
+                       L2I_IMAGE_REQUIRE_AUTH="true",
+                       L2I_IMAGE_X_ACCEL_REDIRECT_LOCATION="foo/")
+    def test_checks_error(self):
+        self.assertCheckMessages(['image_cache_max_age.E001',
+                                  'image_require_auth.E001',
+                                  'image_x_accel_redirect_location.E001'])
+
+
+class CheckAPIList(CheckL2ISettingsBase):
+    # test L2I_API_LIST_PAGE_SIZE and L2I_API_STREAM_CHUNK_SIZE
+    msg_id_prefix = ["api_list_page_size", "api_stream_chunk_size"]
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_API_LIST_PAGE_SIZE=100,
+                       L2I_API_STREAM_CHUNK_SIZE=10)
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_API_LIST_PAGE_SIZE="100",
+                       L2I_API_STREAM_CHUNK_SIZE=0)
+    def test_checks_error(self):
+        self.assertCheckMessages(['api_list_page_size.E001',
+                                  'api_stream_chunk_size.E001'])
+
+
+class CheckCacheLayout(CheckL2ISettingsBase):
+    # test L2I_CACHE_LAYOUT
+    msg_id_prefix = "cache_layout"
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_CACHE_LAYOUT=None)
+    def test_checks_none(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_CACHE_LAYOUT="hash")
+    def test_checks_hash(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_CACHE_LAYOUT="keys")
+    def test_checks_keys(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_CACHE_LAYOUT="foo")
+    def test_checks_error(self):
+        self.assertCheckMessages(["cache_layout.E001"])
+
+
+class CheckCachePolicy(CheckL2ISettingsBase):
+    # test L2I_CACHE_TIMEOUT, L2I_CACHE_COMPILE_ERROR_TIMEOUT,
+    # L2I_CACHE_MEMORY_BUDGET_BYTES and L2I_CACHE_DEFAULT_COST_MS
+    msg_id_prefix = ["cache_timeout", "cache_compile_error_timeout",
+                     "cache_memory_budget_bytes", "cache_default_cost_ms"]
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_CACHE_TIMEOUT=None,
+                       L2I_CACHE_COMPILE_ERROR_TIMEOUT=None,
+                       L2I_CACHE_MEMORY_BUDGET_BYTES=None,
+                       L2I_CACHE_DEFAULT_COST_MS=None)
+    def test_checks_none(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_CACHE_TIMEOUT=3600,
+                       L2I_CACHE_COMPILE_ERROR_TIMEOUT=60,
+                       L2I_CACHE_MEMORY_BUDGET_BYTES=1024 ** 3,
+                       L2I_CACHE_DEFAULT_COST_MS=500.)
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_CACHE_TIMEOUT=0,
+                       L2I_CACHE_COMPILE_ERROR_TIMEOUT="60",
+                       L2I_CACHE_MEMORY_BUDGET_BYTES=-1,
+                       L2I_CACHE_DEFAULT_COST_MS=0)
+    def test_checks_error(self):
+        self.assertCheckMessages(["cache_timeout.E001",
+                                  "cache_compile_error_timeout.E001",
+                                  "cache_memory_budget_bytes.E001",
+                                  "cache_default_cost_ms.E001"])
+
+
+class CheckCacheCompression(CheckL2ISettingsBase):
+    # test L2I_CACHE_COMPRESSION, L2I_CACHE_COMPRESSION_LEVEL,
+    # L2I_CACHE_COMPRESSION_MIN_BYTES and
+    # L2I_CACHE_COMPRESSION_MIN_BYTES_BY_FORMAT
+    msg_id_prefix = ["cache_compression", "cache_compression_level",
+                     "cache_compression_min_bytes",
+                     "cache_compression_min_bytes_by_format"]
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_CACHE_COMPRESSION=None,
+                       L2I_CACHE_COMPRESSION_LEVEL=None,
+                       L2I_CACHE_COMPRESSION_MIN_BYTES=None,
+                       L2I_CACHE_COMPRESSION_MIN_BYTES_BY_FORMAT=None)
+    def test_checks_none(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_CACHE_COMPRESSION="zlib",
+                       L2I_CACHE_COMPRESSION_LEVEL=9,
+                       L2I_CACHE_COMPRESSION_MIN_BYTES=0,
+                       L2I_CACHE_COMPRESSION_MIN_BYTES_BY_FORMAT={
+                           "svg": 256, "png": None})
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_CACHE_COMPRESSION="zstd")
+    def test_checks_zstd(self):
+        with mock.patch("latex.cache.zstandard", object()):
+            self.assertCheckMessages([])
+
+        with mock.patch("latex.cache.zstandard", None):
+            self.assertCheckMessages(["cache_compression.E002"])
+
+    @override_settings(L2I_CACHE_COMPRESSION="lzma",
+                       L2I_CACHE_COMPRESSION_LEVEL="9",
+                       L2I_CACHE_COMPRESSION_MIN_BYTES=-1,
+                       L2I_CACHE_COMPRESSION_MIN_BYTES_BY_FORMAT={"pdf": 0})
+    def test_checks_error(self):
+        self.assertCheckMessages(["cache_compression.E001",
+                                  "cache_compression_level.E001",
+                                  "cache_compression_min_bytes.E001",
+                                  "cache_compression_min_bytes_by_format.E001"])
+
+    @override_settings(L2I_CACHE_COMPRESSION_MIN_BYTES_BY_FORMAT={"svg": -1})
+    def test_checks_by_format_negative(self):
+        self.assertCheckMessages(
+            ["cache_compression_min_bytes_by_format.E001"])
+
+
+class CheckCacheGeneration(CheckL2ISettingsBase):
+    # test L2I_CACHE_GENERATION_CHECK_INTERVAL
+    msg_id_prefix = "cache_generation_check_interval"
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_CACHE_GENERATION_CHECK_INTERVAL=None)
+    def test_checks_none(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_CACHE_GENERATION_CHECK_INTERVAL=0.5)
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_CACHE_GENERATION_CHECK_INTERVAL=-1)
+    def test_checks_negative(self):
+        self.assertCheckMessages(["cache_generation_check_interval.E001"])
+
+    @override_settings(L2I_CACHE_GENERATION_CHECK_INTERVAL="1")
+    def test_checks_not_number(self):
+        self.assertCheckMessages(["cache_generation_check_interval.E001"])
+
+
+class CheckAccessTracking(CheckL2ISettingsBase):
+    # test L2I_ACCESS_TRACKING, L2I_ACCESS_FLUSH_INTERVAL and
+    # L2I_ACCESS_BUFFER_MAX_KEYS
+    msg_id_prefix = ["access_tracking", "access_flush_interval",
+                     "access_buffer_max_keys"]
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_ACCESS_TRACKING=None,
+                       L2I_ACCESS_FLUSH_INTERVAL=None,
+                       L2I_ACCESS_BUFFER_MAX_KEYS=None)
+    def test_checks_none(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_ACCESS_TRACKING=True,
+                       L2I_ACCESS_FLUSH_INTERVAL=0.5,
+                       L2I_ACCESS_BUFFER_MAX_KEYS=100)
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_ACCESS_TRACKING="true",
+                       L2I_ACCESS_FLUSH_INTERVAL=0,
+                       L2I_ACCESS_BUFFER_MAX_KEYS=1.5)
+    def test_checks_error(self):
+        self.assertCheckMessages(["access_tracking.E001",
+                                  "access_flush_interval.E001",
+                                  "access_buffer_max_keys.E001"])
+
+
+class CheckLocalCache(CheckL2ISettingsBase):
+    # test L2I_LOCAL_CACHE_MAX_BYTES
+    msg_id_prefix = "local_cache_max_bytes"
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    @override_settings(L2I_LOCAL_CACHE_MAX_BYTES=None)
+    def test_checks_none(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_LOCAL_CACHE_MAX_BYTES=0)
+    def test_checks_disabled(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_LOCAL_CACHE_MAX_BYTES=1024)
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_LOCAL_CACHE_MAX_BYTES=-1)
+    def test_checks_negative(self):
+        self.assertCheckMessages(["local_cache_max_bytes.E001"])
+
+    @override_settings(L2I_LOCAL_CACHE_MAX_BYTES="1024")
+    def test_checks_str(self):
+        self.assertCheckMessages(["local_cache_max_bytes.E001"])
+
+
+class CheckBulk(CheckL2ISettingsBase):
+    # test L2I_BULK_MAX_ITEMS
+    msg_id_prefix = "bulk_max_items"
+
+    @property
+    def func(self):
+        from latex.checks import settings_check
+        return settings_check
+
+    VALID_CONF_NONE = None
+    VALID_CONF = 10
+    INVALID_CONF_STR = "10"
+    INVALID_CONF_ZERO = 0
+
+    @override_settings(L2I_BULK_MAX_ITEMS=VALID_CONF_NONE)
+    def test_checks_none(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_BULK_MAX_ITEMS=VALID_CONF)
+    def test_checks_ok(self):
+        self.assertCheckMessages([])
+
+    @override_settings(L2I_BULK_MAX_ITEMS=INVALID_CONF_STR)
+    def test_checks_str(self):
+        self.assertCheckMessages(["bulk_max_items.E001"])
+
+    @override_settings(L2I_BULK_MAX_ITEMS=INVALID_CONF_ZERO)
+    def test_checks_zero(self):
+        self.assertCheckMessages(["bulk_max_items.E001"])
+
+
 class VersionCheckTest(TestCase):
     def test_check_version_error(self):
         class FakeCommand1(CommandBase):
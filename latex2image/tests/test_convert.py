@@ -1,13 +1,27 @@
 import os
+import re
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest import TestCase, mock, skipIf
 
+from django.test import override_settings
 from tests.base_test_mixins import get_latex_file_dir
 from tests.utils import SKIP_ON_WINDOWS_REASON, skip_on_windows
 
-from latex.converter import (ImageConvertError, LatexCompileError,
-                             UnknownCompileError, get_tex2img_class,
+from latex.converter import (ConvertedImage, Dvipng, Dvisvg, FormatCache,
+                             ImageConvertError, ImageMagick, LatexCompileError,
+                             LatexTimeoutError, Pdf2svg, PdfLatex,
+                             UnknownCompileError, XeLatex,
+                             batch_tex_to_img_convert, build_batch_tex_source,
+                             get_batch_preamble, get_number_of_page_images,
+                             get_page_image_path, get_tex2img_class,
+                             read_converted_image,
+                             set_imagemagick_memory_limit, split_preamble,
                              tex_to_img_converter)
-from latex.utils import file_read, get_abstract_latex_log
+from latex.utils import (SubprocessTimeoutError, file_read, file_write,
+                         get_abstract_latex_log)
 
 
 def get_file_content(file_path):
@@ -166,15 +180,17 @@ class TexToImgConverterTest(TestCase):
                 ).get_converted_data_url()
             self.assertIn(expected_error, str(cm.exception))
 
-    def test_get_data_url_error(self):
+    def test_read_converted_image_error(self):
         doc_path = get_latex_file_dir("xelatex")
         filename = os.listdir(doc_path)[0]
         file_path = os.path.join(doc_path, filename)
         tex_source = get_file_content(file_path).decode("utf-8")
 
         expected_error = "some error"
-        with mock.patch("latex.converter.get_data_url") as mock_get_data_url:
-            mock_get_data_url.side_effect = RuntimeError(expected_error)
+        with mock.patch(
+                "latex.converter.read_converted_image"
+        ) as mock_read_converted_image:
+            mock_read_converted_image.side_effect = RuntimeError(expected_error)
             with self.assertRaises(ImageConvertError) as cm:
                 tex_to_img_converter(
                     "xelatex", tex_source, "svg"
@@ -213,6 +229,38 @@ class TexToImgConverterTest(TestCase):
             self.assertIn("No image was generated", str(cm.exception))
 
 
+class ConvertedImageTest(TestCase):
+    # test latex.converter.ConvertedImage
+    def test_data_url_built_once(self):
+        image = ConvertedImage(b"foo", "image/png")
+        self.assertEqual(image.size, 3)
+        self.assertEqual(image.ext, ".png")
+
+        with mock.patch(
+                "latex.converter.get_data_url_from_buf_and_mimetype"
+        ) as mock_get_data_url:
+            mock_get_data_url.return_value = "data:image/png;base64,Zm9v"
+            self.assertEqual(image.data_url, "data:image/png;base64,Zm9v")
+            self.assertEqual(image.data_url, "data:image/png;base64,Zm9v")
+            mock_get_data_url.assert_called_once_with(b"foo", "image/png")
+
+    def test_to_file(self):
+        image = ConvertedImage(b"<svg></svg>", "image/svg+xml")
+        image_file = image.to_file("foo")
+        self.assertEqual(image_file.name, "foo.svg")
+        self.assertEqual(image_file.read(), b"<svg></svg>")
+
+    def test_read_converted_image(self):
+        working_dir = tempfile.mkdtemp(prefix="l2i_test_")
+        self.addCleanup(shutil.rmtree, working_dir, ignore_errors=True)
+        file_path = os.path.join(working_dir, "foo.svg")
+        file_write(file_path, b"<svg></svg>")
+
+        image = read_converted_image(file_path)
+        self.assertEqual(image.buf, b"<svg></svg>")
+        self.assertEqual(image.mime_type, "image/svg+xml")
+
+
 class GetTex2imgClassTest(TestCase):
     # test latex.converter.get_tex2img_class
     def test_compiler_not_allowed(self):
@@ -235,3 +283,487 @@ class GetAbstractLatexLogTest(TestCase):
     def test_return_str(self):
         # no LATEX_LOG_OMIT_LINE_STARTS and LATEX_ERR_LOG_BEGIN_LINE_STARTS
         self.assertEqual(get_abstract_latex_log("abcd"), "abcd")
+
+
+class SplitPreambleTest(TestCase):
+    # test latex.converter.split_preamble
+    def test_split(self):
+        preamble = "\\documentclass{article}\n\\usepackage{amsmath}\n"
+        body = "\\begin{document}\n$x$\n\\end{document}"
+        self.assertEqual(split_preamble(preamble + body), (preamble, body))
+
+    def test_no_begin_document(self):
+        source = "\\documentclass{article}"
+        self.assertEqual(split_preamble(source), (None, source))
+
+    def test_no_documentclass(self):
+        source = "\\input{foo}\\begin{document}\\end{document}"
+        self.assertEqual(split_preamble(source), (None, source))
+
+    def test_format_line_not_splitted(self):
+        source = "%&myfmt\n\\documentclass{article}\\begin{document}"
+        self.assertEqual(split_preamble(source), (None, source))
+
+
+class SubprocessLimitsTest(TestCase):
+    # test the deadlines and rlimits of compile and convert subprocesses
+    def get_converter(self, image_format="svg"):
+        doc_path = get_latex_file_dir("xelatex")
+        file_path = os.path.join(doc_path, os.listdir(doc_path)[0])
+        tex_source = get_file_content(file_path).decode("utf-8")
+        return tex_to_img_converter("xelatex", tex_source, image_format)
+
+    @override_settings(L2I_COMPILE_TIMEOUT=10, L2I_CONVERT_TIMEOUT=5,
+                       L2I_CROP_TIMEOUT=3, L2I_SUBPROCESS_MEMORY_LIMIT=1024,
+                       L2I_SUBPROCESS_LIMITS={"dvisvgm": {"timeout": 20}})
+    def test_get_subprocess_limits(self):
+        self.assertEqual(
+            XeLatex().get_subprocess_limits(),
+            {"timeout": 10, "cpu_time_limit": None, "memory_limit": 1024,
+             "file_size_limit": None})
+        self.assertEqual(Pdf2svg().get_subprocess_limits()["timeout"], 5)
+        self.assertEqual(Dvisvg().get_subprocess_limits()["timeout"], 20)
+
+        with mock.patch("latex.converter.popen_wrapper") as mock_popen:
+            mock_popen.return_value = ("", "", 0)
+            Pdf2svg().do_convert("foo.pdf", "foo.svg", "/tmp")
+            (crop_cmdline,), crop_kwargs = mock_popen.call_args_list[0]
+            self.assertEqual(crop_cmdline[0], "pdfcrop")
+            self.assertEqual(crop_kwargs["timeout"], 3)
+            __, convert_kwargs = mock_popen.call_args_list[1]
+            self.assertEqual(convert_kwargs["timeout"], 5)
+
+    @override_settings(L2I_SUBPROCESS_MEMORY_LIMIT=1024 ** 3,
+                       L2I_SUBPROCESS_LIMITS={
+                           "convert": {"memory_limit": 512 * 1024 ** 2}})
+    def test_imagemagick_memory_limit(self):
+        limits = {}
+        with mock.patch("latex.converter.wand_limits", limits):
+            with mock.patch("latex.converter.wand_image"):
+                success, _error = ImageMagick().do_convert(
+                    "foo.pdf", "foo.png", "/tmp")
+            self.assertTrue(success)
+            # Not changed for all the threads on each conversion
+            self.assertEqual(limits, {})
+
+            set_imagemagick_memory_limit()
+            self.assertEqual(limits, {"memory": 512 * 1024 ** 2})
+
+    def test_compile_timeout(self):
+        converter = self.get_converter()
+        with mock.patch("latex.converter.popen_wrapper") as mock_popen:
+            mock_popen.side_effect = SubprocessTimeoutError("latexmk", 60)
+            with self.assertRaises(LatexTimeoutError) as cm:
+                converter.get_converted_data_url()
+
+        self.assertIn("timed out after 60 seconds", str(cm.exception))
+        assert_working_dir_cleaned(self, converter.working_dir)
+
+    def test_convert_timeout(self):
+        converter = self.get_converter()
+        with mock.patch("latex.converter.Tex2ImgBase.get_compiled_file"
+                        ) as mock_compile, mock.patch(
+                "latex.converter.ImageConverter.crop_popen"
+        ) as mock_crop:
+            converter.working_dir = tempfile.mkdtemp(prefix="l2i_test_")
+            mock_compile.return_value = os.path.join(
+                converter.working_dir, "foo.pdf")
+            mock_crop.side_effect = SubprocessTimeoutError("pdfcrop", 30)
+            with self.assertRaises(LatexTimeoutError):
+                converter.get_converted_data_url()
+
+        self.assertFalse(os.path.isdir(converter.working_dir))
+
+
+def assert_working_dir_cleaned(test, working_dir):
+    # The working dir is either removed, or scrubbed and kept for reuse.
+    if os.path.isdir(working_dir):
+        test.assertEqual(os.listdir(working_dir), [])
+
+
+class WorkingDirCleanupTest(TestCase):
+    # test that working dirs are released on all paths
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="l2i_workdir_test_")
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+        override = override_settings(L2I_WORKING_DIR_ROOT=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def get_converter(self):
+        return tex_to_img_converter(
+            "latex",
+            "\\documentclass{article}\n\\begin{document}\n$x$\n"
+            "\\end{document}\n",
+            "png")
+
+    def compile_success_side_effect(self, converter):
+        def side_effect(cmdline):
+            file_write(os.path.join(
+                converter.working_dir, converter.tex_key + ".dvi"), b"dvi")
+            return "", "", 0
+        return side_effect
+
+    def test_compile_error(self):
+        converter = self.get_converter()
+        with mock.patch("latex.converter.popen_wrapper") as mock_popen:
+            mock_popen.return_value = ("", "some error", 1)
+            with self.assertRaises(LatexCompileError):
+                converter.get_converted_data_url()
+
+        self.assertEqual(os.path.dirname(converter.working_dir), self.root)
+        assert_working_dir_cleaned(self, converter.working_dir)
+
+    def test_no_compiled_file(self):
+        converter = self.get_converter()
+        with mock.patch("latex.converter.popen_wrapper") as mock_popen:
+            mock_popen.return_value = ("", "", 0)
+            with self.assertRaises(UnknownCompileError):
+                converter.get_converted_data_url()
+
+        assert_working_dir_cleaned(self, converter.working_dir)
+
+    def test_page_counting_failed(self):
+        converter = self.get_converter()
+        with mock.patch(
+                "latex.converter.Tex2ImgBase.compile_popen"
+        ) as mock_compile, mock.patch(
+                "latex.converter.Dvipng.do_convert") as mock_convert, \
+                mock.patch(
+                    "latex.converter.get_number_of_images"
+                ) as mock_count:
+            mock_compile.side_effect = (
+                self.compile_success_side_effect(converter))
+            mock_convert.return_value = (True, "")
+            mock_count.return_value = 0
+            with self.assertRaises(ImageConvertError):
+                converter.get_converted_data_url()
+
+            mock_count.return_value = 2
+            with self.assertRaises(ImageConvertError):
+                converter.get_converted_data_url()
+
+            mock_count.side_effect = OSError()
+            with self.assertRaises(OSError):
+                converter.get_converted_data_url()
+
+        assert_working_dir_cleaned(self, converter.working_dir)
+
+    def test_working_dir_reused(self):
+        with override_settings(L2I_WORKING_DIR_POOL_SIZE=1):
+            converter = self.get_converter()
+            with mock.patch("latex.converter.popen_wrapper") as mock_popen:
+                mock_popen.return_value = ("", "some error", 1)
+                with self.assertRaises(LatexCompileError):
+                    converter.get_converted_data_url()
+                working_dir = converter.working_dir
+
+                with self.assertRaises(LatexCompileError):
+                    converter.get_converted_data_url()
+
+        self.assertEqual(converter.working_dir, working_dir)
+
+    def test_quota_exceeded(self):
+        converter = self.get_converter()
+        with override_settings(L2I_WORKING_DIR_QUOTA_BYTES=2), mock.patch(
+                "latex.converter.Tex2ImgBase.compile_popen"
+        ) as mock_compile:
+            mock_compile.side_effect = (
+                self.compile_success_side_effect(converter))
+            with self.assertRaises(LatexCompileError) as cm:
+                converter.get_converted_data_url()
+
+        self.assertIn("exceeds the quota", str(cm.exception))
+        assert_working_dir_cleaned(self, converter.working_dir)
+
+    def test_quota_enforced_while_running(self):
+        converter = self.get_converter()
+
+        def side_effect(cmdline, cwd, **kwargs):
+            # killed by RLIMIT_FSIZE after writing up to the limit
+            file_write(
+                os.path.join(cwd, converter.tex_key + ".log"),
+                b"l" * kwargs["file_size_limit"])
+            file_write(os.path.join(cwd, "other.aux"), b"a")
+            return "", "File size limit exceeded", 153
+
+        with override_settings(L2I_WORKING_DIR_QUOTA_BYTES=100), mock.patch(
+                "latex.converter.popen_wrapper") as mock_popen:
+            mock_popen.side_effect = side_effect
+            with self.assertRaises(LatexCompileError) as cm:
+                converter.get_converted_data_url()
+
+        self.assertEqual(mock_popen.call_args[1]["file_size_limit"], 100)
+        self.assertIn("exceeds the quota", str(cm.exception))
+        assert_working_dir_cleaned(self, converter.working_dir)
+
+
+class FormatCacheTest(TestCase):
+    # test latex.converter.FormatCache
+    preamble = "\\documentclass{article}\n"
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp(prefix="l2i_fmt_test_")
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        self.format_cache = FormatCache(self.cache_dir, max_bytes=100)
+
+        popen_patch = mock.patch("latex.converter.popen_wrapper")
+        self.mock_popen = popen_patch.start()
+        self.addCleanup(popen_patch.stop)
+
+    def dump_success_side_effect(self, cmdline, cwd, **kwargs):
+        jobname = [arg for arg in cmdline if arg.startswith("-jobname=")][0]
+        file_write(
+            os.path.join(cwd, jobname[len("-jobname="):] + ".fmt"), b"f" * 10)
+        return "", "", 0
+
+    def test_dump_and_reuse(self):
+        self.mock_popen.side_effect = self.dump_success_side_effect
+
+        fmt_path = self.format_cache.get_format_path(PdfLatex(), self.preamble)
+        self.assertTrue(os.path.isfile(fmt_path))
+        self.assertEqual(self.mock_popen.call_count, 1)
+
+        self.assertEqual(
+            self.format_cache.get_format_path(PdfLatex(), self.preamble),
+            fmt_path)
+        self.assertEqual(self.mock_popen.call_count, 1)
+
+    def test_dump_failed_not_retried(self):
+        self.mock_popen.return_value = ("", "error", 1)
+
+        self.assertIsNone(
+            self.format_cache.get_format_path(PdfLatex(), self.preamble))
+        self.assertIsNone(
+            self.format_cache.get_format_path(PdfLatex(), self.preamble))
+        self.assertEqual(self.mock_popen.call_count, 1)
+
+    def test_dump_timeout_retried(self):
+        self.mock_popen.side_effect = SubprocessTimeoutError("pdflatex", 10)
+        self.assertIsNone(
+            self.format_cache.get_format_path(PdfLatex(), self.preamble))
+
+        self.mock_popen.side_effect = self.dump_success_side_effect
+        self.assertIsNotNone(
+            self.format_cache.get_format_path(PdfLatex(), self.preamble))
+        self.assertEqual(self.mock_popen.call_count, 2)
+
+    @skipIf(skip_on_windows, SKIP_ON_WINDOWS_REASON)
+    def test_concurrent_dumps(self):
+        def slow_dump(cmdline, cwd, **kwargs):
+            time.sleep(0.2)
+            return self.dump_success_side_effect(cmdline, cwd, **kwargs)
+
+        self.mock_popen.side_effect = slow_dump
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            futures = [
+                executor.submit(
+                    self.format_cache.get_format_path,
+                    PdfLatex(), self.preamble)
+                for _ in range(3)]
+            fmt_paths = {future.result() for future in futures}
+
+        self.assertEqual(len(fmt_paths), 1)
+        self.assertIsNotNone(fmt_paths.pop())
+        self.assertEqual(self.mock_popen.call_count, 1)
+
+    def test_evict_least_recently_used(self):
+        self.mock_popen.side_effect = self.dump_success_side_effect
+        self.format_cache.max_bytes = 25
+
+        paths = []
+        for i in range(3):
+            path = self.format_cache.get_format_path(
+                PdfLatex(), self.preamble + "%% %d" % i)
+            os.utime(path, (i, i))
+            paths.append(path)
+
+        self.assertFalse(os.path.isfile(paths[0]))
+        self.assertTrue(os.path.isfile(paths[1]))
+        self.assertTrue(os.path.isfile(paths[2]))
+
+    def test_compile_with_format(self):
+        doc_path = get_latex_file_dir("pdflatex")
+        file_path = os.path.join(doc_path, os.listdir(doc_path)[0])
+        tex_source = get_file_content(file_path).decode("utf-8")
+
+        self.mock_popen.side_effect = self.dump_success_side_effect
+
+        with override_settings(L2I_FORMAT_CACHE_DIR=self.cache_dir):
+            with mock.patch("latex.converter.Tex2ImgBase.compile_popen"
+                            ) as mock_compile_subprocess:
+                mock_compile_subprocess.return_value = ["foo", "", 0]
+                with self.assertRaises(UnknownCompileError):
+                    tex_to_img_converter(
+                        "pdflatex", tex_source, "png"
+                    ).get_converted_data_url()
+
+                cmdline, = mock_compile_subprocess.call_args[0]
+                self.assertTrue(
+                    any(arg.startswith('-latexoption="-fmt=')
+                        for arg in cmdline))
+
+    def test_lualatex_not_using_format(self):
+        doc_path = get_latex_file_dir("lualatex")
+        file_path = os.path.join(doc_path, os.listdir(doc_path)[0])
+        tex_source = get_file_content(file_path).decode("utf-8")
+
+        with override_settings(L2I_FORMAT_CACHE_DIR=self.cache_dir):
+            self.assertIsNone(
+                tex_to_img_converter(
+                    "lualatex", tex_source, "png").get_format_path())
+        self.mock_popen.assert_not_called()
+
+
+class BatchConvertTest(TestCase):
+    # test latex.converter.batch_tex_to_img_convert
+    preamble = "\\documentclass{article}\n"
+    snippets = ["$x$", "$y$", "$z$"]
+
+    def setUp(self):
+        compile_popen_patch = mock.patch(
+            "latex.converter.Tex2ImgBase.compile_popen")
+        self.mock_compile_popen = compile_popen_patch.start()
+        self.addCleanup(compile_popen_patch.stop)
+
+        def compile_side_effect(cmdline):
+            tex_path = cmdline[-1]
+            file_write(tex_path.replace(".tex", ".dvi"), b"dvi")
+            return "", "", 0
+
+        self.mock_compile_popen.side_effect = compile_side_effect
+
+        convert_popen_patch = mock.patch(
+            "latex.converter.ImageConverter.convert_popen")
+        self.mock_convert_popen = convert_popen_patch.start()
+        self.addCleanup(convert_popen_patch.stop)
+
+    def convert_side_effect(self, n_pages):
+        def side_effect(cmdline, cwd):
+            output_pattern = cmdline[cmdline.index("-o") + 1]
+            for page in range(1, n_pages + 1):
+                file_write(output_pattern.replace("%d", str(page)), b"png")
+            return "", "", 0
+        return side_effect
+
+    def test_build_batch_tex_source(self):
+        source = build_batch_tex_source(self.preamble, self.snippets)
+        self.assertEqual(split_preamble(source)[0].strip(),
+                         self.preamble.strip())
+        self.assertEqual(source.count("\\clearpage"), 2)
+
+    def test_batch_preamble(self):
+        self.assertEqual(
+            get_batch_preamble(self.preamble), self.preamble)
+        for preamble, expected in [
+                ("\\documentclass{standalone}\n",
+                 "\\documentclass[multi]{standalone}\n"),
+                ("\\documentclass[border=1pt]{standalone}\n",
+                 "\\documentclass[border=1pt,multi]{standalone}\n"),
+                ("\\documentclass[multi=true]{standalone}\n",
+                 "\\documentclass[multi=true]{standalone}\n")]:
+            with self.subTest(preamble=preamble):
+                self.assertEqual(get_batch_preamble(preamble), expected)
+
+        for preamble in ["\\usepackage{amsmath}\n",
+                         "\\documentclass[multi=false]{standalone}\n"]:
+            with self.subTest(preamble=preamble):
+                with self.assertRaises(ValueError):
+                    build_batch_tex_source(preamble, self.snippets)
+        self.mock_compile_popen.assert_not_called()
+
+    def test_standalone_pages_split(self):
+        def compile_side_effect(cmdline):
+            # standalone puts all the pages into one without "multi"
+            tex_path = cmdline[-1]
+            source = file_read(tex_path).decode("utf-8")
+            n_pages = source.count("\\clearpage") + 1
+            if "{standalone}" in source and "multi" not in source:
+                n_pages = 1
+            file_write(
+                tex_path.replace(".tex", ".dvi"), str(n_pages).encode())
+            return "", "", 0
+
+        def convert_side_effect(cmdline, cwd):
+            dvi_path = [arg for arg in cmdline if arg.endswith(".dvi")][0]
+            n_pages = int(file_read(os.path.join(cwd, dvi_path)))
+            return self.convert_side_effect(n_pages)(cmdline, cwd)
+
+        self.mock_compile_popen.side_effect = compile_side_effect
+        self.mock_convert_popen.side_effect = convert_side_effect
+        data_urls = batch_tex_to_img_convert(
+            "latex", "\\documentclass[border=1pt]{standalone}\n",
+            self.snippets, "png")
+        self.assertEqual(len(data_urls), 3)
+
+    def test_empty(self):
+        self.assertEqual(
+            batch_tex_to_img_convert(
+                "latex", self.preamble, [], "png"), [])
+        self.mock_compile_popen.assert_not_called()
+
+    def test_success(self):
+        self.mock_convert_popen.side_effect = self.convert_side_effect(3)
+        data_urls = batch_tex_to_img_convert(
+            "latex", self.preamble, self.snippets, "png")
+
+        self.assertEqual(len(data_urls), 3)
+        for data_url in data_urls:
+            self.assertTrue(data_url.startswith("data:image/png"))
+        self.mock_compile_popen.assert_called_once()
+
+    def test_number_of_images_mismatch(self):
+        self.mock_convert_popen.side_effect = self.convert_side_effect(2)
+        with self.assertRaises(ImageConvertError) as cm:
+            batch_tex_to_img_convert(
+                "latex", self.preamble, self.snippets, "png")
+        self.assertIn("expecting 3", str(cm.exception))
+
+    def test_svg_ten_or_more_pages(self):
+        def dvisvgm_side_effect(cmdline, cwd):
+            # page numbers are zero padded by dvisvgm to the width of the
+            # largest page number with "%p", or to N digits with "%Np"
+            output_pattern = cmdline[cmdline.index("-o") + 1]
+            width_match = re.search(r"%(\d?)p", output_pattern)
+            width = int(width_match.group(1) or len(str(len(snippets))))
+            for page in range(1, len(snippets) + 1):
+                file_write(
+                    output_pattern.replace(
+                        width_match.group(0), str(page).zfill(width)),
+                    b"<svg></svg>")
+            return "", "", 0
+
+        snippets = ["$x_{%d}$" % i for i in range(12)]
+        self.mock_convert_popen.side_effect = dvisvgm_side_effect
+        data_urls = batch_tex_to_img_convert(
+            "latex", self.preamble, snippets, "svg")
+
+        self.assertEqual(len(data_urls), 12)
+        for data_url in data_urls:
+            self.assertTrue(data_url.startswith("data:image/svg+xml"))
+
+    def test_multi_page_cmdlines(self):
+        output_path = "/tmp/foo.svg"
+        self.assertIn(
+            "/tmp/foo-%1p.svg",
+            Dvisvg()._get_convert_cmdlines(
+                "foo.dvi", output_path, multi_page=True)[0])
+        self.assertIn(
+            "/tmp/foo-%d.svg",
+            Pdf2svg()._get_convert_cmdlines(
+                "foo.pdf", output_path, multi_page=True)[-1])
+        self.assertNotIn(
+            "-pp",
+            Dvipng()._get_convert_cmdlines(
+                "foo.dvi", "/tmp/foo.png", multi_page=True)[0])
+
+    def test_get_number_of_page_images(self):
+        working_dir = tempfile.mkdtemp(prefix="l2i_test_")
+        self.addCleanup(shutil.rmtree, working_dir, ignore_errors=True)
+
+        image_path = os.path.join(working_dir, "foo.png")
+        self.assertEqual(get_number_of_page_images(image_path), 0)
+        for page in (1, 2, 4):
+            file_write(get_page_image_path(image_path, page), b"png")
+        self.assertEqual(get_number_of_page_images(image_path), 2)
@@ -0,0 +1,78 @@
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase
+
+from latex.executor import ConversionExecutor, ConversionQueueFull
+
+
+class ConversionExecutorTest(SimpleTestCase):
+    # test latex.executor.ConversionExecutor
+    def setUp(self):
+        lock_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(lock_dir.cleanup)
+        self.lock_dir = lock_dir.name
+
+    def get_executor(self, **kwargs):
+        kwargs.setdefault("max_concurrency", 1)
+        kwargs.setdefault("max_queue", 1)
+        kwargs.setdefault("queue_timeout", 5)
+        return ConversionExecutor(lock_dir=self.lock_dir, **kwargs)
+
+    def test_run(self):
+        executor = self.get_executor()
+        func = mock.MagicMock(return_value="foo")
+        self.assertEqual(executor.run(func, 1, bar=2), "foo")
+        func.assert_called_once_with(1, bar=2)
+
+        # The slot was released
+        self.assertEqual(executor.run(func), "foo")
+        self.assertEqual(executor.get_stats()["admitted"], 2)
+
+    def test_slots_shared_by_executors(self):
+        # i.e., by processes with the same lock dir
+        executor = self.get_executor(max_queue=0)
+        another = self.get_executor(max_queue=0)
+
+        with executor.slot():
+            with self.assertRaises(ConversionQueueFull):
+                another.run(mock.MagicMock())
+
+        another.run(mock.MagicMock())
+        self.assertEqual(another.get_stats()["rejected"], 1)
+
+    def test_queue_full(self):
+        executor = self.get_executor(retry_after=3)
+
+        def wait():
+            with executor.slot():
+                pass
+
+        with executor.slot():
+            queued = threading.Thread(target=wait)
+            queued.start()
+            time.sleep(0.1)
+
+            with self.assertRaises(ConversionQueueFull) as cm:
+                executor.run(mock.MagicMock())
+            self.assertEqual(cm.exception.retry_after, 3)
+
+        queued.join()
+        stats = executor.get_stats()
+        self.assertEqual(stats["admitted"], 2)
+        self.assertEqual(stats["rejected"], 1)
+        self.assertGreater(stats["queue_time_max"], 0)
+
+    def test_queue_timeout(self):
+        executor = self.get_executor(queue_timeout=0.1)
+
+        with executor.slot():
+            with self.assertRaises(ConversionQueueFull):
+                executor.run(mock.MagicMock())
+
+        self.assertEqual(executor.get_stats()["timed_out"], 1)
+
+        # The queue slot was released
+        executor.run(mock.MagicMock())
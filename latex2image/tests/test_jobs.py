@@ -0,0 +1,126 @@
+import json
+import threading
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from latex.executor import ConversionQueueFull
+from latex.jobs import (JOB_STATUS_DONE, JOB_STATUS_PENDING,
+                        REDIS_JOB_QUEUE_KEY, InProcessJobQueue, RedisJobQueue,
+                        enqueue_job, get_job_pending_timeout, get_job_queue,
+                        get_job_status, mark_job_pending, set_job_status)
+
+LOCMEM_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    }
+}
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class JobStatusTest(SimpleTestCase):
+    # test latex.jobs job status
+    def setUp(self):
+        from django.core.cache import caches
+        self.addCleanup(caches["default"].clear)
+
+    def test_mark_job_pending(self):
+        self.assertIsNone(get_job_status("foo"))
+        self.assertTrue(mark_job_pending("foo"))
+        self.assertEqual(get_job_status("foo")["status"], JOB_STATUS_PENDING)
+        self.assertFalse(mark_job_pending("foo"))
+
+    def test_mark_done_job_pending(self):
+        set_job_status("foo", JOB_STATUS_DONE)
+        self.assertTrue(mark_job_pending("foo"))
+
+    @override_settings(L2I_JOB_PENDING_TIMEOUT=10)
+    def test_stale_pending_job(self):
+        with mock.patch("latex.jobs.time.time", return_value=1000):
+            self.assertTrue(mark_job_pending("foo"))
+
+        with mock.patch("latex.jobs.time.time", return_value=1005):
+            self.assertEqual(
+                get_job_status("foo")["status"], JOB_STATUS_PENDING)
+            self.assertFalse(mark_job_pending("foo"))
+
+        with mock.patch("latex.jobs.time.time", return_value=1011):
+            self.assertIsNone(get_job_status("foo"))
+            self.assertTrue(mark_job_pending("foo"))
+            self.assertEqual(
+                get_job_status("foo")["status"], JOB_STATUS_PENDING)
+
+    @override_settings(
+        L2I_JOB_PENDING_TIMEOUT=None, L2I_CONVERSION_QUEUE_TIMEOUT=1,
+        L2I_COMPILE_TIMEOUT=2, L2I_CONVERT_TIMEOUT=3, L2I_CROP_TIMEOUT=4)
+    def test_default_pending_timeout(self):
+        self.assertEqual(get_job_pending_timeout(), 10)
+
+    def test_enqueue_queue_full(self):
+        queue = InProcessJobQueue(max_workers=1, max_size=1, retry_after=3)
+        with mock.patch("latex.jobs.get_job_queue", return_value=queue):
+            with mock.patch.object(queue.executor, "submit"):
+                self.assertTrue(enqueue_job({"tex_key": "foo"}))
+                with self.assertRaises(ConversionQueueFull) as cm:
+                    enqueue_job({"tex_key": "bar"})
+
+        self.assertEqual(cm.exception.retry_after, 3)
+        self.assertIsNotNone(get_job_status("foo"))
+        self.assertIsNone(get_job_status("bar"))
+
+
+class JobQueueTest(SimpleTestCase):
+    # test latex.jobs job queues
+    def test_redis_job_queue(self):
+        connection = mock.MagicMock()
+        queue = RedisJobQueue(connection)
+
+        job = {"tex_key": "foo"}
+        queue.enqueue(job)
+        connection.rpush.assert_called_once_with(
+            REDIS_JOB_QUEUE_KEY, json.dumps(job))
+
+        connection.blpop.return_value = (REDIS_JOB_QUEUE_KEY, json.dumps(job))
+        self.assertEqual(queue.dequeue(timeout=1), job)
+
+        connection.blpop.return_value = None
+        self.assertIsNone(queue.dequeue(timeout=1))
+
+    @override_settings(L2I_JOB_QUEUE="inprocess", L2I_JOB_QUEUE_WORKERS=3,
+                       L2I_JOB_QUEUE_MAX_SIZE=7)
+    def test_get_in_process_job_queue(self):
+        queue = get_job_queue()
+        self.assertIsInstance(queue, InProcessJobQueue)
+        self.assertIs(get_job_queue(), queue)
+        self.assertEqual(queue.max_workers, 3)
+        self.assertEqual(queue.max_size, 7)
+
+    def test_in_process_job_queue_bounded(self):
+        queue = InProcessJobQueue(max_workers=1, max_size=2)
+        with mock.patch("latex.jobs.run_job") as mock_run_job:
+            started = threading.Event()
+            release = threading.Event()
+
+            def run_job(job):
+                started.set()
+                release.wait(5)
+
+            mock_run_job.side_effect = run_job
+
+            queue.enqueue({"tex_key": "foo"})
+            started.wait(5)
+            queue.enqueue({"tex_key": "bar"})
+            self.assertEqual(len(queue), 2)
+            with self.assertRaises(ConversionQueueFull):
+                queue.enqueue({"tex_key": "baz"})
+
+            release.set()
+            queue.executor.shutdown(wait=True)
+
+        self.assertEqual(len(queue), 0)
+        self.assertEqual(mock_run_job.call_count, 2)
+
+    @override_settings(L2I_JOB_QUEUE="redis")
+    def test_get_redis_job_queue(self):
+        with mock.patch("django_redis.get_redis_connection"):
+            self.assertIsInstance(get_job_queue(), RedisJobQueue)
@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from prometheus_client import REGISTRY
+
+from latex.api import get_cached_attribute_by_tex_key
+from latex.converter import LatexTimeoutError, tex_to_img_converter
+from latex.metrics import get_registry
+from latex.utils import file_write
+
+
+def get_sample_value(name, labels=None):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsViewTest(SimpleTestCase):
+    # test latex.metrics.metrics_view
+    def test_metrics(self):
+        resp = self.client.get(reverse("metrics"))
+        self.assertEqual(resp.status_code, 200)
+        self.assertContains(resp, "l2i_compile_seconds")
+        self.assertContains(resp, "l2i_subprocesses_in_flight")
+
+    @override_settings(L2I_METRICS_ENABLED=False)
+    def test_metrics_disabled(self):
+        resp = self.client.get(reverse("metrics"))
+        self.assertEqual(resp.status_code, 404)
+
+    def test_multiprocess_registry(self):
+        multiproc_dir = tempfile.mkdtemp(prefix="l2i_prometheus_")
+        self.addCleanup(shutil.rmtree, multiproc_dir, ignore_errors=True)
+
+        with mock.patch.dict(
+                os.environ, {"PROMETHEUS_MULTIPROC_DIR": multiproc_dir}):
+            self.assertIsNot(get_registry(), REGISTRY)
+        self.assertIs(get_registry(), REGISTRY)
+
+
+class CacheMetricsTest(TestCase):
+    # test the cache metrics of latex.api.get_cached_attribute_by_tex_key
+    def test_hit_and_miss(self):
+        from django.core.cache import caches
+
+        hit_labels = {"result": "hit"}
+        miss_labels = {"result": "miss"}
+        hits = get_sample_value("l2i_cache_requests_total", hit_labels)
+        misses = get_sample_value("l2i_cache_requests_total", miss_labels)
+
+        request = mock.MagicMock(method="GET")
+        get_cached_attribute_by_tex_key("foo_key", "image", request)
+        self.assertEqual(
+            get_sample_value("l2i_cache_requests_total", miss_labels),
+            misses + 1)
+
+        caches["default"].set("foo_key:image", "bar")
+        self.addCleanup(caches["default"].clear)
+        get_cached_attribute_by_tex_key("foo_key", "image", request)
+        self.assertEqual(
+            get_sample_value("l2i_cache_requests_total", hit_labels),
+            hits + 1)
+
+
+class ConverterMetricsTest(SimpleTestCase):
+    # test the compile and convert metrics of latex.converter.Tex2ImgBase
+    labels = {"compiler": "latex", "image_format": "png"}
+
+    def get_converter(self):
+        return tex_to_img_converter(
+            "latex",
+            "\\documentclass{article}\n\\begin{document}\n$x$\n"
+            "\\end{document}\n",
+            "png")
+
+    def test_success(self):
+        converter = self.get_converter()
+        converter.working_dir = tempfile.mkdtemp(prefix="l2i_test_")
+        file_write(os.path.join(converter.working_dir, "foo.png"), b"p" * 10)
+
+        compiles = get_sample_value("l2i_compile_seconds_count", self.labels)
+        image_bytes = get_sample_value("l2i_image_bytes_sum", self.labels)
+
+        with mock.patch(
+                "latex.converter.Tex2ImgBase.get_compiled_file"
+        ) as mock_compile, mock.patch(
+                "latex.converter.Dvipng.do_convert"
+        ) as mock_convert:
+            mock_compile.return_value = os.path.join(
+                converter.working_dir, "foo.dvi")
+            mock_convert.return_value = (True, "")
+            converter.get_converted_data_url()
+
+        self.assertEqual(
+            get_sample_value("l2i_compile_seconds_count", self.labels),
+            compiles + 1)
+        self.assertEqual(
+            get_sample_value("l2i_image_bytes_sum", self.labels),
+            image_bytes + 10)
+
+    def test_compile_timeout(self):
+        labels = dict(self.labels, kind="timeout")
+        errors = get_sample_value("l2i_compile_errors_total", labels)
+
+        with mock.patch(
+                "latex.converter.Tex2ImgBase.get_compiled_file"
+        ) as mock_compile:
+            mock_compile.side_effect = LatexTimeoutError("timed out")
+            with self.assertRaises(LatexTimeoutError):
+                self.get_converter().get_converted_data_url()
+
+        self.assertEqual(
+            get_sample_value("l2i_compile_errors_total", labels), errors + 1)
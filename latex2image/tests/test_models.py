@@ -1,7 +1,11 @@
+from unittest import mock
+
 from django.core.exceptions import ValidationError
 from django.test import TestCase
-from tests.base_test_mixins import get_fake_data_url
+from tests import factories
+from tests.base_test_mixins import L2ITestMixinBase, get_fake_data_url
 
+from latex.converter import ConvertedImage
 from latex.models import LatexImage
 
 
@@ -21,3 +25,23 @@ class LatexImageModelTest(TestCase):
         )
         with self.assertRaises(ValidationError):
             a.save()
+
+
+class LatexImageConvertedImageTest(L2ITestMixinBase, TestCase):
+    def test_save_converted_image(self):
+        converted_image = ConvertedImage(b"<svg></svg>", "image/svg+xml")
+        with mock.patch("latex.models.make_image_file") as mock_make_file:
+            instance = LatexImage(
+                tex_key="foo",
+                converted_image=converted_image,
+                creator=factories.UserFactory())
+            instance.save()
+            mock_make_file.assert_not_called()
+
+        self.assertIsNone(instance.converted_image)
+        self.assertEqual(instance.data_url, converted_image.data_url)
+        self.assertEqual(instance.image.name, "l2i_images/foo.svg")
+
+        instance = LatexImage.objects.get(tex_key="foo")
+        with instance.image.open() as f:
+            self.assertEqual(f.read(), b"<svg></svg>")
@@ -4,7 +4,7 @@ from tests import factories
 from tests.base_test_mixins import (L2ITestMixinBase,
                                     improperly_configured_cache_patch)
 
-from latex.api import get_field_cache_key
+from latex.cache import get_field_cache_key
 from latex.models import LatexImage
 from latex.serializers import LatexImageSerializer
 
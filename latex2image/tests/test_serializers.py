@@ -1,7 +1,7 @@
 from django.test import SimpleTestCase
 from rest_framework.exceptions import ValidationError
 
-from latex.serializers import LatexImageCreateDataSerialzier
+from latex.serializers import LatexImageCreateDataSerialzier, get_only_fields
 
 
 class LatexImageCreateDataSerializerTest(SimpleTestCase):
@@ -77,3 +77,15 @@ class LatexImageCreateDataSerializerTest(SimpleTestCase):
         with self.assertRaises(ValidationError) as cm:
             serializer.is_valid(raise_exception=True)
         self.assertIn(expected_message, str(cm.exception))
+
+
+class GetOnlyFieldsTest(SimpleTestCase):
+    def test_get_only_fields(self):
+        self.assertEqual(
+            sorted(get_only_fields("image,creator")),
+            ["compile_error", "creator", "image"])
+        self.assertEqual(
+            sorted(get_only_fields(["data_url"])), ["compile_error", "data_url"])
+
+        # unknown fields are ignored
+        self.assertEqual(get_only_fields("foo"), ["compile_error"])
@@ -0,0 +1,112 @@
+import threading
+import time
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from latex.singleflight import (KeyLockTable, get_single_flight_lock_cache_key,
+                                single_flight)
+
+
+class KeyLockTableTest(SimpleTestCase):
+    # test latex.singleflight.KeyLockTable
+    def test_hold(self):
+        table = KeyLockTable()
+        with table.hold("foo", 1) as acquired:
+            self.assertTrue(acquired)
+            self.assertEqual(len(table), 1)
+
+            with table.hold("bar", 1) as acquired:
+                self.assertTrue(acquired)
+                self.assertEqual(len(table), 2)
+
+            with table.hold("foo", 0.01) as acquired:
+                self.assertFalse(acquired)
+
+        self.assertEqual(len(table), 0)
+
+    def test_hold_waits_for_holder(self):
+        table = KeyLockTable()
+        order = []
+
+        def hold():
+            with table.hold("foo", 5) as acquired:
+                order.append(("waiter", acquired))
+
+        with table.hold("foo", 1):
+            thread = threading.Thread(target=hold)
+            thread.start()
+            time.sleep(0.05)
+            order.append(("holder", True))
+
+        thread.join()
+        self.assertEqual(order, [("holder", True), ("waiter", True)])
+        self.assertEqual(len(table), 0)
+
+
+@override_settings(L2I_SINGLE_FLIGHT_WAIT_TIMEOUT=0.1,
+                   L2I_SINGLE_FLIGHT_LOCK_TIMEOUT=10)
+class SingleFlightTest(SimpleTestCase):
+    # test latex.singleflight.single_flight
+    def setUp(self):
+        self.addCleanup(caches["default"].clear)
+        self.lock_cache_key = get_single_flight_lock_cache_key("foo")
+
+    def test_single_flight(self):
+        with single_flight("foo") as acquired:
+            self.assertTrue(acquired)
+            self.assertIsNotNone(caches["default"].get(self.lock_cache_key))
+
+        self.assertIsNone(caches["default"].get(self.lock_cache_key))
+
+    def test_locked_by_other_process(self):
+        caches["default"].add(self.lock_cache_key, "other", 10)
+
+        with single_flight("foo") as acquired:
+            self.assertFalse(acquired)
+
+        # The lock of others is not released
+        self.assertEqual(caches["default"].get(self.lock_cache_key), "other")
+
+    def test_lock_released_by_other_process(self):
+        caches["default"].add(self.lock_cache_key, "other", 10)
+
+        def release():
+            time.sleep(0.03)
+            caches["default"].delete(self.lock_cache_key)
+
+        thread = threading.Thread(target=release)
+        thread.start()
+
+        with override_settings(L2I_SINGLE_FLIGHT_WAIT_TIMEOUT=5):
+            with single_flight("foo") as acquired:
+                self.assertTrue(acquired)
+
+        thread.join()
+
+    def test_lock_expired_and_taken_by_others(self):
+        with single_flight("foo") as acquired:
+            self.assertTrue(acquired)
+            caches["default"].set(self.lock_cache_key, "other", 10)
+
+        self.assertEqual(caches["default"].get(self.lock_cache_key), "other")
+
+    def test_cache_unavailable(self):
+        # e.g., redis is down, with django-redis IGNORE_EXCEPTIONS
+        cache = mock.MagicMock()
+        cache.add.return_value = None
+        with override_settings(L2I_SINGLE_FLIGHT_WAIT_TIMEOUT=5), \
+                mock.patch("latex.singleflight._get_lock_cache",
+                           return_value=cache):
+            start = time.monotonic()
+            with single_flight("foo") as acquired:
+                self.assertTrue(acquired)
+            self.assertLess(time.monotonic() - start, 1)
+
+            cache.add.side_effect = ConnectionError
+            with single_flight("foo") as acquired:
+                self.assertTrue(acquired)
+
+        self.assertEqual(cache.add.call_count, 2)
+        cache.delete.assert_not_called()
@@ -0,0 +1,125 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.http import HttpResponse
+from django.test import SimpleTestCase, override_settings
+from django.test.client import RequestFactory
+
+from latex.converter import ConvertedImage, tex_to_img_converter
+from latex.timing import (STAGE_COMPILE, STAGE_CONVERT, STAGE_ENCODE,
+                          ServerTimingMiddleware, TimingAggregator,
+                          collect_timings, collect_timings_into,
+                          get_server_timing_header_value, merge_timings,
+                          record_stage, timed_stage)
+from latex.utils import file_write
+
+
+class TimingAggregatorTest(SimpleTestCase):
+    # test latex.timing.TimingAggregator
+    def test_get_stats(self):
+        aggregator = TimingAggregator()
+        aggregator.add("foo", 1.)
+        aggregator.add("foo", 3.)
+        self.assertEqual(
+            aggregator.get_stats(),
+            {"foo": {"count": 2, "total": 4., "min": 1., "max": 3.,
+                     "avg": 2.}})
+
+        aggregator.reset()
+        self.assertEqual(aggregator.get_stats(), {})
+
+
+class CollectTimingsTest(SimpleTestCase):
+    # test latex.timing.collect_timings
+    def test_collect_timings(self):
+        record_stage("foo", 1.)
+
+        with self.assertLogs("latex.timing", level="INFO") as cm:
+            with collect_timings("bar") as timings:
+                record_stage("foo", 0.5)
+                record_stage("foo", 0.25)
+                with timed_stage("baz"):
+                    pass
+
+        self.assertEqual(set(timings), {"foo", "baz"})
+        self.assertEqual(timings["foo"], 0.75)
+        self.assertIn('"label": "bar"', cm.output[0])
+        self.assertIn('"foo": 750.0', cm.output[0])
+
+    def test_timed_stage_raises(self):
+        with collect_timings("bar") as timings:
+            with self.assertRaises(RuntimeError):
+                with timed_stage("foo"):
+                    raise RuntimeError()
+
+        self.assertIn("foo", timings)
+
+    def test_collect_timings_into(self):
+        with collect_timings("bar") as timings:
+            record_stage("foo", 1.)
+            item_timings = {}
+            with collect_timings_into(item_timings):
+                record_stage("foo", 0.5)
+            self.assertEqual(timings, {"foo": 1.})
+            self.assertEqual(item_timings, {"foo": 0.5})
+
+            merge_timings(item_timings)
+            merge_timings({"baz": 0.25})
+
+        self.assertEqual(timings, {"foo": 1.5, "baz": 0.25})
+
+    def test_header_value(self):
+        self.assertEqual(
+            get_server_timing_header_value({"compile": 0.5, "convert": 0.01}),
+            "compile;dur=500.000, convert;dur=10.000")
+
+    def test_converter_stages(self):
+        converter = tex_to_img_converter("latex", "foo", "png")
+        converter.working_dir = tempfile.mkdtemp(prefix="l2i_test_")
+        file_write(os.path.join(converter.working_dir, "foo.png"), b"png")
+
+        with mock.patch(
+                "latex.converter.Tex2ImgBase.get_compiled_file"
+        ) as mock_compile, mock.patch(
+                "latex.converter.Dvipng.do_convert"
+        ) as mock_convert, mock.patch(
+                "latex.converter.get_number_of_images"
+        ) as mock_n_images, mock.patch(
+                "latex.converter.read_converted_image"
+        ) as mock_read_converted_image:
+            mock_compile.return_value = os.path.join(
+                converter.working_dir, "foo.dvi")
+            mock_convert.return_value = (True, "")
+            mock_n_images.return_value = 1
+            mock_read_converted_image.return_value = (
+                ConvertedImage(b"foo", "image/png"))
+
+            with collect_timings("foo") as timings:
+                converter.get_converted_data_url()
+
+        self.assertEqual(
+            set(timings), {STAGE_COMPILE, STAGE_CONVERT, STAGE_ENCODE})
+
+
+class ServerTimingMiddlewareTest(SimpleTestCase):
+    # test latex.timing.ServerTimingMiddleware
+    def get_response(self, request):
+        record_stage("compile", 0.5)
+        return HttpResponse()
+
+    def test_header(self):
+        middleware = ServerTimingMiddleware(self.get_response)
+        response = middleware(RequestFactory().get("/"))
+        self.assertEqual(response["Server-Timing"], "compile;dur=500.000")
+
+    @override_settings(L2I_SERVER_TIMING_HEADER=False)
+    def test_header_disabled(self):
+        middleware = ServerTimingMiddleware(self.get_response)
+        response = middleware(RequestFactory().get("/"))
+        self.assertFalse(response.has_header("Server-Timing"))
+
+    def test_no_stage(self):
+        middleware = ServerTimingMiddleware(lambda request: HttpResponse())
+        response = middleware(RequestFactory().get("/"))
+        self.assertFalse(response.has_header("Server-Timing"))
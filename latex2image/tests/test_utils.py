@@ -0,0 +1,87 @@
+import os
+import sys
+import tempfile
+import time
+from unittest import TestCase, mock, skipIf
+
+from tests.utils import SKIP_ON_WINDOWS_REASON, skip_on_windows
+
+from latex.utils import (SubprocessTimeoutError, get_rlimits_cmdline,
+                         popen_wrapper)
+
+
+@skipIf(skip_on_windows, SKIP_ON_WINDOWS_REASON)
+class PopenWrapperTest(TestCase):
+    # test latex.utils.popen_wrapper
+    def test_success(self):
+        output, error, status = popen_wrapper(
+            [sys.executable, "-c", "print('foo')"], timeout=10)
+        self.assertEqual(output.strip(), "foo")
+        self.assertEqual(status, 0)
+
+    def test_timeout_kills_process_group(self):
+        start = time.monotonic()
+
+        # The grandchild holds the pipes open, and would keep
+        # communicate() waiting if only the child was killed.
+        with self.assertRaises(SubprocessTimeoutError) as cm:
+            popen_wrapper(["sh", "-c", "sleep 10 & sleep 10"], timeout=0.2)
+
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(cm.exception.cmd, "sh")
+        self.assertEqual(cm.exception.timeout, 0.2)
+
+    def test_cpu_time_limit(self):
+        _output, _error, status = popen_wrapper(
+            [sys.executable, "-c", "while True: pass"],
+            timeout=20, cpu_time_limit=1)
+        self.assertNotEqual(status, 0)
+
+    def test_memory_limit(self):
+        _output, error, status = popen_wrapper(
+            [sys.executable, "-c", "x = bytearray(1024 ** 3)"],
+            timeout=20, memory_limit=512 * 1024 ** 2)
+        self.assertNotEqual(status, 0)
+        self.assertIn("MemoryError", error)
+
+    def test_file_size_limit(self):
+        with tempfile.TemporaryDirectory() as working_dir:
+            _output, _error, status = popen_wrapper(
+                [sys.executable, "-c",
+                 "open('big', 'wb').write(bytes(4 * 1024 ** 2))"],
+                cwd=working_dir, timeout=20, file_size_limit=1024 ** 2)
+            self.assertNotEqual(status, 0)
+            self.assertLessEqual(
+                os.path.getsize(os.path.join(working_dir, "big")), 1024 ** 2)
+
+    def test_rlimits_without_preexec_fn(self):
+        with mock.patch("latex.utils.Popen") as mock_popen:
+            mock_popen.return_value.communicate.return_value = (b"", b"")
+            mock_popen.return_value.returncode = 0
+            popen_wrapper(
+                ["foo", "bar"], timeout=10, cpu_time_limit=1.5,
+                memory_limit=1024 ** 2)
+
+        args, kwargs = mock_popen.call_args
+        self.assertNotIn("preexec_fn", kwargs)
+        self.assertTrue(kwargs["start_new_session"])
+        self.assertEqual(
+            args[0],
+            ["sh", "-c", 'ulimit -t 2 && ulimit -v 1024 && exec "$@"', "sh",
+             "foo", "bar"])
+
+    def test_file_size_limit_cmdline(self):
+        # in 512-byte blocks, rounded up
+        self.assertEqual(
+            get_rlimits_cmdline(["foo"], file_size_limit=1000),
+            ["sh", "-c", 'ulimit -f 2 && exec "$@"', "sh", "foo"])
+
+    def test_no_rlimits_cmdline(self):
+        self.assertEqual(get_rlimits_cmdline(["foo", "bar"]), ["foo", "bar"])
+
+    def test_rlimits_args_with_spaces(self):
+        output, _error, status = popen_wrapper(
+            [sys.executable, "-c", "import sys; print(sys.argv[1])", "a b"],
+            timeout=10, cpu_time_limit=10)
+        self.assertEqual(output.strip(), "a b")
+        self.assertEqual(status, 0)
@@ -29,10 +29,11 @@ from unittest import mock
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase
 from tests import factories
-from tests.base_test_mixins import (L2ITestMixinBase, get_fake_data_url,
+from tests.base_test_mixins import (L2ITestMixinBase, get_fake_converted_image,
                                     get_latex_file_dir,
                                     suppress_stdout_decorator)
 
+from latex.executor import ConversionQueueFull
 from latex.models import LatexImage
 
 
@@ -77,9 +78,9 @@ class FormViewTest(L2ITestMixinBase, TestCase):
 
     def test_non_auth_post(self):
         with mock.patch(
-                "latex.converter.Tex2ImgBase.get_converted_data_url"
+                "latex.converter.Tex2ImgBase.get_converted_image"
         ) as mock_convert:
-            mock_convert.return_value = get_fake_data_url("foob=")
+            mock_convert.return_value = get_fake_converted_image()
             with self.temporarily_switch_to_user(None):
                 resp = self.post_latex_form_view(
                     data=self.get_post_data(), follow=False)
@@ -135,9 +136,9 @@ class FormViewTest(L2ITestMixinBase, TestCase):
         self.assertEqual(LatexImage.objects.all().count(), 1)
 
         with mock.patch(
-                "latex.converter.Tex2ImgBase.get_converted_data_url"
+                "latex.converter.Tex2ImgBase.get_converted_image"
         ) as mock_convert:
-            mock_convert.return_value = get_fake_data_url("foob=")
+            mock_convert.return_value = get_fake_converted_image()
             resp = self.post_latex_form_view(
                 data=self.get_post_data())
             self.assertEqual(mock_convert.call_count, 0)
@@ -152,9 +153,9 @@ class FormViewTest(L2ITestMixinBase, TestCase):
         tex_key = "__abcd"
 
         with mock.patch(
-                "latex.converter.Tex2ImgBase.get_converted_data_url"
+                "latex.converter.Tex2ImgBase.get_converted_image"
         ) as mock_convert:
-            mock_convert.return_value = get_fake_data_url("foob=")
+            mock_convert.return_value = get_fake_converted_image()
             resp = self.post_latex_form_view(
                 data=self.get_post_data(tex_key=tex_key))
             self.assertEqual(mock_convert.call_count, 1)
@@ -168,7 +169,7 @@ class FormViewTest(L2ITestMixinBase, TestCase):
         self.assertEqual(LatexImage.objects.all().count(), 1)
 
         with mock.patch(
-                "latex.converter.Tex2ImgBase.get_converted_data_url"
+                "latex.converter.Tex2ImgBase.get_converted_image"
         ) as mock_convert:
             resp = self.post_latex_form_view(
                 data=self.get_post_data(tex_key=tex_key))
@@ -195,7 +196,7 @@ class FormViewTest(L2ITestMixinBase, TestCase):
         self.assertEqual(LatexImage.objects.all().count(), 1)
 
         with mock.patch(
-                "latex.converter.Tex2ImgBase.get_converted_data_url"
+                "latex.converter.Tex2ImgBase.get_converted_image"
         ) as mock_convert:
             resp = self.post_latex_form_view(
                 data=self.get_post_data(file_dir="lualatex"))
@@ -212,9 +213,9 @@ class FormViewTest(L2ITestMixinBase, TestCase):
         self.assertEqual(LatexImage.objects.all().count(), 1)
 
         with mock.patch(
-                "latex.converter.Tex2ImgBase.get_converted_data_url"
+                "latex.converter.Tex2ImgBase.get_converted_image"
         ) as mock_convert:
-            mock_convert.return_value = get_fake_data_url("foob=")
+            mock_convert.return_value = get_fake_converted_image()
             resp = self.post_latex_form_view(
                 data=self.get_post_data(tex_key=tex_key))
 
@@ -226,7 +227,7 @@ class FormViewTest(L2ITestMixinBase, TestCase):
     def test_post_error_not_latex_compile_error(self):
         exception_str = "this is a custom exception."
         with mock.patch(
-                "latex.converter.Tex2ImgBase.get_converted_data_url"
+                "latex.converter.Tex2ImgBase.get_converted_image"
         ) as mock_convert:
             mock_convert.side_effect = RuntimeError(exception_str)
             resp = self.post_latex_form_view(data=self.get_post_data())
@@ -235,3 +236,16 @@ class FormViewTest(L2ITestMixinBase, TestCase):
             self.assertResponseContextIsNotNone(resp, "unknown_error")
             self.assertEqual(LatexImage.objects.all().count(), 0)
             self.assertResponseContextContains(resp, "unknown_error", exception_str)
+
+    def test_post_queue_full(self):
+        with mock.patch(
+                "latex.converter.Tex2ImgBase.get_converted_image"
+        ) as mock_convert:
+            mock_convert.side_effect = ConversionQueueFull("queue is full", 7)
+            resp = self.post_latex_form_view(data=self.get_post_data())
+
+            self.assertEqual(resp.status_code, 503)
+            self.assertEqual(resp["Retry-After"], "7")
+            self.assertEqual(LatexImage.objects.all().count(), 0)
+            self.assertResponseContextContains(
+                resp, "unknown_error", "queue is full")
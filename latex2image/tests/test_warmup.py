@@ -0,0 +1,114 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+from tests import factories
+from tests.base_test_mixins import L2ITestMixinBase
+
+from latex.cache import get_field_cache, get_field_cache_key
+from latex.warmup import get_warm_queryset, warm_field_cache
+
+
+@override_settings(L2I_CACHE_LAYOUT="keys", L2I_CACHE_DATA_URL_ON_SAVE=False,
+                   L2I_API_IMAGE_RETURNS_RELATIVE_PATH=True)
+class WarmFieldCacheTest(L2ITestMixinBase, TestCase):
+    # test latex.warmup.warm_field_cache and the l2i_warm_cache command
+    def setUp(self):
+        super().setUp()
+        self.instances = [
+            factories.LatexImageFactory(
+                creation_time=now() - timedelta(hours=i))
+            for i in range(3)]
+
+        # Cached when saved
+        self.test_cache.clear()
+
+    def get_cached(self, instance, field):
+        return self.test_cache.get(
+            get_field_cache_key(instance.tex_key, field))
+
+    def warm(self, fields=("image",), **kwargs):
+        return warm_field_cache(
+            get_field_cache(), get_warm_queryset(list(fields)), list(fields),
+            **kwargs)
+
+    def test_warm(self):
+        progress = []
+        stats = self.warm(
+            batch_size=2, progress=lambda s: progress.append(s.n_read))
+
+        self.assertEqual(progress, [2, 3])
+        self.assertEqual((stats.n_read, stats.n_cached), (3, 3))
+        self.assertGreater(stats.n_bytes, 0)
+        for instance in self.instances:
+            self.assertEqual(
+                self.get_cached(instance, "image"), str(instance.image))
+            self.assertIsNone(self.get_cached(instance, "data_url"))
+
+    def test_compile_error(self):
+        instance = factories.LatexImageErrorFactory()
+        self.test_cache.clear()
+
+        self.warm()
+        self.assertEqual(
+            self.get_cached(instance, "compile_error"),
+            instance.compile_error)
+        self.assertIsNone(self.get_cached(instance, "image"))
+
+    def test_most_recent_first_within_budget(self):
+        stats = self.warm(batch_size=1, max_bytes=1)
+
+        self.assertEqual(stats.n_read, 1)
+        self.assertIsNotNone(self.get_cached(self.instances[0], "image"))
+        self.assertIsNone(self.get_cached(self.instances[1], "image"))
+
+    def test_cached_fields_kept(self):
+        self.test_cache.set(
+            get_field_cache_key(self.instances[0].tex_key, "image"), "foo.png")
+        self.warm()
+        self.assertEqual(self.get_cached(self.instances[0], "image"), "foo.png")
+
+    def test_rate(self):
+        sleep = mock.MagicMock()
+        self.warm(batch_size=10, rate=2, sleep=sleep, clock=lambda: 0.)
+
+        # Batches of 2 instances, at 2 instances/s
+        self.assertEqual(
+            [c[0][0] for c in sleep.call_args_list], [1., 1.5])
+
+    def test_command(self):
+        out = StringIO()
+        call_command("l2i_warm_cache", "--fields", "image,data_url",
+                     "--limit", "2", stdout=out)
+
+        self.assertIn("Cached the fields of 2 image(s)", out.getvalue())
+        self.assertIn("out of 2 read", out.getvalue())
+        self.assertEqual(
+            self.get_cached(self.instances[1], "data_url"),
+            self.instances[1].data_url)
+        self.assertIsNone(self.get_cached(self.instances[2], "image"))
+
+    def test_command_default_fields(self):
+        call_command("l2i_warm_cache", stdout=StringIO())
+        self.assertIsNotNone(self.get_cached(self.instances[2], "image"))
+        self.assertIsNone(self.get_cached(self.instances[2], "data_url"))
+
+    def test_command_errors(self):
+        for args in [["--fields", "foo"], ["--batch-size", "0"],
+                     ["--rate", "-1"]]:
+            with self.subTest(args=args):
+                with self.assertRaises(CommandError):
+                    call_command("l2i_warm_cache", *args)
+
+        with override_settings(L2I_API_IMAGE_RETURNS_RELATIVE_PATH=False):
+            with self.assertRaises(CommandError):
+                call_command("l2i_warm_cache", "--fields", "image")
+
+        with mock.patch(
+                "latex.management.commands.l2i_warm_cache.get_field_cache",
+                return_value=None):
+            with self.assertRaises(CommandError):
+                call_command("l2i_warm_cache")
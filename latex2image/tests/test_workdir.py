@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase, override_settings
+
+from latex.utils import file_write
+from latex.workdir import (WorkingDirPool, WorkingDirQuotaExceeded,
+                           get_dir_size, get_working_dir_pool)
+
+
+class WorkingDirPoolTest(SimpleTestCase):
+    # test latex.workdir.WorkingDirPool
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="l2i_workdir_test_")
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+
+    def test_acquire_in_root(self):
+        pool = WorkingDirPool(self.root)
+        path = pool.acquire(prefix="LATEX_")
+        self.assertEqual(os.path.dirname(path), self.root)
+        self.assertTrue(os.path.basename(path).startswith("LATEX_"))
+        self.assertEqual(os.listdir(path), [])
+
+    def test_reuse_scrubbed(self):
+        pool = WorkingDirPool(self.root, size=1)
+        path = pool.acquire()
+        file_write(os.path.join(path, "foo.tex"), b"foo")
+        os.makedirs(os.path.join(path, "sub"))
+        os.symlink(self.root, os.path.join(path, "link"))
+        pool.release(path)
+
+        self.assertTrue(os.path.isdir(path))
+        self.assertEqual(os.listdir(path), [])
+        self.assertTrue(os.path.isdir(self.root))
+        self.assertEqual(pool.acquire(), path)
+
+    def test_pool_full(self):
+        pool = WorkingDirPool(self.root, size=1)
+        path1 = pool.acquire()
+        path2 = pool.acquire()
+        self.assertNotEqual(path1, path2)
+
+        pool.release(path1)
+        pool.release(path2)
+        self.assertTrue(os.path.isdir(path1))
+        self.assertFalse(os.path.isdir(path2))
+
+    def test_release_twice(self):
+        pool = WorkingDirPool(self.root, size=2)
+        path = pool.acquire()
+        pool.release(path)
+        pool.release(path)
+        self.assertEqual(pool._idle, [path])
+
+    def test_release_foreign_dir_removed(self):
+        pool = WorkingDirPool(self.root, size=2)
+        path = tempfile.mkdtemp(dir=self.root)
+        pool.release(path)
+        self.assertFalse(os.path.isdir(path))
+        self.assertEqual(pool._idle, [])
+
+    def test_removed_idle_dir_not_reused(self):
+        pool = WorkingDirPool(self.root, size=1)
+        path = pool.acquire()
+        pool.release(path)
+        shutil.rmtree(path)
+
+        new_path = pool.acquire()
+        self.assertTrue(os.path.isdir(new_path))
+
+    def test_working_dir_context_manager(self):
+        pool = WorkingDirPool(self.root, size=0)
+        with self.assertRaises(RuntimeError):
+            with pool.working_dir() as path:
+                raise RuntimeError()
+        self.assertFalse(os.path.isdir(path))
+
+    def test_check_quota(self):
+        pool = WorkingDirPool(self.root, quota_bytes=10)
+        path = pool.acquire()
+        file_write(os.path.join(path, "foo"), b"x" * 10)
+        pool.check_quota(path)
+        self.assertGreaterEqual(get_dir_size(path), 10)
+
+        os.makedirs(os.path.join(path, "sub"))
+        file_write(os.path.join(path, "sub", "bar"), b"x" * 10)
+        with self.assertRaises(WorkingDirQuotaExceeded):
+            pool.check_quota(path)
+
+        # no quota
+        WorkingDirPool(self.root).check_quota(path)
+
+    def test_close(self):
+        pool = WorkingDirPool(self.root, size=1)
+        path = pool.acquire()
+        pool.release(path)
+        pool.close()
+        self.assertFalse(os.path.isdir(path))
+
+    def test_get_working_dir_pool(self):
+        with override_settings(L2I_WORKING_DIR_ROOT=self.root,
+                               L2I_WORKING_DIR_POOL_SIZE=2,
+                               L2I_WORKING_DIR_QUOTA_BYTES="100"):
+            pool = get_working_dir_pool()
+            self.assertIs(get_working_dir_pool(), pool)
+            self.assertEqual(
+                (pool.root, pool.size, pool.quota_bytes), (self.root, 2, 100))
+
+        self.assertIsNot(get_working_dir_pool(), pool)
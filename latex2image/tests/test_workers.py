@@ -0,0 +1,145 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, mock
+
+from django.test import override_settings
+from tests.base_test_mixins import get_latex_file_dir
+
+from latex.converter import PdfLatex, UnknownCompileError, tex_to_img_converter
+from latex.utils import file_read
+from latex.workers import WarmEnginePool, get_warm_engine_pool
+
+PREAMBLE = "\\documentclass{article}\n\\usepackage{amsmath}\n"
+BODY = "\\begin{document}\n$x$\n\\end{document}\n"
+
+
+class WarmEnginePoolTest(TestCase):
+    # test latex.workers.WarmEnginePool
+    def setUp(self):
+        engine_patch = mock.patch("latex.workers.WarmEngine")
+        self.mock_engine_class = engine_patch.start()
+        self.addCleanup(engine_patch.stop)
+
+        def engine_side_effect(compiler, fmt_path):
+            engine = mock.MagicMock()
+            engine.fmt_path = fmt_path
+            engine.is_alive.return_value = True
+            engine.spawned_at = float("inf")
+            return engine
+
+        self.mock_engine_class.side_effect = engine_side_effect
+
+        fmt_path_patch = mock.patch(
+            "latex.workers.WarmEnginePool.get_fmt_path")
+        self.mock_get_fmt_path = fmt_path_patch.start()
+        self.mock_get_fmt_path.return_value = "/path/to/fmt.fmt"
+        self.addCleanup(fmt_path_patch.stop)
+
+    def test_accepts(self):
+        pool = WarmEnginePool(PREAMBLE)
+        self.assertTrue(pool.accepts(PREAMBLE + BODY))
+        self.assertFalse(
+            pool.accepts("\\documentclass{standalone}\n" + BODY))
+        self.assertFalse(pool.accepts(BODY))
+
+    def test_acquire_refill(self):
+        pool = WarmEnginePool(PREAMBLE, size=2)
+
+        # No idle engine at the first request
+        self.assertIsNone(pool.acquire(PdfLatex()))
+        self.assertEqual(self.mock_engine_class.call_count, 2)
+
+        self.assertIsNotNone(pool.acquire(PdfLatex()))
+        self.assertEqual(self.mock_engine_class.call_count, 3)
+
+    def test_acquire_no_format(self):
+        self.mock_get_fmt_path.return_value = None
+        pool = WarmEnginePool(PREAMBLE)
+        self.assertIsNone(pool.acquire(PdfLatex()))
+        self.mock_engine_class.assert_not_called()
+
+    def test_dead_engine_discarded(self):
+        pool = WarmEnginePool(PREAMBLE, size=1)
+        pool.acquire(PdfLatex())
+        dead_engine = pool._idle["pdflatex"][0]
+        dead_engine.is_alive.return_value = False
+
+        engine = pool.acquire(PdfLatex())
+        self.assertIsNone(engine)
+        dead_engine.discard.assert_called_once_with()
+
+    def test_expired_engine_discarded(self):
+        pool = WarmEnginePool(PREAMBLE, size=1, max_idle_seconds=10)
+        pool.acquire(PdfLatex())
+        expired_engine = pool._idle["pdflatex"][0]
+        expired_engine.spawned_at = float("-inf")
+
+        self.assertIsNone(pool.acquire(PdfLatex()))
+        expired_engine.discard.assert_called_once_with()
+
+    def test_get_warm_engine_pool(self):
+        with override_settings(L2I_WARM_POOL_PREAMBLE=None):
+            self.assertIsNone(get_warm_engine_pool())
+
+        with override_settings(L2I_WARM_POOL_PREAMBLE=PREAMBLE):
+            pool = get_warm_engine_pool()
+            self.assertIsNotNone(pool)
+            self.assertIs(get_warm_engine_pool(), pool)
+
+        with override_settings(
+                L2I_WARM_POOL_PREAMBLE=PREAMBLE, L2I_WARM_POOL_SIZE=3):
+            self.assertIsNot(get_warm_engine_pool(), pool)
+
+
+class CompileWithWarmEngineTest(TestCase):
+    # test latex.converter.Tex2ImgBase with warm engines
+    def setUp(self):
+        doc_path = get_latex_file_dir("pdflatex")
+        file_path = os.path.join(doc_path, os.listdir(doc_path)[0])
+        self.tex_source = file_read(file_path).decode("utf-8")
+
+        self.working_dir = tempfile.mkdtemp(prefix="l2i_warm_test_")
+        self.addCleanup(shutil.rmtree, self.working_dir, ignore_errors=True)
+
+        self.warm_engine = mock.MagicMock()
+        self.warm_engine.working_dir = self.working_dir
+        self.warm_engine.tex_filename = "l2i_job.tex"
+
+        get_warm_engine_patch = mock.patch(
+            "latex.converter.Tex2ImgBase.get_warm_engine")
+        self.mock_get_warm_engine = get_warm_engine_patch.start()
+        self.mock_get_warm_engine.return_value = self.warm_engine
+        self.addCleanup(get_warm_engine_patch.stop)
+
+        compile_popen_patch = mock.patch(
+            "latex.converter.Tex2ImgBase.compile_popen")
+        self.mock_compile_popen = compile_popen_patch.start()
+        self.mock_compile_popen.return_value = ["foo", "", 0]
+        self.addCleanup(compile_popen_patch.stop)
+
+    def test_warm_engine_used(self):
+        self.warm_engine.run.return_value = ("foo", "", 0)
+        with self.assertRaises(UnknownCompileError):
+            tex_to_img_converter(
+                "pdflatex", self.tex_source, "png").get_converted_data_url()
+
+        self.warm_engine.run.assert_called_once_with(timeout=mock.ANY)
+        self.mock_compile_popen.assert_not_called()
+
+    def test_fallback_to_latexmk_if_engine_failed(self):
+        # No log file generated, i.e., the engine died
+        self.warm_engine.run.return_value = ("foo", "error", 1)
+        with self.assertRaises(UnknownCompileError):
+            tex_to_img_converter(
+                "pdflatex", self.tex_source, "png").get_converted_data_url()
+
+        self.mock_compile_popen.assert_called_once()
+
+    def test_fallback_to_latexmk_if_engine_raised(self):
+        self.warm_engine.run.side_effect = BrokenPipeError()
+        with self.assertRaises(UnknownCompileError):
+            tex_to_img_converter(
+                "pdflatex", self.tex_source, "png").get_converted_data_url()
+
+        self.mock_compile_popen.assert_called_once()